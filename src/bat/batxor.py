@@ -16,9 +16,16 @@ For this we need to keep some state, possibly even delete the file only later,
 by tagging it as 'temporary' and removing it later on.
 '''
 
-import sys, os, os.path, tempfile, mmap
+import sys, os, os.path, tempfile, mmap, binascii
 import fwunpack
 
+## numpy is optional: without it the blocks are XORed as (big) integers
+try:
+	import numpy
+	havenumpy = True
+except Exception, e:
+	havenumpy = False
+
 ## some of the signatures we know about:
 ## * Splashtop (fast boot environment)
 ## * Bococom router series (2.6.21, Ralink chipset)
@@ -34,26 +41,49 @@ signatures = { 'splashtop': ['\x51', '\x57', '\x45', '\x52']
              , 'edimax':   ['\x88','\x44','\xa2','\xd1','\x68','\xb4','\x5a','\x2d']
              }
 
+## The signatures are also searched for by the prerun marker search (see
+## bat/fsmagic.py, the 'optmagic' setting of the scan), so the file does
+## not have to be searched again.
+signaturemarkers = { 'splashtop': 'xor_splashtop'
+                   , 'bococom':   'xor_bococom'
+                   , 'sitecom':   'xor_sitecom'
+                   , 'edimax':    'xor_edimax'
+                   }
+
+## amount of bytes that is XORed and written at once. This is rounded down
+## to a multiple of the length of the signature, so every block starts at
+## the start of the signature.
+blocksize = 1048576
+
+## XOR a block of data with a block of key data of the same length
+def xorblock(data, keyblock):
+	if havenumpy:
+		return (numpy.frombuffer(data, dtype=numpy.uint8) ^ numpy.frombuffer(keyblock, dtype=numpy.uint8)).tostring()
+	return binascii.unhexlify('%0*x' % (len(data)*2, int(binascii.hexlify(data), 16) ^ int(binascii.hexlify(keyblock), 16)))
+
 def unpackXOR(filename, sig, tempdir=None):
 	tmpdir = fwunpack.unpacksetup(tempdir)
 	tmpfile = tempfile.mkstemp(dir=tmpdir)
-	os.fdopen(tmpfile[0]).close()
+	f2 = os.fdopen(tmpfile[0], 'wb')
+
+	filesize = os.stat(filename).st_size
+	if filesize == 0:
+		f2.close()
+		return tmpdir
 
-	fwunpack.unpackFile(filename, 0, tmpfile[1], tmpdir, modify=True)
-	datafile = open(filename)
-	datafile.seek(0)
-	data = datafile.read(1000000)
+	key = ''.join(signatures[sig])
+	blocklen = max(1, blocksize/len(key)) * len(key)
+	keyblock = key * (blocklen/len(key))
 
 	## read data, XOR, write data out again
-	f2 = open(tmpfile[1], 'w')
-	counter = 0
-	while data != '':
-		for i in data:
-			f2.write(chr(ord(i) ^ ord(signatures[sig][counter])))
-			counter = (counter+1)%len(signatures[sig])
-		data = datafile.read(1000000)
-	f2.close()
+	datafile = open(filename, 'rb')
+	datamm = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+	for offset in xrange(0, filesize, blocklen):
+		data = datamm[offset:offset+blocklen]
+		f2.write(xorblock(data, keyblock[:len(data)]))
+	datamm.close()
 	datafile.close()
+	f2.close()
 	return tmpdir
 
 def searchUnpackXOR(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
@@ -79,36 +109,41 @@ def searchUnpackXOR(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	if signatures == {}:
 		return (diroffsets, blacklist, [], hints)
 
-	## open the file, so we can search for signatures
-	## TODO: use the identifier search we have elsewhere.
-	datafile = os.open(filename, os.O_RDONLY)
-	datamm = mmap.mmap(datafile, 0, access=mmap.ACCESS_READ)
+	## count the instances of every signature, using the offsets from
+	## the marker search if available. We might want to tweak this a bit.
+	datamm = None
+	candidates = []
+	for s in signatures:
+		if signaturemarkers[s] in offsets:
+			siginstances = len(offsets[signaturemarkers[s]])
+		else:
+			if datamm == None:
+				datafile = os.open(filename, os.O_RDONLY)
+				datamm = mmap.mmap(datafile, 0, access=mmap.ACCESS_READ)
+			bs = ''.join(signatures[s])
+			siginstances = 0
+			bsres = datamm.find(bs)
+			while bsres != -1:
+				siginstances += 1
+				bsres = datamm.find(bs, bsres +1)
+		if siginstances == 0 or siginstances < xor_minimum:
+			continue
+		candidates.append(s)
+	if datamm != None:
+		datamm.close()
+		os.close(datafile)
+	if candidates == []:
+		return (diroffsets, blacklist, [], hints)
 
 	tmpdir = fwunpack.dirsetup(tempdir, filename, "xor", counter)
 	res = None
-	for s in signatures:
-		bs = reduce(lambda x, y: x + y, signatures[s])
-		## find all instances of the signature. We might want to tweak
-		## this a bit.
-		bsres = datamm.find(bs)
-		if bsres == -1:
-			continue
-		siginstances = [bsres]
-		while bsres != -1:
-			bsres = datamm.find(bs, bsres +1)
-			if bsres != -1:
-				siginstances.append(bsres)
-		if len(siginstances) > 0:
-			if len(siginstances) < xor_minimum:
-				continue
-			res = unpackXOR(filename, s, tmpdir)
-			if res != None:
-				diroffsets.append((res, 0, os.stat(filename).st_size))
-				## blacklist the whole file
-				blacklist.append((0, os.stat(filename).st_size))
-				break
-	datamm.close()
-	os.close(datafile)
+	for s in candidates:
+		res = unpackXOR(filename, s, tmpdir)
+		if res != None:
+			diroffsets.append((res, 0, os.stat(filename).st_size))
+			## blacklist the whole file
+			blacklist.append((0, os.stat(filename).st_size))
+			break
 	if res == None:
 		os.rmdir(tmpdir)
 		return (diroffsets, blacklist, [], hints)
@@ -44,7 +44,7 @@ running program, are packed in a tar file.
 
 ## import a few standard Python modules
 import sys, os, os.path, hashlib, subprocess, tempfile, shutil, stat, multiprocessing
-import platform, cPickle, glob, tarfile, copy, gzip, Queue
+import platform, cPickle, glob, tarfile, copy, gzip, Queue, mmap, threading
 from optparse import OptionParser
 import datetime, re, struct, ConfigParser
 from multiprocessing import Process, Lock
@@ -58,7 +58,7 @@ import magic
 import psycopg2
 
 ## finally import a few BAT specific modules
-import extractor, prerun, fsmagic
+import extractor, prerun, fsmagic, reportstore, resultcache, hashset, dumparchive, tlshindex, fileview, scanmetrics
 
 ## load the magic library. Some versions of libmagic are too old
 ## to have the NO_CHECK_CDF magic flag, which might be problematic
@@ -74,8 +74,12 @@ ms.load()
 try:
 	import tlsh
 	tlshscan = True
+	## older versions of the TLSH module can only hash a complete
+	## string and cannot be used to compute TLSH in a streaming way
+	tlshstreaming = hasattr(tlsh, 'Tlsh')
 except Exception, e:
 	tlshscan = False
+	tlshstreaming = False
 
 ## Method to run a setup scan. Returns the result of the setup
 ## scan, which is in the form of a tuple (boolean, environment).
@@ -97,9 +101,73 @@ def runSetup(setupscan, usedatabase, cursor, conn, debug=False):
 	scanres = locals()["bat_%s" % method](setupscan['environment'], cursor, conn, debug=debug)
 	return scanres
 
-## convenience method to run the genericMarkerSearch in parallel chunks if needed
-def paralleloffsetsearch((filedir, filename, magicscans, optmagicscans, offset, length)):
-	return prerun.genericMarkerSearch(os.path.join(filedir, filename), magicscans, optmagicscans, offset, length)
+## Big files are searched for markers in parts, which are put in the scan
+## queue, so processes that are idle can search parts of the file as well.
+## Parts are not assigned to a process in advance: a process that takes a
+## task for a part claims the next part that has not been searched yet. The
+## process that is scanning the file claims parts as well, so it never has
+## to wait for parts that no other process has picked up yet.
+##
+## markerjobs is a shared dictionary with the next part to be searched
+## for each file that is searched in parts.
+def claimmarkerpart(markerjobs, llock, jobid, parts):
+	llock.acquire()
+	if not jobid in markerjobs:
+		llock.release()
+		return None
+	index = markerjobs[jobid]
+	if index >= parts:
+		llock.release()
+		return None
+	markerjobs[jobid] = index + 1
+	llock.release()
+	return index
+
+## search a single part of a file for markers. The parts overlap by 50 bytes,
+## so markers that cross the border of two parts are found.
+def markersearchpart(filetoscan, index, partsize, magicscans, optmagicscans):
+	offset = index * partsize
+	return prerun.genericMarkerSearch(filetoscan, magicscans, optmagicscans, max(offset-50, 0), partsize+50)
+
+## search a big file for markers in parts and combine the results
+def parallelmarkersearch(filetoscan, filesize, magicscans, optmagicscans, scanqueue, markerqueues, markerjobs, llock, processid, jobid):
+	## use a few parts per process, but don't use very small parts
+	partsize = max(100000, filesize/(len(markerqueues)*4) + 1)
+	parts = (filesize + partsize - 1) / partsize
+
+	markerjobs[jobid] = 0
+	for i in range(0, parts):
+		scanqueue.put(('markersearch', jobid, processid, filetoscan, parts, partsize))
+
+	results = []
+	while True:
+		index = claimmarkerpart(markerjobs, llock, jobid, parts)
+		if index == None:
+			break
+		results.append(markersearchpart(filetoscan, index, partsize, magicscans, optmagicscans))
+
+	## wait for the parts that were searched by other processes
+	while len(results) < parts:
+		(resultjobid, res) = markerqueues[processid].get()
+		if resultjobid == jobid:
+			results.append(res)
+
+	llock.acquire()
+	del markerjobs[jobid]
+	llock.release()
+
+	offsets = {}
+	isascii = True
+	for (partoffsets, offsettokeys, partisascii) in results:
+		for key in partoffsets:
+			if key in offsets:
+				offsets[key].update(partoffsets[key])
+			else:
+				offsets[key] = set(partoffsets[key])
+		isascii = isascii and partisascii
+	for key in offsets:
+		offsets[key] = sorted(offsets[key])
+	return (offsets, isascii)
 
 ## method to filter scans, based on the tags that were found for a
 ## file, plus a list of tags that the scan should skip.
@@ -121,10 +189,20 @@ def filterScans(scans, tags):
 			filteredscans.append(scan)
 	return filteredscans
 
-## compute a SHA256, and possibly other hashes as well. This is done in chunks
-## to prevent a big file from being read in its entirety at once, slowing down
-## the machine.
-def gethash(filepath, filename, hashtypes, tlshmaxsize):
+## helper method for gethash() to update a hashing object with all data
+## from a memory mapped file, in chunks
+def updatehash(hashobj, hashmap, chunksize=1048576):
+	for offset in xrange(0, len(hashmap), chunksize):
+		hashobj.update(buffer(hashmap, offset, chunksize))
+
+## compute a SHA256, and possibly other hashes as well. The file is memory
+## mapped and all hashes (including TLSH) are computed in a single pass over
+## the data, in chunks that are fed to every hashing object. Hashes that are
+## already known, for example because an unpacker computed them while writing
+## the file, are reused and not computed again.
+## Optionally every hash is computed in its own thread. Most hashing code
+## releases the GIL, so the hashes can be computed in parallel.
+def gethash(filepath, filename, hashtypes, tlshmaxsize, knownhashes={}, hashthreads=False):
 	hashestocompute = set()
 	## always compute SHA256
 	hashestocompute.add('sha256')
@@ -132,50 +210,79 @@ def gethash(filepath, filename, hashtypes, tlshmaxsize):
 		hashestocompute.add(hashtype)
 
 	hashresults = {}
+	for h in hashestocompute:
+		if h in knownhashes:
+			hashresults[h] = knownhashes[h]
+
+	filesize = os.stat(os.path.join(filepath, filename)).st_size
 
 	## initiate new hashing objects, except for CRC32
-	## and TLSH, which need to be treated slightly differently
+	## (which is not yet supported) and TLSH, which
+	## needs to be treated slightly differently
 	hashdict = {}
 	for h in hashestocompute:
-		if h == 'crc32' or h == 'tlsh':
+		if h in hashresults or h == 'crc32':
 			continue
-		hashdict[h] = hashlib.new(h)
-
-	scanfile = open(os.path.join(filepath, filename), 'rb')
-	scanfile.seek(0)
-	hashdata = scanfile.read(10000000)
-	while hashdata != '':
-		for h in hashestocompute:
-			## CRC32 is not yet supported, TLSH is
-			## processed later
-			if h == 'crc32' or h == 'tlsh':
+		if h == 'tlsh':
+			if not tlshscan:
 				continue
-			hashdict[h].update(hashdata)
-		hashdata = scanfile.read(10000000)
-	scanfile.close()
-	for h in hashestocompute:
-		if h == 'crc32' or h == 'tlsh':
-			continue
-		hashresults[h] = hashdict[h].hexdigest()
-	filesize = os.stat(os.path.join(filepath, filename)).st_size
-
-	## compute TLSH, as long as it is not too big (determined by tlshmaxsize)
-	if 'tlsh' in hashestocompute:
-		if tlshscan:
+			## compute TLSH, as long as it is not too big (determined by tlshmaxsize)
 			if filesize >= 256 and filesize <= tlshmaxsize:
-				scanfile = open(os.path.join(filepath, filename), 'rb')
-				scanfile.seek(0)
-				hashdata = scanfile.read()
-				scanfile.close()
-				hashresults['tlsh'] = tlsh.hash(hashdata)
+				if tlshstreaming:
+					hashdict[h] = tlsh.Tlsh()
+				else:
+					scanfile = open(os.path.join(filepath, filename), 'rb')
+					hashresults[h] = tlsh.hash(scanfile.read())
+					scanfile.close()
 			else:
-				hashresults['tlsh'] = None
+				hashresults[h] = None
+			continue
+		hashdict[h] = hashlib.new(h)
+
+	if hashdict == {}:
+		return hashresults
+
+	## empty files cannot be memory mapped
+	if filesize == 0:
+		hashmap = ''
+	else:
+		scanfile = open(os.path.join(filepath, filename), 'rb')
+		hashmap = mmap.mmap(scanfile.fileno(), 0, access=mmap.ACCESS_READ)
+		scanfile.close()
+
+	if hashthreads and len(hashdict) > 1:
+		hashworkers = []
+		for h in hashdict:
+			t = threading.Thread(target=updatehash, args=(hashdict[h], hashmap))
+			t.start()
+			hashworkers.append(t)
+		for t in hashworkers:
+			t.join()
+	else:
+		chunksize = 1048576
+		for offset in xrange(0, filesize, chunksize):
+			hashdata = buffer(hashmap, offset, chunksize)
+			for h in hashdict:
+				hashdict[h].update(hashdata)
+	if filesize != 0:
+		hashmap.close()
+
+	for h in hashdict:
+		if h == 'tlsh':
+			hashdict[h].final()
+			try:
+				hashresults[h] = hashdict[h].hexdigest()
+			except ValueError, e:
+				## not enough variation in the data, which is
+				## what tlsh.hash() returns in that case as well
+				hashresults[h] = ''
+		else:
+			hashresults[h] = hashdict[h].hexdigest()
 	return hashresults
 
 ## continuously grab tasks (files) from a queue, tag ('prerun phase'), possibly unpack
 ## and recurse ('unpack'). Then run different scans per file ('leaf').
-def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, prerunmagic, magicscans, optmagicscans, processid, hashdict, llock, template, unpacktempdir, topleveldir, tempdir, outputhash, cursor, conn, scansourcecode, dumpoffsets, offsetdir, compressed, timeout, scan_binary_basename, tlshmaxsize):
-	lentempdir = len(tempdir)
+def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, prerunmagic, magicscans, optmagicscans, processid, hashes, llock, template, unpacktempdir, outputhash, cursor, conn, scansourcecode, dumpoffsets, compressed, compresslevel, timeout, tlshmaxsize, tlshindexfile, hashthreads, resultcachedir, leaffingerprint, markersearchminimum, markerqueues, markerjobs):
 	sourcecodequery = "select checksum from processed_file where checksum=%s limit 1"
 
 	## import all methods defined in the scans, once per thread
@@ -208,11 +315,49 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 			blacklistscans.add((module, method))
 			continue
 
+	## extensions of files that are ignored by some scans. Results for
+	## files with these extensions could be different from results for
+	## identical files with a different name, which matters for the result
+	## cache.
+	ignoreextensions = set()
+	for s in prerunscans + scans + leafscans:
+		if 'extensionsignore' in s:
+			ignoreextensions.update(s['extensionsignore'].split(':'))
+
+	## counter for files that are searched for markers in parts
+	markerjobcounter = 0
+
 	## grab tasks from the queue continuously until there are no more tasks left
 	while True:
 		## reset the reports, blacklist, offsets and tags for each new scan
 		blacklist = []
-		(dirname, filename, lenscandir, debug, tags, scanhints, offsets) = scanqueue.get(timeout=timeout)
+		scantask = scanqueue.get(timeout=timeout)
+
+		## search a part of a big file for markers for another process
+		if scantask[0] == 'markersearch':
+			(tasktype, jobid, owner, markerfile, parts, partsize) = scantask
+			index = claimmarkerpart(markerjobs, llock, jobid, parts)
+			if index != None:
+				markerqueues[owner].put((jobid, markersearchpart(markerfile, index, partsize, magicscans, optmagicscans)))
+			scanqueue.task_done()
+			continue
+
+		(scanbinary, dirname, filename, lenscandir, debug, tags, scanhints, offsets) = scantask
+
+		## The processes are shared by all binaries that are scanned, so
+		## the directories of the binary are passed with each task.
+		topleveldir = scanbinary['topleveldir']
+		tempdir = scanbinary['tempdir']
+		lentempdir = len(tempdir)
+		offsetdir = scanbinary['offsetdir']
+
+		## the number of new tasks for files that were unpacked from this
+		## file, so it is known when all files of a binary are done.
+		newtasks = 0
+
+		## metrics of the scans for this file, which are sent back
+		## with the results
+		taskmetrics = scanmetrics.ScanMetrics()
 
 		if debug:
 			## record the time when processing of the file started
@@ -271,13 +416,13 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		if os.path.islink(filetoscan):
 			tags.append('symlink')
 			unpackreports['tags'] = tags
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 			scanqueue.task_done()
 			continue
 
 		## no use to further check pipes, sockets, device files, etcetera
 		if not os.path.isfile(filetoscan) and not os.path.isdir(filetoscan):
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 			scanqueue.task_done()
 			continue
 
@@ -289,13 +434,18 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		if filesize == 0:
 			tags.append('empty')
 			unpackreports['tags'] = tags
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 			scanqueue.task_done()
 			continue
 
 		## Store the hash of the file for identification and for possibly
 		## querying the knowledgebase later on.
-		filehashresults = gethash(dirname, filename, [outputhash, 'sha1', 'md5', 'tlsh'], tlshmaxsize)
+		## Unpackers can pass hashes that were computed while unpacking
+		## the file as a hint, so the file does not need to be hashed again.
+		knownhashes = {}
+		if 'hashes' in scanhints:
+			knownhashes = scanhints['hashes']
+		filehashresults = taskmetrics.measure('internal', 'hashing', False, gethash, dirname, filename, [outputhash, 'sha1', 'md5', 'tlsh'], tlshmaxsize, knownhashes, hashthreads)
 		unpackreports['checksum'] = filehashresults[outputhash]
 		for u in filehashresults:
 			unpackreports[u] = filehashresults[u]
@@ -309,7 +459,7 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 			if res != []:
 				seenbefore = True
 				for r in res:
-					exactmatches.append(res)
+					exactmatches.append(r)
 
 		blacklistedfiles = []
 		if cursor != None:
@@ -318,25 +468,51 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		if filehash in blacklistedfiles:
 			tags.append('blacklisted')
 			unpackreports['tags'] = tags
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 			scanqueue.task_done()
 			continue
 
-		## acquire the lock for the shared dictionary to see if this file was already
-		## scanned, or is in the process of being scanned.
-		llock.acquire()
-		if filehash in hashdict:
-			llock.release()
+		## claim the checksum in the shared set of checksums to see if this
+		## file was already scanned, or is in the process of being scanned.
+		if not hashes.claim(scanbinary['id'], filehash):
 			## if the hash is already there mark it as a
 			## duplicate and stop scanning.
 			unpackreports['tags'] = ['duplicate']
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 			scanqueue.task_done()
 			continue
-		else:
-			## add the file to the shared dictionary
-			hashdict[filehash] = relfiletoscan
-			llock.release()
+
+		## Check if the file was scanned before (possibly in another
+		## firmware) with the same configuration. Results depend on the
+		## tags that were passed by the unpacker and on file extensions
+		## that are ignored by scans, so these are part of the context.
+		## Files that unpackers passed extra information about are not
+		## cached.
+		cacheable = False
+		cachedreport = None
+		if resultcachedir != None:
+			if not dumpoffsets and not 'knownfile' in scanhints and not 'blacklistignorescans' in scanhints:
+				cacheable = True
+				incomingtags = set(tags)
+				cachecontext = (sorted(incomingtags - set(['temporary'])), sorted([x for x in ignoreextensions if filename.endswith(x)]))
+				cachedreport = taskmetrics.measure('internal', 'resultcache', False, resultcache.getcache(resultcachedir).get, filehash, leaffingerprint, cachecontext)
+
+		## Files that were in the baseline (a scan of an earlier version of
+		## the binary) and that nothing was unpacked from are not scanned
+		## again, but the results of the baseline are used, including the
+		## results of ranking. These are not put in the result cache.
+		if cachedreport == None and scanbinary['baselinedir'] != None:
+			if not dumpoffsets and not 'knownfile' in scanhints and not 'blacklistignorescans' in scanhints:
+				baselinestore = reportstore.getstore(scanbinary['baselinedir'])
+				if baselinestore.exists(filehash):
+					baselinereport = baselinestore.load(filehash)
+					## results from the knowledgebase are looked up again
+					baselinetags = set(baselinereport['tags']) - set(['toplevel', 'temporary', 'duplicate', 'closematch', 'exactbinarymatch'])
+					for r in ['tags', 'closematch', 'exactbinarymatches']:
+						if r in baselinereport:
+							del baselinereport[r]
+					cachedreport = {'tags': list(baselinetags), 'reports': baselinereport}
+					cacheable = False
 
 		## look up the file in the BAT database to see if it is
 		## a known source code file.
@@ -354,6 +530,12 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		if 'knownfile' in scanhints:
 			knownfile = scanhints['knownfile']
 			unpacked = True
+		elif cachedreport != None:
+			## the file was scanned before and nothing was unpacked
+			## from it, so the unpack scans do not need to be run.
+			knownfile = True
+			tags = list(set(tags + cachedreport['tags']))
+			unpackreports['scans'] = []
 		else:
 			blacklistignorescans = set()
 			if "blacklistignorescans" in scanhints:
@@ -394,7 +576,7 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 					continue
 
 				## run the known unpack method
-				scanres = eval("bat_%s(filetoscan, tempdir, newenv, debug=debug)" % (method))
+				scanres = taskmetrics.measure('unpack', unpackscan['name'], 'profile' in unpackscan, locals()['bat_%s' % method], filetoscan, tempdir, newenv, debug=debug)
 				if scanres == ([], [], [], {}):
 					## no result, so move on to the next scan
 					continue
@@ -454,8 +636,9 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 											scannerhints[sc] = copy.deepcopy(hints[filepathname][sc])
 									if "temporary" in tags and diroffset[1] == 0 and diroffset[2] == filesize:
 										leaftags.append('temporary')
-									scantask = (i[0], p, len(scandir), debug, leaftags, scannerhints, {})
+									scantask = (scanbinary, i[0], p, len(scandir), debug, leaftags, scannerhints, {})
 									scanqueue.put(scantask)
+									newtasks += 1
 									relscanpath = "%s/%s" % (i[0][lentempdir:], p)
 									if relscanpath.startswith('/'):
 										relscanpath = relscanpath[1:]
@@ -470,7 +653,12 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		if not knownfile or 'blacklistignorescans' in scanhints:
 			## scan for markers in case they are not already known
 			if offsets == {}:
-				(offsets, offsetkeys, isascii) = prerun.genericMarkerSearch(filetoscan, magicscans, optmagicscans)
+				## big files are searched in parts by several processes
+				if filesize > markersearchminimum and len(markerqueues) > 1:
+					(offsets, isascii) = taskmetrics.measure('internal', 'markersearch', False, parallelmarkersearch, filetoscan, filesize, magicscans, optmagicscans, scanqueue, markerqueues, markerjobs, llock, processid, (processid, markerjobcounter))
+					markerjobcounter += 1
+				else:
+					(offsets, offsetkeys, isascii) = taskmetrics.measure('internal', 'markersearch', False, prerun.genericMarkerSearch, filetoscan, magicscans, optmagicscans)
 				if isascii:
 					tags.append('text')
 				else:
@@ -486,19 +674,11 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 			try:
 				os.stat(checkoffsetpicklename)
 			except:
-				picklefile = open(offsetpicklename, 'wb')
+				## optionally compress the pickle files to save space
+				picklefile = extractor.openreport(offsetpicklename, compressed, compresslevel)
 				cPickle.dump(offsets, picklefile)
 				picklefile.close()
 
-				## optionally compress the pickle files to save space
-				if compressed:
-					fin = open(offsetpicklename, 'rb')
-					fout = gzip.open("%s.gz" % offsetpicklename, 'wb')
-					fout.write(fin.read())
-					fout.close()
-					fin.close()
-					os.unlink(fin.name)
-
 		if "encrypted" in tags:
 			knownfile = True
 
@@ -515,215 +695,223 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 					if offsets[magictype][0] - fsmagic.correction.get(magictype, 0) == 0:
 						zerooffsets.add(magictype)
 
-			## prerun scans should be run before any of the other scans
-			for prerunscan in prerunscans:
-				ignore = False
-				if 'extensionsignore' in prerunscan:
-					extensionsignore = prerunscan['extensionsignore'].split(':')
-					for e in extensionsignore:
-						if filetoscan.endswith(e):
-							ignore = True
-							break
-				if ignore:
-					continue
-				if prerunscan['name'] in prerunignore:
-					if set(tags).intersection(set(prerunignore[prerunscan['name']])) != set():
-						continue
-				if prerunscan['name'] in prerunmagic:
-					if set(prerunmagic[prerunscan['name']]).intersection(filterscans) == set():
+			## the headers at the offsets are checked by many of the prerun
+			## and unpack scans, so the file is only opened once for all of them
+			fileview.openshared(filetoscan)
+			try:
+				## prerun scans should be run before any of the other scans
+				for prerunscan in prerunscans:
+					ignore = False
+					if 'extensionsignore' in prerunscan:
+						extensionsignore = prerunscan['extensionsignore'].split(':')
+						for e in extensionsignore:
+							if filetoscan.endswith(e):
+								ignore = True
+								break
+					if ignore:
 						continue
-				module = prerunscan['module']
-				method = prerunscan['method']
-				if (module, method) in blacklistscans:
-					continue
-				if debug:
-					print >>sys.stderr, module, method, filetoscan, datetime.datetime.utcnow().isoformat()
-					sys.stderr.flush()
-
-				scantags = locals()['bat_%s' % method](filetoscan, cursor, conn, tempdir, tags, offsets, prerunscan['environment'], debug=debug, unpacktempdir=unpacktempdir, filehashes=filehashresults)
-				## append the tag results. These will be used later to be able to specifically filter
-				## out files
-				if scantags != []:
-					tags = tags + scantags
-
-			## Reorder the scans based on information about offsets. If one scan has a
-			## match for offset 0 (after correction of the offset, like for tar, gzip,
-			## iso9660, etc.) make sure it is run first (not enabled now, unsafe in some
-			## cases).
-			unpackscans = []
-			scanfirst = []
-
-			## Filter scans
-			filteredscans = filterScans(scans, tags)
-			for unpackscan in filteredscans:
-				## filter the scan again as the tags might have changed
-				if unpackscan['noscan'] != None:
-					noscans = unpackscan['noscan'].split(':')
-					if set(noscans).intersection(set(tags)) != set():
+					if prerunscan['name'] in prerunignore:
+						if set(tags).intersection(set(prerunignore[prerunscan['name']])) != set():
+							continue
+					if prerunscan['name'] in prerunmagic:
+						if set(prerunmagic[prerunscan['name']]).intersection(filterscans) == set():
+							continue
+					module = prerunscan['module']
+					method = prerunscan['method']
+					if (module, method) in blacklistscans:
 						continue
-				if unpackscan['magic'] != None:
-					scanmagic = unpackscan['magic'].split(':')
-					if set(scanmagic).intersection(filterscans) != set():
-						if set(scanmagic).intersection(zerooffsets) != set():
-							if unpackscan['name'] != 'lzma':
-								scanfirst.append(unpackscan)
+					if debug:
+						print >>sys.stderr, module, method, filetoscan, datetime.datetime.utcnow().isoformat()
+						sys.stderr.flush()
+
+					scantags = taskmetrics.measure('prerun', prerunscan['name'], 'profile' in prerunscan, locals()['bat_%s' % method], filetoscan, cursor, conn, tempdir, tags, offsets, prerunscan['environment'], debug=debug, unpacktempdir=unpacktempdir, filehashes=filehashresults)
+					## append the tag results. These will be used later to be able to specifically filter
+					## out files
+					if scantags != []:
+						tags = tags + scantags
+
+				## Reorder the scans based on information about offsets. If one scan has a
+				## match for offset 0 (after correction of the offset, like for tar, gzip,
+				## iso9660, etc.) make sure it is run first (not enabled now, unsafe in some
+				## cases).
+				unpackscans = []
+				scanfirst = []
+
+				## Filter scans
+				filteredscans = filterScans(scans, tags)
+				for unpackscan in filteredscans:
+					## filter the scan again as the tags might have changed
+					if unpackscan['noscan'] != None:
+						noscans = unpackscan['noscan'].split(':')
+						if set(noscans).intersection(set(tags)) != set():
+							continue
+					if unpackscan['magic'] != None:
+						scanmagic = unpackscan['magic'].split(':')
+						if set(scanmagic).intersection(filterscans) != set():
+							if set(scanmagic).intersection(zerooffsets) != set():
+								if unpackscan['name'] != 'lzma':
+									scanfirst.append(unpackscan)
+								else:
+									unpackscans.append(unpackscan)
 							else:
 								unpackscans.append(unpackscan)
-						else:
-							unpackscans.append(unpackscan)
-				else:
-					unpackscans.append(unpackscan)
+					else:
+						unpackscans.append(unpackscan)
 
-			## sort 'unpackscans' in decreasing priority, so highest
-			## priority scans are run first.
-			unpackscans = sorted(unpackscans, key=lambda x: x['priority'], reverse=True)
+				## sort 'unpackscans' in decreasing priority, so highest
+				## priority scans are run first.
+				unpackscans = sorted(unpackscans, key=lambda x: x['priority'], reverse=True)
 
-			## prepend the most promising scans at offset 0 (if any)
-			scanfirst = sorted(scanfirst, key=lambda x: x['priority'], reverse=True)
-			unpackscans = scanfirst + unpackscans
+				## prepend the most promising scans at offset 0 (if any)
+				scanfirst = sorted(scanfirst, key=lambda x: x['priority'], reverse=True)
+				unpackscans = scanfirst + unpackscans
 
-			unpackreports['scans'] = []
+				unpackreports['scans'] = []
 
-			blacklistignorescans = set()
-			if "blacklistignorescans" in scanhints:
-				blacklistignorescans = scanhints['blacklistignorescans']
+				blacklistignorescans = set()
+				if "blacklistignorescans" in scanhints:
+					blacklistignorescans = scanhints['blacklistignorescans']
+
+				unpacked = False
+				for unpackscan in unpackscans:
+					blacklistignored = False
+					if extractor.inblacklist(0, blacklist) == filesize:
+						## the whole file has already been scanned by other scans, so
+						## continue with the leaf scans.
+						blacklisted = True
+						if len(blacklistignorescans) == 0:
+							break
+						if not unpackscan['name'] in blacklistignorescans:
+							continue
 
-			unpacked = False
-			for unpackscan in unpackscans:
-				blacklistignored = False
-				if extractor.inblacklist(0, blacklist) == filesize:
-					## the whole file has already been scanned by other scans, so
-					## continue with the leaf scans.
-					blacklisted = True
-					if len(blacklistignorescans) == 0:
-						break
-					if not unpackscan['name'] in blacklistignorescans:
-						continue
+						## store a copy of the old blacklist
+						blacklistignored = True
+						oldblacklist = copy.deepcopy(blacklist)
+						blacklist = []
 
-					## store a copy of the old blacklist
-					blacklistignored = True
-					oldblacklist = copy.deepcopy(blacklist)
-					blacklist = []
+					if 'minimumsize' in unpackscan:
+						if filesize < unpackscan['minimumsize']:
+							continue
 
-				if 'minimumsize' in unpackscan:
-					if filesize < unpackscan['minimumsize']:
+					if unpackscan['noscan'] != None:
+						noscans = unpackscan['noscan'].split(':')
+						if list(set(tags).intersection(set(noscans))) != []:
+							continue
+		
+					ignore = False
+					if 'extensionsignore' in unpackscan:
+						extensionsignore = unpackscan['extensionsignore'].split(':')
+						for e in extensionsignore:
+							if filetoscan.endswith(e):
+								ignore = True
+							break
+					if ignore:
 						continue
-
-				if unpackscan['noscan'] != None:
-					noscans = unpackscan['noscan'].split(':')
-					if list(set(tags).intersection(set(noscans))) != []:
+					module = unpackscan['module']
+					method = unpackscan['method']
+					if (module, method) in blacklistscans:
 						continue
-		
-				ignore = False
-				if 'extensionsignore' in unpackscan:
-					extensionsignore = unpackscan['extensionsignore'].split(':')
-					for e in extensionsignore:
-						if filetoscan.endswith(e):
-							ignore = True
-						break
-				if ignore:
-					continue
-				module = unpackscan['module']
-				method = unpackscan['method']
-				if (module, method) in blacklistscans:
-					continue
-				if debug:
-					print >>sys.stderr, module, method, filetoscan, datetime.datetime.utcnow().isoformat()
-					sys.stderr.flush()
-
-				## make a copy before changing the environment
-				newenv = copy.deepcopy(unpackscan['environment'])
-				newenv['BAT_UNPACKED'] = unpacked
-
-				if template != None:
-					templen = len(re.findall('%s', template))
-					if templen == 2:
-						newenv['TEMPLATE'] = template % (os.path.basename(filetoscan), unpackscan['name'])
-					elif templen == 1:
-						newenv['TEMPLATE'] = template % unpackscan['name']
-					else:
-						newenv['TEMPLATE'] = template
-
-				## return value is the temporary dir, plus offset in the parent file
-				## plus a blacklist containing blacklisted ranges for the *original*
-				## file and a hash with offsets for each marker.
-				scanres = locals()["bat_%s" % method](filetoscan, tempdir, blacklist, offsets, newenv, debug=debug)
-				## result is either empty, or contains offsets, blacklist, tags and hints
-				if len(scanres) == 0:
-					continue
-				if len(scanres) != 4:
-					continue
-				(diroffsets, blacklist, scantags, hints) = scanres
-				tags = list(set(tags + scantags))
-				if extractor.inblacklist(0, blacklist) == filesize:
-					blacklisted = True
-
-				## special case: the whole file was unpacked and blacklisted
-				## but 'blacklistignorescans' was set. Resubmitting into the queue is
-				## not a possibility
-				if len(diroffsets) == 0:
-					if filetoscan in hints:
-						if 'blacklistignorescans' in hints[filetoscan]:
-							blacklistignorescans = hints[filetoscan]['blacklistignorescans']
-				for diroffset in diroffsets:
-					if diroffset == None:
+					if debug:
+						print >>sys.stderr, module, method, filetoscan, datetime.datetime.utcnow().isoformat()
+						sys.stderr.flush()
+
+					## make a copy before changing the environment
+					newenv = copy.deepcopy(unpackscan['environment'])
+					newenv['BAT_UNPACKED'] = unpacked
+
+					if template != None:
+						templen = len(re.findall('%s', template))
+						if templen == 2:
+							newenv['TEMPLATE'] = template % (os.path.basename(filetoscan), unpackscan['name'])
+						elif templen == 1:
+							newenv['TEMPLATE'] = template % unpackscan['name']
+						else:
+							newenv['TEMPLATE'] = template
+
+					## return value is the temporary dir, plus offset in the parent file
+					## plus a blacklist containing blacklisted ranges for the *original*
+					## file and a hash with offsets for each marker.
+					scanres = taskmetrics.measure('unpack', unpackscan['name'], 'profile' in unpackscan, locals()["bat_%s" % method], filetoscan, tempdir, blacklist, offsets, newenv, debug=debug)
+					## result is either empty, or contains offsets, blacklist, tags and hints
+					if len(scanres) == 0:
 						continue
-					unpacked = True
-					report = {}
-					scandir = diroffset[0]
+					if len(scanres) != 4:
+						continue
+					(diroffsets, blacklist, scantags, hints) = scanres
+					tags = list(set(tags + scantags))
+					if extractor.inblacklist(0, blacklist) == filesize:
+						blacklisted = True
+
+					## special case: the whole file was unpacked and blacklisted
+					## but 'blacklistignorescans' was set. Resubmitting into the queue is
+					## not a possibility
+					if len(diroffsets) == 0:
+						if filetoscan in hints:
+							if 'blacklistignorescans' in hints[filetoscan]:
+								blacklistignorescans = hints[filetoscan]['blacklistignorescans']
+					for diroffset in diroffsets:
+						if diroffset == None:
+							continue
+						unpacked = True
+						report = {}
+						scandir = diroffset[0]
 
-					## recursively scan all files in the directory
-					osgen = os.walk(scandir)
-					scanreports = []
-					try:
-       						while True:
-                					i = osgen.next()
-							## make sure all directories can be accessed
-							for d in i[1]:
-								directoryname = os.path.join(i[0], d)
-								if not os.path.islink(directoryname):
-									os.chmod(directoryname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
-                					for p in i[2]:
-								filepathname = os.path.join(i[0], p)
-								try:
-									leaftags = []
-									scannerhints = {}
-									if not os.path.islink(filepathname):
-										os.chmod(filepathname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
-									if filepathname in hints:
-										if 'tags' in hints[filepathname]:
-											leaftags = list(set(leaftags + hints[filepathname]['tags']))
-										if 'scanned' in hints[filepathname]:
-											if hints[filepathname]['scanned']:
-												scannerhints['knownfile'] = True
-												## TODO: add offsets if available
-										for sc in hints[filepathname]:
-											scannerhints[sc] = copy.deepcopy(hints[filepathname][sc])
-									if "temporary" in tags and diroffset[1] == 0 and diroffset[2] == filesize:
-										leaftags.append('temporary')
-									scantask = (i[0], p, len(scandir), debug, leaftags, scannerhints, {})
-									scanqueue.put(scantask)
-									relscanpath = "%s/%s" % (i[0][lentempdir:], p)
-									if relscanpath.startswith('/'):
-										relscanpath = relscanpath[1:]
-									scanreports.append(relscanpath)
-								except Exception, e:
-									pass
-					except StopIteration:
-						pass
-					unpackreports['scans'].append({'scanname': unpackscan['name'], 'scanreports': scanreports, 'offset': diroffset[1], 'size': diroffset[2]})
-				newblacklist = []
-				for b in blacklist:
-					if len(b) == 2:
-						b = b + (unpackscan['name'],)
-					newblacklist.append(b)
-				blacklist = newblacklist
-				if blacklistignored:
-					## restore the old blacklist
-					blacklist = copy.deepcopy(oldblacklist)
-					## add anything new
-					for b in newblacklist:
-						blacklist.append(b)
+						## recursively scan all files in the directory
+						osgen = os.walk(scandir)
+						scanreports = []
+						try:
+	       						while True:
+	                					i = osgen.next()
+								## make sure all directories can be accessed
+								for d in i[1]:
+									directoryname = os.path.join(i[0], d)
+									if not os.path.islink(directoryname):
+										os.chmod(directoryname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
+	                					for p in i[2]:
+									filepathname = os.path.join(i[0], p)
+									try:
+										leaftags = []
+										scannerhints = {}
+										if not os.path.islink(filepathname):
+											os.chmod(filepathname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
+										if filepathname in hints:
+											if 'tags' in hints[filepathname]:
+												leaftags = list(set(leaftags + hints[filepathname]['tags']))
+											if 'scanned' in hints[filepathname]:
+												if hints[filepathname]['scanned']:
+													scannerhints['knownfile'] = True
+													## TODO: add offsets if available
+											for sc in hints[filepathname]:
+												scannerhints[sc] = copy.deepcopy(hints[filepathname][sc])
+										if "temporary" in tags and diroffset[1] == 0 and diroffset[2] == filesize:
+											leaftags.append('temporary')
+										scantask = (scanbinary, i[0], p, len(scandir), debug, leaftags, scannerhints, {})
+										scanqueue.put(scantask)
+										newtasks += 1
+										relscanpath = "%s/%s" % (i[0][lentempdir:], p)
+										if relscanpath.startswith('/'):
+											relscanpath = relscanpath[1:]
+										scanreports.append(relscanpath)
+									except Exception, e:
+										pass
+						except StopIteration:
+							pass
+						unpackreports['scans'].append({'scanname': unpackscan['name'], 'scanreports': scanreports, 'offset': diroffset[1], 'size': diroffset[2]})
+					newblacklist = []
+					for b in blacklist:
+						if len(b) == 2:
+							b = b + (unpackscan['name'],)
+						newblacklist.append(b)
+					blacklist = newblacklist
+					if blacklistignored:
+						## restore the old blacklist
+						blacklist = copy.deepcopy(oldblacklist)
+						## add anything new
+						for b in newblacklist:
+							blacklist.append(b)
+			finally:
+				## also close the view if one of the scans failed
+				fileview.closeshared()
 
 		blacklist.sort()
 
@@ -774,7 +962,7 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 		unpackreports['tags'] = tags
 		if not unpacked and 'temporary' in tags:
 			os.unlink(filetoscan)
-			reportqueue.put({relfiletoscan: unpackreports})
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 		else:
 			reports = {}
 
@@ -783,7 +971,23 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 			## TODO: make configurable
 			tlshthreshold = 60
 			closestfile = None
-			if cursor != None:
+			if tlshindexfile != None:
+				## look up the closest file in the TLSH index, which
+				## also finds files with a different name
+				if tlshscan and not seenbefore:
+					if filehashresults.get('tlsh') != None:
+						closest = tlshindex.getindex(tlshindexfile).query(filehashresults['tlsh'], tlshthreshold)
+						if closest != []:
+							(tlshdistance, (tlshchecksum, tlshfilename, tlshpathname, parentname, parentchecksum)) = closest[0]
+							## the file itself is in the index (it was
+							## scanned before), which is an exact match
+							## and not a close match
+							if tlshchecksum == filehash:
+								seenbefore = True
+								exactmatches.append((tlshpathname, parentname, parentchecksum))
+							else:
+								closestfile = (tlshpathname, parentname, tlshdistance)
+			elif cursor != None:
 				if tlshscan and not seenbefore:
 					if 'tlsh' in filehashresults:
 						if filehashresults['tlsh'] != None:
@@ -809,8 +1013,9 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 								tlshdistance = tlsh.diff(filehashresults['tlsh'], tlshchecksum)
 								if tlshdistance < tlshminimum:
 									tlshminimum = tlshdistance
+									closestres = (tlshpathname, parentname, tlshdistance)
 							if tlshminimum < tlshthreshold:
-								closestfile = (tlshpathname, parentname, tlshdistance)
+								closestfile = closestres
 			if closestfile != None:
 				reports['closematch'] = closestfile
 				tags.append('closematch')
@@ -819,8 +1024,15 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 				reports['exactbinarymatches'] = exactmatches
 				tags.append('exactbinarymatch')
 
-			## run the leaf scans for the file
-			for leafscan in filterScans(leafscans, tags):
+			## run the leaf scans for the file, unless the results
+			## can be taken from the result cache.
+			if cachedreport != None:
+				runleafscans = []
+				for r in cachedreport['reports']:
+					reports[r] = cachedreport['reports'][r]
+			else:
+				runleafscans = filterScans(leafscans, tags)
+			for leafscan in runleafscans:
 				## filter the scan again as the tags might have changed
 				if leafscan['noscan'] != None:
 					noscans = leafscan['noscan'].split(':')
@@ -853,7 +1065,7 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 					sys.stderr.flush()
 					scandebug = True
 
-				res = eval("bat_%s(filetoscan, tags, cursor, conn, filehashresults, blacklist, leafscan['environment'], scandebug=scandebug, unpacktempdir=unpacktempdir)" % (method))
+				res = taskmetrics.measure('leaf', leafscan['name'], 'profile' in leafscan, locals()['bat_%s' % method], filetoscan, tags, cursor, conn, filehashresults, blacklist, leafscan['environment'], scandebug=scandebug, unpacktempdir=unpacktempdir)
 				if res != None:
 					(nt, leafres) = res
 					reports[leafscan['name']] = leafres
@@ -862,20 +1074,29 @@ def scan(scanqueue, reportqueue, scans, leafscans, prerunscans, prerunignore, pr
 			reports['tags'] = list(set(tags))
 			unpackreports['tags'] = list(set(unpackreports['tags'] + reports['tags']))
 
-			## write pickles with information to disk here to reduce memory usage
-			try:
-				os.stat('%s/filereports/%s-filereport.pickle' % (topleveldir,filehash))
-			except Exception, e:
-				picklefile = open('%s/filereports/%s-filereport.pickle' % (topleveldir,filehash), 'wb')
-				cPickle.dump(reports, picklefile)
-				picklefile.close()
-			reportqueue.put({relfiletoscan: unpackreports})
+			## store the results of the leaf scans in the result cache,
+			## but only for files that were not unpacked, as for these
+			## everything can be skipped the next time. Results from the
+			## knowledgebase that are not from leaf scans are not stored.
+			if cacheable and cachedreport == None and not unpacked:
+				cachetags = set(reports['tags']) - incomingtags - set(['closematch', 'exactbinarymatch'])
+				cachereports = {}
+				for leafscan in leafscans:
+					if leafscan['name'] in reports:
+						cachereports[leafscan['name']] = reports[leafscan['name']]
+				resultcache.getcache(resultcachedir).put(filehash, leaffingerprint, cachecontext, {'tags': list(cachetags), 'reports': cachereports})
+
+			## write the report to the report store here to reduce memory usage
+			leafstore = reportstore.getstore(topleveldir)
+			if not leafstore.exists(filehash):
+				leafstore.store(filehash, reports)
+			reportqueue.put((scanbinary['id'], newtasks, {relfiletoscan: unpackreports}, taskmetrics.result()))
 		if debug:
 			print >>sys.stderr, "DONE", filetoscan, starttime, datetime.datetime.utcnow().isoformat()
 			sys.stderr.flush()
 		scanqueue.task_done()
 
-def aggregatescan(unpackreports, aggregatescans, processors, scantempdir, topleveldir, scan_binary, scandate, batcursors, batcons, debug, unpacktempdir):
+def aggregatescan(unpackreports, aggregatescans, processors, scantempdir, topleveldir, scan_binary, scandate, batcursors, batcons, debug, unpacktempdir, metrics):
 	## aggregate scans look at the entire result and possibly modify it.
 	## The best example is JAR files: individual .class files will not be
 	## very significant (or even insignificant), but combined results are.
@@ -904,31 +1125,30 @@ def aggregatescan(unpackreports, aggregatescans, processors, scantempdir, toplev
 		except Exception, e:
 			continue
 
-		res = eval("bat_%s(unpackreports, scantempdir, topleveldir, processors, aggregatescan['environment'], batcursors, batcons, scandebug=scandebug, unpacktempdir=unpacktempdir)" % (method))
+		res = metrics.measure('aggregate', aggregatescan['name'], 'profile' in aggregatescan, locals()['bat_%s' % method], unpackreports, scantempdir, topleveldir, processors, aggregatescan['environment'], batcursors, batcons, scandebug=scandebug, unpacktempdir=unpacktempdir)
 		if res != None:
 			if res.keys() != []:
 				filehash = unpackreports[scan_binary]['checksum']
-				leaf_file_path = os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)
-				leaf_file = open(leaf_file_path, 'rb')
-				leafreports = cPickle.load(leaf_file)
-				leaf_file.close()
+				leafstore = reportstore.getstore(topleveldir)
+				leafreports = leafstore.loadfields(filehash, ['tags'])
 
 				for reskey in set(res.keys()):
 					leafreports[reskey] = res[reskey]
 					unpackreports[scan_binary]['tags'].append(reskey)
 					leafreports['tags'].append(reskey)
 
-				leaf_file = open(leaf_file_path, 'wb')
-				leafreports = cPickle.dump(leafreports, leaf_file)
-				leaf_file.close()
+				leafstore.update(filehash, leafreports)
 		endtime = datetime.datetime.utcnow()
 		if debug:
 			print >>sys.stderr, "AGGREGATE END", method, endtime.isoformat()
 		statistics[method] = endtime - starttime
 	return statistics
 
-## continuously grab tasks (files) from a queue and process
-def postrunscan(scanqueue, postrunscans, topleveldir, scantempdir, cursor, conn, debug, timeout):
+## continuously grab tasks (files) from a queue and process. The processes
+## are shared by all binaries that are scanned, so the directories of the
+## binary are passed with each task. After a file has been processed the
+## identifier of the binary is sent back using reportqueue.
+def postrunscan(scanqueue, reportqueue, postrunscans, cursor, conn, debug, timeout):
 
 	## import all methods defined in the scans
 	blacklistscans = set()
@@ -948,24 +1168,114 @@ def postrunscan(scanqueue, postrunscans, topleveldir, scantempdir, cursor, conn,
 
 	## grab tasks from the queue continuously until there are no more tasks
 	while True:
-		(filetoscan, unpackreports) = scanqueue.get(timeout=timeout)
+		(scanbinary, filetoscan, unpackreports) = scanqueue.get(timeout=timeout)
+		topleveldir = scanbinary['topleveldir']
+		scantempdir = scanbinary['tempdir']
 		ignore = False
 		for e in extensionsignore:
 			if filetoscan.endswith(e):
 				ignore = True
 				break
 		if ignore:
+			reportqueue.put((scanbinary['id'], None))
 			scanqueue.task_done()
 			continue
+		taskmetrics = scanmetrics.ScanMetrics()
 		for postrunscan in postrunscans:
 			module = postrunscan['module']
 			method = postrunscan['method']
-			res = eval("bat_%s(filetoscan, unpackreports, scantempdir, topleveldir, postrunscan['environment'], cursor, conn, debug=debug)" % (method))
+			try:
+				res = taskmetrics.measure('postrun', postrunscan['name'], 'profile' in postrunscan, locals()['bat_%s' % method], filetoscan, unpackreports, scantempdir, topleveldir, postrunscan['environment'], cursor, conn, debug=debug)
+			except Exception, e:
+				## the process is used for other files and binaries
+				## as well, so it should not stop here.
+				print >>sys.stderr, "postrun scan %s failed for %s: %s" % (method, filetoscan, e)
+				sys.stderr.flush()
+				continue
 			## TODO: find out what to do with this
 			if res != None:
 				pass
+		reportqueue.put((scanbinary['id'], taskmetrics.result()))
 		scanqueue.task_done()
 
+## send a file of a binary to the postrun scans. Duplicates are not scanned.
+def queuepostrun(scanqueue, scanstate, filename):
+	unpackreports = scanstate['unpackreports']
+	if not 'checksum' in unpackreports[filename]:
+		return
+	if not 'tags' in unpackreports[filename]:
+		return
+	if 'duplicate' in unpackreports[filename]['tags']:
+		return
+	unpackreports[filename]['tags'] = list(set(unpackreports[filename]['tags']))
+	scanstate['postrunpending'] += 1
+	scanqueue.put((scanstate['scanbinary'], filename, unpackreports[filename]))
+
+## continuously grab files from a queue and run the methods of aggregate scans
+## that work on individual files (perfilemethod) on them. The tags that are
+## added by these methods are sent back using reportqueue.
+def perfilescan(scanqueue, reportqueue, perfilescans, cursor, conn, debug, timeout):
+
+	## import all methods defined in the scans
+	blacklistscans = set()
+
+	for perfilescan in perfilescans:
+		module = perfilescan['module']
+		method = perfilescan['perfilemethod']
+		try:
+			exec "from %s import %s as bat_%s" % (module, method, method)
+		except Exception, e:
+			blacklistscans.add((module, method))
+			continue
+
+	## grab tasks from the queue continuously until there are no more tasks
+	while True:
+		(scanbinary, filehash, filetoscan, tags) = scanqueue.get(timeout=timeout)
+		topleveldir = scanbinary['topleveldir']
+		newtags = []
+		taskmetrics = scanmetrics.ScanMetrics()
+		for perfilescan in perfilescans:
+			module = perfilescan['module']
+			method = perfilescan['perfilemethod']
+			if (module, method) in blacklistscans:
+				continue
+			if debug:
+				scandebug = True
+			else:
+				scandebug = 'debug' in perfilescan
+			try:
+				res = taskmetrics.measure('perfile', perfilescan['name'], 'profile' in perfilescan, locals()['bat_%s' % method], filehash, filetoscan, tags, topleveldir, perfilescan['environment'], cursor, conn, scandebug=scandebug)
+			except Exception, e:
+				## the aggregate scan will process the file instead
+				print >>sys.stderr, "perfile scan %s failed for %s: %s" % (method, filetoscan, e)
+				sys.stderr.flush()
+				continue
+			if res != None:
+				for t in res:
+					if not t in newtags:
+						newtags.append(t)
+		reportqueue.put((scanbinary['id'], filehash, newtags, taskmetrics.result()))
+		scanqueue.task_done()
+
+## open a connection to the database for each process. If not all connections
+## could be made only the connections that succeeded are returned.
+def connectdatabase(scanenv, processamount):
+	batcons = []
+	batcursors = []
+	for i in range(0,processamount):
+		try:
+			c = psycopg2.connect(database=scanenv['POSTGRESQL_DB'], user=scanenv['POSTGRESQL_USER'], password=scanenv['POSTGRESQL_PASSWORD'], port=scanenv.get('POSTGRESQL_PORT', None), host=scanenv.get('POSTGRESQL_HOST', None))
+			## count the queries if metrics are recorded
+			if scanmetrics.enabled:
+				cursor = c.cursor(cursor_factory=scanmetrics.CountingCursor)
+			else:
+				cursor = c.cursor()
+			batcons.append(c)
+			batcursors.append(cursor)
+		except Exception, e:
+			break
+	return (batcursors, batcons)
+
 ## process a single configuration section
 def scanconfigsection(config, section, scanenv, batconf):
 	if config.has_option(section, 'type'):
@@ -1050,6 +1360,12 @@ def scanconfigsection(config, section, scanenv, batconf):
 				conf['debug'] = True
 		except:
 			pass
+		try:
+			## run the scan with cProfile if metrics are recorded
+			if config.get(section, 'profile') == 'yes':
+				conf['profile'] = True
+		except:
+			pass
 		try:
 			parallel = config.get(section, 'parallel')
 			if parallel == 'yes':
@@ -1125,6 +1441,26 @@ def scanconfigsection(config, section, scanenv, batconf):
 				else:
 					conf['compress'] = False
 
+		if config.get(section, 'type') == 'aggregate':
+			## method that does the part of the aggregate scan that
+			## only needs the results of a single file. It is run as
+			## soon as the file has been unpacked and scanned.
+			try:
+				conf['perfilemethod'] = config.get(section, 'perfilemethod')
+			except:
+				pass
+			## aggregate scans that can change the results of
+			## individual files are a barrier: postrun scans can only
+			## be run after these aggregate scans have finished.
+			try:
+				barrier = config.get(section, 'barrier')
+				if barrier == 'no':
+					conf['barrier'] = False
+				else:
+					conf['barrier'] = True
+			except:
+				conf['barrier'] = True
+
 		## finally add the configurations to the right list
 		if config.get(section, 'type') == 'leaf':
 			if debug:
@@ -1246,6 +1582,30 @@ def readconfig(config, configfilename):
 				batconf['dumpoffsets'] = False
 		except:
 			batconf['dumpoffsets'] = False
+		try:
+			## directory with results of earlier scans that can
+			## be reused for identical files
+			resultcachedir = config.get(section, 'resultcachedirectory')
+			if not os.path.isdir(resultcachedir):
+				batconf['resultcachedirectory'] = None
+			else:
+				batconf['resultcachedirectory'] = resultcachedir
+		except:
+			batconf['resultcachedirectory'] = None
+		try:
+			## index of the TLSH hashes of files in the database,
+			## made with maintenance/createtlshindex.py
+			tlshindexfile = config.get(section, 'tlshindex')
+			if not os.path.isfile(tlshindexfile):
+				batconf['tlshindex'] = None
+			else:
+				batconf['tlshindex'] = tlshindexfile
+		except:
+			batconf['tlshindex'] = None
+		try:
+			batconf['knowledgebaseversion'] = config.get(section, 'knowledgebaseversion')
+		except:
+			batconf['knowledgebaseversion'] = None
 		try:
 			packconfig = config.get(section, 'cleanup')
 			if packconfig == 'yes':
@@ -1270,6 +1630,14 @@ def readconfig(config, configfilename):
 		except:
 			## set a default minimum threshold of 20 million bytes
 			batconf['markersearchminimum'] = 20000000
+		try:
+			concurrentbinaries = int(config.get(section, 'concurrentbinaries'))
+			if concurrentbinaries < 1:
+				concurrentbinaries = 1
+			batconf['concurrentbinaries'] = concurrentbinaries
+		except:
+			## by default scan one binary at a time
+			batconf['concurrentbinaries'] = 1
 		try:
 			tasktimeout = int(config.get(section, 'tasktimeout'))
 			batconf['tasktimeout'] = tasktimeout
@@ -1343,6 +1711,15 @@ def readconfig(config, configfilename):
 			batconf['tlshmaxsize'] = int(config.get(section, 'tlshmaxsize'))
 		except:
 			pass
+		try:
+			## compute the hashes of a file in separate threads
+			hashthreads = config.get(section, 'hashthreads')
+			if hashthreads == 'yes':
+				batconf['hashthreads'] = True
+			else:
+				batconf['hashthreads'] = False
+		except:
+			batconf['hashthreads'] = False
 		try:
 			debug = config.get(section, 'debug')
 			if debug == 'yes':
@@ -1359,6 +1736,16 @@ def readconfig(config, configfilename):
 				batconf['debugphases'] = debugphases.split(':')
 		except:
 			batconf['debugphases'] = []
+		try:
+			## record metrics for every scan and write them
+			## to METRICS.json in the output archive
+			metrics = config.get(section, 'metrics')
+			if metrics == 'yes':
+				batconf['metrics'] = True
+			else:
+				batconf['metrics'] = False
+		except:
+			batconf['metrics'] = False
 		try:
 			writeoutputfile = config.get(section, 'writeoutputfile')
 			if writeoutputfile == 'yes':
@@ -1430,6 +1817,25 @@ def readconfig(config, configfilename):
 				batconf['compress'] = False
 		except:
 			batconf['compress'] = False
+		## gzip compression level for result files (1 is fastest, 9 is
+		## smallest)
+		try:
+			compresslevel = int(config.get(section, 'compresslevel'))
+			if compresslevel >= 1 and compresslevel <= 9:
+				batconf['compresslevel'] = compresslevel
+			else:
+				batconf['compresslevel'] = 9
+		except:
+			batconf['compresslevel'] = 9
+		## compression of the output archive: 'gzip' (default) or 'none'
+		try:
+			outputcompression = config.get(section, 'outputcompression')
+			if outputcompression == 'none':
+				batconf['outputcompression'] = 'none'
+			else:
+				batconf['outputcompression'] = 'gzip'
+		except:
+			batconf['outputcompression'] = 'gzip'
 
 	## then process configurations of any plugins
 	## if defined.
@@ -1555,6 +1961,7 @@ def readconfig(config, configfilename):
 		if s['compress']:
 			## this is an ugly hack *cringe*
 			s['environment']['compress'] = True
+			s['environment']['compresslevel'] = batconf['compresslevel']
 		if 'reporthash' in batconf:
 			s['environment']['OUTPUTHASH'] = batconf['reporthash']
 		if 'template' in batconf:
@@ -1574,6 +1981,7 @@ def readconfig(config, configfilename):
 		if s['compress']:
 			## this is an ugly hack *cringe*
 			s['environment']['compress'] = True
+			s['environment']['compresslevel'] = batconf['compresslevel']
 
 	## sort scans on priority (highest priority first)
 	prerunscans = sorted(prerunscans, key=lambda x: x['priority'], reverse=True)
@@ -1658,28 +2066,89 @@ def dumpData(unpackreports, scans, tempdir, packpickles):
 		cPickle.dump(unpackreports, picklefile)
 		picklefile.close()
 
-def compressPickle((infile)):
-	fin = open(infile, 'rb')
-	fout = gzip.open("%s.gz" % infile, 'wb')
-	fout.write(fin.read())
-	fout.close()
-	fin.close()
-	os.unlink(fin.name)
+def exportReports((tempdir, filehashes, compress, compresslevel)):
+	reportstore.getstore(tempdir).export(tempdir, filehashes, compress, compresslevel)
+
+## Read the results of a scan of an earlier version of a binary (the
+## "baseline") from its scan archive. The reports of files that nothing was
+## unpacked from are put in a report store in 'baselinedir', so the scan
+## processes can use them for files with the same checksum. This needs an
+## archive with pickles (packpickles). Returns the amount of reports, or None
+## if the archive was made with a different version of BAT, configuration of
+## the scans or knowledgebase (according to its fingerprint).
+def readBaseline(baselinefile, baselinedir, scanfingerprint):
+	unpackreports = None
+	baselinefingerprint = None
+	baselinestore = reportstore.getstore(baselinedir)
+	tar = tarfile.open(baselinefile, 'r:*')
+	for member in tar:
+		if not member.isfile():
+			continue
+		if member.name == 'scandata.pickle':
+			unpackreports = cPickle.load(tar.extractfile(member))
+			continue
+		if member.name == 'FINGERPRINT':
+			baselinefingerprint = tar.extractfile(member).read().strip()
+			continue
+		if not member.name.startswith('filereports/'):
+			continue
+		picklename = os.path.basename(member.name)
+		if picklename.endswith('-filereport.pickle.gz'):
+			picklefile = gzip.GzipFile(fileobj=tar.extractfile(member))
+		elif picklename.endswith('-filereport.pickle'):
+			picklefile = tar.extractfile(member)
+		else:
+			continue
+		baselinestore.store(picklename.split('-', 1)[0], cPickle.load(picklefile))
+	tar.close()
+
+	if baselinefingerprint != scanfingerprint:
+		for filehash in baselinestore.checksums():
+			baselinestore.delete(filehash)
+		baselinestore.close()
+		return None
+
+	## only keep reports of files that nothing was unpacked from
+	reusable = set()
+	if unpackreports != None:
+		for u in unpackreports:
+			if not 'checksum' in unpackreports[u] or not 'tags' in unpackreports[u]:
+				continue
+			if 'duplicate' in unpackreports[u]['tags']:
+				continue
+			if unpackreports[u].get('scans', []) != []:
+				continue
+			reusable.add(unpackreports[u]['checksum'])
+	for filehash in set(baselinestore.checksums()) - reusable:
+		baselinestore.delete(filehash)
+	baselinereports = len(reusable.intersection(set(baselinestore.checksums())))
+	baselinestore.close()
+	return baselinereports
+
+## Open the archive with the results of a scan. Depending on the
+## configuration it is gzip compressed (using several threads) or
+## not compressed at all.
+def openDumpfile(scans, outputfile, processamount):
+	return dumparchive.DumpArchive(outputfile, scans['batconfig']['outputcompression'], processamount, scans['batconfig']['compresslevel'])
 
 ## Write everything to a dump file. A few directories that always should be
 ## packed are hardcoded, the other files are determined from the configuration.
 ## The configuration option 'lite' allows to leave out the extracted data, to
 ## speed up extraction of data in the GUI.
-def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, tempdir, batversion, statistics, packpickles, lite=False, debug=False, compress=True):
+##
+## If the archive was already opened earlier (to add the unpacked data while
+## the postrun scans were running) it is passed as 'dumpfile'.
+def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, tempdir, batversion, statistics, packpickles, lite=False, debug=False, compress=True, compresslevel=9, dumpfile=None, metrics=None, scanfingerprint=None):
 	dumpData(unpackreports, scans, tempdir, packpickles)
-	dumpfile = tarfile.open(outputfile, 'w:gz')
-	oldcwd = os.getcwd()
-	os.chdir(tempdir)
+	if dumpfile == None:
+		dumpfile = openDumpfile(scans, outputfile, processamount)
+		if not lite:
+			dumpfile.addbackground(os.path.join(tempdir, 'data'), 'data')
 
 	## write some statistics about BAT and the underlying
 	## platform, mostly for debugging purposes
 	statisticsfilename = 'STATISTICS'
-	statisticsfile = open(statisticsfilename, 'wb')
+	statisticsfile = open(os.path.join(tempdir, statisticsfilename), 'wb')
 	statisticsfile.write("BAT VERSION: %d\n" % batversion)
 	statisticsfile.write("PLATFORM: %s\n" % platform.platform())
 	statisticsfile.write("CPU: %s\n" % platform.processor())
@@ -1688,7 +2157,22 @@ def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, t
 	for i in statistics:
 		statisticsfile.write("%s: %s\n" % (i.upper(), statistics[i]))
 	statisticsfile.close()
-	dumpfile.add(statisticsfilename)
+	dumpfile.add(os.path.join(tempdir, statisticsfilename), statisticsfilename)
+
+	## write the fingerprint of the scans, which is checked when the
+	## archive is used as a baseline for a later scan
+	if scanfingerprint != None:
+		fingerprintfile = open(os.path.join(tempdir, 'FINGERPRINT'), 'wb')
+		fingerprintfile.write("%s\n" % scanfingerprint)
+		fingerprintfile.close()
+		dumpfile.add(os.path.join(tempdir, 'FINGERPRINT'), 'FINGERPRINT')
+
+	## write the metrics of the scans to METRICS.json, which is packed
+	## with the other JSON files, and the profiles of the scans, if any
+	if metrics != None:
+		metrics.write(tempdir, statistics)
+		if os.path.exists(os.path.join(tempdir, 'profiles')):
+			dumpfile.add(os.path.join(tempdir, 'profiles'), 'profiles')
 
 	## see if the BAT configuration file needs to be
 	## stored in the archive, with some information
@@ -1713,47 +2197,46 @@ def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, t
 				os.write(tmpscrub[0], scrubline)
 			os.fdopen(tmpscrub[0]).close()
 			scrubfile = tmpscrub[1]
-			shutil.copy(scrubfile, os.path.basename(configfile))
+			shutil.copy(scrubfile, os.path.join(tempdir, os.path.basename(configfile)))
 			os.unlink(scrubfile)
 		else:
-			shutil.copy(configfile, '.')
-		dumpfile.add(os.path.basename(configfile))
+			shutil.copy(configfile, tempdir)
+		dumpfile.add(os.path.join(tempdir, os.path.basename(configfile)), os.path.basename(configfile))
 
-	## By default pack all the JSON files in the current directory
-	dirfiles = os.listdir('.')
+	## By default pack all the JSON files in the top level directory
+	dirfiles = os.listdir(tempdir)
 	jsonfiles = filter(lambda x: x.endswith('.json'), dirfiles)
 	for j in jsonfiles:
-		dumpfile.add(j)
+		dumpfile.add(os.path.join(tempdir, j), j)
 
 	if scans['batconfig']['extrapack'] != []:
 		for e in scans['batconfig']['extrapack']:
 			if os.path.isabs(e):
 				continue
-			if os.path.islink(e):
+			if os.path.islink(os.path.join(tempdir, e)):
 				continue
 			## only pack files once
 			if e in jsonfiles:
 				continue
 			## TODO: many more checks
-			if os.path.exists(e):
-				dumpfile.add(e)
-	if not lite:
-		dumpfile.add('data')
+			if os.path.exists(os.path.join(tempdir, e)):
+				dumpfile.add(os.path.join(tempdir, e), e)
 
-	## optionally pack the Python pickles
+	## optionally pack the Python pickles. The leaf reports are
+	## exported from the report store to a pickle per file first.
 	if packpickles:
-		dumpfile.add('scandata.pickle')
+		dumpfile.add(os.path.join(tempdir, 'scandata.pickle'), 'scandata.pickle')
 		try:
-			os.stat('filereports')
-			if compress:
+			filehashes = reportstore.getstore(tempdir).checksums()
+			if compress and processamount > 1 and len(filehashes) > 1:
 				## compress pickle files in parallel
-				filereports = os.listdir('filereports')
-				fnames = map(lambda x: os.path.join(tempdir, "filereports", x), filereports)
-				if fnames != []:
-					pool = multiprocessing.Pool(processes=processamount)
-					pool.map(compressPickle, fnames, 1)
-					pool.terminate()
-			dumpfile.add('filereports')
+				exporttasks = map(lambda x: (tempdir, filehashes[x::processamount], compress, compresslevel), range(0, processamount))
+				pool = multiprocessing.Pool(processes=processamount)
+				pool.map(exportReports, exporttasks, 1)
+				pool.terminate()
+			else:
+				reportstore.getstore(tempdir).export(tempdir, filehashes, compress, compresslevel)
+			dumpfile.add(os.path.join(tempdir, 'filereports'), 'filereports')
 		except Exception,e:
 			if debug:
 				print >>sys.stderr, "writeDumpfile", e
@@ -1763,7 +2246,7 @@ def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, t
 	for i in (scans['postrunscans'] + scans['aggregatescans']):
 		if i['storedir'] != None and i['storetarget'] != None and i['storetype'] != None:
 			try:
-				os.stat(i['storetarget'])
+				os.stat(os.path.join(tempdir, i['storetarget']))
 				dumpadds.add(i['storetarget'])
 			except Exception, e:
 				if debug:
@@ -1772,14 +2255,20 @@ def writeDumpfile(unpackreports, scans, processamount, outputfile, configfile, t
 				else:
 					pass
 	for i in dumpadds:
-		dumpfile.add(i)
+		dumpfile.add(os.path.join(tempdir, i), i)
 	dumpfile.close()
-	os.chdir(oldcwd)
+	## members that were added in the background and could not be added
+	## are missing from the archive, so the archive is not complete
+	for (arcname, e) in dumpfile.errors:
+		print >>sys.stderr, "writeDumpfile: could not add %s to %s:" % (arcname, outputfile), e
+		sys.stderr.flush()
+	return dumpfile.errors == []
 
 ## runscan is the entry point for this file.
 ## It takes a list of binaries, a fully checked configuration
 ## and the BAT version number and then processes each
-## binary separately.
+## binary separately. It returns a list of binaries for
+## which the scan failed.
 def runscan(scans, binaries, batversion):
 	## first some initialization code that is the same for
 	## every binary to be scanned.
@@ -1867,6 +2356,11 @@ def runscan(scans, binaries, batversion):
 
 	usedatabase = scans['batconfig']['usedatabase']
 
+	## metrics have to be enabled before the connections to the database
+	## are made and the processes are started
+	if scans['batconfig']['metrics']:
+		scanmetrics.enable()
+
 	## For TLSH a default maximum size is set to 50 MiB
 	tlshmaxsize=52428800
 	if 'tlshmaxsize' in scans['batconfig']:
@@ -1879,15 +2373,9 @@ def runscan(scans, binaries, batversion):
 
 	scanenv = copy.deepcopy(scans['batconfig']['environment'])
 	if usedatabase:
-		for i in range(0,processamount):
-			try:
-				c = psycopg2.connect(database=scanenv['POSTGRESQL_DB'], user=scanenv['POSTGRESQL_USER'], password=scanenv['POSTGRESQL_PASSWORD'], host=scanenv.get('POSTGRESQL_HOST', None), port=scanenv.get('POSTGRESQL_PORT', None))
-				cursor = c.cursor()
-				batcons.append(c)
-				batcursors.append(cursor)
-			except Exception, e:
-				usedatabase = False
-				break
+		(batcursors, batcons) = connectdatabase(scanenv, processamount)
+		if len(batcons) != processamount:
+			usedatabase = False
 
 	## source code scanning only makes sense if there is
 	## a database with source code in the first place
@@ -1977,9 +2465,9 @@ def runscan(scans, binaries, batversion):
 			sscan['environment'] = newenv
 			finalleafscans.append(sscan)
 
+	aggregatedebug=False
+	finalaggregatescans = []
 	if scans['aggregatescans'] != []:
-		aggregatedebug=False
-		finalaggregatescans = []
 		if debug:
 			aggregatedebug = True
 			if debugphases != []:
@@ -2010,11 +2498,42 @@ def runscan(scans, binaries, batversion):
 			sscan['environment'] = newenv
 			finalaggregatescans.append(sscan)
 
+	## Results of earlier scans can be reused if the version of BAT, the
+	## configuration of the scans and the knowledgebase did not change,
+	## which is recorded in a fingerprint. The aggregate scans get their own
+	## fingerprint (which includes the fingerprint of the leaf scans, as
+	## these produce their input) via the environment.
+	##
+	## The fingerprint of all scans is written to the output archive, so
+	## it can be checked if the archive can be used as a baseline.
+	if usedatabase:
+		knowledgebase = resultcache.knowledgebaseversion(scans['batconfig']['knowledgebaseversion'], batcursors[0], batcons[0])
+	else:
+		knowledgebase = resultcache.knowledgebaseversion(scans['batconfig']['knowledgebaseversion'], None, None)
+	scanfingerprint = resultcache.fingerprint(batversion, knowledgebase, [scans['prerunscans'], finalunpackscans, finalleafscans, finalaggregatescans, scansourcecode, usedatabase])
+
+	resultcachedir = scans['batconfig']['resultcachedirectory']
+	leaffingerprint = None
+	if resultcachedir != None:
+		leaffingerprint = resultcache.fingerprint(batversion, knowledgebase, [scans['prerunscans'], finalunpackscans, finalleafscans, scansourcecode, usedatabase])
+		for s in finalaggregatescans:
+			aggregatefingerprint = resultcache.fingerprint(batversion, knowledgebase, [leaffingerprint, s, usedatabase])
+			s['environment']['BAT_RESULTCACHE'] = resultcachedir
+			s['environment']['BAT_RESULTCACHE_FINGERPRINT'] = aggregatefingerprint
+
 	unpackdirectory = scans['batconfig']['unpackdirectory']
 	if unpackdirectory != None:
 		if not os.path.exists(unpackdirectory):
 			unpackdirectory = None
 
+	## test if unpackdirectory is actually writable
+	if unpackdirectory != None:
+		try:
+			testdir = tempfile.mkdtemp(dir=unpackdirectory)
+			os.rmdir(testdir)
+		except:
+			unpackdirectory = None
+
 	## By default the output hash is set to SHA256, but
 	## it can be changed to other hashes, such as MD5
 	## or SHA1 (the only two other options supported at
@@ -2026,369 +2545,536 @@ def runscan(scans, binaries, batversion):
 
 	timeout=scans['batconfig']['tasktimeout']
 
-	## record the original working directory, as that is
-	## what BAT will start at for each scan.
-	origcwd = os.getcwd()
-
-	## now process each of the binaries individually
-	for bins in binaries:
-		statistics = {}
-		(scan_binary, writeconfig) = bins
-
-		## extra sanity check, in case the binary was removed
-		if not os.path.exists(scan_binary):
-			continue
-		scan_binary_basename = os.path.basename(scan_binary)
-
-		## force the cwd to a known value. This is to prevent mysterious
-		## errors in case some old results are cleaned up and the cwd is not
-		## restored in the code that had to change cwd for some reason.
-		os.chdir(origcwd)
-		scandate = datetime.datetime.utcnow()
-
-		## Per binary scanned a list with results is returned.
-		## Each file system or compressed file inside the binary returns a list
-		## with reports back as its result, so we have a list of lists.
-		## Within the inner list there is a result tuple, which could contain
-		## more lists in some fields, like libraries, or more result lists if
-		## the file inside a file system we looked at was in fact a file system.
-		unpackreports = {}
-
-		try:
-			## test if unpackdirectory is actually writable
-			topleveldir = tempfile.mkdtemp(dir=unpackdirectory)
-		except:
-			unpackdirectory = None
-			topleveldir = tempfile.mkdtemp(dir=unpackdirectory)
-
-		## reset the environment to a fresh copy
-		scanenv = copy.deepcopy(scans['batconfig']['environment'])
-
-		## create the top level directory where all the unpacked data
-		## will be stored
-		scantempdir = os.path.join(topleveldir, "data")
-		os.makedirs(scantempdir)
-
-		## copy the binary to the root of the unpack directory
-		starttime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "COPYING BEGIN", starttime.isoformat()
-			sys.stderr.flush()
-
-		shutil.copy(scan_binary, scantempdir)
-		os.chmod(os.path.join(scantempdir, scan_binary_basename), stat.S_IRWXU)
-
-		endtime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "COPYING END", endtime.isoformat()
-			sys.stderr.flush()
-
-		statistics['copying'] = endtime - starttime
-
-		## create the directory where result files (internal use) will be stored
-		if not os.path.exists(os.path.join(topleveldir, 'filereports')):
-			os.mkdir(os.path.join(topleveldir, 'filereports'))
-
-		## create the directory where result files (external) will be stored
-		if not os.path.exists(os.path.join(topleveldir, 'reports')):
-			os.mkdir(os.path.join(topleveldir, 'reports'))
-
-		## initialize a few data structures for the top level file:
-		## * tags    :: a list of tags that BAT will keep for the file
-		## * offsets :: a dictionary with offsets for each file type
-		##              found and which is used by unpacking scans
-		## * hints   :: a dictionary to pass extra information back
-		##              to the code launching the unpackers
-		tags = []
-		offsets = {}
-		hints = {}
-
-		## check if the file has an extension try to find if there
-		## is a special method defined for processing fies with that
-		## extension: often files with a particular extension will
-		## actually be of that file type, and it is possible to take
-		## a shortcut in those cases and skip many scans.
-		knownextension = False
-		fileextensions = scan_binary.lower().rsplit('.', 1)
-		if len(fileextensions) == 2:
-			fileextension = fileextensions[1]
-			for unpackscan in finalunpackscans:
-				if 'knownfilemethod' in unpackscan:
-					if fileextension in unpackscan['extensions']:
-						knownextension = True
-						break
-
-		## In case the extension is not known (and it is not possible to
-		## take a shortcut) try to do the marker search for the top level
-		## file in parallel if the file is big enough. For very big files
-		## this can save quite a bit of time.
-		if not knownextension:
-			offsetcutoff = scans['batconfig']['markersearchminimum']
-			if os.stat(scan_binary).st_size > offsetcutoff:
-				offsettasks = []
-				for i in range(0, os.stat(scan_binary).st_size, 100000):
-					offsettasks.append((scantempdir, scan_binary_basename, magicscans, optmagicscans, max(i-50, 0), 100000+50))
-				pool = multiprocessing.Pool(processes=processamount)
-				res = pool.map(paralleloffsetsearch, offsettasks)
-				pool.terminate()
-
-				isascii = True
-
-				for offsetresult in res:
-					(i, offsettokeys, offsetisascii) = offsetresult
-					for j in i:
-						if j in offsets:
-							offsets[j] += i[j]
-						else:
-							offsets[j] = copy.deepcopy(i[j])
-					isascii = isascii and offsetisascii
-				for i in offsets:
-					offsets[i] = sorted(list(set(offsets[i])))
-				if isascii:
-					tags.append('text')
-				else:
-					tags.append('binary')
+	template = scans['batconfig']['template']
 
-		## fill the scan task list with the first entry
-		scantasks = [(scantempdir, scan_binary_basename, len(scantempdir), tmpdebug, tags, hints, offsets)]
+	## Aggregate scans can have a method that only needs the results of a
+	## single file (for example ranking). These methods are run as soon as
+	## a file has been unpacked and scanned, while other files are still
+	## being unpacked.
+	finalperfilescans = filter(lambda x: 'perfilemethod' in x, finalaggregatescans)
 
-		template = scans['batconfig']['template']
+	postrundebug = False
+	if debug:
+		postrundebug = True
+		if debugphases != []:
+			if not 'postrun' in debugphases:
+				postrundebug = False
+	postrunprocessamount = processamount
+	if postrundebug:
+		if debugphases == []:
+			postrunprocessamount = 1
+		else:
+			if 'postrun' in debugphases:
+				postrunprocessamount = 1
+
+	## Postrun scans can also be run for a file as soon as it is done, but
+	## only if there are no aggregate scans that could still change the
+	## results of the file (barriers).
+	pipelinepostrunscans = False
+	if scans['postrunscans'] != []:
+		if filter(lambda x: x['barrier'], finalaggregatescans) == []:
+			pipelinepostrunscans = True
+
+	## The processes for unpacking and scanning, for the perfile methods
+	## and for the postrun scans are shared by all binaries and run at the
+	## same time as the aggregate scans of binaries that have already been
+	## unpacked, so each of them needs its own connections to the database.
+	aggregatecons = []
+	aggregatecursors = []
+	perfilecons = []
+	perfilecursors = []
+	postruncons = []
+	postruncursors = []
+	if usedatabase:
+		if finalaggregatescans != []:
+			(aggregatecursors, aggregatecons) = connectdatabase(scanenv, processamount)
+			if len(aggregatecons) != processamount:
+				print >>sys.stderr, "could not connect to database for aggregate scans"
+				sys.stderr.flush()
+				for c in aggregatecons:
+					c.close()
+				aggregatecons = []
+				aggregatecursors = []
+		if finalperfilescans != []:
+			(perfilecursors, perfilecons) = connectdatabase(scanenv, processamount)
+			if len(perfilecons) != processamount:
+				for c in perfilecons:
+					c.close()
+				perfilecons = []
+				perfilecursors = []
+				finalperfilescans = []
+		if scans['postrunscans'] != []:
+			(postruncursors, postruncons) = connectdatabase(scanenv, postrunprocessamount)
+			if len(postruncons) != postrunprocessamount:
+				print >>sys.stderr, "could not connect to database for postrun scans"
+				sys.stderr.flush()
+				for c in postruncons:
+					c.close()
+				postruncons = []
+				postruncursors = []
 
-		starttime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "PRERUN UNPACK BEGIN", starttime.isoformat()
-			sys.stderr.flush()
+	## record the original working directory, as that is
+	## what BAT will start at for each scan.
+	origcwd = os.getcwd()
 
-		## create the directory to dump offsets in case they need
-		## to be dumped for later reference.
-		offsetdir = os.path.join(topleveldir, "offsets")
-		if scans['batconfig']['dumpoffsets']:
-			os.makedirs(offsetdir)
-
-		## use a queue made with a manager to avoid some issues, see:
-		## http://docs.python.org/2/library/multiprocessing.html#pipes-and-queues
-		lock = Lock()
-		scanmanager = multiprocessing.Manager()
-		scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-		reportqueue = scanmanager.Queue(maxsize=0)
-		processpool = []
-
-		## keep a dictionary for hashes, to see which ones
-		## have already been processed, so duplicates can be
-		## detected.
-		hashdict = scanmanager.dict()
-
-		map(lambda x: scanqueue.put(x), scantasks)
+	## use a queue made with a manager to avoid some issues, see:
+	## http://docs.python.org/2/library/multiprocessing.html#pipes-and-queues
+	lock = Lock()
+	scanmanager = multiprocessing.Manager()
+	scanqueue = multiprocessing.JoinableQueue(maxsize=0)
+	reportqueue = scanmanager.Queue(maxsize=0)
+	processpool = []
+
+	## keep a set of hashes (per binary) in shared memory, to see which
+	## ones have already been processed, so duplicates can be
+	## detected.
+	hashes = hashset.SharedHashSet()
+
+	## Files bigger than 'markersearchminimum' are searched for markers
+	## in parts by all processes. Each process gets a queue for the results
+	## of the parts that were searched by other processes.
+	markerjobs = scanmanager.dict()
+	markerqueues = []
+	for i in range(0,processamount):
+		markerqueues.append(scanmanager.Queue(maxsize=0))
+
+	for i in range(0,processamount):
+		if usedatabase:
+			cursor = batcursors[i]
+			conn = batcons[i]
+		else:
+			cursor = None
+			conn = None
+		p = multiprocessing.Process(target=scan, args=(scanqueue, reportqueue, finalunpackscans, finalleafscans, scans['prerunscans'], prerunignore, prerunmagic, magicscans, optmagicscans, i, hashes, lock, template, unpackdirectory, outputhash, cursor, conn, scansourcecode, scans['batconfig']['dumpoffsets'], compressed, scans['batconfig']['compresslevel'], timeout, tlshmaxsize, scans['batconfig']['tlshindex'], scans['batconfig']['hashthreads'], resultcachedir, leaffingerprint, scans['batconfig']['markersearchminimum'], markerqueues, markerjobs))
+		processpool.append(p)
+		p.start()
+
+	## Start the processes for the perfile methods of aggregate scans
+	## and for the postrun scans, so files can be processed as soon as
+	## they are ready.
+	perfilepool = []
+	if finalperfilescans != []:
+		perfilequeue = multiprocessing.JoinableQueue(maxsize=0)
+		perfilereportqueue = scanmanager.Queue(maxsize=0)
 		for i in range(0,processamount):
 			if usedatabase:
-				cursor = batcursors[i]
-				conn = batcons[i]
+				cursor = perfilecursors[i]
+				conn = perfilecons[i]
 			else:
 				cursor = None
 				conn = None
-			p = multiprocessing.Process(target=scan, args=(scanqueue, reportqueue, finalunpackscans, finalleafscans, scans['prerunscans'], prerunignore, prerunmagic, magicscans, optmagicscans, i, hashdict, lock, template, unpackdirectory, topleveldir, scantempdir, outputhash, cursor, conn, scansourcecode, scans['batconfig']['dumpoffsets'], offsetdir, compressed, timeout, scan_binary_basename, tlshmaxsize))
-			processpool.append(p)
+			p = multiprocessing.Process(target=perfilescan, args=(perfilequeue, perfilereportqueue, finalperfilescans, cursor, conn, aggregatedebug, timeout))
+			perfilepool.append(p)
 			p.start()
 
-		scanqueue.join()
-
-		## Sometimes there are identical files inside a blob.
-		## To minimize time spent on scanning these should only be
-		## scanned once. Since the results are independent anyway (the
-		## unpacking phase is where unique paths are determined after all)
-		## each sha256 can be scanned only once. If there are more files
-		## with the same sha256 the result can simply be copied
-		## with some data changed.
-		##
-		## * keep a list of which sha256 have duplicates.
-		## * filter out the checksums
-		## * for each sha256 scan once
-		## * copy results in case there are duplicates
-		dupes = []
-
-		while True:
-			try:
-				val = reportqueue.get_nowait()
-				for k in val:
-					if 'tags' in val[k]:
-						## the file is a duplicate, so store
-						## it in a list dupes and continue
-						## with the next item.
-						if 'duplicate' in val[k]['tags']:
-							dupes.append(val)
-							continue
-					unpackreports[k] = val[k]
-				reportqueue.task_done()
-			except Queue.Empty, e:
-				## Queue is empty
-				break
+	postrunpool = []
+	if scans['postrunscans'] != []:
+		postrunqueue = multiprocessing.JoinableQueue(maxsize=0)
+		postrunreportqueue = scanmanager.Queue(maxsize=0)
+		for i in range(0,postrunprocessamount):
+			if postruncursors != []:
+				cursor = postruncursors[i]
+				conn = postruncons[i]
+			else:
+				cursor = None
+				conn = None
+			p = multiprocessing.Process(target=postrunscan, args=(postrunqueue, postrunreportqueue, scans['postrunscans'], cursor, conn, postrundebug, timeout))
+			postrunpool.append(p)
+			p.start()
 
-		## block here until the reportqueue is empty
-		reportqueue.join()
-	
-		## for duplicate files copy some information into
-		## unpackreports, except for the name and path
-		for i in dupes:
-			for k in i:
-				dupesha256 = i[k]['checksum']
-				origname = i[k]['name']
-				origrealpath = i[k]['realpath']
-				origpath = i[k]['path']
-				origrelativename = i[k]['relativename']
-				## keep name, realpath, relativename, path for
-				## the duplicate, and copy the rest of the
-				## data from the original.
-				dupecopy = copy.deepcopy(unpackreports[hashdict[dupesha256]])
-				dupecopy['name'] = origname
-				dupecopy['path'] = origpath
-				dupecopy['realpath'] = origrealpath
-				dupecopy['relativename'] = origrelativename
-				dupecopy['tags'].append('duplicate')
-				unpackreports[k] = dupecopy
-
-		## finally shut down all the processes and the scanmanager
-		for p in processpool:
-			p.terminate()
-
-		scanmanager.shutdown()
+	## Several binaries can be scanned at the same time (set with
+	## 'concurrentbinaries'). The processes take files from all binaries
+	## from the same queue, so while the aggregate scans for one binary are
+	## run, or a binary only has a few big files left, files of other
+	## binaries are unpacked and scanned. Each binary has its own unpacking
+	## directory and output file.
+	##
+	## For each binary the state of the scan is kept:
+	## * unpack  :: files are being unpacked and scanned
+	## * perfile :: waiting for the perfile methods of aggregate scans
+	## * postrun :: waiting for the postrun scans
+	concurrentbinaries = scans['batconfig']['concurrentbinaries']
+	scanstates = {}
+	binaryid = 0
+	binaryqueue = list(binaries)
+	scannedbinaries = 0
+	failedbinaries = []
+	batchstarttime = datetime.datetime.utcnow()
 
-		endtime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "PRERUN UNPACK END", endtime.isoformat()
-		if scans['batconfig']['reportendofphase']:
-			print "PRERUN UNPACK END %s" % scan_binary_basename, endtime.isoformat()
-		statistics['prerununpack'] = endtime - starttime
-
-		## always add an extra tag 'toplevel' for the top level item
-		if 'checksum' in unpackreports[scan_binary_basename]:
-			filehash = unpackreports[scan_binary_basename]['checksum']
-			leaf_file_path = os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)
-
-			## first record what the top level element is. This will be used by other scans
-			leaf_file = open(leaf_file_path, 'rb')
-			leafreports = cPickle.load(leaf_file)
-			leaf_file.close()
-
-			unpackreports[scan_binary_basename]['tags'].append('toplevel')
-			unpackreports[scan_binary_basename]['scandate'] = scandate
-			leafreports['tags'].append('toplevel')
-
-			leaf_file = open(leaf_file_path, 'wb')
-			leafreports = cPickle.dump(leafreports, leaf_file)
-			leaf_file.close()
-
-		## LEGACY: Now the next phase starts, namely scanning each individual
-		## file. This is done once per unique file (based on checksum).
-		## CURRENT: this is a NOP and just there to satisfy a few older use cases
-		if scans['batconfig']['reportendofphase']:
-			print "LEAF END %s" % scan_binary_basename, datetime.datetime.utcnow().isoformat()
-			sys.stdout.flush()
+	while True:
+		## start scanning new binaries until the batch is full
+		while len(scanstates) < concurrentbinaries and binaryqueue != []:
+			statistics = {}
+			(scan_binary, writeconfig) = binaryqueue.pop(0)
 
-		## Scan the files in context
-		starttime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "AGGREGATE BEGIN", starttime.isoformat()
-			sys.stderr.flush()
-		if scans['aggregatescans'] != []:
-			## because there are 'eval' statements the code to call aggregate scans
-			## has to be in a separate method
-			aggregatestatistics = aggregatescan(unpackreports, finalaggregatescans, processamount, scantempdir, topleveldir, scan_binary_basename, scandate, batcursors, batcons, aggregatedebug, unpackdirectory)
-			statistics.update(aggregatestatistics)
-		endtime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "AGGREGATE END", endtime.isoformat()
-			sys.stderr.flush()
-		if scans['batconfig']['reportendofphase']:
-			print "AGGREGATE END %s" % scan_binary_basename, endtime.isoformat()
-			sys.stdout.flush()
-		statistics['aggregate'] = endtime - starttime
+			## extra sanity check, in case the binary was removed
+			if not os.path.exists(scan_binary):
+				continue
+			scan_binary_basename = os.path.basename(scan_binary)
 
-		for i in unpackreports:
-			if 'tags' in unpackreports[i]:
-				unpackreports[i]['tags'] = list(set(unpackreports[i]['tags']))
+			## force the cwd to a known value. This is to prevent mysterious
+			## errors in case some old results are cleaned up and the cwd is not
+			## restored in the code that had to change cwd for some reason.
+			os.chdir(origcwd)
+			scandate = datetime.datetime.utcnow()
 
-		starttime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "POSTRUN BEGIN", starttime.isoformat()
-		## run postrunscans here, again in parallel, if needed/wanted
-		## These scans typically only have a few side effects, but don't change
-		## the reporting/scanning, just process the results. Examples: generate
-		## fancier reports, use microblogging to post scan results, etc.
-		## Duplicates that are tagged as 'duplicate' are not processed.
-		if scans['postrunscans'] != [] and unpackreports != {}:
-			scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-
-			havetask = False
-			for i in unpackreports:
-				if not 'checksum' in unpackreports[i]:
-					continue
-				if not 'tags' in unpackreports[i]:
-					continue
-				if 'duplicate' in unpackreports[i]['tags']:
-					continue
-				tmpdebug = False
-				if debug:
-					tmpdebug = True
-					if debugphases != []:
-						if not 'postrun' in debugphases:
-							tmpdebug = False
-				havetask = True
-				scanqueue.put((i, unpackreports[i]))
-
-			if havetask:
-				processpool = []
-				parallel = True
-				if tmpdebug:
-					if debugphases == []:
-						parallel = False
-					else:
-						if 'postrun' in debugphases:
-							parallel = False
-				if not parallel:
-					postrunprocessamount = 1
-				else:
-					postrunprocessamount = processamount
-				for i in range(0,postrunprocessamount):
-					if usedatabase:
-						cursor = batcursors[i]
-						conn = batcons[i]
-					else:
-						cursor = None
-						conn = None
-					p = multiprocessing.Process(target=postrunscan, args=(scanqueue, scans['postrunscans'], topleveldir, scantempdir, cursor, conn, tmpdebug, timeout))
-					processpool.append(p)
-					p.start()
+			topleveldir = tempfile.mkdtemp(dir=unpackdirectory)
 
-				scanqueue.join()
+			## create the top level directory where all the unpacked data
+			## will be stored
+			scantempdir = os.path.join(topleveldir, "data")
+			os.makedirs(scantempdir)
 
-				for p in processpool:
-					p.terminate()
+			## copy the binary to the root of the unpack directory
+			starttime = datetime.datetime.utcnow()
+			if debug:
+				print >>sys.stderr, "COPYING BEGIN", starttime.isoformat()
+				sys.stderr.flush()
 
-		endtime = datetime.datetime.utcnow()
-		if debug:
-			print >>sys.stderr, "POSTRUN END", endtime.isoformat()
-		if scans['batconfig']['reportendofphase']:
-			print "POSTRUN END %s" % scan_binary_basename, endtime.isoformat()
-		statistics['postrun'] = endtime - starttime
+			shutil.copy(scan_binary, scantempdir)
+			os.chmod(os.path.join(scantempdir, scan_binary_basename), stat.S_IRWXU)
 
-		endtime = datetime.datetime.utcnow()
-		statistics['total'] = endtime - scandate
+			endtime = datetime.datetime.utcnow()
+			if debug:
+				print >>sys.stderr, "COPYING END", endtime.isoformat()
+				sys.stderr.flush()
 
-		## finally write an archive file with all the data, if configured to do so
-		if scans['batconfig']['writeoutputfile']:
-			writeDumpfile(unpackreports, scans, processamount, writeconfig['outputfile'], writeconfig['config'], topleveldir, batversion, statistics, scans['batconfig']['packpickles'], scans['batconfig']['outputlite'], scans['batconfig']['debug'], compressed)
-		if scans['batconfig']['cleanup']:
-			try:
-				shutil.rmtree(topleveldir)
-			except Exception, e:
-				pass
-		if scans['batconfig']['reportendofphase']:
-			print "done", scan_binary, datetime.datetime.utcnow().isoformat()
+			statistics['copying'] = endtime - starttime
+
+			## create the directory where result files (internal use) will be stored
+			if not os.path.exists(os.path.join(topleveldir, 'filereports')):
+				os.mkdir(os.path.join(topleveldir, 'filereports'))
+
+			## create the directory where result files (external) will be stored
+			if not os.path.exists(os.path.join(topleveldir, 'reports')):
+				os.mkdir(os.path.join(topleveldir, 'reports'))
+
+			## initialize a few data structures for the top level file:
+			## * tags    :: a list of tags that BAT will keep for the file
+			## * offsets :: a dictionary with offsets for each file type
+			##              found and which is used by unpacking scans
+			## * hints   :: a dictionary to pass extra information back
+			##              to the code launching the unpackers
+			##
+			## The offsets of the top level file are searched by the scan
+			## processes, like for any other file. Big files are searched
+			## in parts by several processes (see 'markersearchminimum').
+			tags = []
+			offsets = {}
+			hints = {}
+
+			starttime = datetime.datetime.utcnow()
+			if debug:
+				print >>sys.stderr, "PRERUN UNPACK BEGIN", starttime.isoformat()
+				sys.stderr.flush()
+
+			## create the directory to dump offsets in case they need
+			## to be dumped for later reference.
+			offsetdir = os.path.join(topleveldir, "offsets")
+			if scans['batconfig']['dumpoffsets']:
+				os.makedirs(offsetdir)
+
+			## the directories of the binary, which are passed to
+			## the processes with each task
+			scanbinary = {'id': binaryid, 'topleveldir': topleveldir, 'tempdir': scantempdir, 'offsetdir': offsetdir, 'baselinedir': None}
+
+			## read the results of the scan of an earlier version of
+			## the binary, if any, to reuse the results of files that
+			## did not change.
+			if writeconfig.get('baseline') != None:
+				baselinedir = os.path.join(topleveldir, 'baseline')
+				os.mkdir(baselinedir)
+				try:
+					baselinereports = readBaseline(writeconfig['baseline'], baselinedir, scanfingerprint)
+					if baselinereports == None:
+						print >>sys.stderr, "baseline %s was made with a different version of BAT, scan configuration or knowledgebase, scanning everything" % writeconfig['baseline']
+					elif baselinereports == 0:
+						print >>sys.stderr, "baseline %s has no reusable results, scanning everything" % writeconfig['baseline']
+					else:
+						scanbinary['baselinedir'] = baselinedir
+				except Exception, e:
+					print >>sys.stderr, "baseline %s could not be read, scanning everything: %s" % (writeconfig['baseline'], e)
+				sys.stderr.flush()
+
+			## Per binary scanned a list with results is returned.
+			## Each file system or compressed file inside the binary returns a list
+			## with reports back as its result, so we have a list of lists.
+			## Within the inner list there is a result tuple, which could contain
+			## more lists in some fields, like libraries, or more result lists if
+			## the file inside a file system we looked at was in fact a file system.
+			## 'pending' is the number of files that have not been unpacked and
+			## scanned yet.
+			scanstates[binaryid] = {'scanbinary': scanbinary, 'binary': scan_binary, 'basename': scan_binary_basename, 'writeconfig': writeconfig, 'scandate': scandate, 'statistics': statistics, 'starttime': starttime, 'unpackreports': {}, 'dupes': [], 'originals': {}, 'pending': 1, 'perfilepending': {}, 'postrunpending': 0, 'state': 'unpack', 'metrics': scanmetrics.ScanMetrics()}
+
+			## fill the scan queue with the first entry
+			scanqueue.put((scanbinary, scantempdir, scan_binary_basename, len(scantempdir), tmpdebug, tags, hints, offsets))
+			binaryid += 1
+
+		if scanstates == {}:
+			break
+
+		## Process the results of files that were unpacked and scanned. Each
+		## result also records how many new files were found.
+		reports = []
+		try:
+			reports.append(reportqueue.get(timeout=1))
+			while True:
+				reports.append(reportqueue.get_nowait())
+		except Queue.Empty, e:
+			pass
+
+		for (reportid, newtasks, val, valmetrics) in reports:
+			scanstate = scanstates[reportid]
+			scanstate['pending'] += newtasks - 1
+			scanstate['metrics'].merge(valmetrics)
+			unpackreports = scanstate['unpackreports']
+			for k in val:
+				if 'tags' in val[k]:
+					## the file is a duplicate, so store
+					## it in a list dupes and continue
+					## with the next item.
+					if 'duplicate' in val[k]['tags']:
+						scanstate['dupes'].append(val)
+						continue
+				unpackreports[k] = val[k]
+				if not 'checksum' in val[k]:
+					continue
+				filehash = val[k]['checksum']
+				scanstate['originals'][filehash] = k
+				if finalperfilescans != []:
+					perfilepending = scanstate['perfilepending']
+					if filehash in perfilepending:
+						perfilepending[filehash].append(k)
+					else:
+						perfilepending[filehash] = [k]
+						perfilequeue.put((scanstate['scanbinary'], filehash, os.path.join(val[k]['realpath'], val[k]['name']), val[k]['tags']))
+				elif pipelinepostrunscans:
+					## the top level file is only scanned after
+					## the aggregate scans have been run.
+					if k != scanstate['basename']:
+						queuepostrun(postrunqueue, scanstate, k)
+
+		## process the results of the perfile methods: add the new tags
+		## to the reports of all files with the same checksum.
+		if finalperfilescans != []:
+			while True:
+				try:
+					(reportid, filehash, newtags, perfilemetrics) = perfilereportqueue.get_nowait()
+				except Queue.Empty, e:
+					break
+				scanstate = scanstates[reportid]
+				scanstate['metrics'].merge(perfilemetrics)
+				unpackreports = scanstate['unpackreports']
+				for filename in scanstate['perfilepending'][filehash]:
+					for t in newtags:
+						if not t in unpackreports[filename]['tags']:
+							unpackreports[filename]['tags'].append(t)
+					if pipelinepostrunscans and filename != scanstate['basename']:
+						queuepostrun(postrunqueue, scanstate, filename)
+				del scanstate['perfilepending'][filehash]
+
+		if scans['postrunscans'] != []:
+			while True:
+				try:
+					(reportid, postrunmetrics) = postrunreportqueue.get_nowait()
+				except Queue.Empty, e:
+					break
+				scanstates[reportid]['postrunpending'] -= 1
+				scanstates[reportid]['metrics'].merge(postrunmetrics)
+
+		for i in sorted(scanstates.keys()):
+			scanstate = scanstates[i]
+			scan_binary = scanstate['binary']
+			scan_binary_basename = scanstate['basename']
+			scanbinary = scanstate['scanbinary']
+			topleveldir = scanbinary['topleveldir']
+			scantempdir = scanbinary['tempdir']
+			scandate = scanstate['scandate']
+			statistics = scanstate['statistics']
+			unpackreports = scanstate['unpackreports']
+
+			if scanstate['state'] == 'unpack' and scanstate['pending'] == 0:
+				## Sometimes there are identical files inside a blob.
+				## To minimize time spent on scanning these should only be
+				## scanned once. Since the results are independent anyway (the
+				## unpacking phase is where unique paths are determined after all)
+				## each sha256 can be scanned only once. If there are more files
+				## with the same sha256 the result can simply be copied
+				## with some data changed.
+				##
+				## for duplicate files copy some information into
+				## unpackreports, except for the name and path
+				for d in scanstate['dupes']:
+					for k in d:
+						dupesha256 = d[k]['checksum']
+						origname = d[k]['name']
+						origrealpath = d[k]['realpath']
+						origpath = d[k]['path']
+						origrelativename = d[k]['relativename']
+						## keep name, realpath, relativename, path for
+						## the duplicate, and copy the rest of the
+						## data from the original.
+						dupecopy = copy.deepcopy(unpackreports[scanstate['originals'][dupesha256]])
+						dupecopy['name'] = origname
+						dupecopy['path'] = origpath
+						dupecopy['realpath'] = origrealpath
+						dupecopy['relativename'] = origrelativename
+						dupecopy['tags'].append('duplicate')
+						unpackreports[k] = dupecopy
+						## tags added by perfile methods that have not
+						## finished yet are added to the duplicate later
+						if dupesha256 in scanstate['perfilepending']:
+							scanstate['perfilepending'][dupesha256].append(k)
+
+				## the checksums of this binary are no longer needed
+				for h in scanstate['originals']:
+					hashes.remove(i, h)
+
+				endtime = datetime.datetime.utcnow()
+				if debug:
+					print >>sys.stderr, "PRERUN UNPACK END", endtime.isoformat()
+				if scans['batconfig']['reportendofphase']:
+					print "PRERUN UNPACK END %s" % scan_binary_basename, endtime.isoformat()
+				statistics['prerununpack'] = endtime - scanstate['starttime']
+				scanstate['state'] = 'perfile'
+
+			## wait for the perfile methods of the aggregate scans to finish
+			if scanstate['state'] == 'perfile' and scanstate['perfilepending'] == {}:
+				## always add an extra tag 'toplevel' for the top level item
+				if 'checksum' in unpackreports[scan_binary_basename]:
+					filehash = unpackreports[scan_binary_basename]['checksum']
+					leafstore = reportstore.getstore(topleveldir)
+
+					## first record what the top level element is. This will be used by other scans
+					leaftags = leafstore.get(filehash, 'tags')
+
+					unpackreports[scan_binary_basename]['tags'].append('toplevel')
+					unpackreports[scan_binary_basename]['scandate'] = scandate
+					leaftags.append('toplevel')
+
+					leafstore.update(filehash, {'tags': leaftags})
+
+				## LEGACY: Now the next phase starts, namely scanning each individual
+				## file. This is done once per unique file (based on checksum).
+				## CURRENT: this is a NOP and just there to satisfy a few older use cases
+				if scans['batconfig']['reportendofphase']:
+					print "LEAF END %s" % scan_binary_basename, datetime.datetime.utcnow().isoformat()
+					sys.stdout.flush()
+
+				## Scan the files in context
+				os.chdir(origcwd)
+				starttime = datetime.datetime.utcnow()
+				if debug:
+					print >>sys.stderr, "AGGREGATE BEGIN", starttime.isoformat()
+					sys.stderr.flush()
+				if scans['aggregatescans'] != []:
+					## because there are 'eval' statements the code to call aggregate scans
+					## has to be in a separate method
+					aggregatestatistics = aggregatescan(unpackreports, finalaggregatescans, processamount, scantempdir, topleveldir, scan_binary_basename, scandate, aggregatecursors, aggregatecons, aggregatedebug, unpackdirectory, scanstate['metrics'])
+					statistics.update(aggregatestatistics)
+				endtime = datetime.datetime.utcnow()
+				if debug:
+					print >>sys.stderr, "AGGREGATE END", endtime.isoformat()
+					sys.stderr.flush()
+				if scans['batconfig']['reportendofphase']:
+					print "AGGREGATE END %s" % scan_binary_basename, endtime.isoformat()
+					sys.stdout.flush()
+				statistics['aggregate'] = endtime - starttime
+
+				for u in unpackreports:
+					if 'tags' in unpackreports[u]:
+						unpackreports[u]['tags'] = list(set(unpackreports[u]['tags']))
+
+				## Reports that were reused from the baseline already have
+				## the tags that the aggregate scans added in the earlier
+				## scan (the 'ranking' tag is needed to not rank the files
+				## again), so the aggregate scans could have added them twice.
+				if scanbinary['baselinedir'] != None:
+					leafstore = reportstore.getstore(topleveldir)
+					for filehash in leafstore.checksums():
+						leaftags = leafstore.get(filehash, 'tags')
+						if leaftags == None or len(set(leaftags)) == len(leaftags):
+							continue
+						uniquetags = []
+						for t in leaftags:
+							if not t in uniquetags:
+								uniquetags.append(t)
+						leafstore.update(filehash, {'tags': uniquetags})
+
+				scanstate['starttime'] = datetime.datetime.utcnow()
+				if debug:
+					print >>sys.stderr, "POSTRUN BEGIN", scanstate['starttime'].isoformat()
+				## run postrunscans here, again in parallel, if needed/wanted
+				## These scans typically only have a few side effects, but don't change
+				## the reporting/scanning, just process the results. Examples: generate
+				## fancier reports, use microblogging to post scan results, etc.
+				## Duplicates that are tagged as 'duplicate' are not processed.
+				if pipelinepostrunscans:
+					## all other files were already sent to the postrun
+					## scans, so only the top level file is left.
+					queuepostrun(postrunqueue, scanstate, scan_binary_basename)
+				elif scans['postrunscans'] != []:
+					for u in unpackreports:
+						queuepostrun(postrunqueue, scanstate, u)
+				scanstate['state'] = 'postrun'
+
+				## The unpacked data does not change anymore after the
+				## aggregate scans, so it can already be added to the
+				## archive while the postrun scans are running.
+				if scans['batconfig']['writeoutputfile']:
+					scanstate['dumpfile'] = openDumpfile(scans, scanstate['writeconfig']['outputfile'], processamount)
+					if not scans['batconfig']['outputlite']:
+						scanstate['dumpfile'].addbackground(os.path.join(topleveldir, 'data'), 'data')
+
+			## wait for the postrun scans to finish
+			if scanstate['state'] == 'postrun' and scanstate['postrunpending'] == 0:
+				endtime = datetime.datetime.utcnow()
+				if debug:
+					print >>sys.stderr, "POSTRUN END", endtime.isoformat()
+				if scans['batconfig']['reportendofphase']:
+					print "POSTRUN END %s" % scan_binary_basename, endtime.isoformat()
+				statistics['postrun'] = endtime - scanstate['starttime']
+
+				endtime = datetime.datetime.utcnow()
+				statistics['total'] = endtime - scandate
+
+				## finally write an archive file with all the data, if configured to do so
+				if scans['batconfig']['writeoutputfile']:
+					metrics = None
+					if scans['batconfig']['metrics']:
+						metrics = scanstate['metrics']
+					if not writeDumpfile(unpackreports, scans, processamount, scanstate['writeconfig']['outputfile'], scanstate['writeconfig']['config'], topleveldir, batversion, statistics, scans['batconfig']['packpickles'], scans['batconfig']['outputlite'], scans['batconfig']['debug'], compressed, scans['batconfig']['compresslevel'], scanstate['dumpfile'], metrics, scanfingerprint):
+						print >>sys.stderr, "scan of %s failed: output file %s is incomplete" % (scan_binary, scanstate['writeconfig']['outputfile'])
+						sys.stderr.flush()
+						failedbinaries.append(scan_binary)
+				if scans['batconfig']['cleanup']:
+					try:
+						shutil.rmtree(topleveldir)
+					except Exception, e:
+						pass
+				if scans['batconfig']['reportendofphase']:
+					print "done", scan_binary, datetime.datetime.utcnow().isoformat()
+					sys.stdout.flush()
+				del scanstates[i]
+				scannedbinaries += 1
+
+	## finally shut down all the processes and the scanmanager
+	for p in processpool + perfilepool + postrunpool:
+		p.terminate()
+
+	scanmanager.shutdown()
+
+	## report the throughput when more than one binary was scanned
+	if scannedbinaries > 1:
+		batchtime = (datetime.datetime.utcnow() - batchstarttime).total_seconds()
+		if batchtime > 0:
+			print "scanned %d binaries in %.1f seconds (%.1f binaries per hour)" % (scannedbinaries, batchtime, scannedbinaries * 3600.0 / batchtime)
 			sys.stdout.flush()
 
 	## clean up the database connections and
 	## close all connections to the database
-	for c in batcursors:
+	for c in batcursors + aggregatecursors + perfilecursors + postruncursors:
 		c.close()
-	for c in batcons:
+	for c in batcons + aggregatecons + perfilecons + postruncons:
 		c.close()
+	return failedbinaries
@@ -11,78 +11,220 @@ proof and false positives are likely, so either check the results, or replace
 it with your own more robust checks.
 '''
 
-import string, re, os, magic, subprocess, sys, tempfile, copy
+import string, re, os, magic, subprocess, sys, tempfile, copy, mmap
 import extractor, elfcheck
 
-## generic searcher for certain marker strings
-## TODO: implement overlap between subsequent buffer reads
-def genericSearch(filename, markerDict, blacklist=[], unpacktempdir=None):
-	results = []
-	## first see if the entire file has been blacklisted
-	filesize = os.stat(filename).st_size
-	carved = False
-	foundmarkers = set()
-	if blacklist != []:
-		if extractor.inblacklist(0, blacklist) == filesize:
-			return None
+## size of the chunks that are searched for marker strings
+markerchunksize = 1048576
+
+## Search a file for marker strings of several scans at once. 'markerscans'
+## is a dictionary with for each scan a dictionary with for each marker a list
+## of strings, any of which indicates the marker. Every distinct string is
+## searched for only once, even if it is used by several markers or scans,
+## and strings of markers that were already found are no longer searched for.
+class MarkerMatcher:
+	def __init__(self, markerscans):
+		self.markerscans = markerscans
+		## marker string -> list of (scan, marker)
+		self.owners = {}
+		for scan in markerscans:
+			for marker in markerscans[scan]:
+				for markerstring in markerscans[scan][marker]:
+					if markerstring in self.owners:
+						self.owners[markerstring].append((scan, marker))
+					else:
+						self.owners[markerstring] = [(scan, marker)]
+		self.maxlen = max([1] + map(lambda x: len(x), self.owners.keys()))
+
+	## Search the file in a single pass over a memory map. Only the
+	## parts of the file that are not blacklisted are searched, in chunks
+	## that overlap, so strings at the edge of a chunk are also found.
+	## Returns a dictionary with for each scan a list of markers that were
+	## found, or None if nothing was found.
+	def search(self, filename, blacklist=[]):
+		results = {}
+		for scan in self.markerscans:
+			results[scan] = None
+		filesize = os.stat(filename).st_size
+		if filesize == 0:
+			return results
+		if blacklist != []:
+			if extractor.inblacklist(0, blacklist) == filesize:
+				return results
+		found = set()
+		remaining = set(self.owners.keys())
 		datafile = open(filename, 'rb')
-		lastindex = 0
-		datafile.seek(lastindex)
-		## make a copy and add a bogus value for the last
-		## byte to a temporary blacklist to make the loop work
-		## well.
-		blacklist_tmp = copy.deepcopy(blacklist)
-		blacklist_tmp.append((filesize,filesize))
-		for i in blacklist_tmp:
-			if i[0] == lastindex:
-				lastindex = i[1] - 1
-				datafile.seek(lastindex)
-				continue
-			if i[0] > lastindex:
-				## read the data, then search for markers
-				data = datafile.read(i[0] - lastindex)
-				if len(data) <=1:
-					## set lastindex to the next
-					lastindex = i[1] - 1
-					datafile.seek(lastindex)
-					continue
-				for marker in markerDict.keys():
-					if marker in foundmarkers:
+		data = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+		for (start, end) in extractor.carveranges(filesize, blacklist):
+			offset = start
+			while offset < end and remaining != set():
+				databuffer = data[offset:min(offset + markerchunksize + self.maxlen - 1, end)]
+				for markerstring in list(remaining):
+					if not markerstring in remaining:
 						continue
-					for markerstring in markerDict[marker]:
-						markeroffset = data.find(markerstring)
-						if markeroffset != -1:
-							results.append(marker)
-							foundmarkers.add(marker)
-							break
-				## set lastindex to the next
-				lastindex = i[1] - 1
-				datafile.seek(lastindex)
-		datafile.close()
-	else:
-		datafile = open(filename, 'rb')
-		databuffer = []
-		offset = 0
-		datafile.seek(offset)
-		databuffer = datafile.read(100000)
-		while databuffer != '':
-			for marker in markerDict.keys():
-				if marker in foundmarkers:
-					continue
-				for markerstring in markerDict[marker]:
-					markeroffset = databuffer.find(markerstring)
-					if markeroffset != -1:
-						results.append(marker)
-						foundmarkers.add(marker)
-						break
-			## move the offset 100000
-			datafile.seek(offset + 100000)
-			databuffer = datafile.read(100000)
-			offset = offset + len(databuffer)
+					if databuffer.find(markerstring) == -1:
+						continue
+					for owner in self.owners[markerstring]:
+						found.add(owner)
+					## the other strings of a marker that was
+					## found do not need to be searched for
+					for (scan, marker) in self.owners[markerstring]:
+						for otherstring in self.markerscans[scan][marker]:
+							if set(self.owners[otherstring]).issubset(found):
+								remaining.discard(otherstring)
+				offset += markerchunksize
+		data.close()
 		datafile.close()
-	if results != []:
-		return list(set(results))
-	return None
+		for (scan, marker) in found:
+			if results[scan] == None:
+				results[scan] = []
+			results[scan].append(marker)
+		return results
+
+## generic searcher for certain marker strings
+def genericSearch(filename, markerDict, blacklist=[], unpacktempdir=None):
+	return MarkerMatcher({'generic': markerDict}).search(filename, blacklist)['generic']
+
+## markers of various open source programs (searchMarker())
+markerStrings = {
+     'loadlin': [ 'Ooops..., size of "setup.S" has become too long for LOADLIN,'
+		, 'LOADLIN started from $'
+		],
+     'iptables':[ 'iptables who? (do you need to insmod?)'
+		, 'Will be implemented real soon.  I promise ;)'
+		, 'can\'t initialize iptables table `%s\': %s'
+		],
+     'dproxy':  [ '# dproxy monitors this file to determine when the machine is'
+		, '# If you want dproxy to log debug info specify a file here.'
+		],
+     'ez-ipupdate': [ 'ez-ipupdate Version %s, Copyright (C) 1998-'
+		, '%s says that your IP address has not changed since the last update'
+		, 'you must provide either an interface or an address'
+		],
+     'libusb':  [ 'Check that you have permissions to write to %s/%s and, if you don\'t, that you set up hotplug (http://linux-hotplug.sourceforge.net/) correctly.'
+		, 'usb_os_find_busses: Skipping non bus directory %s'
+		, 'usb_os_init: couldn\'t find USB VFS in USB_DEVFS_PATH'
+		],
+     'vsftpd':  [ 'vsftpd: version'
+		, '(vsFTPd '
+		, 'VSFTPD_LOAD_CONF'
+		, 'run two copies of vsftpd for IPv4 and IPv6'
+		],
+     'hostapd': [ 'hostapd v'],
+     'wpasupplicant': [ 'wpa_supplicant v'],
+     'iproute': [ 'Usage: tc [ OPTIONS ] OBJECT { COMMAND | help }'
+		, 'tc utility, iproute2-ss%s'
+		, 'Option "%s" is unknown, try "tc -help".'
+		],
+     'wireless-tools': [ "Driver has no Wireless Extension version information."
+		, "Wireless Extension version too old."
+		, "Wireless-Tools version"
+		, "Wireless Extension, while we are using version %d."
+		, "Currently compiled with Wireless Extension v%d."
+       	                ],
+     'redboot': ["Display RedBoot version information"],
+     'uboot': [ "run script starting at addr"
+		, "Hit any key to stop autoboot: %2d"
+		, "## Binary (kermit) download aborted"
+		, "## Ready for binary (ymodem) download "
+		]}
+
+## markers of licenses (scanLicenses())
+licenseidentifiers = {}
+
+## identifiers for any GNU license (could apply to multiple licenses)
+licenseidentifiers['GNU'] = ["General Public License", "http://www.gnu.org/licenses/", "http://gnu.org/licenses/", "http://www.gnu.org/gethelp/", "http://www.gnu.org/software/"]
+
+## identifiers for a version of GNU GPL
+licenseidentifiers['GPL'] = ["http://gnu.org/licenses/gpl.html", "http://www.gnu.org/licenses/gpl.html",
+                                "http://www.gnu.org/licenses/gpl.txt", "http://www.opensource.org/licenses/gpl-license.php",
+                                "http://www.gnu.org/copyleft/gpl.html"]
+
+## identifiers specifically for GPLv2
+licenseidentifiers['GPL-2.0'] = ["http://gnu.org/licenses/gpl-2.0.html", "http://www.gnu.org/licenses/old-licenses/gpl-2.0.html"]
+
+## identifiers specifically for LGPLv2.1
+licenseidentifiers['LGPL-2.1'] = ["http://gnu.org/licenses/old-licenses/lgpl-2.1.html"]
+
+## identifiers specifically for Apache 2.0
+licenseidentifiers['Apache-2.0'] = ["http://www.apache.org/licenses/LICENSE-2.0", "http://opensource.org/licenses/apache2.0.php"]
+
+## identifiers for MPL license
+licenseidentifiers['MPL'] = ["http://www.mozilla.org/MPL/"]
+
+## identifiers for MIT license
+licenseidentifiers['MIT'] = ["http://www.opensource.org/licenses/mit-license.php"]
+
+## identifiers for BSD license
+licenseidentifiers['BSD'] = ["http://www.opensource.org/licenses/bsd-license.php"]
+
+## identifiers specifically for OpenOffice
+licenseidentifiers['OpenOffice'] = ["http://www.openoffice.org/license.html"]
+
+## identifiers specifically for BitTorrent
+licenseidentifiers['BitTorrent'] = ["http://www.bittorrent.com/license/"]
+
+## identifiers specifically for Tizen
+licenseidentifiers['Tizen'] = ["http://www.tizenopensource.org/license"]
+
+## identifiers specifically for OpenSSL
+licenseidentifiers['OpenSSL'] = ["http://www.openssl.org/source/license.html"]
+
+## identifiers specifically for Boost
+licenseidentifiers['BSL-1.0'] = ["http://www.boost.org/LICENSE_1_0.txt", "http://pocoproject.org/license.html"]
+
+## identifiers specifically for zlib
+licenseidentifiers['Zlib'] = ["http://www.zlib.net/zlib_license.html"]
+
+## identifiers specifically for jQuery
+licenseidentifiers['jQuery'] = ["http://jquery.org/license"]
+
+## identifiers specifically for libxml
+licenseidentifiers['libxml'] = ["http://xmlsoft.org/FAQ.html#License"]
+
+## identifiers specifically for ICU
+licenseidentifiers['ICU'] = ["http://source.icu-project.org/repos/icu/icu/trunk/license.html"]
+
+## markers of forges (scanForges())
+forgeidentifiers = {}
+
+forgeidentifiers['sourceforge.net'] = ["sourceforge.net"]
+
+forgeidentifiers['freedesktop.org'] = ["http://cvs.freedesktop.org/", "http://cgit.freedesktop.org/"]
+
+forgeidentifiers['code.google.com'] = ["code.google.com", "googlecode.com"]
+
+forgeidentifiers['savannah.gnu.org'] = ["savannah.gnu.org/"]
+
+forgeidentifiers['github.com'] = ["github.com", "github.io"]
+
+forgeidentifiers['bitbucket.org'] = ["bitbucket.org"]
+
+forgeidentifiers['tigris.org'] = ["tigris.org"]
+
+forgeidentifiers['svn.apache.org'] = ["http://svn.apache.org/"]
+
+forgeidentifiers['launchpad.net'] = ["https://git.launchpad.net/", "launchpad.net"]
+
+## various gits:
+## http://git.fedoraproject.org/git/
+## https://fedorahosted.org/
+
+## All marker style leaf scans are searched for at the same time, so every
+## file is only read once for all of them. The scans are run one after the
+## other for a file in the same process, so the results for the last file
+## are kept until the next scan asks for them.
+markerscans = {'markers': markerStrings, 'licenses': licenseidentifiers, 'forges': forgeidentifiers}
+markermatcher = MarkerMatcher(markerscans)
+markerresults = {}
+
+def markerSearch(scan, filename, blacklist=[]):
+	filestat = os.stat(filename)
+	key = (filename, filestat.st_ino, filestat.st_size, filestat.st_mtime, tuple(blacklist))
+	if not key in markerresults:
+		markerresults.clear()
+		markerresults[key] = markermatcher.search(filename, blacklist)
+	return markerresults[key][scan]
 
 ## The result of this method is a list of library names that the file dynamically links
 ## with. The path of these libraries is not given, since this is usually not recorded
@@ -112,50 +254,7 @@ def scanArchitecture(filename, tags, cursor, conn, filehashes, blacklist=[], sca
 ## search markers for various open source programs
 ## This search is not accurate, but might come in handy in some situations
 def searchMarker(filename, tags, cursor, conn, filehashes, blacklist=[], scanenv={}, scandebug=False, unpacktempdir=None):
-	markerStrings = {
-             'loadlin': [ 'Ooops..., size of "setup.S" has become too long for LOADLIN,'
-			, 'LOADLIN started from $'
-			],
-	     'iptables':[ 'iptables who? (do you need to insmod?)'
-			, 'Will be implemented real soon.  I promise ;)'
-			, 'can\'t initialize iptables table `%s\': %s'
-			],
-	     'dproxy':  [ '# dproxy monitors this file to determine when the machine is'
-			, '# If you want dproxy to log debug info specify a file here.'
-			],
-	     'ez-ipupdate': [ 'ez-ipupdate Version %s, Copyright (C) 1998-'
-			, '%s says that your IP address has not changed since the last update'
-			, 'you must provide either an interface or an address'
-			],
-	     'libusb':  [ 'Check that you have permissions to write to %s/%s and, if you don\'t, that you set up hotplug (http://linux-hotplug.sourceforge.net/) correctly.'
-			, 'usb_os_find_busses: Skipping non bus directory %s'
-			, 'usb_os_init: couldn\'t find USB VFS in USB_DEVFS_PATH'
-			],
-	     'vsftpd':  [ 'vsftpd: version'
-			, '(vsFTPd '
-			, 'VSFTPD_LOAD_CONF'
-			, 'run two copies of vsftpd for IPv4 and IPv6'
-			],
-	     'hostapd': [ 'hostapd v'],
-	     'wpasupplicant': [ 'wpa_supplicant v'],
-	     'iproute': [ 'Usage: tc [ OPTIONS ] OBJECT { COMMAND | help }'
-			, 'tc utility, iproute2-ss%s'
-			, 'Option "%s" is unknown, try "tc -help".'
-			],
-	     'wireless-tools': [ "Driver has no Wireless Extension version information."
-			, "Wireless Extension version too old."
-			, "Wireless-Tools version"
-			, "Wireless Extension, while we are using version %d."
-			, "Currently compiled with Wireless Extension v%d."
-       	                ],
-	     'redboot': ["Display RedBoot version information"],
-             'uboot': [ "run script starting at addr"
-			, "Hit any key to stop autoboot: %2d"
-			, "## Binary (kermit) download aborted"
-			, "## Ready for binary (ymodem) download "
-			]}
-
-	res = genericSearch(filename, markerStrings, blacklist)
+	res = markerSearch('markers', filename, blacklist)
 	if res != None:
 		return (res, res)
 
@@ -230,62 +329,7 @@ def scanPDF(filename, tags, cursor, conn, filehashes, blacklist=[], scanenv={},
 ## This should only be used as an indicator for further investigation,
 ## never as proof that a binary is actually licensed under a license!
 def scanLicenses(filename, tags, cursor, conn, filehashes, blacklist=[], scanenv={}, scandebug=False, unpacktempdir=None):
-	licenseidentifiers = {}
-
-	## identifiers for any GNU license (could apply to multiple licenses)
-	licenseidentifiers['GNU'] = ["General Public License", "http://www.gnu.org/licenses/", "http://gnu.org/licenses/", "http://www.gnu.org/gethelp/", "http://www.gnu.org/software/"]
-
-	## identifiers for a version of GNU GPL
-	licenseidentifiers['GPL'] = ["http://gnu.org/licenses/gpl.html", "http://www.gnu.org/licenses/gpl.html",
-                                "http://www.gnu.org/licenses/gpl.txt", "http://www.opensource.org/licenses/gpl-license.php",
-                                "http://www.gnu.org/copyleft/gpl.html"]
-
-	## identifiers specifically for GPLv2
-	licenseidentifiers['GPL-2.0'] = ["http://gnu.org/licenses/gpl-2.0.html", "http://www.gnu.org/licenses/old-licenses/gpl-2.0.html"]
-
-	## identifiers specifically for LGPLv2.1
-	licenseidentifiers['LGPL-2.1'] = ["http://gnu.org/licenses/old-licenses/lgpl-2.1.html"]
-
-	## identifiers specifically for Apache 2.0
-	licenseidentifiers['Apache-2.0'] = ["http://www.apache.org/licenses/LICENSE-2.0", "http://opensource.org/licenses/apache2.0.php"]
-
-	## identifiers for MPL license
-	licenseidentifiers['MPL'] = ["http://www.mozilla.org/MPL/"]
-
-	## identifiers for MIT license
-	licenseidentifiers['MIT'] = ["http://www.opensource.org/licenses/mit-license.php"]
-
-	## identifiers for BSD license
-	licenseidentifiers['BSD'] = ["http://www.opensource.org/licenses/bsd-license.php"]
-
-	## identifiers specifically for OpenOffice
-	licenseidentifiers['OpenOffice'] = ["http://www.openoffice.org/license.html"]
-
-	## identifiers specifically for BitTorrent
-	licenseidentifiers['BitTorrent'] = ["http://www.bittorrent.com/license/"]
-
-	## identifiers specifically for Tizen
-	licenseidentifiers['Tizen'] = ["http://www.tizenopensource.org/license"]
-
-	## identifiers specifically for OpenSSL
-	licenseidentifiers['OpenSSL'] = ["http://www.openssl.org/source/license.html"]
-
-	## identifiers specifically for Boost
-	licenseidentifiers['BSL-1.0'] = ["http://www.boost.org/LICENSE_1_0.txt", "http://pocoproject.org/license.html"]
-
-	## identifiers specifically for zlib
-	licenseidentifiers['Zlib'] = ["http://www.zlib.net/zlib_license.html"]
-
-	## identifiers specifically for jQuery
-	licenseidentifiers['jQuery'] = ["http://jquery.org/license"]
-
-	## identifiers specifically for libxml
-	licenseidentifiers['libxml'] = ["http://xmlsoft.org/FAQ.html#License"]
-
-	## identifiers specifically for ICU
-	licenseidentifiers['ICU'] = ["http://source.icu-project.org/repos/icu/icu/trunk/license.html"]
-
-	licenseresults = genericSearch(filename, licenseidentifiers, blacklist)
+	licenseresults = markerSearch('licenses', filename, blacklist)
 
 	if licenseresults != None:
 		return (['licenses'], licenseresults)
@@ -296,31 +340,7 @@ def scanLicenses(filename, tags, cursor, conn, filehashes, blacklist=[], scanenv
 ## Some of the URLs of the forges no longer work or are redirected, but they
 ## might still pop up in binaries.
 def scanForges(filename, tags, cursor, conn, filehashes, blacklist=[], scanenv={}, scandebug=False, unpacktempdir=None):
-	forgeidentifiers = {}
-
-	forgeidentifiers['sourceforge.net'] = ["sourceforge.net"]
-
-	forgeidentifiers['freedesktop.org'] = ["http://cvs.freedesktop.org/", "http://cgit.freedesktop.org/"]
-
-	forgeidentifiers['code.google.com'] = ["code.google.com", "googlecode.com"]
-
-	forgeidentifiers['savannah.gnu.org'] = ["savannah.gnu.org/"]
-
-	forgeidentifiers['github.com'] = ["github.com", "github.io"]
-
-	forgeidentifiers['bitbucket.org'] = ["bitbucket.org"]
-
-	forgeidentifiers['tigris.org'] = ["tigris.org"]
-
-	forgeidentifiers['svn.apache.org'] = ["http://svn.apache.org/"]
-
-	forgeidentifiers['launchpad.net'] = ["https://git.launchpad.net/", "launchpad.net"]
-
-	## various gits:
-	## http://git.fedoraproject.org/git/
-	## https://fedorahosted.org/
-
-	forgeresults = genericSearch(filename, forgeidentifiers, blacklist)
+	forgeresults = markerSearch('forges', filename, blacklist)
 
 	if forgeresults != None:
 		return (['forges'], forgeresults)
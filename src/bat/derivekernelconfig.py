@@ -37,7 +37,7 @@ def main(argv):
 	## first unpack the tar archive into a temporary directory
 	tmpdir = tempfile.mkdtemp()
 	try:
-		tar = tarfile.open(options.archive, 'r:gz')
+		tar = tarfile.open(options.archive, 'r:*')
 		tar.extractall(tmpdir)
 		tar.close()
 	except Exception, e:
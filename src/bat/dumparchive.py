@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains the writer for the archive with the results of a scan (the
+"dump file") that is written by bat/bruteforcescan.py.
+
+The archive used to be written with tarfile in 'w:gz' mode after the scan
+had completely finished, which compresses everything in a single thread. For
+big firmwares (with many unpacked files in the 'data' directory) this could
+be the longest part of a scan.
+
+The archive is now written as a stream. Compression is done like pigz does:
+the data is split in blocks, which are compressed by several threads at the
+same time (zlib releases the GIL while compressing) and written in order as
+a single gzip stream, so any gzip implementation can read it. Because blocks
+are compressed independently the result is slightly bigger than with a
+single thread.
+
+Members can be added while other parts of the scan are still running, for
+example the unpacked data can be added while the postrun scans run. The
+archive can also be written without any compression, which is useful if the
+archive is unpacked again right away.
+'''
+
+import tarfile, threading, struct, time, zlib
+from multiprocessing.pool import ThreadPool
+
+## size of the blocks that are compressed separately
+blocksize = 1048576
+
+## compress a block of data as a raw deflate stream. Blocks except the last
+## one end with a sync flush, so the output of all blocks can be concatenated.
+def compressblock(data, compresslevel, last):
+	compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+	if last:
+		return compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+	return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+## A file like object that writes gzip compressed data to 'fileobj', using
+## 'threads' threads for compression.
+class ParallelGzipWriter:
+	def __init__(self, fileobj, threads=1, compresslevel=9):
+		self.fileobj = fileobj
+		self.threads = max(threads, 1)
+		self.compresslevel = compresslevel
+		self.buffers = []
+		self.buffered = 0
+		self.crc = zlib.crc32('')
+		self.size = 0
+		if self.threads > 1:
+			self.pool = ThreadPool(processes=self.threads)
+		else:
+			self.pool = None
+		## compressed blocks that still have to be written, in order
+		self.pending = []
+		## gzip header: deflate, no flags, modification time, no extra
+		## flags, unknown operating system
+		self.fileobj.write('\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + '\x00\xff')
+
+	def write(self, data):
+		self.buffers.append(data)
+		self.buffered += len(data)
+		if self.buffered >= blocksize:
+			self.flushblock(False)
+
+	def flushblock(self, last):
+		data = ''.join(self.buffers)
+		self.buffers = []
+		self.buffered = 0
+		self.crc = zlib.crc32(data, self.crc)
+		self.size += len(data)
+		if self.pool == None:
+			self.fileobj.write(compressblock(data, self.compresslevel, last))
+			return
+		self.pending.append(self.pool.apply_async(compressblock, (data, self.compresslevel, last)))
+		## write blocks that are done, but keep enough blocks
+		## in flight to keep all threads busy
+		while self.pending != [] and (last or len(self.pending) > self.threads * 2 or self.pending[0].ready()):
+			self.fileobj.write(self.pending.pop(0).get())
+
+	def close(self):
+		self.flushblock(True)
+		self.fileobj.write(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+		self.fileobj.close()
+		if self.pool != None:
+			self.pool.close()
+			self.pool.join()
+
+## The archive with the results of a scan. 'compression' is either 'gzip'
+## or 'none'.
+class DumpArchive:
+	def __init__(self, outputfile, compression='gzip', threads=1, compresslevel=9):
+		if compression == 'gzip':
+			self.fileobj = ParallelGzipWriter(open(outputfile, 'wb'), threads, compresslevel)
+		else:
+			self.fileobj = open(outputfile, 'wb')
+		self.tar = tarfile.open(fileobj=self.fileobj, mode='w|')
+		## members are added one at a time, also when added from
+		## a separate thread
+		self.lock = threading.Lock()
+		self.threads = []
+		self.errors = []
+
+	## add a file or a directory (recursively) with the name 'arcname'
+	def add(self, path, arcname):
+		self.lock.acquire()
+		try:
+			self.tar.add(path, arcname)
+		finally:
+			self.lock.release()
+
+	## add a file or directory in a separate thread, so other work can be
+	## done in the meantime
+	def addbackground(self, path, arcname):
+		t = threading.Thread(target=self.addthread, args=(path, arcname))
+		t.start()
+		self.threads.append(t)
+
+	def addthread(self, path, arcname):
+		try:
+			self.add(path, arcname)
+		except Exception, e:
+			self.errors.append((arcname, e))
+
+	## wait until all members that are added in the background are added
+	def wait(self):
+		for t in self.threads:
+			t.join()
+		self.threads = []
+
+	def close(self):
+		self.wait()
+		self.tar.close()
+		self.fileobj.close()
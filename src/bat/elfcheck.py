@@ -16,7 +16,7 @@ https://dev.openwrt.org/ticket/6847
 https://bugs.busybox.net/show_bug.cgi?id=729
 '''
 
-import sys, os, subprocess, os.path, struct, math
+import sys, os, subprocess, os.path, struct, math, mmap
 import tempfile, re
 
 ## information about ELF was collected from the following places:
@@ -183,16 +183,580 @@ architecturemapping = { 0: None
                      , 200: "Freescale 56800EX"
                      }
 
+## The structure of the ELF header, program headers, section headers,
+## symbol table entries and dynamic section entries, per ELF class (32 or 64
+## bit) and endianness. These are compiled once, so each header or entry can
+## be read with a single call instead of a call per field.
+elfstructs = {}
+for (bit32, littleendian) in [(True, True), (True, False), (False, True), (False, False)]:
+	if littleendian:
+		endian = '<'
+	else:
+		endian = '>'
+	if bit32:
+		## type, offset, size in file, alignment
+		programheader = struct.Struct(endian + 'II8xI8xI')
+		## name, type, flags, address, offset, size
+		sectionheader = struct.Struct(endian + 'IIIIII')
+		## name, value, size, info, other, section index
+		symbolentry = struct.Struct(endian + 'IIIBBH')
+		dynamicvalue = struct.Struct(endian + 'I')
+	else:
+		## type, offset, size in file, alignment (lower 4 bytes at offset 52)
+		programheader = struct.Struct(endian + 'I4xQ16xQ12xI')
+		sectionheader = struct.Struct(endian + 'IIQQQQ')
+		## name, info, other, section index, value, size
+		symbolentry = struct.Struct(endian + 'IBBHQQ')
+		dynamicvalue = struct.Struct(endian + 'Q')
+	elfstructs[(bit32, littleendian)] = {'programheader': programheader, 'sectionheader': sectionheader, 'symbolentry': symbolentry, 'dynamicvalue': dynamicvalue, 'half': struct.Struct(endian + 'H'), 'word': struct.Struct(endian + 'I')}
+
+## A single ELF file. The file is memory mapped and all data (headers,
+## sections, symbol tables, dynamic section) is only parsed when it is first
+## needed, and then kept, so different scans looking at the same file do not
+## have to parse it again.
+class ELFFile:
+	def __init__(self, filename, offset=0):
+		self.filename = filename
+		self.offset = offset
+		elffile = open(filename, 'rb')
+		filesize = os.fstat(elffile.fileno()).st_size
+		## empty files cannot be memory mapped
+		if filesize == 0:
+			self.data = ''
+		else:
+			self.data = mmap.mmap(elffile.fileno(), 0, access=mmap.ACCESS_READ)
+		elffile.close()
+		self.filesize = filesize
+		self.parseresult = None
+		self.symbols = {}
+		self.dynamiclibs = None
+
+	## returns (totalelf, elfresult), see parseELF()
+	def parse(self):
+		global parsecount
+		if self.parseresult == None:
+			parsecount += 1
+			self.parseresult = self.parseheaders()
+		return self.parseresult
+
+	def parseheaders(self):
+		data = self.data
+		offset = self.offset
+		filesize = self.filesize
+		elfresult = {}
+
+		## read 64 bytes for the header
+		elfbytes = data[offset:offset+64]
+		if len(elfbytes) != 64:
+			return (False, None)
+
+		if elfbytes[0:4] != '\x7f\x45\x4c\x46':
+			return (False, None)
+
+		iself = False
+
+		## first check if this is a 32 bit or 64 bit binary
+		## and then check if this is a little endian or big endian binary
+		bit32 = ord(elfbytes[4]) == 1
+		littleendian = ord(elfbytes[5]) == 1
+
+		elfresult['bit32'] = bit32
+		elfresult['littleendian'] = littleendian
+
+		structs = elfstructs[(bit32, littleendian)]
+		half = structs['half']
+		word = structs['word']
+		if littleendian:
+			address = struct.Struct('<Q')
+		else:
+			address = struct.Struct('>Q')
+
+		## first determine the size of the ELF header
+		if bit32:
+			elfheadersize = half.unpack_from(elfbytes, 0x28)[0]
+		else:
+			elfheadersize = half.unpack_from(elfbytes, 0x34)[0]
+
+		if not (elfheadersize == 52 or elfheadersize == 64):
+			return (False, None)
+
+		## ELF header cannot extend past the end of the file
+		if offset + elfheadersize > filesize:
+			return (False, None)
+
+		## then read the actual ELF header
+		elfbytes = data[offset:offset+elfheadersize]
+
+		## check the ELF type.
+		elftypebyte = half.unpack_from(elfbytes, 0x10)[0]
+		if elftypebyte == 0:
+			elftype = 'elftypenone'
+		elif elftypebyte == 1:
+			elftype = 'elfrelocatable'
+		elif elftypebyte == 2:
+			elftype = 'elfexecutable'
+		elif elftypebyte == 3:
+			elftype = 'elfdynamic'
+		elif elftypebyte == 4:
+			elftype = 'elfcore'
+		else:
+			return (False, None)
+
+		elfresult['elftype'] = elftype
+
+		## check the machine type
+		elfmachinebyte = half.unpack_from(elfbytes, 0x12)[0]
+		if elfmachinebyte in architecturemapping:
+			architecture = architecturemapping[elfmachinebyte]
+		else:
+			architecture = "UNKNOWN"
+
+		elfresult['architecture'] = architecture
+
+		## the start of program headers and section headers
+		if bit32:
+			startprogramheader = word.unpack_from(elfbytes, 0x1C)[0]
+			startsectionheader = word.unpack_from(elfbytes, 0x20)[0]
+		else:
+			startprogramheader = address.unpack_from(elfbytes, 0x20)[0]
+			startsectionheader = address.unpack_from(elfbytes, 0x28)[0]
+
+		## program header cannot be outside of the file
+		if offset + startprogramheader > filesize:
+			return (False, None)
+
+		## section header cannot be outside of the file
+		if offset + startsectionheader > filesize:
+			return (False, None)
+
+		## the size and amount of program headers and section headers
+		## and the index of the section with the section names
+		if bit32:
+			(programheadersize, numberprogramheaders, sectionheadersize, numbersectionheaders, sectionheaderindex) = struct.unpack(half.format[0] + 'HHHHH', elfbytes[0x2A:0x34])
+		else:
+			(programheadersize, numberprogramheaders, sectionheadersize, numbersectionheaders, sectionheaderindex) = struct.unpack(half.format[0] + 'HHHHH', elfbytes[0x36:0x40])
+
+		## program header cannot extend past the file
+		if offset + startprogramheader + programheadersize > filesize:
+			return (False, None)
+
+		if numberprogramheaders != 0:
+			## program header cannot be inside the ELF header
+			if offset + startprogramheader + programheadersize < offset + elfheadersize:
+				return (False, None)
+
+		## section header cannot extend past the end of the file
+		if offset + startsectionheader + sectionheadersize > filesize:
+			return (False, None)
+
+		## section header cannot be inside the ELF header
+		if numbersectionheaders != 0:
+			if offset + startsectionheader + sectionheadersize < offset + elfheadersize:
+				return (False, None)
+
+		## First process the program header table
+		programheader = structs['programheader']
+		brokenelf = False
+		maxendofprogramsegments = 0
+		for i in xrange(0,numberprogramheaders):
+			headeroffset = offset + startprogramheader + i*programheadersize
+			elfbytes = data[headeroffset:headeroffset+programheadersize]
+			if len(elfbytes) != programheadersize:
+				brokenelf = True
+				break
+			## first the segmenttype. PT_NULL is unused, so ignore
+			segmenttype = word.unpack_from(elfbytes)[0]
+			if segmenttype == 0:
+				continue
+
+			## then the offset in the file, the size in bytes in
+			## the file image and the alignment. The virtual address,
+			## physical address, size in memory and flags are skipped
+			(segmenttype, segmentoffset, segmentsize, alignment) = programheader.unpack_from(elfbytes)
+
+			## segment cannot be outside of the file
+			if offset + segmentoffset > filesize:
+				brokenelf = True
+				break
+
+			## segment cannot extend past the end of the file
+			if offset + segmentoffset + segmentsize > filesize:
+				brokenelf = True
+				break
+			maxendofprogramsegments = max(offset + segmentoffset + segmentsize, maxendofprogramsegments)
+
+			if alignment != 0 and alignment != 1:
+				## alignment has to be a power of 2
+				if alignment != pow(2,int(math.log(alignment, 2))):
+					brokenelf = True
+					break
+				## TODO: check if certain parts are properly aligned
+
+		if brokenelf:
+			return (False, None)
+
+		dynamic = False
+
+		sections = {}
+
+		## process the section headers
+		sectionheader = structs['sectionheader']
+		maxendofsection = 0
+		dynamiccount = 0
+		for i in xrange(0,numbersectionheaders):
+			headeroffset = offset + startsectionheader + i * sectionheadersize
+			elfbytes = data[headeroffset:headeroffset+sectionheadersize]
+			if len(elfbytes) != sectionheadersize:
+				return (False, None)
+			(sh_name, sh_type, sh_flags, sh_addr, sectionoffset, sectionsize) = sectionheader.unpack_from(elfbytes)
+			if sh_type == 6:
+				dynamiccount += 1
+
+			## section offset cannot be outside of the file
+			if offset + sectionoffset > filesize:
+				brokenelf = True
+				break
+
+			## segment cannot extend past the end of the file.
+			## This check only makes sense if the section has a different
+			## type than NOBITS
+			if sh_type != 8:
+				if offset + sectionoffset + sectionsize > filesize:
+					brokenelf = True
+					break
+				maxendofsection = max(offset + sectionoffset + sectionsize, maxendofsection)
+
+			sections[i] = {'sectionoffset': sectionoffset, 'sectionsize': sectionsize, 'nameoffset': sh_name, 'sectiontype': sh_type}
+
+		if brokenelf:
+			return (False, None)
+
+		## dynamic count cannot be larger than 1
+		if dynamiccount == 1:
+			dynamic = True
+
+		## for each section find the name in the table with section names
+		sectionnames = []
+		if sectionheaderindex in sections:
+			sectionnamebytes = data[sections[sectionheaderindex]['sectionoffset']:sections[sectionheaderindex]['sectionoffset']+sections[sectionheaderindex]['sectionsize']]
+			sectionnames = sectionnamebytes.split('\x00')
+			for i in sections:
+				endofsectionname = sectionnamebytes.find('\x00', sections[i]['nameoffset'])
+				sections[i]['name'] = sectionnamebytes[sections[i]['nameoffset']:endofsectionname]
+
+		## Now some extra checks so files can be tagged as ELF
+		if maxendofprogramsegments == filesize:
+			iself = True
+			totalsize = filesize
+		elif maxendofsection == filesize:
+			iself = True
+			totalsize = filesize
+		else:
+			## This does not work well for some Linux kernel modules as well as other files
+			## (architecture dependent?)
+			## One architecture where this sometimes seems to happen is ARM.
+			totalsize = startsectionheader + sectionheadersize * numbersectionheaders
+
+			## there are files where the number of section headers is zero, but
+			## which are valid ELF files. An example is the bootloader on certain
+			## Android devices. TODO.
+			if totalsize == 0:
+				pass
+			if totalsize == filesize:
+				iself = True
+			else:
+				## If it is a signed kernel module then the key is appended to the ELF data
+				elfbytes = data[filesize-28:filesize]
+				if elfbytes == "~Module signature appended~\n":
+					## The metadata of the signing data can be found in 12 bytes
+					## preceding the 'magic'
+					## According to 'scripts/sign-file' in the Linux kernel
+					## the last 4 bytes are the size of the signature data
+					## three bytes before that are 0x00
+					## The byte before that is the length of the key identifier
+					## The byte before that is the length of the "signer's name"
+					totalsiglength = 40
+					elfbytes = data[filesize-40:filesize-28]
+					signaturelength = struct.unpack('>I', elfbytes[-4:])[0]
+					totalsiglength += signaturelength
+					keyidentifierlen = ord(elfbytes[4])
+					signernamelen = ord(elfbytes[3])
+					totalsiglength += keyidentifierlen
+					totalsiglength += signernamelen
+					if totalsiglength + totalsize == filesize:
+						iself = True
+					totalsize += totalsiglength
+				## check if the max end of section happens to be later than
+				## the totalsize, as this happens as well in non-stripped binaries
+				totalsize = max(maxendofsection, totalsize)
+
+		elfresult['dynamic'] = dynamic
+		elfresult['sectionnames'] = sectionnames
+		elfresult['sections'] = sections
+		elfresult['size'] = totalsize
+
+		if not iself:
+			return (False, elfresult)
+
+		return (True, elfresult)
+
+	## return the index of the first section with the name 'sectionname'
+	def findsection(self, sectionname):
+		(totalelf, elfresult) = self.parse()
+		if elfresult == None:
+			return
+		for i in elfresult['sections']:
+			if elfresult['sections'][i].get('name') == sectionname:
+				return i
+
+	## extract information about a section given a section name
+	def getSection(self, sectionname):
+		i = self.findsection(sectionname)
+		if i != None:
+			return self.parseresult[1]['sections'][i]
+
+	## the contents of a section (by index)
+	def getSectionData(self, section):
+		sectiondata = self.parseresult[1]['sections'][section]
+		return self.data[sectiondata['sectionoffset']:sectiondata['sectionoffset']+sectiondata['sectionsize']]
+
+	## A generic method to get symbols from either the dynamic symbol
+	## table or the symbol table (non-stripped binaries)
+	def getSymbols(self, symboltype):
+		if not symboltype in self.symbols:
+			self.symbols[symboltype] = self.parsesymbols(symboltype)
+		if self.symbols[symboltype] == None:
+			return
+		return list(self.symbols[symboltype])
+
+	def parsesymbols(self, symboltype):
+		(totalelf, elfresult) = self.parse()
+		if elfresult == None:
+			return
+
+		symsection = None
+		strsection = None
+		for i in elfresult['sections']:
+			if symboltype == 'dynamic':
+				if elfresult['sections'][i]['sectiontype'] == 11:
+					symsection = i
+			elif symboltype == 'symbol':
+				if elfresult['sections'][i]['sectiontype'] == 2:
+					symsection = i
+			if symboltype == 'dynamic':
+				if elfresult['sections'][i]['name'] == '.dynstr':
+					if elfresult['sections'][i]['sectiontype'] == 3:
+						strsection = i
+			else:
+				if elfresult['sections'][i]['name'] == '.strtab':
+					if elfresult['sections'][i]['sectiontype'] == 3:
+						strsection = i
+
+		## no need to continue if both the symsection
+		## and strsection are None (most likely indicating a corrupt ELF file)
+		if symsection == None:
+			return
+
+		if strsection == None:
+			return
+
+		bit32 = elfresult['bit32']
+		littleendian = elfresult['littleendian']
+		symbolentry = elfstructs[(bit32, littleendian)]['symbolentry']
+
+		## first, get the symbol section and the string section
+		elfbytes = self.getSectionData(symsection)
+		strbytes = self.getSectionData(strsection)
+
+		dynamicsymbols = []
+
+		## Then process all the symbol entries.
+		## Various pieces of information are extracted, such as type,
+		## binding and visibility. The name of the symbol is extracted
+		## from the string section using an offset defined in the symbol
+		## entry.
+		## For 32 bit binaries each entry takes up 16 bytes, for 64 bit
+		## binaries each entry takes up 24 bytes.
+		entrysize = symbolentry.size
+		for i in xrange(0, len(elfbytes)/entrysize):
+			dynsymres = {}
+			dynsymres['index'] = i
+			if bit32:
+				(st_name, st_value, st_size, st_info, st_other, st_shndx) = symbolentry.unpack_from(elfbytes, i*entrysize)
+			else:
+				(st_name, st_info, st_other, st_shndx, st_value, st_size) = symbolentry.unpack_from(elfbytes, i*entrysize)
+
+			endofname = strbytes.find('\x00', st_name)
+			dynsymres['name'] = strbytes[st_name:endofname]
+			dynsymres['section'] = st_shndx
+			dynsymres['size'] = st_size
+			dynsymres['value'] = st_value
+			binding = st_info >> 4
+			if binding == 0:
+				dynsymres['binding'] = 'local'
+			elif binding == 1:
+				dynsymres['binding'] = 'global'
+			elif binding == 2:
+				dynsymres['binding'] = 'weak'
+			elif binding == 10:
+				dynsymres['binding'] = 'unique' # STB_LOOS according to ELF specs, so might be Linux specific
+			else:
+				## by default ignore, TODO
+				dynsymres['binding'] = 'ignore'
+
+			## extract the symbol type
+			dyntype = st_info%16
+			if dyntype == 0:
+				dynsymres['type'] = 'notype'
+			elif dyntype == 1:
+				## symbol is an object (variable)
+				dynsymres['type'] = 'object'
+			elif dyntype == 2:
+				## symbol is a function
+				dynsymres['type'] = 'func'
+			elif dyntype == 3:
+				## symbol is a section
+				dynsymres['type'] = 'section'
+			elif dyntype == 4:
+				## symbol is a file name
+				dynsymres['type'] = 'file'
+			elif dyntype == 6:
+				dynsymres['type'] = 'tls' # thread local storage
+			elif dyntype == 10:
+				## symbol is an ifunc (GNU extension)
+				dynsymres['type'] = 'ifunc' # STT_LOOS according to ELF specs, so might be Linux specific
+			else:
+				## by default ignore, TODO
+				dynsymres['type'] = 'ignore'
+
+			## extract the visibility
+			if st_other & 0x03 == 0:
+				dynsymres['visibility'] = 'default'
+			elif st_other & 0x03 == 1:
+				dynsymres['visibility'] = 'internal'
+			elif st_other & 0x03 == 2:
+				dynsymres['visibility'] = 'hidden'
+			elif st_other & 0x03 == 3:
+				dynsymres['visibility'] = 'protected'
+			dynsymres['symboltype'] = symboltype
+			dynamicsymbols.append(dynsymres)
+		return dynamicsymbols
+
+	## similar to readelf -d
+	def getDynamicLibs(self):
+		if self.dynamiclibs == None:
+			self.dynamiclibs = (self.parsedynamiclibs(),)
+		return self.dynamiclibs[0]
+
+	def parsedynamiclibs(self):
+		(totalelf, elfresult) = self.parse()
+		if not totalelf:
+			return
+
+		if not 'dynamic' in elfresult:
+			return
+
+		dynamicsection = None
+		dynstrsection = None
+		for i in elfresult['sections']:
+			if elfresult['sections'][i]['name'] == '.dynstr':
+				dynstrsection = i
+			if elfresult['sections'][i]['name'] == '.dynamic':
+				dynamicsection = i
+
+		if dynamicsection == None or dynstrsection == None:
+			return
+
+		if elfresult['sections'][dynamicsection]['sectiontype'] != 6:
+			return
+
+		if elfresult['sections'][dynstrsection]['sectiontype'] != 3:
+			return
+
+		bit32 = elfresult['bit32']
+		littleendian = elfresult['littleendian']
+		dynamicvalue = elfstructs[(bit32, littleendian)]['dynamicvalue']
+
+		## first, get the dynamic section and the dynamic string section
+		elfbytes = self.getSectionData(dynamicsection)
+		dynstrbytes = self.getSectionData(dynstrsection)
+
+		## then process the entries. Each entry is a tag followed by a
+		## value, both 4 bytes (32 bit) or 8 bytes (64 bit).
+		tagsize = dynamicvalue.size
+
+		needed_names = []
+		sonames = []
+		rpathname = None
+		for i in xrange(0, len(elfbytes)/tagsize, 2):
+			d_tag = dynamicvalue.unpack_from(elfbytes, i*tagsize)[0]
+
+			if d_tag == 1:
+				## equivalent to NEEDED in readelf output
+				d_needed_offset = dynamicvalue.unpack(elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2])[0]
+				endofneededname = dynstrbytes.find('\x00', d_needed_offset)
+				needed_names.append(dynstrbytes[d_needed_offset:endofneededname])
+			elif d_tag == 14:
+				## equivalent to SONAME in readelf output
+				soname_offset = dynamicvalue.unpack(elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2])[0]
+				endofsoname = dynstrbytes.find('\x00', soname_offset)
+				soname = dynstrbytes[soname_offset:endofsoname]
+				sonames.append(soname)
+			elif d_tag == 15:
+				## equivalent to RPATH in readelf output
+				rpath_offset = dynamicvalue.unpack(elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2])[0]
+				endofrpathname = dynstrbytes.find('\x00', rpath_offset)
+				rpathname = dynstrbytes[rpath_offset:endofrpathname]
+
+		dynamic_res = {}
+
+		if rpathname != None:
+			dynamic_res['rpathname'] = rpathname
+		if sonames != []:
+			dynamic_res['sonames'] = sonames
+		if needed_names != []:
+			dynamic_res['needed_libs'] = needed_names
+		return dynamic_res
+
+## Keep the most recently used ELF files, so a file is only parsed once,
+## even if it is looked at by several scans (the ELF check in the prerun
+## phase, the identifier and library scans in the leaf phase, the aggregate
+## scans). Files are identified by name, inode, size and modification time,
+## so a file that is replaced is parsed again. Setting 'elfcachesize' to 0
+## disables the cache.
+elfcachesize = 8
+elfcache = {}
+elfcacheorder = []
+
+## the amount of times ELF headers were parsed, for benchmarking
+parsecount = 0
+
+def getELF(filename):
+	if elfcachesize == 0:
+		return ELFFile(filename)
+	filestat = os.stat(filename)
+	cachekey = (filename, filestat.st_ino, filestat.st_size, filestat.st_mtime)
+	if cachekey in elfcache:
+		elfcacheorder.remove(cachekey)
+		elfcacheorder.append(cachekey)
+		return elfcache[cachekey]
+	elf = ELFFile(filename)
+	elfcache[cachekey] = elf
+	elfcacheorder.append(cachekey)
+	## remove the least recently used files. Their memory maps are closed
+	## as soon as nothing uses them anymore.
+	while len(elfcacheorder) > elfcachesize:
+		del elfcache[elfcacheorder.pop(0)]
+	return elf
+
 ## read the architecture of a (validated) ELF file
 def getArchitecture(filename, tags):
 	## return if the file is not a valid ELF file
 	if not 'elf' in tags:
 		return
-	elffile = open(filename, 'rb')
 
 	## first read the ELF header
-	elffile.seek(0)
-	elfbytes = elffile.read(64)
+	elfbytes = getELF(filename).data[:64]
 
 	## then check if this is a little endian or big endian binary
 	littleendian = True
@@ -210,21 +774,18 @@ def getArchitecture(filename, tags):
 		architecture = architecturemapping[elfmachinebyte]
 	else:
 		architecture = "UNKNOWN"
-	elffile.close()
 	return architecture
 
 ## extract information about a section given a section name
 def getSection(filename, sectionname, debug=False):
-	(totalelf, elfresult) = parseELF(filename, 0, debug)
-	returnsection = None
-	if elfresult == None:
-		return
-	for i in elfresult['sections']:
-		if elfresult['sections'][i]['name'] == sectionname:
-			returnsection = i
-			break
-	if returnsection != None:
-		return elfresult['sections'][returnsection]
+	return getELF(filename).getSection(sectionname)
+
+## extract the contents of a section given a section name
+def getSectionData(filename, sectionname, debug=False):
+	elf = getELF(filename)
+	section = elf.findsection(sectionname)
+	if section != None:
+		return elf.getSectionData(section)
 
 ## get all the symbols from an ELF binary.
 ## This is similar to "readelf -s"
@@ -253,271 +814,19 @@ def getDynamicSymbols(filename, elfresult=None, debug=False):
 	return getSymbolsAbstraction(filename, 'dynamic', elfresult, debug)
 
 ## A generic method to get symbols from either the dynamic symbol
-## table or the symbol table (non-stripped binaries)
+## table or the symbol table (non-stripped binaries). If 'elfresult' is
+## passed the file is not required to be a complete ELF file.
 def getSymbolsAbstraction(filename, symboltype, elfresult, debug=False):
+	elf = getELF(filename)
 	if elfresult == None:
-		(totalelf, elfresult) = parseELF(filename, 0, debug)
+		(totalelf, elfresult) = elf.parse()
 		if not totalelf:
 			return
-
-	symsection = None
-	strsection = None
-	for i in elfresult['sections']:
-		if symboltype == 'dynamic':
-			if elfresult['sections'][i]['sectiontype'] == 11:
-				symsection = i
-		elif symboltype == 'symbol':
-			if elfresult['sections'][i]['sectiontype'] == 2:
-				symsection = i
-		if symboltype == 'dynamic':
-			if elfresult['sections'][i]['name'] == '.dynstr':
-				if elfresult['sections'][i]['sectiontype'] == 3:
-					strsection = i
-		else:
-			if elfresult['sections'][i]['name'] == '.strtab':
-				if elfresult['sections'][i]['sectiontype'] == 3:
-					strsection = i
-
-	## no need to continue if both the symsection
-	## and strsection are None (most likely indicating a corrupt ELF file)
-	if symsection == None:
-		return
-
-	if strsection == None:
-		return
-
-	bit32 = elfresult['bit32']
-	littleendian = elfresult['littleendian']
-
-	## first, get the dynamic symbol section
-	elffile = open(filename, 'rb')
-	elffile.seek(elfresult['sections'][symsection]['sectionoffset'])
-	elfbytes = elffile.read(elfresult['sections'][symsection]['sectionsize'])
-
-	## then get the string section from the binary
-	elffile.seek(elfresult['sections'][strsection]['sectionoffset'])
-	strbytes = elffile.read(elfresult['sections'][strsection]['sectionsize'])
-	elffile.close()
-
-	dynamicsymbols = []
-
-	## Then process all the symbol entries.
-	## Various pieces of information are extracted, such as type,
-	## binding and visibility. The name of the symbol is extracted
-	## from the string section using an offset defined in the symbol
-	## entry.
-	if bit32:
-		## for 32 bit binaries each entry takes up 16 bytes
-		entrysize = 16
-	else:
-		## for 64 bit binaries each entry takes up 24 bytes
-		entrysize = 24
-	for i in xrange(0, len(elfbytes)/entrysize):
-		dynsymres = {}
-		dynsymres['index'] = i
-		if bit32:
-			if littleendian:
-				st_name = struct.unpack('<I', elfbytes[i*entrysize:i*entrysize+4])[0]
-				st_value = struct.unpack('<I', elfbytes[i*entrysize+4:i*entrysize+8])[0]
-				st_size = struct.unpack('<I', elfbytes[i*entrysize+8:i*entrysize+12])[0]
-				st_info = ord(elfbytes[i*entrysize+12])
-				st_other = ord(elfbytes[i*entrysize+13])
-				st_shndx = struct.unpack('<H', elfbytes[i*entrysize+14:i*entrysize+16])[0]
-			else:
-				st_name = struct.unpack('>I', elfbytes[i*entrysize:i*entrysize+4])[0]
-				st_value = struct.unpack('>I', elfbytes[i*entrysize+4:i*entrysize+8])[0]
-				st_size = struct.unpack('>I', elfbytes[i*entrysize+8:i*entrysize+12])[0]
-				st_info = ord(elfbytes[i*entrysize+12])
-				st_other = ord(elfbytes[i*entrysize+13])
-				st_shndx = struct.unpack('>H', elfbytes[i*entrysize+14:i*entrysize+16])[0]
-		else:
-			if littleendian:
-				st_name = struct.unpack('<I', elfbytes[i*entrysize:i*entrysize+4])[0]
-				st_info = ord(elfbytes[i*entrysize+4])
-				st_other = ord(elfbytes[i*entrysize+5])
-				st_shndx = struct.unpack('<H', elfbytes[i*entrysize+6:i*entrysize+8])[0]
-				st_value = struct.unpack('<Q', elfbytes[i*entrysize+8:i*entrysize+16])[0]
-				st_size = struct.unpack('<Q', elfbytes[i*entrysize+16:i*entrysize+24])[0]
-			else:
-				st_name = struct.unpack('>I', elfbytes[i*entrysize:i*entrysize+4])[0]
-				st_info = ord(elfbytes[i*entrysize+4])
-				st_other = ord(elfbytes[i*entrysize+5])
-				st_shndx = struct.unpack('>H', elfbytes[i*entrysize+6:i*entrysize+8])[0]
-				st_value = struct.unpack('>Q', elfbytes[i*entrysize+8:i*entrysize+16])[0]
-				st_size = struct.unpack('>Q', elfbytes[i*entrysize+16:i*entrysize+24])[0]
-
-		endofname = strbytes.find('\x00', st_name)
-		dynsymres['name'] = strbytes[st_name:endofname]
-		dynsymres['section'] = st_shndx
-		dynsymres['size'] = st_size
-		dynsymres['value'] = st_value
-		binding = st_info >> 4
-		if binding == 0:
-			dynsymres['binding'] = 'local'
-		elif binding == 1:
-			dynsymres['binding'] = 'global'
-		elif binding == 2:
-			dynsymres['binding'] = 'weak'
-		elif binding == 10:
-			dynsymres['binding'] = 'unique' # STB_LOOS according to ELF specs, so might be Linux specific
-		else:
-			## by default ignore, TODO
-			dynsymres['binding'] = 'ignore'
-
-		## extract the symbol type
-		dyntype = st_info%16
-		if dyntype == 0:
-			dynsymres['type'] = 'notype'
-		elif dyntype == 1:
-			## symbol is an object (variable)
-			dynsymres['type'] = 'object'
-		elif dyntype == 2:
-			## symbol is a function
-			dynsymres['type'] = 'func'
-		elif dyntype == 3:
-			## symbol is a section
-			dynsymres['type'] = 'section'
-		elif dyntype == 4:
-			## symbol is a file name
-			dynsymres['type'] = 'file'
-		elif dyntype == 6:
-			dynsymres['type'] = 'tls' # thread local storage
-		elif dyntype == 10:
-			## symbol is an ifunc (GNU extension)
-			dynsymres['type'] = 'ifunc' # STT_LOOS according to ELF specs, so might be Linux specific
-		else:
-			## by default ignore, TODO
-			dynsymres['type'] = 'ignore'
-
-		## extract the visibility
-		if st_other & 0x03 == 0:
-			dynsymres['visibility'] = 'default'
-		elif st_other & 0x03 == 1:
-			dynsymres['visibility'] = 'internal'
-		elif st_other & 0x03 == 2:
-			dynsymres['visibility'] = 'hidden'
-		elif st_other & 0x03 == 3:
-			dynsymres['visibility'] = 'protected'
-		dynsymres['symboltype'] = symboltype
-		dynamicsymbols.append(dynsymres)
-	return dynamicsymbols
+	return elf.getSymbols(symboltype)
 
 ## similar to readelf -d
 def getDynamicLibs(filename, debug=False):
-	(totalelf, elfresult) = parseELF(filename, 0, debug)
-	if not totalelf:
-		return
-
-	if not 'dynamic' in elfresult:
-		return
-	
-	dynamicsection = None
-	dynstrsection = None
-	for i in elfresult['sections']:
-		if elfresult['sections'][i]['name'] == '.dynstr':
-			dynstrsection = i
-		if elfresult['sections'][i]['name'] == '.dynamic':
-			dynamicsection = i
-
-	if dynamicsection == None:
-		return
-
-	if elfresult['sections'][dynamicsection]['sectiontype'] != 6:
-		return
-
-	if elfresult['sections'][dynstrsection]['sectiontype'] != 3:
-		return
-
-	bit32 = elfresult['bit32']
-	littleendian = elfresult['littleendian']
-
-	## first, get the dynamic section
-	elffile = open(filename, 'rb')
-	elffile.seek(elfresult['sections'][dynamicsection]['sectionoffset'])
-	elfbytes = elffile.read(elfresult['sections'][dynamicsection]['sectionsize'])
-
-	elffile.seek(elfresult['sections'][dynstrsection]['sectionoffset'])
-	dynstrbytes = elffile.read(elfresult['sections'][dynstrsection]['sectionsize'])
-	elffile.close()
-
-	## then process the entries
-	if bit32:
-		tagsize = 4
-	else:
-		tagsize = 8
-
-	needed_names = []
-	sonames = []
-	rpathname = None
-	for i in xrange(0, len(elfbytes)/tagsize, 2):
-		tagbytes = elfbytes[i*tagsize:i*tagsize+tagsize]
-		if littleendian:
-			if bit32:
-				d_tag = struct.unpack('<I', tagbytes)[0]
-			else:
-				d_tag = struct.unpack('<Q', tagbytes)[0]
-		else:
-			if bit32:
-				d_tag = struct.unpack('>I', tagbytes)[0]
-			else:
-				d_tag = struct.unpack('>Q', tagbytes)[0]
-
-		if d_tag == 1:
-			## equivalent to NEEDED in readelf output
-			offsetbytes = elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2]
-			if littleendian:
-				if bit32:
-					d_needed_offset = struct.unpack('<I', offsetbytes)[0]
-				else:
-					d_needed_offset = struct.unpack('<Q', offsetbytes)[0]
-			else:
-				if bit32:
-					d_needed_offset = struct.unpack('>I', offsetbytes)[0]
-				else:
-					d_needed_offset = struct.unpack('>Q', offsetbytes)[0]
-			endofneededname = dynstrbytes.find('\x00', d_needed_offset)
-			needed_names.append(dynstrbytes[d_needed_offset:endofneededname])
-		elif d_tag == 14:
-			## equivalent to SONAME in readelf output
-			offsetbytes = elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2]
-			if littleendian:
-				if bit32:
-					soname_offset = struct.unpack('<I', offsetbytes)[0]
-				else:
-					soname_offset = struct.unpack('<Q', offsetbytes)[0]
-			else:
-				if bit32:
-					soname_offset = struct.unpack('>I', offsetbytes)[0]
-				else:
-					soname_offset = struct.unpack('>Q', offsetbytes)[0]
-			endofsoname = dynstrbytes.find('\x00', soname_offset)
-			soname = dynstrbytes[soname_offset:endofsoname]
-			sonames.append(soname)
-		elif d_tag == 15:
-			## equivalent to RPATH in readelf output
-			offsetbytes = elfbytes[i*tagsize+tagsize:i*tagsize+tagsize*2]
-			if littleendian:
-				if bit32:
-					rpath_offset = struct.unpack('<I', offsetbytes)[0]
-				else:
-					rpath_offset = struct.unpack('<Q', offsetbytes)[0]
-			else:
-				if bit32:
-					rpath_offset = struct.unpack('>I', offsetbytes)[0]
-				else:
-					rpath_offset = struct.unpack('>Q', offsetbytes)[0]
-			endofrpathname = dynstrbytes.find('\x00', rpath_offset)
-			rpathname = dynstrbytes[rpath_offset:endofrpathname]
-
-	dynamic_res = {}
-
-	if rpathname != None:
-		dynamic_res['rpathname'] = rpathname
-	if sonames != []:
-		dynamic_res['sonames'] = sonames
-	if needed_names != []:
-		dynamic_res['needed_libs'] = needed_names
-	return dynamic_res
+	return getELF(filename).getDynamicLibs()
 
 ## method to verify if a file is a valid ELF file
 ##
@@ -538,12 +847,11 @@ def verifyELF(filename, tempdir=None, tags=[], offsets={}, scanenv={}, debug=Fal
 	elffile = open(filename, 'rb')
 	elffile.seek(offset)
 	elfbytes = elffile.read(4)
+	elffile.close()
 	if elfbytes != '\x7f\x45\x4c\x46':
-		elffile.close()
 		return []
 
 	newtags = []
-	filesize = os.stat(filename).st_size
 
 	(totalelf, elfresult) = parseELF(filename, 0, debug)
 
@@ -584,473 +892,10 @@ def verifyELF(filename, tempdir=None, tags=[], offsets={}, scanenv={}, debug=Fal
 ##
 ## For thorough documentation of each of the parts consult
 ## the ELF documentation referred above.
+##
+## ELF files at offset 0 (so complete files) are kept in the cache,
+## ELF files inside other files (during unpacking) are not.
 def parseELF(filename, offset=0, debug=False):
-	elffile = open(filename, 'rb')
-
-	elfresult = {}
-	filesize = os.stat(filename).st_size
-
-	## read 64 bytes for the header
-	elffile.seek(offset)
-	elfbytes = elffile.read(64)
-	if len(elfbytes) != 64:
-		elffile.close()
-		return (False, None)
-
-	if elfbytes[0:4] != '\x7f\x45\x4c\x46':
-		elffile.close()
-		return (False, None)
-
-	iself = False
-
-	## just set some default values: little endian, 32 bit
-	littleendian = True
-	bit32 = True
-
-	## first check if this is a 32 bit or 64 bit binary
-	if struct.unpack('>B', elfbytes[4])[0] != 1:
-		bit32 = False
-	## then check if this is a little endian or big endian binary
-	if struct.unpack('>B', elfbytes[5])[0] != 1:
-		littleendian = False
-
-	elfresult['bit32'] = bit32
-	elfresult['littleendian'] = littleendian
-
-	## first determine the size of the ELF header
-	if bit32:
-		elfunpackbytes = elfbytes[0x28:0x28+2]
-	else:
-		elfunpackbytes = elfbytes[0x34:0x34+2]
-	if littleendian:
-		elfheadersize = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		elfheadersize = struct.unpack('>H', elfunpackbytes)[0]
-
-	if not (elfheadersize == 52 or elfheadersize == 64):
-		elffile.close()
-		return (False, None)
-
-	## ELF header cannot extend past the end of the file
-	if offset + elfheadersize > filesize:
-		elffile.close()
-		return (False, None)
-
-	if elfheadersize == 0:
-		elffile.close()
-		return (False, None)
-
-	## then read the actual ELF header
-	elffile.seek(offset)
-	elfbytes = elffile.read(elfheadersize)
-
-	## check the ELF type.
-	if littleendian:
-		elftypebyte = struct.unpack('<H', elfbytes[0x10:0x10+2])[0]
-	else:
-		elftypebyte = struct.unpack('>H', elfbytes[0x10:0x10+2])[0]
-	if elftypebyte == 0:
-		elftype = 'elftypenone'
-	elif elftypebyte == 1:
-		elftype = 'elfrelocatable'
-	elif elftypebyte == 2:
-		elftype = 'elfexecutable'
-	elif elftypebyte == 3:
-		elftype = 'elfdynamic'
-	elif elftypebyte == 4:
-		elftype = 'elfcore'
-	else:
-		return (False, None)
-
-	elfresult['elftype'] = elftype
-
-	## check the machine type
-	if littleendian:
-		elfmachinebyte = struct.unpack('<H', elfbytes[0x12:0x12+2])[0]
-	else:
-		elfmachinebyte = struct.unpack('>H', elfbytes[0x12:0x12+2])[0]
-	if elfmachinebyte in architecturemapping:
-		architecture = architecturemapping[elfmachinebyte]
-	else:
-		architecture = "UNKNOWN"
-
-	elfresult['architecture'] = architecture
-
-	## the start of program headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x1C:0x20]
-	else:
-		elfunpackbytes = elfbytes[0x20:0x28]
-	if littleendian:
-		if bit32:
-			startprogramheader = struct.unpack('<I', elfunpackbytes)[0]
-		else:
-			startprogramheader = struct.unpack('<Q', elfunpackbytes)[0]
-	else:
-		if bit32:
-			startprogramheader = struct.unpack('>I', elfunpackbytes)[0]
-		else:
-			startprogramheader = struct.unpack('>Q', elfunpackbytes)[0]
-
-	## program header cannot be outside of the file
-	if offset + startprogramheader > filesize:
-		elffile.close()
-		return (False, None)
-
-	## the start of section headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x20:0x20+4]
-	else:
-		elfunpackbytes = elfbytes[0x28:0x28+8]
-	if littleendian:
-		if bit32:
-			startsectionheader = struct.unpack('<I', elfunpackbytes)[0]
-		else:
-			startsectionheader = struct.unpack('<Q', elfunpackbytes)[0]
-	else:
-		if bit32:
-			startsectionheader = struct.unpack('>I', elfunpackbytes)[0]
-		else:
-			startsectionheader = struct.unpack('>Q', elfunpackbytes)[0]
-
-	## section header cannot be outside of the file
-	if offset + startsectionheader > filesize:
-		elffile.close()
-		return (False, None)
-
-	## the size of the program headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x2A:0x2A+2]
-	else:
-		elfunpackbytes = elfbytes[0x36:0x36+2]
-	if littleendian:
-		programheadersize = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		programheadersize = struct.unpack('>H', elfunpackbytes)[0]
-
-	## program header cannot extend past the file
-	if offset + startprogramheader + programheadersize > filesize:
-		elffile.close()
-		return (False, None)
-
-	## the amount of program headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x2C:0x2C+2]
-	else:
-		elfunpackbytes = elfbytes[0x38:0x38+2]
-	if littleendian:
-		numberprogramheaders = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		numberprogramheaders = struct.unpack('>H', elfunpackbytes)[0]
-
-	if numberprogramheaders != 0:
-		## program header cannot be inside the ELF header
-		if offset + startprogramheader + programheadersize < offset + elfheadersize:
-			elffile.close()
-			return (False, None)
-
-	## the size of the section headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x2E:0x2E+2]
-	else:
-		elfunpackbytes = elfbytes[0x3A:0x3A+2]
-	if littleendian:
-		sectionheadersize = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		sectionheadersize = struct.unpack('>H', elfunpackbytes)[0]
-
-	## section header cannot extend past the end of the file
-	if offset + startsectionheader + sectionheadersize > filesize:
-		elffile.close()
-		return (False, None)
-
-	## the amount of section headers
-	if bit32:
-		elfunpackbytes = elfbytes[0x30:0x30+2]
-	else:
-		elfunpackbytes = elfbytes[0x3C:0x3C+2]
-	if littleendian:
-		numbersectionheaders = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		numbersectionheaders = struct.unpack('>H', elfunpackbytes)[0]
-
-	## the start of section header index
-	if bit32:
-		elfunpackbytes = elfbytes[0x32:0x32+2]
-	else:
-		elfunpackbytes = elfbytes[0x3E:0x3E+2]
-	if littleendian:
-		sectionheaderindex = struct.unpack('<H', elfunpackbytes)[0]
-	else:
-		sectionheaderindex = struct.unpack('>H', elfunpackbytes)[0]
-
-	## section header cannot be inside the ELF header
-	if numbersectionheaders != 0:
-		if offset + startsectionheader + sectionheadersize < offset + elfheadersize:
-			elffile.close()
-			return (False, None)
-
-	## First process the program header table
-	brokenelf = False
-	maxendofprogramsegments = 0
-	for i in range(0,numberprogramheaders):
-		elffile.seek(offset + startprogramheader + i*programheadersize)
-		elfbytes = elffile.read(programheadersize)
-		if len(elfbytes) != programheadersize:
-			brokenelf = True
-			break
-		## first the segmenttype
-		if littleendian:
-			segmenttype = struct.unpack('<I', elfbytes[:4])[0]
-		else:
-			segmenttype = struct.unpack('>I', elfbytes[:4])[0]
-
-		## PT_NULL is unused, so ignore
-		if segmenttype == 0:
-			continue
-
-		## then the offset in the file
-		if littleendian:
-			if bit32:
-				segmentoffset = struct.unpack('<I', elfbytes[4:8])[0]
-			else:
-				segmentoffset = struct.unpack('<Q', elfbytes[8:16])[0]
-		else:
-			if bit32:
-				segmentoffset = struct.unpack('>I', elfbytes[4:8])[0]
-			else:
-				segmentoffset = struct.unpack('>Q', elfbytes[8:16])[0]
-
-		## segment cannot be outside of the file
-		if offset + segmentoffset > filesize:
-			brokenelf = True
-			break
-
-		## then the virtual address in memory (skip for now) -- 4 bytes (32 bit) or 8 bytes
-		## then the physical address in memory (skip for now) -- 4 bytes (32 bit) or 8 bytes
-		## then the size in bytes in the file image
-		if littleendian:
-			if bit32:
-				segmentsize = struct.unpack('<I', elfbytes[16:20])[0]
-			else:
-				segmentsize = struct.unpack('<Q', elfbytes[32:40])[0]
-		else:
-			if bit32:
-				segmentsize = struct.unpack('>I', elfbytes[16:20])[0]
-			else:
-				segmentsize = struct.unpack('>Q', elfbytes[32:40])[0]
-
-		## segment cannot extend past the end of the file
-		if offset + segmentoffset + segmentsize > filesize:
-			brokenelf = True
-			break
-		maxendofprogramsegments = max(offset + segmentoffset + segmentsize, maxendofprogramsegments)
-
-		## then the size in bytes in memory image
-		if littleendian:
-			if bit32:
-				memsegmentsize = struct.unpack('<I', elfbytes[16:20])[0]
-			else:
-				memsegmentsize = struct.unpack('<Q', elfbytes[32:40])[0]
-		else:
-			if bit32:
-				memsegmentsize = struct.unpack('>I', elfbytes[16:20])[0]
-			else:
-				memsegmentsize = struct.unpack('>Q', elfbytes[32:40])[0]
-		## PT_LOAD
-		if segmenttype == 1:
-			## memory size cannot be smaller than the
-			## segment to be loaded into memory.
-			if memsegmentsize < segmentsize:
-				brokenelf = True
-				break
-		## then the segment dependent flags (skip for now) -- 4 bytes
-		## then the alignment
-		if littleendian:
-			if bit32:
-				alignment = struct.unpack('<I', elfbytes[28:32])[0]
-			else:
-				alignment = struct.unpack('<I', elfbytes[52:60])[0]
-
-		else:
-			if bit32:
-				alignment = struct.unpack('>I', elfbytes[28:32])[0]
-			else:
-				alignment = struct.unpack('>I', elfbytes[52:60])[0]
-		if alignment != 0 and alignment != 1:
-			## alignment has to be a power of 2
-			if alignment != pow(2,int(math.log(alignment, 2))):
-				brokenelf = True
-				break
-			## TODO: check if certain parts are properly aligned
-
-	if brokenelf:
-		elffile.close()
-		return (False, None)
-
-	dynamic = False
-
-	sections = {}
-
-	## process the section headers
-	maxendofsection = 0
-	dynamiccount = 0
-	for i in xrange(0,numbersectionheaders):
-		elffile.seek(offset+startsectionheader + i * sectionheadersize)
-		elfbytes = elffile.read(sectionheadersize)
-		if len(elfbytes) != sectionheadersize:
-			elffile.close()
-			return (False, None)
-		if littleendian:
-			sh_name = struct.unpack('<I', elfbytes[0:4])[0]
-		else:
-			sh_name = struct.unpack('>I', elfbytes[0:4])[0]
-		if littleendian:
-			sh_type = struct.unpack('<I', elfbytes[4:8])[0]
-		else:
-			sh_type = struct.unpack('>I', elfbytes[4:8])[0]
-		if sh_type == 6:
-			dynamiccount += 1
-		## then the flags (4 byte or 8 byte) -- skip for now
-		if littleendian:
-			if bit32:
-				sh_flags = struct.unpack('<I', elfbytes[8:12])[0]
-			else:
-				sh_flags = struct.unpack('<Q', elfbytes[8:16])[0]
-		else:
-			if bit32:
-				sh_flags = struct.unpack('>I', elfbytes[8:12])[0]
-			else:
-				sh_flags = struct.unpack('>Q', elfbytes[8:16])[0]
-	
-		## then the virtual address (4 byte or 8 byte) -- skip for now
-		if littleendian:
-			if bit32:
-				sh_addr = struct.unpack('<I', elfbytes[12:16])[0]
-			else:
-				sh_addr = struct.unpack('<Q', elfbytes[16:24])[0]
-		else:
-			if bit32:
-				sh_addr = struct.unpack('>I', elfbytes[12:16])[0]
-			else:
-				sh_addr = struct.unpack('>Q', elfbytes[16:24])[0]
-		## then the offset
-		if littleendian:
-			if bit32:
-				sectionoffset = struct.unpack('<I', elfbytes[16:20])[0]
-			else:
-				sectionoffset = struct.unpack('<Q', elfbytes[24:32])[0]
-		else:
-			if bit32:
-				sectionoffset = struct.unpack('>I', elfbytes[16:20])[0]
-			else:
-				sectionoffset = struct.unpack('>Q', elfbytes[24:32])[0]
-
-		## section offset cannot be outside of the file
-		if offset + sectionoffset > filesize:
-			brokenelf = True
-			break
-
-		## then the size in bytes in the file image
-		if littleendian:
-			if bit32:
-				sectionsize = struct.unpack('<I', elfbytes[20:24])[0]
-			else:
-				sectionsize = struct.unpack('<Q', elfbytes[32:40])[0]
-		else:
-			if bit32:
-				sectionsize = struct.unpack('>I', elfbytes[20:24])[0]
-			else:
-				sectionsize = struct.unpack('>Q', elfbytes[32:40])[0]
-
-		## segment cannot extend past the end of the file.
-		## This check only makes sense if the section has a different
-		## type than NOBITS
-		if sh_type != 8:
-			if offset + sectionoffset + sectionsize > filesize:
-				brokenelf = True
-				break
-			maxendofsection = max(offset + sectionoffset + sectionsize, maxendofsection)
-
-		sections[i] = {'sectionoffset': sectionoffset, 'sectionsize': sectionsize, 'nameoffset': sh_name, 'sectiontype': sh_type}
-
-	if brokenelf:
-		elffile.close()
-		return (False, None)
-
-	## dynamic count cannot be larger than 1
-	if dynamiccount == 1:
-		dynamic = True
-
-	## for each section find the name in the table with section names
-	sectionnames = []
-	if sectionheaderindex in sections:
-		elffile.seek(sections[sectionheaderindex]['sectionoffset'])
-		sectionnamebytes = elffile.read(sections[sectionheaderindex]['sectionsize'])
-		sectionnames = sectionnamebytes.split('\x00')
-		for i in sections:
-			endofsectionname = sectionnamebytes.find('\x00', sections[i]['nameoffset'])
-			sections[i]['name'] = sectionnamebytes[sections[i]['nameoffset']:endofsectionname]
-
-	## finally close the file
-	elffile.close()
-
-	## Now some extra checks so files can be tagged as ELF
-	if maxendofprogramsegments == filesize:
-		iself = True
-		totalsize = filesize
-	elif maxendofsection == filesize:
-		iself = True
-		totalsize = filesize
-	else:
-		## This does not work well for some Linux kernel modules as well as other files
-		## (architecture dependent?)
-		## One architecture where this sometimes seems to happen is ARM.
-		totalsize = startsectionheader + sectionheadersize * numbersectionheaders
-
-		## there are files where the number of section headers is zero, but
-		## which are valid ELF files. An example is the bootloader on certain
-		## Android devices. TODO.
-		if totalsize == 0:
-			pass
-		if totalsize == filesize:
-			iself = True
-		else:
-			## If it is a signed kernel module then the key is appended to the ELF data
-			elffile = open(filename, 'rb')
-			elffile.seek(-28, os.SEEK_END)
-			elfbytes = elffile.read()
-			if elfbytes == "~Module signature appended~\n":
-				## The metadata of the signing data can be found in 12 bytes
-				## preceding the 'magic'
-				## According to 'scripts/sign-file' in the Linux kernel
-				## the last 4 bytes are the size of the signature data
-				## three bytes before that are 0x00
-				## The byte before that is the length of the key identifier
-				## The byte before that is the length of the "signer's name"
-				totalsiglength = 40
-				elffile.seek(-40, os.SEEK_END)
-				elfbytes = elffile.read(12)
-				signaturelength = struct.unpack('>I', elfbytes[-4:])[0]
-				totalsiglength += signaturelength
-				keyidentifierlen = ord(elfbytes[4])
-				signernamelen = ord(elfbytes[3])
-				totalsiglength += keyidentifierlen
-				totalsiglength += signernamelen
-				if totalsiglength + totalsize == filesize:
-					iself = True
-				totalsize += totalsiglength
-			elffile.close()
-			## check if the max end of section happens to be later than
-			## the totalsize, as this happens as well in non-stripped binaries
-			totalsize = max(maxendofsection, totalsize)
-
-	elfresult['dynamic'] = dynamic
-	elfresult['sectionnames'] = sectionnames
-	elfresult['sections'] = sections
-	elfresult['size'] = totalsize
-
-	if not iself:
-		return (False, elfresult)
-
-	return (True, elfresult)
+	if offset == 0:
+		return getELF(filename).parse()
+	return ELFFile(filename, offset).parse()
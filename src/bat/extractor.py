@@ -8,7 +8,7 @@
 This file contains a few convenience functions that are used throughout the code.
 '''
 
-import string, re, subprocess, sys
+import string, re, subprocess, sys, gzip
 from xml.dom import minidom
 
 def isPrintables(lines):
@@ -49,6 +49,99 @@ def lowestnextblacklist(offset, blacklist):
 		return 0
 	return lowest
 
+## Compute the byte ranges of a file that are not blacklisted. This mirrors
+## how the string extraction in bat/identifier.py historically carved files:
+## a blacklisted range (lower, upper) resumes at upper - 1, so the last byte
+## of a blacklisted range is kept.
+def carveranges(filesize, blacklist):
+	blacklist_tmp = sorted(blacklist)
+	blacklist_tmp.append((filesize,filesize))
+	lastindex = 0
+	ranges = []
+	for i in blacklist_tmp:
+		if i[0] == lastindex:
+			lastindex = max(i[1] - 1, 0)
+			continue
+		if i[0] > lastindex:
+			ranges.append((lastindex, i[0]))
+			lastindex = max(i[1] - 1, 0)
+	return ranges
+
+## return 'size' bytes at 'offset' of the data that would be the result
+## of concatenating all ranges of 'data'
+def rangebytes(data, ranges, offset, size):
+	databytes = ''
+	rangeoffset = 0
+	for (start, end) in ranges:
+		rangelength = end - start
+		if offset < rangeoffset + rangelength and offset + size > rangeoffset:
+			lower = max(offset - rangeoffset, 0)
+			upper = min(offset + size - rangeoffset, rangelength)
+			databytes += data[start+lower:start+upper]
+		rangeoffset += rangelength
+	return databytes
+
+## Characters that are printed by 'strings': printable 7 bit ASCII and TAB.
+printablechars = '\t' + ''.join(map(lambda x: chr(x), range(0x20, 0x7f)))
+printablerun = re.compile('[\t\x20-\x7e]*')
+stringpatterns = {}
+
+## Extract printable strings of at least 'stringcutoff' characters from 'data'
+## (a string or a memory map). The result is the same as the output of
+## 'strings -a -n stringcutoff' (split into lines), but without writing the
+## data to a file first and running an external program on it.
+##
+## If 'ranges' is given only those ranges of 'data' are looked at and they are
+## treated as if they were concatenated, so strings continue from the end of
+## one range into the next range.
+def printablestrings(data, stringcutoff, ranges=None):
+	if ranges == None:
+		ranges = [(0, len(data))]
+	if not stringcutoff in stringpatterns:
+		stringpatterns[stringcutoff] = re.compile('[\t\x20-\x7e]{%d,}' % stringcutoff)
+	stringpattern = stringpatterns[stringcutoff]
+	lines = []
+	## printable characters at the end of the previous range
+	carry = ''
+	for (start, end) in ranges:
+		if start >= end:
+			continue
+		pos = start
+		if carry != '':
+			res = printablerun.match(data, start, end)
+			carry += res.group()
+			pos = res.end()
+			if pos == end:
+				continue
+			if len(carry) >= stringcutoff:
+				lines.append(carry)
+			carry = ''
+		lastend = pos
+		for res in stringpattern.finditer(data, pos, end):
+			lines.append(res.group())
+			lastend = res.end()
+		if lastend == end and lastend != pos:
+			## the last string runs until the end of the range
+			carry = lines.pop()
+		else:
+			## a string shorter than stringcutoff could continue
+			## in the next range
+			trailing = end
+			while trailing > max(pos, lastend) and trailing > end - stringcutoff and data[trailing-1] in printablechars:
+				trailing -= 1
+			carry = data[trailing:end]
+	if len(carry) >= stringcutoff:
+		lines.append(carry)
+	return lines
+
+## Open a result file (HTML, JSON, pickle) for writing. If 'compressed' is
+## set '.gz' is appended to the name and the data is gzip compressed while it
+## is written, instead of writing the file first and compressing it later.
+def openreport(filename, compressed=False, compresslevel=9, mode='wb'):
+	if compressed:
+		return gzip.GzipFile("%s.gz" % filename, mode, compresslevel)
+	return open(filename, mode)
+
 ###
 ## The helper method below is to specifically analyse Microsoft Windows binaries
 ## and extract the XML that can usually be found in those installers. Based on
@@ -10,15 +10,17 @@ package a file belongs to based on the name of a package. This information is
 mined from distributions like Fedora and Debian.
 '''
 
-import os, os.path, sys, subprocess, copy, Queue, cPickle
+import os, os.path, sys, subprocess, copy, Queue
+import reportstore, scanmetrics
 import multiprocessing
 from multiprocessing import Process, Lock
 from multiprocessing.sharedctypes import Value, Array
 
-def grabpackage(scanqueue, reportqueue, cursor, query):
+def grabpackage(scanqueue, reportqueue, cursor, query, dbqueries):
 	## select the packages that are available. It would be better to also have the directory
 	## name available, so we should get rid of 'path' and use something else that is better
 	## suited
+	scanmetrics.resetcounters()
 	while True:
 		filename = scanqueue.get(timeout=2592000)
 		cursor.execute(query, (os.path.basename(filename),))
@@ -35,6 +37,7 @@ def grabpackage(scanqueue, reportqueue, cursor, query):
 				distrores['distributionversion'] = distroversion
 				returnres.append(distrores)
 			reportqueue.put({filename: returnres})
+		scanmetrics.sharecounter('dbqueries', dbqueries)
 		scanqueue.task_done()
 
 def filename2package(unpackreports, scantempdir, topleveldir, processors, scanenv, batcursors, batcons, scandebug=False, unpacktempdir=None):
@@ -59,9 +62,10 @@ def filename2package(unpackreports, scantempdir, topleveldir, processors, scanen
 	map(lambda x: scanqueue.put(x), processtasks)
 	minprocessamount = min(len(processtasks), processamount)
 	res = []
+	dbqueries = Value('L', 0)
 
 	for i in range(0,minprocessamount):
-		p = multiprocessing.Process(target=grabpackage, args=(scanqueue,reportqueue,batcursors[i],query))
+		p = multiprocessing.Process(target=grabpackage, args=(scanqueue,reportqueue,batcursors[i],query,dbqueries))
 		processpool.append(p)
 		p.start()
 
@@ -77,25 +81,22 @@ def filename2package(unpackreports, scantempdir, topleveldir, processors, scanen
 			break
 	reportqueue.join()
 
+	## wait for the workers, so their I/O is counted in the metrics
 	for p in processpool:
 		p.terminate()
+		p.join()
+	scanmetrics.count('dbqueries', dbqueries.value)
 
 	for r in res:
 		filename = r.keys()[0]
 		filehash = unpackreports[filename]['checksum']
 
-                ## read pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
-
-		## write pickle file
+		## only the tags and the new result are written
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags'])
 		leafreports['file2package'] = r[filename]
 		leafreports['tags'].append('file2package')
 		unpackreports[filename]['tags'].append('file2package')
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-		cPickle.dump(leafreports, leaf_file)
-		leaf_file.close()
+		reportstore.getstore(topleveldir).update(filehash, leafreports)
 
 	returnres = res
 
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains a read-only view on (part of) a file. The view memory maps
+the parent file and only exposes the bytes from 'offset' to 'offset+length',
+so unpackers that are implemented in Python can work on data inside a larger
+file without first carving it to a temporary file.
+
+A view behaves like a file opened in 'rb' mode (read(), seek(), tell(),
+close()) and like a string (len(), indexing, slicing, find()), with all
+offsets relative to the start of the view.
+
+Views are also used to check the headers at the offsets where markers were
+found. Fields are read with precompiled struct layouts (unpack(), value())
+directly from the memory map, so checking thousands of offsets does not cost
+any system calls. The file that is scanned by bruteforcescan.py is mapped once
+for all prerun and unpack scans (openshared()) and scans get this view with
+getview(). Closing the shared view in a scan does nothing.
+'''
+
+import os, mmap, struct, subprocess
+
+## Precompiled struct layouts, shared by all views. Scans can also use this
+## to precompile the layouts of the headers they check.
+layouts = {}
+
+def layout(fmt):
+	if not fmt in layouts:
+		layouts[fmt] = struct.Struct(fmt)
+	return layouts[fmt]
+
+class FileView:
+	def __init__(self, filename, offset=0, length=0):
+		datafile = open(filename, 'rb')
+		filesize = os.fstat(datafile.fileno()).st_size
+		offset = min(offset, filesize)
+		## like unpackFile() a length of 0 means "until the end of the file"
+		if length == 0 or offset + length > filesize:
+			length = filesize - offset
+		## empty files cannot be memory mapped
+		if filesize == 0:
+			self.data = ''
+		else:
+			self.data = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+		datafile.close()
+		self.filename = filename
+		self.offset = offset
+		self.length = length
+		self.position = 0
+		self.closed = False
+		self.shared = False
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			(start, stop, step) = index.indices(self.length)
+			if step != 1:
+				return self.data[self.offset + start:self.offset + stop][::step]
+			return self.data[self.offset + start:self.offset + max(start, stop)]
+		if index < 0:
+			index += self.length
+		if index < 0 or index >= self.length:
+			raise IndexError("view index out of range")
+		return self.data[self.offset + index]
+
+	def find(self, sub, start=0, end=None):
+		if end == None or end > self.length:
+			end = self.length
+		res = self.data.find(sub, self.offset + start, self.offset + end)
+		if res == -1:
+			return -1
+		return res - self.offset
+
+	## Return 'size' bytes at 'offset', without changing the position.
+	## Less bytes are returned at the end of the view.
+	def readat(self, offset, size):
+		if offset < 0 or offset >= self.length:
+			return ''
+		return self.data[self.offset + offset:self.offset + min(offset + size, self.length)]
+
+	## Unpack a struct layout (a format string or a precompiled
+	## struct.Struct) at 'offset'. Returns None if the view is too short.
+	def unpack(self, fmt, offset):
+		if not isinstance(fmt, struct.Struct):
+			fmt = layout(fmt)
+		if offset < 0 or offset + fmt.size > self.length:
+			return None
+		return fmt.unpack_from(self.data, self.offset + offset)
+
+	## Unpack a layout with a single field, or return None if the view
+	## is too short.
+	def value(self, fmt, offset):
+		res = self.unpack(fmt, offset)
+		if res == None:
+			return None
+		return res[0]
+
+	def read(self, size=-1):
+		if size < 0 or self.position + size > self.length:
+			size = max(0, self.length - self.position)
+		res = self.data[self.offset + self.position:self.offset + self.position + size]
+		self.position += len(res)
+		return res
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.position
+		elif whence == 2:
+			offset += self.length
+		if offset < 0:
+			raise IOError("invalid seek offset")
+		self.position = offset
+
+	def tell(self):
+		return self.position
+
+	def flush(self):
+		pass
+
+	def close(self):
+		if self.closed or self.shared:
+			return
+		if not isinstance(self.data, str):
+			self.data.close()
+		self.closed = True
+
+## the view on the file that is currently scanned by bruteforcescan.py
+sharedview = None
+
+def openshared(filename):
+	global sharedview
+	closeshared()
+	sharedview = FileView(filename)
+	sharedview.shared = True
+	return sharedview
+
+def closeshared():
+	global sharedview
+	if sharedview == None:
+		return
+	sharedview.shared = False
+	sharedview.close()
+	sharedview = None
+
+## Return a view on the whole file: the shared view if it is for 'filename',
+## otherwise a new view that should be closed by the caller.
+def getview(filename):
+	if sharedview != None and sharedview.filename == filename:
+		return sharedview
+	return FileView(filename)
+
+## Write the contents of a view to the standard input of a program, in chunks
+## of 'chunksize' bytes, so the data does not have to be carved to a file or
+## read into memory first. The output of the program is written to 'stdout'
+## (a file descriptor or file object). Returns the return code of the program.
+def pipeView(view, args, stdout=None, cwd=None, chunksize=10485760):
+	devnull = open(os.devnull, 'wb')
+	if stdout == None:
+		stdout = devnull
+	p = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=stdout, stderr=devnull, close_fds=True, cwd=cwd)
+	viewoffset = 0
+	try:
+		while viewoffset < len(view):
+			p.stdin.write(view[viewoffset:viewoffset+chunksize])
+			viewoffset += chunksize
+	except IOError, e:
+		## the program stopped reading, for example because of
+		## invalid data
+		pass
+	try:
+		p.stdin.close()
+	except IOError, e:
+		pass
+	p.wait()
+	devnull.close()
+	return p.returncode
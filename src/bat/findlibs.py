@@ -4,9 +4,9 @@
 ## Copyright 2012-2016 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import os, os.path, sys, subprocess, copy, cPickle, multiprocessing, pydot
+import os, os.path, sys, subprocess, copy, multiprocessing, pydot
 import bat.interfaces
-import elfcheck
+import elfcheck, reportstore
 
 '''
 This program can be used to check whether the dependencies of a dynamically
@@ -287,7 +287,7 @@ def findlibs(unpackreports, scantempdir, topleveldir, processors, scanenv, batcu
 							symlinks[os.path.basename(i)] = [{'original': i, 'target': target, 'absolutetargetpath': linkpath[scantempdirlen+1:]}]
 			continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 
 		if not 'elf' in unpackreports[i]['tags']:
@@ -414,9 +414,7 @@ def findlibs(unpackreports, scantempdir, topleveldir, processors, scanenv, batcu
 		if elftypes[i] == 'elfrelocatable':
 			continue
 		filehash = unpackreports[i]['checksum']
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['architecture'])
 
 		if not 'architecture' in leafreports:
 			continue
@@ -440,9 +438,7 @@ def findlibs(unpackreports, scantempdir, topleveldir, processors, scanenv, batcu
 
 		filehash = unpackreports[i]['checksum']
 
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['libs'])
 
 		if remotefunctionnames[i] == [] and remotevariablenames[i] == [] and weakremotefunctionnames == [] and weakremotevariablenames == []:
 			## nothing to resolve, so continue
@@ -861,9 +857,7 @@ def findlibs(unpackreports, scantempdir, topleveldir, processors, scanenv, batcu
 		## only write the new leafreport if there actually is something to write back
 		if writeback:
 			filehash = unpackreports[i]['checksum']
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-			leafreports = cPickle.load(leaf_file)
-			leaf_file.close()
+			leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags'])
 
 			for e in aggregatereturn:
 				if aggregatereturn.has_key(e):
@@ -871,9 +865,7 @@ def findlibs(unpackreports, scantempdir, topleveldir, processors, scanenv, batcu
 			if i in plugins:
 				leafreports['tags'].append('plugin')
 
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-			leafreports = cPickle.dump(leafreports, leaf_file)
-			leaf_file.close()
+			reportstore.getstore(topleveldir).update(filehash, leafreports)
 
 	squashedgraph = {}
 	for i in elffiles:
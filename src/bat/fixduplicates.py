@@ -5,7 +5,7 @@
 ## Copyright 2014-2016 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import os, os.path, sys, subprocess, copy, cPickle, elfcheck
+import os, os.path, sys, subprocess, copy, elfcheck, reportstore
 
 '''
 During scanning BAT tags duplicate files (same checksums) and only processes a
@@ -32,7 +32,7 @@ def fixduplicates(unpackreports, scantempdir, topleveldir, processors, scanenv,
 		if not 'checksum' in unpackreports[i]:
 			continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 
 		if not 'elf' in unpackreports[i]['tags']:
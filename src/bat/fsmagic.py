@@ -119,6 +119,10 @@ fsmagic = {
             'ics':		'acsp',
             'elf':		'\x7f\x45\x4c\x46',
             'bflt':		'\x62\x46\x4c\x54',
+            'xor_splashtop':	'\x51\x57\x45\x52', ## XOR keys, see bat/batxor.py
+            'xor_bococom':	'\x3a\x93\xa2\x95\xc3\x63\x48\x45\x58\x09\x12\x03\x08\xc8\x3c',
+            'xor_sitecom':	'\x78\x3c\x9e\xcf\x67\xb3\x59\xac',
+            'xor_edimax':	'\x88\x44\xa2\xd1\x68\xb4\x5a\x2d',
           }
 
 ## some offsets can be found after a certain number of bytes, but
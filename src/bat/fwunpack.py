@@ -15,12 +15,21 @@ Optionally return a range of bytes that should be excluded in same cases
 to prevent other scans from (re)scanning (part of) the data.
 '''
 
-import sys, os, subprocess, os.path, shutil, stat, array, struct, binascii, json, math
+import sys, os, subprocess, os.path, shutil, stat, array, struct, binascii, json, math, errno
 import tempfile, bz2, re, magic, tarfile, zlib, copy, uu, hashlib, StringIO, zipfile
-import fsmagic, extractor, ext2, jffs2, prerun, javacheck, elfcheck
+import fsmagic, extractor, ext2, jffs2, prerun, javacheck, elfcheck, fileview
 from collections import deque
 import xml.dom
 
+## Python 2 does not ship with a module for LZMA and XZ, so use the backport
+## (backports.lzma) if it is installed. If not, LZMA and XZ data is unpacked
+## with the external 'lzma' and 'xz' programs.
+try:
+	from backports import lzma
+	have_lzma = True
+except Exception, e:
+	have_lzma = False
+
 ## generic method to create temporary directories, with the correct filenames
 ## which is used throughout the code.
 def dirsetup(tempdir, filename, marker, counter):
@@ -42,6 +51,114 @@ def unpacksetup(tempdir):
 		tmpdir = tempdir
 	return tmpdir
 
+## Bytes are copied inside the kernel where possible, so data does not have
+## to pass through Python or external programs like 'dd' and 'tail'.
+## copy_file_range() (Linux 4.5+) is tried first: on file systems that support
+## it (Btrfs, XFS, NFS 4.2) this shares extents instead of copying data. If
+## it is not available sendfile() is used. Python 2 has neither os.sendfile()
+## nor os.copy_file_range(), so the functions from libc are used via ctypes.
+try:
+	import ctypes, ctypes.util, fcntl
+	libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+	have_ctypes = True
+except Exception, e:
+	have_ctypes = False
+
+have_copy_file_range = False
+have_sendfile = False
+if have_ctypes:
+	if hasattr(libc, 'copy_file_range'):
+		libc.copy_file_range.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t, ctypes.c_uint]
+		libc.copy_file_range.restype = ctypes.c_ssize_t
+		have_copy_file_range = True
+	if hasattr(libc, 'sendfile64'):
+		libc.sendfile64.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+		libc.sendfile64.restype = ctypes.c_ssize_t
+		have_sendfile = True
+
+## ioctl to clone a complete file (reflink), from linux/fs.h
+FICLONE = 0x40049409
+
+## maximum amount of bytes per system call, and size of the buffer that is
+## used if the kernel can't do the copying
+carvechunksize = 1073741824
+carvebuffersize = 10485760
+
+## copy 'length' bytes starting at 'offset' in srcfd to the current position
+## in dstfd using system calls. Returns the amount of bytes that were copied,
+## which can be less than 'length' if the system calls are not supported for
+## these files.
+def kernelCopy(srcfd, dstfd, offset, length):
+	global have_copy_file_range, have_sendfile
+	copied = 0
+	for method in ['copy_file_range', 'sendfile']:
+		if method == 'copy_file_range' and not have_copy_file_range:
+			continue
+		if method == 'sendfile' and not have_sendfile:
+			continue
+		while copied < length:
+			inoffset = ctypes.c_longlong(offset + copied)
+			if method == 'copy_file_range':
+				res = libc.copy_file_range(srcfd, ctypes.byref(inoffset), dstfd, None, min(length - copied, carvechunksize), 0)
+			else:
+				res = libc.sendfile64(dstfd, srcfd, ctypes.byref(inoffset), min(length - copied, carvechunksize))
+			if res < 0:
+				err = ctypes.get_errno()
+				if err == errno.EINTR:
+					continue
+				if err == errno.ENOSYS:
+					## not implemented by this kernel, so don't try again
+					if method == 'copy_file_range':
+						have_copy_file_range = False
+					else:
+						have_sendfile = False
+				break
+			if res == 0:
+				## end of file
+				return copied
+			copied += res
+		if copied == length:
+			break
+	return copied
+
+## Carve 'length' bytes starting at 'offset' from filename into tmpfile. If
+## 'length' is 0 everything from 'offset' until the end of the file is
+## carved. No external programs or intermediate files are used.
+def carveFile(filename, tmpfile, offset, length=0):
+	srcfile = open(filename, 'rb')
+	filesize = os.fstat(srcfile.fileno()).st_size
+	if length == 0 or offset + length > filesize:
+		carvelength = max(0, filesize - offset)
+	else:
+		carvelength = length
+	dstfile = open(tmpfile, 'wb')
+	copied = 0
+
+	## the complete file is needed, so first try to clone it
+	if have_ctypes and offset == 0 and carvelength == filesize:
+		try:
+			fcntl.ioctl(dstfile.fileno(), FICLONE, srcfile.fileno())
+			copied = carvelength
+		except Exception, e:
+			pass
+
+	if copied == 0 and have_ctypes and carvelength != 0:
+		copied = kernelCopy(srcfile.fileno(), dstfile.fileno(), offset, carvelength)
+		dstfile.seek(copied)
+
+	## copy what could not be copied by the kernel
+	if copied < carvelength:
+		srcfile.seek(offset + copied)
+		while copied < carvelength:
+			databuffer = srcfile.read(min(carvelength - copied, carvebuffersize))
+			if databuffer == '':
+				break
+			dstfile.write(databuffer)
+			copied += len(databuffer)
+	dstfile.close()
+	srcfile.close()
+	os.chmod(tmpfile, stat.S_IRWXU)
+
 ## Carve a file from a larger file, or simply copy or hardlink the file.
 def unpackFile(filename, offset, tmpfile, tmpdir, length=0, modify=False, unpacktempdir=None, blacklist=[]):
 	if blacklist != []:
@@ -57,10 +174,6 @@ def unpackFile(filename, offset, tmpfile, tmpdir, length=0, modify=False, unpack
 	if filesize == length:
 		length = 0
 
-	## don't use dd for stuff that is less than 50 million bytes
-	## TODO: make configurable
-	unpackcutoff = 50000000
-
 	## If the whole file needs to be scanned, then either copy it, or hardlink it.
 	## Hardlinking is only possible if the file resides on the same file system
 	## and if the file is not modified in a way.
@@ -78,93 +191,84 @@ def unpackFile(filename, offset, tmpfile, tmpdir, length=0, modify=False, unpack
 			except OSError, e:
 				## if filename and tmpdir are on different devices it is
 				## not possible to use hardlinks
-				shutil.copy(filename, templink[1])
+				carveFile(filename, templink[1], 0)
+				shutil.copymode(filename, templink[1])
 		else:
-			shutil.copy(filename, templink[1])
+			carveFile(filename, templink[1], 0)
+			shutil.copymode(filename, templink[1])
 		shutil.move(templink[1], tmpfile)
 	else:
-		if length == 0:
-			if unpackcutoff < filesize and (filesize - offset) < unpackcutoff:
-				srcfile = open(filename, 'rb')
-				dstfile = open(tmpfile, 'wb')
-				srcfile.seek(offset)
-				dstfile.write(srcfile.read(length))
-				dstfile.flush()
-				dstfile.close()
-				srcfile.close()
-				return
-			## The tail end of the file is needed and the first bytes (indicated by 'offset') need
-			## to be ignored, while the rest needs to be copied. If the offset is small, it is
-			## faster to use 'tail' instead of 'dd', especially for big files.
-			if offset < 128:
-				tmptmpfile = open(tmpfile, 'wb')
-				p = subprocess.Popen(['tail', filename, '-c', "%d" % (filesize - offset)], stdout=tmptmpfile, stderr=subprocess.PIPE, close_fds=True)
-				(stanout, stanerr) = p.communicate()
-				tmptmpfile.close()
-			else:
-				p = subprocess.Popen(['dd', 'if=%s' % (filename,), 'of=%s' % (tmpfile,), 'bs=%s' % (offset,), 'skip=1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-				(stanout, stanerr) = p.communicate()
-				os.chmod(tmpfile, stat.S_IRWXU)
-		else:
-			if unpackcutoff < filesize and length < unpackcutoff:
-				srcfile = open(filename, 'rb')
-				dstfile = open(tmpfile, 'wb')
-				srcfile.seek(offset)
-				dstfile.write(srcfile.read(length))
-				dstfile.flush()
-				dstfile.close()
-				srcfile.close()
-				return
-			if offset == 0:
-				## sometimes there are some issues with dd and maximum file size
-				## see for example https://bugzilla.redhat.com/show_bug.cgi?id=612839
-				if (length+offset) >= 2147479552:
-					shutil.copy(filename, tmpfile)
-					truncfile = open(tmpfile, 'a+b')
-					truncfile.seek(length+offset)
-					truncfile.truncate()
-					truncfile.close()
-				else:
-					## bytes need be removed only from the end of the file
-					p = subprocess.Popen(['dd', 'if=%s' % (filename,), 'of=%s' % (tmpfile,), 'bs=%s' % (length,), 'count=1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-					(stanout, stanerr) = p.communicate()
-					os.chmod(tmpfile, stat.S_IRWXU)
-			else:
-				## bytes need to be removed on both sides of the file, so possibly
-				## use a two way pass
-				## First determine which side to cut first before cutting
-				if offset > (filesize - length):
-					p = subprocess.Popen(['dd', 'if=%s' % (filename,), 'of=%s' % (tmpfile,), 'bs=%s' % (offset,), 'skip=1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-					(stanout, stanerr) = p.communicate()
-					os.chmod(tmpfile, stat.S_IRWXU)
-					tmptmpfile = open(tmpfile, 'a+b')
-					tmptmpfile.seek(length)
-					tmptmpfile.truncate()
-					tmptmpfile.close()
-				else:
-					tmptmpfile = tempfile.mkstemp(dir=tmpdir)
-					os.fdopen(tmptmpfile[0]).close()
-
-					## sometimes there are some issues with dd and maximum file size
-					## see for example https://bugzilla.redhat.com/show_bug.cgi?id=612839
-					if (length+offset) >= 2147479552:
-						shutil.copy(filename, tmptmpfile[1])
-						os.chmod(tmptmpfile[1], stat.S_IRWXU)
-						truncfile = open(tmptmpfile[1], 'a+b')
-						truncfile.seek(length+offset)
-						truncfile.truncate()
-						truncfile.close()
-					else:
-						## first copy bytes from the front of the file up to a certain length
-						p = subprocess.Popen(['dd', 'if=%s' % (filename,), 'of=%s' % (tmptmpfile[1],), 'bs=%s' % (length+offset,), 'count=1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-						(stanout, stanerr) = p.communicate()
-						os.chmod(tmptmpfile[1], stat.S_IRWXU)
+		carveFile(filename, tmpfile, offset, length)
+
+## Candidate offsets for compressed data are tested with in-process
+## decompression objects (zlib, bz2, lzma). Most false positives can be
+## rejected after decompressing only a small amount of data, so first the
+## first 'probesize' bytes of a view are decompressed. This returns the
+## uncompressed data, or None if the data is not valid.
+def probeStream(view, decompressor, probesize=65536):
+	try:
+		return decompressor.decompress(view[:probesize])
+	except Exception, e:
+		return None
 
-					## then copy bytes from the temporary file, but skip 'offset' bytes at the front
-					p = subprocess.Popen(['dd', 'if=%s' % (tmptmpfile[1],), 'of=%s' % (tmpfile,), 'bs=%s' % (offset,), 'skip=1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-					(stanout, stanerr) = p.communicate()
-					os.chmod(tmpfile, stat.S_IRWXU)
-					os.unlink(tmptmpfile[1])
+## check if the decompressor has found the end of the compressed stream
+def streamEnded(decompressor):
+	if decompressor.unused_data != '':
+		return True
+	if getattr(decompressor, 'eof', False):
+		return True
+	return False
+
+## If the data passed probeStream() the rest of the data in the view, starting
+## at 'viewoffset', is decompressed in chunks of 'readsize' bytes and written
+## to 'outfile' (together with the data 'uncompressed' from probeStream()),
+## until the end of the stream or the end of the view is reached, so the
+## uncompressed data is never kept in memory completely.
+## The hashes in 'streamhashes' of the uncompressed data are computed as well,
+## so they can be passed to the scanning code as a hint and the unpacked file
+## does not need to be read again to compute them.
+## Returns a tuple with the size of the compressed stream, the size and CRC32
+## of the uncompressed data, whether or not the end of the stream was found,
+## whether or not there was a decompression error and the hashes.
+streamhashes = ['sha256', 'sha1', 'md5']
+
+def streamDecompress(view, decompressor, outfile, uncompressed, viewoffset=65536, readsize=10485760):
+	viewoffset = min(viewoffset, len(view))
+	uncompressedsize = len(uncompressed)
+	crc32 = binascii.crc32(uncompressed)
+	hashdict = {}
+	for h in streamhashes:
+		hashdict[h] = hashlib.new(h)
+		hashdict[h].update(uncompressed)
+	outfile.write(uncompressed)
+	error = False
+	while not streamEnded(decompressor) and viewoffset < len(view):
+		compresseddata = view[viewoffset:viewoffset+readsize]
+		viewoffset += len(compresseddata)
+		try:
+			uncompressed = decompressor.decompress(compresseddata)
+		except Exception, e:
+			error = True
+			break
+		uncompressedsize += len(uncompressed)
+		crc32 = binascii.crc32(uncompressed, crc32)
+		for h in hashdict:
+			hashdict[h].update(uncompressed)
+		outfile.write(uncompressed)
+	outfile.close()
+	complete = streamEnded(decompressor)
+	if not complete and not error and isinstance(decompressor, bz2.BZ2Decompressor):
+		## bz2 only reports the end of a stream that is not followed by
+		## any other data when trying to decompress more data
+		try:
+			decompressor.decompress('')
+		except EOFError, e:
+			complete = True
+	compressedsize = viewoffset - len(decompressor.unused_data)
+	hashresults = {}
+	for h in hashdict:
+		hashresults[h] = hashdict[h].hexdigest()
+	return (compressedsize, uncompressedsize, crc32 & 0xffffffff, complete, error, hashresults)
 
 ## There are certain routers that have all bytes swapped, because they use 16
 ## bytes NOR flash instead of 8 bytes SPI flash. This is an ugly hack to first
@@ -1909,6 +2013,10 @@ def searchUnpackYaffs2(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 			os.rmdir(tmpdir)
 	else:
 		for offset in offsets['yaffs2']:
+			## the smallest possible file system is 512 bytes, so there
+			## is no need to run the unpacker
+			if filesize - offset < 512:
+				break
 			blacklistoffset = extractor.inblacklist(offset, blacklist)
 			if blacklistoffset != None:
 				continue
@@ -2483,14 +2591,15 @@ def searchUnpackXZ(filename, tempdir=None, blacklist=[], offsets={}, scanenv={},
 		return ([], blacklist, [], hints)
 
 	dotest = True
-	## check version of XZ, as older versions do not support -l
-	p = subprocess.Popen(['xz', '-V'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(stanout, stanerr) = p.communicate()
-	if p.returncode != 0:
-		return ([], blacklist, [], hints)
+	if not have_lzma:
+		## check version of XZ, as older versions do not support -l
+		p = subprocess.Popen(['xz', '-V'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		(stanout, stanerr) = p.communicate()
+		if p.returncode != 0:
+			return ([], blacklist, [], hints)
 
-	if '4.999.9beta' in stanout:
-		dotest = False
+		if '4.999.9beta' in stanout:
+			dotest = False
 
 	diroffsets = []
 	newtags = []
@@ -2527,14 +2636,14 @@ def searchUnpackXZ(filename, tempdir=None, blacklist=[], offsets={}, scanenv={},
 				continue
 
 			xzsize = trail+2 - offset
-			datafile.seek(offset)
-			data = datafile.read(xzsize)
 			## TODO: the two bytes before that are the so called "backward size"
 
 			tmpdir = dirsetup(tempdir, filename, "xz", counter)
 			res = unpackXZ(filename, offset, xzsize, template, dotest, tmpdir)
 			if res != None:
-				diroffsets.append((res, offset, xzsize))
+				(xzdir, xzhints) = res
+				hints.update(xzhints)
+				diroffsets.append((xzdir, offset, xzsize))
 				blacklist.append((offset, trail+2))
 				if offset == 0 and trail+2 == os.stat(filename).st_size:
 					datafile.close()
@@ -2551,43 +2660,68 @@ def searchUnpackXZ(filename, tempdir=None, blacklist=[], offsets={}, scanenv={},
 
 def unpackXZ(filename, offset, xzsize, template, dotest, tempdir=None):
 	tmpdir = unpacksetup(tempdir)
-	tmpfile = tempfile.mkstemp(dir=tmpdir)
-	os.fdopen(tmpfile[0]).close()
 
-	unpackFile(filename, offset, tmpfile[1], tmpdir, length=xzsize)
+	if have_lzma:
+		## decompress in process from a view on the parent file. The
+		## decompressor verifies the integrity checks like 'xz -l' does.
+		## Invalid data is rejected after decompressing only a little bit.
+		xzview = fileview.FileView(filename, offset, xzsize)
+		xzdecompressobj = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+		uncompresseddata = probeStream(xzview, xzdecompressobj)
+		if uncompresseddata == None:
+			xzview.close()
+			if tempdir == None:
+				os.rmdir(tmpdir)
+			return None
+		outtmpfile = tempfile.mkstemp(dir=tmpdir)
+		outxzfile = os.fdopen(outtmpfile[0], 'wb')
+		(compressedsize, uncompressedsize, crc32, complete, unpackingerror, hashresults) = streamDecompress(xzview, xzdecompressobj, outxzfile, uncompresseddata)
+		xzview.close()
+		if unpackingerror or not complete or uncompressedsize == 0:
+			os.unlink(outtmpfile[1])
+			if tempdir == None:
+				os.rmdir(tmpdir)
+			return None
+	else:
+		tmpfile = tempfile.mkstemp(dir=tmpdir)
+		os.fdopen(tmpfile[0]).close()
+
+		unpackFile(filename, offset, tmpfile[1], tmpdir, length=xzsize)
 
-	if dotest:
-		## test integrity of the file
-		p = subprocess.Popen(['xz', '-l', tmpfile[1]], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+		if dotest:
+			## test integrity of the file
+			p = subprocess.Popen(['xz', '-l', tmpfile[1]], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+			(stanout, stanerr) = p.communicate()
+			if p.returncode != 0:
+				os.unlink(tmpfile[1])
+				return None
+		## unpack
+		outtmpfile = tempfile.mkstemp(dir=tmpdir)
+		p = subprocess.Popen(['xzcat', tmpfile[1]], stdout=outtmpfile[0], stderr=subprocess.PIPE, close_fds=True)
 		(stanout, stanerr) = p.communicate()
-		if p.returncode != 0:
+		os.fsync(outtmpfile[0])
+		os.fdopen(outtmpfile[0]).close()
+		if os.stat(outtmpfile[1]).st_size == 0:
+			os.unlink(outtmpfile[1])
 			os.unlink(tmpfile[1])
+			if tempdir == None:
+				os.rmdir(tmpdir)
 			return None
-	## unpack
-	outtmpfile = tempfile.mkstemp(dir=tmpdir)
-	p = subprocess.Popen(['xzcat', tmpfile[1]], stdout=outtmpfile[0], stderr=subprocess.PIPE, close_fds=True)
-	(stanout, stanerr) = p.communicate()
-	os.fsync(outtmpfile[0])
-	os.fdopen(outtmpfile[0]).close()
-	if os.stat(outtmpfile[1]).st_size == 0:
-		os.unlink(outtmpfile[1])
 		os.unlink(tmpfile[1])
-		if tempdir == None:
-			os.rmdir(tmpdir)
-		return None
-	os.unlink(tmpfile[1])
 
 	wholefile = False
 	if offset == 0 and offset+xzsize == os.stat(filename).st_size:
 		if filename.lower().endswith('.xz'):
 			wholefile = True
 
+	outputpath = outtmpfile[1]
 	if wholefile:
 		filenamenoext = os.path.basename(filename)[:-3]
 		if len(filenamenoext) > 0:
 			if not os.path.exists(os.path.join(tmpdir, filenamenoext)):
 				try:
 					shutil.move(outtmpfile[1], os.path.join(tmpdir, filenamenoext))
+					outputpath = os.path.join(tmpdir, filenamenoext)
 				except Exception, e:
 					pass
 	else:
@@ -2595,9 +2729,16 @@ def unpackXZ(filename, offset, xzsize, template, dotest, tempdir=None):
 			if not os.path.exists(os.path.join(tmpdir, template)):
 				try:
 					shutil.move(outtmpfile[1], os.path.join(tmpdir, template))
+					outputpath = os.path.join(tmpdir, template)
 				except Exception, e:
 					pass
-	return tmpdir
+
+	## pass the hashes of the unpacked data to the scanning code, if
+	## they were computed while unpacking
+	xzhints = {}
+	if have_lzma:
+		xzhints[outputpath] = {'hashes': hashresults}
+	return (tmpdir, xzhints)
 
 ## Not sure how cpio works if we have a cpio archive within a cpio archive
 ## especially with regards to locating the proper cpio trailer.
@@ -2649,7 +2790,7 @@ def searchUnpackCpio(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 
 	if newcpiooffsets == []:
 		return ([], blacklist, newtags, hints)
-	datafile = open(filename, 'rb')
+	filesize = os.stat(filename).st_size
 	for offset in newcpiooffsets:
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
 		if blacklistoffset != None:
@@ -2660,17 +2801,18 @@ def searchUnpackCpio(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 			blacklistoffset = extractor.inblacklist(trailer, blacklist)
 			if blacklistoffset != None:
 				continue
-			datafile.seek(offset)
 			tmpdir = dirsetup(tempdir, filename, "cpio", counter)
 			## length of 'TRAILER!!!' plus 1 to include the whole trailer
 			## Also, cpio archives are always rounded to blocks of 512 bytes
-			data = datafile.read(trailer + 10 - offset)
-			trailercorrection = 512 - len(data)%512
-			data += datafile.read(trailercorrection)
+			cpiolength = min(trailer + 10 - offset, filesize - offset)
+			trailercorrection = 512 - cpiolength%512
+			cpiolength = min(cpiolength + trailercorrection, filesize - offset)
+			data = fileview.FileView(filename, offset, cpiolength)
 			res = unpackCpio(data, tmpdir)
+			data.close()
 			if res != None:
-				diroffsets.append((res, offset, len(data)))
-				if offset == 0 and len(data) == os.stat(filename).st_size:
+				diroffsets.append((res, offset, cpiolength))
+				if offset == 0 and cpiolength == filesize:
 					newtags.append('cpio')
 				blacklist.append((offset, trailer + 10 + trailercorrection))
 				counter = counter + 1
@@ -2680,23 +2822,21 @@ def searchUnpackCpio(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 			else:
 				## cleanup
 				os.rmdir(tmpdir)
-	datafile.close()
 	return (diroffsets, blacklist, newtags, hints)
 
 ## tries to unpack stuff using cpio. If it is successful, it will
 ## return a directory for further processing, otherwise it will return None.
 ## This one needs to stay separate, since it is also used by RPM unpacking
+## 'data' is either a string or a file view.
 def unpackCpio(data, tempdir=None):
 	tmpdir = unpacksetup(tempdir)
-	p = subprocess.Popen(['cpio', '-t'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=tmpdir)
-	(stanout, stanerr) = p.communicate(data)
-	if p.returncode != 0:
+	returncode = fileview.pipeView(data, ['cpio', '-t'], cwd=tmpdir)
+	if returncode != 0:
 		## we don't have a valid archive according to cpio -t
 		if tempdir == None:
 			os.rmdir(tmpdir)
 		return
-	p = subprocess.Popen(['cpio', '-i', '-d', '--no-absolute-filenames'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=tmpdir)
-	(stanout, stanerr) = p.communicate(data)
+	fileview.pipeView(data, ['cpio', '-i', '-d', '--no-absolute-filenames'], cwd=tmpdir)
 	return tmpdir
 
 def searchUnpackRomfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
@@ -2797,6 +2937,11 @@ def unpackRomfs(filename, offset, tempdir=None, unpacktempdir=None, blacklist=[]
 ## unpacking cramfs file systems. This will fail on file systems from some
 ## devices most notably from Sigma Designs, since they seem to have tweaked
 ## the file system.
+## layouts of the size and flags in the cramfs header and of the other 32 bit
+## fields, for big endian (True) and little endian (False) file systems
+cramfsheader = {True: fileview.layout('>II'), False: fileview.layout('<II')}
+cramfsword = {True: fileview.layout('>I'), False: fileview.layout('<I')}
+
 def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
 	hints = {}
 	if not 'cramfs_le' in offsets and not 'cramfs_be' in offsets:
@@ -2824,7 +2969,7 @@ def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 	else:
 		be_offsets = set(offsets['cramfs_be'])
 
-	cramfsfile = open(filename, 'rb')
+	cramfsview = fileview.getview(filename)
 	for offset in cramfsoffsets:
 		bigendian = False
 		if offset in be_offsets:
@@ -2832,22 +2977,14 @@ def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
 		if blacklistoffset != None:
 			continue
-		cramfsfile.seek(offset)
-		tmpbytes = cramfsfile.read(64)
-		if len(tmpbytes) != 64:
+		if offset + 64 > filesize:
 			break
-		if not tmpbytes[16:32] == "Compressed ROMFS":
+		if not cramfsview.readat(offset+16, 16) == "Compressed ROMFS":
 			continue
 
-		if bigendian:
-			cramfslen = struct.unpack('>I', tmpbytes[4:8])[0]
-		else:
-			cramfslen = struct.unpack('<I', tmpbytes[4:8])[0]
-
-		if bigendian:
-			cramfsversion = struct.unpack('>I', tmpbytes[8:12])[0] & 1
-		else:
-			cramfsversion = struct.unpack('<I', tmpbytes[8:12])[0] & 1
+		## size and flags
+		(cramfslen, cramfsflags) = cramfsview.unpack(cramfsheader[bigendian], offset+4)
+		cramfsversion = cramfsflags & 1
 
 		oldcramfs = False
 		## check if the length of the cramfslen field does not
@@ -2860,43 +2997,38 @@ def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 
 			## find out the amount of files, which includes the root inode
 			## as well
-			if bigendian:
-				amountoffiles = struct.unpack('>I', tmpbytes[44:48])[0]
-			else:
-				amountoffiles = struct.unpack('<I', tmpbytes[44:48])[0]
-			cramfsfile.seek(offset+64)
+			amountoffiles = cramfsview.value(cramfsword[bigendian], offset+44)
+			inodeoffset = offset+64
 
 			## Then walk the inodes. 6 bits are for the name length, the
 			## other 26 bits for the offset. Depending on whether or not the
 			## file system is big endian or little endian some tricks have to
 			## be performed to get the correct data out of the inode.
 			## first the root node
-			tmpbytes = cramfsfile.read(12)
-			if len(tmpbytes) != 12:
+			namelenoffset = cramfsview.value(cramfsword[bigendian], inodeoffset+8)
+			if namelenoffset == None:
 				continue
+			inodeoffset += 12
 			if bigendian:
-				namelenoffset = struct.unpack('>I', tmpbytes[8:12])[0]
 				namelength = (namelenoffset & 4227858432) >> 26
 				entryoffset = (namelenoffset & 67108863)
 			else:
-				namelenoffset = struct.unpack('<I', tmpbytes[8:12])[0]
 				namelength = namelenoffset & 63
 				entryoffset = (namelenoffset & 4294967232) >> 6
 				if entryoffset*4 > filesize - offset:
 					validcramfs = False
 					continue
-			for a in range(1,amountoffiles):
+			for a in xrange(1,amountoffiles):
 				## first read the data of a cramfs_inode
-				tmpbytes = cramfsfile.read(12)
-				if len(tmpbytes) != 12:
+				namelenoffset = cramfsview.value(cramfsword[bigendian], inodeoffset+8)
+				if namelenoffset == None:
 					validcramfs = False
 					break
+				inodeoffset += 12
 				if bigendian:
-					namelenoffset = struct.unpack('>I', tmpbytes[8:12])[0]
 					namelength = (namelenoffset & 4227858432) >> 26
 					entryoffset = (namelenoffset & 67108863)
 				else:
-					namelenoffset = struct.unpack('<I', tmpbytes[8:12])[0]
 					namelength = namelenoffset & 63
 					entryoffset = (namelenoffset & 4294967232) >> 6
 				if namelength == 0:
@@ -2906,11 +3038,10 @@ def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 					validcramfs = False
 					break
 				## followed by the file name
-				tmpbytes = cramfsfile.read(namelength*4)
-				if len(tmpbytes) != namelength*4:
+				if inodeoffset + namelength*4 > filesize:
 					validcramfs = False
 					break
-				filenameentry = tmpbytes.split('\x00', 1)[0]
+				inodeoffset += namelength*4
 		else:
 			oldcramfs = True
 			## this is an old cramfs version, so length
@@ -2934,7 +3065,7 @@ def searchUnpackCramfs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 		else:
 			## cleanup
 			os.rmdir(tmpdir)
-	cramfsfile.close()
+	cramfsview.close()
 	return (diroffsets, blacklist, newtags, hints)
 
 ## unpack a cramfs file system
@@ -3005,6 +3136,7 @@ def searchUnpackSquashfs(filename, tempdir=None, blacklist=[], offsets={}, scane
 
 	diroffsets = []
 	counter = 1
+	sqshview = fileview.getview(filename)
 	for offset in squashoffsets:
 		## check if the offset we find is in a blacklist
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
@@ -3020,34 +3152,25 @@ def searchUnpackSquashfs(filename, tempdir=None, blacklist=[], offsets={}, scane
 		## determine the size of the file for the blacklist. The size can sometimes be extracted
 		## from the header, but it depends on the endianness and the major version of squashfs
 		## used. In some of the cases this data might not be relevant.
-		sqshfile = open(filename, 'rb')
-		sqshfile.seek(offset)
-		sqshheader = sqshfile.read(4)
+		sqshheader = sqshview.readat(offset, 4)
 		bigendian = False
 		if sqshheader in ['sqsh', 'qshs', 'tqsh']:
 			bigendian = True
 		## get the version from the header
-		sqshfile.seek(offset+28)
-		versionbytes = sqshfile.read(2)
 		if bigendian:
-			majorversion = struct.unpack('>H', versionbytes)[0]
+			majorversion = sqshview.value('>H', offset+28)
 		else:
-			majorversion = struct.unpack('<H', versionbytes)[0]
+			majorversion = sqshview.value('<H', offset+28)
 
-		if majorversion > 5 or majorversion == 0:
+		if majorversion == None or majorversion > 5 or majorversion == 0:
 			continue
 
 		## first read the first 80 bytes from the file system to see if
 		## the string '7zip' can be found. If so, then the inodes have been
 		## compressed with a variant of squashfs that uses 7zip compression
 		## and might cause crashes in some of the variants below.
-		sqshfile = open(filename, 'rb')
-		sqshfile.seek(offset)
-		sqshbuffer = sqshfile.read(80)
-		sqshfile.close()
-
 		sevenzipcompression = False
-		if "7zip" in sqshbuffer:
+		if sqshview.find("7zip", offset, offset+80) != -1:
 			sevenzipcompression = True
 
 		tmpdir = dirsetup(tempdir, filename, "squashfs", counter)
@@ -3061,6 +3184,7 @@ def searchUnpackSquashfs(filename, tempdir=None, blacklist=[], offsets={}, scane
 		else:
 			## cleanup
 			os.rmdir(tmpdir)
+	sqshview.close()
 	## squashfs7 is different, we first need to rewrite the binary
 	## to replace the identifier 'sqlz' with 'sqsh', then we can unpack
 	## it with unsquashfsRealtekLZMA
@@ -3710,7 +3834,7 @@ def searchUnpackExt2fs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 		return ([], blacklist, [], hints)
 	if offsets['ext2'] == []:
 		return ([], blacklist, [], hints)
-	datafile = open(filename, 'rb')
+	ext2view = fileview.getview(filename)
 	diroffsets = []
 	counter = 1
 	newtags = []
@@ -3731,27 +3855,20 @@ def searchUnpackExt2fs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 			continue
 
 		## only revisions 0 and 1 have ever been made, so ignore the rest
-		datafile.seek(offset - 0x438 + 0x44c)
-		revisionbytes = datafile.read(4)
-		if len(revisionbytes) < 4:
-			continue
-		revision = struct.unpack('<I', revisionbytes)[0]
+		revision = ext2view.value('<I', offset - 0x438 + 0x44c)
 		if not (revision == 1 or revision == 0):
 			continue
 
 		## for a quick sanity check only a tiny bit of data is needed.
 		## Use tune2fs for this.
-		datafile.seek(offset - 0x438)
-		ext2checkdata = datafile.read(8192)
+		ext2checkdata = ext2view.readat(offset - 0x438, 8192)
 		if len(ext2checkdata) != 8192:
 			continue
 
 		## check for RO_COMPAT_SPARSE_SUPER
-		datafile.seek(offset - 0x438 + 0x464)
-		featureflagbytes = datafile.read(4)
-		if len(featureflagbytes) < 4:
+		featureflags = ext2view.value('<I', offset - 0x438 + 0x464)
+		if featureflags == None:
 			continue
-		featureflags = struct.unpack('<I', featureflagbytes)[0]
 		sparse_super = False
 		if featureflags & 0x01:
 			sparse_super = True
@@ -3778,11 +3895,9 @@ def searchUnpackExt2fs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 		os.unlink(tmpfile[1])
 
 		## blocks per group
-		datafile.seek(offset - 0x438 + 0x420)
-		ext2bytes = datafile.read(4)
-		if len(ext2bytes) < 4:
+		blockspergroup = ext2view.value('<I', offset - 0x438 + 0x420)
+		if blockspergroup == None:
 			continue
-		blockspergroup = struct.unpack('<I', ext2bytes)[0]
 
 		## sanity check: see if there are backup superblocks at
 		## the correct locations
@@ -3797,27 +3912,25 @@ def searchUnpackExt2fs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 				for p in [3,5,7]:
 					if pow(p, int(math.log(groupnumber, p))) == groupnumber:
 						if blocksize == 1024:
-							datafile.seek(offset - 0x438 + 0x400 + groupnumber*blocksize*blockspergroup)
+							superblockoffset = offset - 0x438 + 0x400 + groupnumber*blocksize*blockspergroup
 						else:
-							datafile.seek(offset - 0x438 + groupnumber*blocksize*blockspergroup)
-						ext2bytes = datafile.read(1024)
-						if len(ext2bytes) != 1024:
+							superblockoffset = offset - 0x438 + groupnumber*blocksize*blockspergroup
+						if superblockoffset + 1024 > filesize:
 							validext2 = False
 							break
-						if ext2bytes[0x38:0x3a] != '\x53\xef':
+						if ext2view.readat(superblockoffset + 0x38, 2) != '\x53\xef':
 							validext2 = False
 							break
 						break
 			else:
 				if blocksize == 1024:
-					datafile.seek(offset - 0x438 + 0x400 + groupnumber*blocksize*blockspergroup)
+					superblockoffset = offset - 0x438 + 0x400 + groupnumber*blocksize*blockspergroup
 				else:
-					datafile.seek(offset - 0x438 + groupnumber*blocksize*blockspergroup)
-				ext2bytes = datafile.read(1024)
-				if len(ext2bytes) != 1024:
+					superblockoffset = offset - 0x438 + groupnumber*blocksize*blockspergroup
+				if superblockoffset + 1024 > filesize:
 					validext2 = False
 					break
-				if ext2bytes[0x38:0x3a] != '\x53\xef':
+				if ext2view.readat(superblockoffset + 0x38, 2) != '\x53\xef':
 					validext2 = False
 					break
 		if not validext2:
@@ -3840,7 +3953,7 @@ def searchUnpackExt2fs(filename, tempdir=None, blacklist=[], offsets={}, scanenv
 				newtags.append('filesystem')
 		else:
 			os.rmdir(tmpdir)
-	datafile.close()
+	ext2view.close()
 	return (diroffsets, blacklist, newtags, hints)
 
 ## Unpack an ext2 file system using e2tools and some custom written code from BAT's own ext2 module
@@ -4023,85 +4136,43 @@ def searchUnpackGzip(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 			gzipfile.close()
 			continue
 
+		gzipfile.close()
+
 		## Because gzip is a header followed by deflate data it is
 		## possible to do some sanity checking by first decompressing
-		## some data.
-		## try to uncompress raw deflate data, first one block of
-		## a bit less than 10 meg
+		## some data. Only if that succeeds the rest of the raw deflate
+		## data is decompressed, directly to the output file.
 		## http://www.zlib.net/manual.html#Advanced
-		gzipfile.seek(localoffset)
-		readsize = 10000000
-		deflatedata = gzipfile.read(readsize)
+		gzipview = fileview.FileView(filename, localoffset)
 		deflateobj = zlib.decompressobj(-zlib.MAX_WBITS)
-		deflatesize = 0
-		try:
-			uncompresseddata = deflateobj.decompress(deflatedata)
-			## check if there is some uncompressed data left. For a completely
-			## uncompressed ## file there should be some data left (8 bytes, namely
-			## CRC32 and file size). If there is no data left, then it means that
-			## decompression is not yet complete.
-			if deflateobj.unused_data != "":
-				deflatesize = len(deflatedata) - len(deflateobj.unused_data)
-		except:
-			gzipfile.close()
+		uncompresseddata = probeStream(gzipview, deflateobj)
+		if uncompresseddata == None:
+			gzipview.close()
 			continue
 
 		tmpdir = dirsetup(tempdir, filename, "gzip", counter)
 		tmpfile = tempfile.mkstemp(dir=tmpdir)
-		os.fdopen(tmpfile[0]).close()
+		outgzipfile = os.fdopen(tmpfile[0], 'wb')
+		(deflatesize, uncompressedsize, crc32, complete, unpackfailure, hashresults) = streamDecompress(gzipview, deflateobj, outgzipfile, uncompresseddata)
 
-		outgzipfile = open(tmpfile[1], 'wb')
-		outgzipfile.write(uncompresseddata)
-		outgzipfile.flush()
-		## The size of the *raw* deflate data is gzipsize,
+		## The size of the *raw* deflate data is deflatesize,
 		## followed by the crc32 of the uncompresed data
 		## and the size
-		unpackfailure = False
-		if deflatesize == 0:
-			while deflateobj.unused_data == "":
-				localoffset += readsize
-				deflatedata = gzipfile.read(readsize)
-				if deflatedata == '':
-					break
-				try:
-					uncompresseddata = deflateobj.decompress(deflatedata)
-					outgzipfile.write(uncompresseddata)
-					outgzipfile.flush()
-				except:
-					## something weird is going on
-					unpackfailure = True
-					break
-			deflatesize = len(deflatedata) - len(deflateobj.unused_data)
-		deflateobj.flush()
-		outgzipfile.close()
+		gzipcrc32andsize = gzipview[deflatesize:deflatesize+8]
+		gzipview.close()
 
-		if unpackfailure:
-			gzipfile.close()
+		if unpackfailure or not complete or len(gzipcrc32andsize) != 8:
 			os.unlink(tmpfile[1])
 			os.rmdir(tmpdir)
 			continue
 
 		## The trailer of a valid gzip file is the CRC32 followed by file
 		## size of uncompressed data
-		crc32 = gzipcrc32(tmpfile[1])
-
-		gzipfile.seek(localoffset + deflatesize)
-		gzipcrc32andsize = gzipfile.read(8)
-
-		if len(gzipcrc32andsize) != 8:
-			gzipfile.close()
-			os.unlink(tmpfile[1])
-			os.rmdir(tmpdir)
-			continue
-
 		if gzipcrc32andsize[0:4] != struct.pack('<I', crc32):
-			gzipfile.close()
 			os.unlink(tmpfile[1])
 			os.rmdir(tmpdir)
 			continue
-		filesize = os.stat(tmpfile[1]).st_size % pow(2,32)
-		if gzipcrc32andsize[4:8] != struct.pack('<I', filesize):
-			gzipfile.close()
+		if gzipcrc32andsize[4:8] != struct.pack('<I', uncompressedsize % pow(2,32)):
 			os.unlink(tmpfile[1])
 			os.rmdir(tmpdir)
 			continue
@@ -4113,11 +4184,13 @@ def searchUnpackGzip(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 		diroffsets.append((tmpdir, offset, gzipsize))
 		blacklist.append((offset, offset + gzipsize))
 		counter = counter + 1
+		outputpath = tmpfile[1]
 		if hasnameset and renamename != None:
 			mvname = os.path.basename(renamename)
 			if not os.path.exists(os.path.join(tmpdir, mvname)):
 				try:
 					shutil.move(tmpfile[1], os.path.join(tmpdir, mvname))
+					outputpath = os.path.join(tmpdir, mvname)
 				except Exception, e:
 					## if there is an exception don't rename
 					pass
@@ -4139,13 +4212,16 @@ def searchUnpackGzip(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 						gzpath = os.path.join(tmpdir, filenamenoext)
 						if not os.path.exists(gzpath):
 							shutil.move(tmpfile[1], gzpath)
+							outputpath = gzpath
 				elif filename.lower().endswith('.tgz'):
 					filenamenoext = os.path.basename(filename)[:-4] + ".tar"
 					if len(filenamenoext) > 4:
 						gzpath = os.path.join(tmpdir, filenamenoext)
 						if not os.path.exists(gzpath):
 							shutil.move(tmpfile[1], gzpath)
-		gzipfile.close()
+							outputpath = gzpath
+		## pass the hashes of the unpacked data to the scanning code
+		hints[outputpath] = {'hashes': hashresults}
 
 	return (diroffsets, blacklist, newtags, hints)
 
@@ -4289,7 +4365,6 @@ def searchUnpackBzip2(filename, tempdir=None, blacklist=[], offsets={}, scanenv=
 	diroffsets = []
 	counter = 1
 	newtags = []
-	bzip2datasize = 10000000
 	for offset in offsets['bz2']:
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
 		if blacklistoffset != None:
@@ -4328,114 +4403,53 @@ def searchUnpackBzip2(filename, tempdir=None, blacklist=[], offsets={}, scanenv=
 			if blockbytes[5] != '\x59':
 				continue
 
-		## extra sanity check: try to uncompress a few blocks of data
-		bzfile = open(filename, 'rb')
-		bzfile.seek(offset)
-		bzip2data = bzfile.read(bzip2datasize)
-		bzfile.close()
+		## extra sanity check: try to uncompress some data. Only if that
+		## succeeds the rest of the data is decompressed, directly to the
+		## output file.
+		bzip2view = fileview.FileView(filename, offset)
 		bzip2decompressobj = bz2.BZ2Decompressor()
-		bzip2size = 0
-		try:
-			uncompresseddata = bzip2decompressobj.decompress(bzip2data)
-		except Exception, e:
+		uncompresseddata = probeStream(bzip2view, bzip2decompressobj)
+		if uncompresseddata == None:
+			bzip2view.close()
 			continue
-		if bzip2decompressobj.unused_data != "":
-			bzip2size = len(bzip2data) - len(bzip2decompressobj.unused_data)
-		else:
-			if len(uncompresseddata) != 0:
-				if len(bzip2data) == os.stat(filename).st_size:
-					bzip2size = len(bzip2data)
 
 		tmpdir = dirsetup(tempdir, filename, "bzip2", counter)
-		if bzip2size != 0:
-			tmpfile = tempfile.mkstemp(dir=tmpdir)
-			os.fdopen(tmpfile[0]).close()
-
-			outbzip2file = open(tmpfile[1], 'wb')
-			outbzip2file.write(uncompresseddata)
-			outbzip2file.flush()
-			outbzip2file.close()
-			diroffsets.append((tmpdir, offset, bzip2size))
-			blacklist.append((offset, offset + bzip2size))
-			if offset == 0 and (bzip2size == os.stat(filename).st_size):
-				## rename the file, like bunzip does
-				if filename.lower().endswith('.bz2'):
-					filenamenoext = os.path.basename(filename)[:-4]
-					if len(filenamenoext) > 0:
-						bz2path = os.path.join(tmpdir, filenamenoext)
-						if not os.path.exists(bz2path):
-							shutil.move(tmpfile[1], bz2path)
-				## slightly different for tbz2
-				elif filename.lower().endswith('.tbz2'):
-					filenamenoext = os.path.basename(filename)[:-5] + ".tar"
-					if len(filenamenoext) > 4:
-						bz2path = os.path.join(tmpdir, filenamenoext)
-						if not os.path.exists(bz2path):
-							shutil.move(tmpfile[1], bz2path)
-				newtags.append('compressed')
-				newtags.append('bzip2')
-			counter = counter + 1
-		else:
-			## try to load more data into the bzip2 decompression object
-			localoffset = offset + bzip2datasize
-			bzfile = open(filename, 'rb')
-			bzfile.seek(localoffset)
-			bzip2data = bzfile.read(bzip2datasize)
-			unpackingerror = False
-			bytesread = bzip2datasize
-			unpackedbytessize = len(uncompresseddata)
-
-			tmpfile = tempfile.mkstemp(dir=tmpdir)
-			os.fdopen(tmpfile[0]).close()
+		tmpfile = tempfile.mkstemp(dir=tmpdir)
+		outbzip2file = os.fdopen(tmpfile[0], 'wb')
+		(bzip2size, unpackedbytessize, crc32, complete, unpackingerror, hashresults) = streamDecompress(bzip2view, bzip2decompressobj, outbzip2file, uncompresseddata)
+		bzip2view.close()
 
-			outbzip2file = open(tmpfile[1], 'wb')
-			outbzip2file.write(uncompresseddata)
-			outbzip2file.flush()
-			while bzip2data != "":
-				try:
-					uncompresseddata = bzip2decompressobj.decompress(bzip2data)
-					outbzip2file.write(uncompresseddata)
-					outbzip2file.flush()
-					unpackedbytessize += len(uncompresseddata)
-				except Exception, e:
-					unpackingerror = True
-					break
+		if unpackingerror or unpackedbytessize == 0:
+			## cleanup
+			os.unlink(tmpfile[1])
+			os.rmdir(tmpdir)
+			continue
 
-				## end of the bzip2 compressed data is reached
-				if bzip2decompressobj.unused_data != "":
-					bytesread += len(bzip2data) - len(bzip2decompressobj.unused_data)
-					break
-				bytesread += len(bzip2data)
-				bzip2data = bzfile.read(bzip2datasize)
-			bzfile.close()
-			outbzip2file.close()
-			if unpackingerror:
-				## cleanup
-				os.unlink(tmpfile[1])
-				os.rmdir(tmpdir)
-			if unpackedbytessize != 0:
-				diroffsets.append((tmpdir, offset, bytesread))
-				blacklist.append((offset, offset + bytesread))
-				if offset == 0 and (bytesread == os.stat(filename).st_size):
-					## rename the file, like bunzip does
-					if filename.lower().endswith('.bz2'):
-						filenamenoext = os.path.basename(filename)[:-4]
-						bz2path = os.path.join(tmpdir, filenamenoext)
-						if not os.path.exists(bz2path):
-							shutil.move(tmpfile[1], bz2path)
-					## slightly different for tbz2
-					elif filename.lower().endswith('.tbz2'):
-						filenamenoext = os.path.basename(filename)[:-5] + ".tar"
-						bz2path = os.path.join(tmpdir, filenamenoext)
-						if not os.path.exists(bz2path):
-							shutil.move(tmpfile[1], bz2path)
-					newtags.append('compressed')
-					newtags.append('bzip2')
-				counter = counter + 1
-			else:
-				## cleanup
-				os.unlink(tmpfile[1])
-				os.rmdir(tmpdir)
+		diroffsets.append((tmpdir, offset, bzip2size))
+		blacklist.append((offset, offset + bzip2size))
+		outputpath = tmpfile[1]
+		if offset == 0 and (bzip2size == os.stat(filename).st_size):
+			## rename the file, like bunzip does
+			if filename.lower().endswith('.bz2'):
+				filenamenoext = os.path.basename(filename)[:-4]
+				if len(filenamenoext) > 0:
+					bz2path = os.path.join(tmpdir, filenamenoext)
+					if not os.path.exists(bz2path):
+						shutil.move(tmpfile[1], bz2path)
+						outputpath = bz2path
+			## slightly different for tbz2
+			elif filename.lower().endswith('.tbz2'):
+				filenamenoext = os.path.basename(filename)[:-5] + ".tar"
+				if len(filenamenoext) > 4:
+					bz2path = os.path.join(tmpdir, filenamenoext)
+					if not os.path.exists(bz2path):
+						shutil.move(tmpfile[1], bz2path)
+						outputpath = bz2path
+			newtags.append('compressed')
+			newtags.append('bzip2')
+		## pass the hashes of the unpacked data to the scanning code
+		hints[outputpath] = {'hashes': hashresults}
+		counter = counter + 1
 	return (diroffsets, blacklist, newtags, hints)
 
 def searchUnpackRZIP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
@@ -4944,39 +4958,22 @@ def unpackLRZIP(filename, offset, hasmd5, lrzipmd5, lrzipsize, tempdir=None):
 
 	return (tmpdir, md5match, os.stat(filename).st_size)
 
-def unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, memorycutoff, tempdir=None):
+def unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, tempdir=None):
 	filesize = os.stat(filename).st_size
 
 	inmemory = False
-	havetmpfile = False
 	if offset != 0 or cutoff != filesize:
 		inmemory = True
 
 	tmpdir = unpacksetup(tempdir)
 
 	ziplen = cutoff - offset
-	## process everything in memory if the size of the ZIP file is below
-	## a certain threshold and is not a complete ZIP file (in which case
-	## using 'unzip' might be faster).
+	## ZIP files that are not a complete file are processed using a view
+	## on the data in the parent file, so there is no need to carve them.
 	if not inmemory:
 		memfile = filename
 	else:
-		if ziplen < memorycutoff:
-			openzipfile = open(filename, 'rb')
-			openzipfile.seek(offset)
-			zipdata = openzipfile.read(ziplen)
-			openzipfile.close()
-			memfile = StringIO.StringIO(zipdata)
-		else:
-			tmpfile = tempfile.mkstemp(dir=tempdir)
-			os.fdopen(tmpfile[0]).close()
-
-			if cutoff != 0:
-				unpackFile(filename, offset, tmpfile[1], tmpdir, length=ziplen)
-			else:
-				unpackFile(filename, offset, tmpfile[1], tmpdir)
-			havetmpfile = True
-			memfile = tmpfile[1]
+		memfile = fileview.FileView(filename, offset, ziplen)
 	try:
 		memzipfile = zipfile.ZipFile(memfile, 'r')
 		infolist = memzipfile.infolist()
@@ -4996,35 +4993,24 @@ def unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, memorycuto
 				## data is encrypted
 				memzipfile.close()
 				if inmemory:
-					if not havetmpfile:
-						memfile.close()
-					if not havetmpfile:
-						## write out the data if it is not already there
-						tmpdir = unpacksetup(tempdir)
-						tmpfile = tempfile.mkstemp(dir=tempdir)
-						os.fdopen(tmpfile[0]).close()
-
-						datafile = open(tmpfile[1], 'wb')
-						datafile.write(zipdata)
-						datafile.close()
+					memfile.close()
+					## write out the data, as it cannot be unpacked
+					tmpdir = unpacksetup(tempdir)
+					tmpfile = tempfile.mkstemp(dir=tempdir)
+					os.fdopen(tmpfile[0]).close()
+					unpackFile(filename, offset, tmpfile[1], tmpdir, length=ziplen)
 
 				return (tmpdir, ['encrypted'])
-		if not havetmpfile:
-			tmpdir = unpacksetup(tempdir)
+		tmpdir = unpacksetup(tempdir)
 		for i in infolist:
 			if weirdzip and i.filename in weirdzipnames:
 				os.mkdir(os.path.join(tmpdir, i.filename))
 			else:
 				memzipfile.extract(i, tmpdir)
 		memzipfile.close()
-		if havetmpfile:
-			os.unlink(tmpfile[1])
 	except Exception, e:
 		if inmemory:
-			if havetmpfile:
-				os.unlink(tmpfile[1])
-			else:
-				memfile.close()
+			memfile.close()
 		for i in os.listdir(tmpdir):
 			try:
 				os.unlink(os.path.join(tmpdir, i))
@@ -5033,8 +5019,7 @@ def unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, memorycuto
 				shutil.rmtree(os.path.join(tmpdir, i))
 		return (None, [])
 	if inmemory:
-		if not havetmpfile:
-			memfile.close()
+		memfile.close()
 	return (tmpdir, [])
 
 def searchUnpackKnownZip(filename, tempdir=None, scanenv={}, debug=False):
@@ -5100,12 +5085,6 @@ def searchUnpackZip(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	counter = 1
 	filesize = os.stat(filename).st_size
 
-	## read the parameter for the maximum file size that should be read into
-	## memory from the configuration. Default: 50 million bytes.
-	try:
-		memorycutoff = int(scanenv.get('ZIP_MEMORY_CUTOFF', 50000000))
-	except:
-		memorycutoff = 50000000
 	zipfile = open(filename, 'rb')
 
 	zipends = []
@@ -5218,7 +5197,7 @@ def searchUnpackZip(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 
 			tmpdir = dirsetup(tempdir, filename, "zip", counter)
 			endofcentraldir = zipend - offset
-			(res, tmptags) = unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, memorycutoff, tmpdir)
+			(res, tmptags) = unpackZip(filename, offset, cutoff, endofcentraldir, commentsize, tmpdir)
 			if res != None:
 				blacklist.append((offset, zipend + 22 + commentsize))
 				if offset == 0 and zipend + commentsize + 22 == filesize:
@@ -5479,6 +5458,75 @@ def searchUnpackLZMA(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 				continue
 			lzmasizeknown = True
 
+		if have_lzma:
+			## decompress in process from a view on the parent file, up
+			## to the next blacklisted area. Most false positives are
+			## rejected after decompressing only a little bit of data.
+			lzmalength = 0
+			lowest = extractor.lowestnextblacklist(offset, blacklist)
+			if lowest != 0:
+				lzmalength = lowest - offset
+			lzmaview = fileview.FileView(filename, offset, lzmalength)
+			lzmadecompressobj = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+			uncompresseddata = probeStream(lzmaview, lzmadecompressobj)
+
+			## if no data can be decompressed at all, it is not a
+			## valid LZMA stream
+			if uncompresseddata == None or (uncompresseddata == '' and not streamEnded(lzmadecompressobj)):
+				lzmaview.close()
+				continue
+
+			tmpdir = dirsetup(tempdir, filename, "lzma", counter)
+			tmpfile = tempfile.mkstemp(dir=tmpdir)
+			outlzmafile = os.fdopen(tmpfile[0], 'wb')
+			(lzmasize, uncompressedsize, crc32, complete, unpackingerror, hashresults) = streamDecompress(lzmaview, lzmadecompressobj, outlzmafile, uncompresseddata)
+			lzmaview.close()
+
+			validlzma = True
+			if lzmasizeknown:
+				## the size of the uncompressed data is recorded in the
+				## header and should match. Streams where the end is
+				## missing are kept if all data could be unpacked.
+				if uncompressedsize != struct.unpack('<Q', lzmasizebytes)[0]:
+					validlzma = False
+			elif uncompressedsize < lzmalimit:
+				validlzma = False
+			elif not complete and uncompressedsize < 1000:
+				## If there is a very big difference (thousandfold) between
+				## the unpacked data and the data that was read it is a
+				## false positive for sure
+				if uncompressedsize == 0 or lzmasize/uncompressedsize > 1000:
+					validlzma = False
+			if not validlzma:
+				os.unlink(tmpfile[1])
+				os.rmdir(tmpdir)
+				continue
+
+			outputpath = tmpfile[1]
+			if template != None:
+				mvpath = os.path.join(tmpdir, template)
+				if not os.path.exists(mvpath):
+					try:
+						shutil.move(tmpfile[1], mvpath)
+						outputpath = mvpath
+					except Exception, e:
+						pass
+			## pass the hashes of the unpacked data to the scanning code
+			hints[outputpath] = {'hashes': hashresults}
+			if complete:
+				diroffsets.append((tmpdir, offset, lzmasize))
+				if offset == 0 and lzmasize == filesize:
+					newtags.append('compressed')
+					newtags.append('lzma')
+			else:
+				diroffsets.append((tmpdir, offset, 0))
+			## the end of an incomplete stream with a known size is
+			## not known, so nothing is blacklisted for it
+			if complete or not lzmasizeknown:
+				blacklist.append((offset, offset+lzmasize))
+			counter += 1
+			continue
+
 		## either read all bytes that are left in the file or a minimum
 		## amount of bytes, whichever is the smallest
 		minlzmadatatoread = 10000000
@@ -5589,22 +5637,24 @@ def unpackLZMA(filename, offset, template, tempdir=None, minbytesize=1, lzma_tmp
 
 	## if UNPACK_TEMPDIR is set to for example a ramdisk use that instead.
 	if lzma_tmpdir != None:
-		tmpfile = tempfile.mkstemp(dir=lzma_tmpdir)
-		os.fdopen(tmpfile[0]).close()
 		outtmpfile = tempfile.mkstemp(dir=lzma_tmpdir)
-		unpackFile(filename, offset, tmpfile[1], lzma_tmpdir, blacklist=blacklist)
 	else:
-		tmpfile = tempfile.mkstemp(dir=tmpdir)
-		os.fdopen(tmpfile[0]).close()
 		outtmpfile = tempfile.mkstemp(dir=tmpdir)
-		unpackFile(filename, offset, tmpfile[1], tmpdir, blacklist=blacklist)
-	p = subprocess.Popen(['lzma', '-cd', tmpfile[1]], stdout=outtmpfile[0], stderr=subprocess.PIPE, close_fds=True)
-	(stanout, stanerr) = p.communicate()
+
+	## the data is not carved, but sent to lzma from a view on the
+	## parent file. Like unpackFile() stop at the next blacklisted area.
+	lzmalength = 0
+	if blacklist != []:
+		lowest = extractor.lowestnextblacklist(offset, blacklist)
+		if lowest != 0:
+			lzmalength = lowest - offset
+	lzmaview = fileview.FileView(filename, offset, lzmalength)
+	returncode = fileview.pipeView(lzmaview, ['lzma', '-cd'], stdout=outtmpfile[0])
+	lzmaview.close()
 	wholefile = False
-	if p.returncode == 0:
+	if returncode == 0:
 		wholefile = True
 	os.fdopen(outtmpfile[0]).close()
-	os.unlink(tmpfile[1])
 
 	## sanity checks if the size is set
 	lzmafile = open(filename, 'rb')
@@ -5825,24 +5875,24 @@ def searchUnpackIco(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		return (diroffsets, blacklist, [], hints)
 
 	## now check how many images there are in the file
-	icofile = open(filename, 'rb')
-	icofile.seek(4)
-	icobytes = icofile.read(2)
-	icocount = struct.unpack('<H', icobytes)[0]
+	icoview = fileview.getview(filename)
+	icocount = icoview.value('<H', 4)
+	if icocount == None:
+		icoview.close()
+		return (diroffsets, blacklist, [], hints)
 
 	## the ICO format first has all the headers, then the image data
 	for i in xrange(0,icocount):
-		tmpdir = dirsetup(tempdir, filename, "ico", counter)
-		icoheader = icofile.read(16)
 		## grab the size of the icon, plus the offset where it can
 		## be found in the file
-		icosize = struct.unpack('<I', icoheader[8:12])[0]
-		icooffset = struct.unpack('<I', icoheader[12:16])[0]
+		icoheader = icoview.unpack(prerun.icoentry, 6 + i*16)
+		if icoheader == None:
+			break
+		(icosize, icooffset) = icoheader[-2:]
+		tmpdir = dirsetup(tempdir, filename, "ico", counter)
 
 		ispng = False
-		oldoffset = icofile.tell()
-		icofile.seek(icooffset)
-		icobytes = icofile.read(icosize)
+		icobytes = icoview.readat(icooffset, icosize)
 		if len(icobytes) > 45:
 			if icobytes[:8] == fsmagic.fsmagic['png']:
 				ispng = True
@@ -5887,11 +5937,10 @@ def searchUnpackIco(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		icooutput.write(icobytes)
 		icooutput.close()
 		
-		icofile.seek(oldoffset)
 		counter += 1
 		diroffsets.append((tmpdir, icooffset, icosize))
 	
-	icofile.close()
+	icoview.close()
 
 	return (diroffsets, blacklist, [], hints)
 
@@ -6148,6 +6197,9 @@ def unpackPDF(filename, offset, trailer, tempdir=None):
 		size = os.stat(tmpfile[1]).st_size
 		return (tmpdir, size)
 
+## layout of the size and pixel data offset in the BMP file header
+bmpfileheader = fileview.layout('<I4xI')
+
 def searchUnpackBMP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
 	hints = {}
 	if not 'bmp' in offsets:
@@ -6159,33 +6211,29 @@ def searchUnpackBMP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	newtags = []
 	counter = 1
 
-	datafile = open(filename, 'rb')
+	bmpview = fileview.getview(filename)
 
 	for offset in offsets['bmp']:
 		## first check if the offset is not blacklisted
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
 		if blacklistoffset != None:
 			continue
-		datafile.seek(offset+2)
-		sizebytes = datafile.read(4)
-		if len(sizebytes) != 4:
+		## the size of the file, 4 bytes for reserved fields
+		## and the offset of the pixel data
+		bmpheader = bmpview.unpack(bmpfileheader, offset+2)
+		if bmpheader == None:
 			break
-		bmpsize = struct.unpack('<I', sizebytes)[0]
+		(bmpsize, bmpoffset) = bmpheader
 		if bmpsize + offset > filesize:
 			break
-		## read 8 bytes more data. The first 4 bytes are for
-		## reserved fields, the last 
-		bmpdata = datafile.read(8)
-		bmpoffset = struct.unpack('<I', bmpdata[4:])[0]
 		if bmpoffset + offset > filesize:
 			break
-		## offset for BMP cannot be less than the current
-		## file pointer
-		if bmpoffset + offset < datafile.tell():
+		## offset for BMP cannot be less than the end
+		## of the header
+		if bmpoffset < 14:
 			break
-		## reset the file pointer and read all needed data
-		datafile.seek(offset)
-		bmpdata = datafile.read(bmpsize)
+		## read all needed data
+		bmpdata = bmpview.readat(offset, bmpsize)
 		if len(bmpdata) != bmpsize:
 			break
 		p = subprocess.Popen(['bmptopnm'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -6196,7 +6244,7 @@ def searchUnpackBMP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		## image here, so why bother?
 		if offset == 0 and bmpsize == filesize:
 			blacklist.append((0,bmpsize))
-			datafile.close()
+			bmpview.close()
 			return (diroffsets, blacklist, ['graphics', 'bmp', 'binary'], hints)
 
 		## not the whole file, so carve
@@ -6211,7 +6259,7 @@ def searchUnpackBMP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		blacklist.append((offset,offset + bmpsize))
 		diroffsets.append((tmpdir, offset, bmpsize))
 		counter = counter + 1
-	datafile.close()
+	bmpview.close()
 
 	return (diroffsets, blacklist, newtags, hints)
 
@@ -6226,6 +6274,10 @@ def searchUnpackBMP(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 ## valid GIF file has been carved out (part of the file, or
 ## the whole file), or stop if no valid GIF file can be found.
 ## TODO: remove call to gifinfo after running more tests
+## layout of the logical screen descriptor (after the GIF header): width,
+## height and packed fields
+gifscreendescriptor = fileview.layout('<HHB')
+
 def searchUnpackGIF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
 	hints = {}
 	newtags = []
@@ -6264,8 +6316,9 @@ def searchUnpackGIF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	brokenxmpmagic2 = "".join(brokenxmpmagicheaderbytes2)
 	brokenxmpheaders.append(brokenxmpmagic2)
 
-	datafile = open(filename, 'rb')
-	filesize = os.stat(filename).st_size
+	## the view is read like a file, but without any system calls
+	datafile = fileview.getview(filename)
+	filesize = len(datafile)
 	for i in range(0,len(gifoffsets)):
 		offset = gifoffsets[i]
 		## first check if the header is not blacklisted
@@ -6273,23 +6326,17 @@ def searchUnpackGIF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		if blacklistoffset != None:
 			continue
 
-		localoffset = offset
-
-		## sanity check for the logical screen descriptor
-		datafile.seek(offset+6)
-		localoffset += 6
-		## first logical screen width
-		databytes = datafile.read(2)
-		localoffset += 2
-		logicalwidth = struct.unpack('<H', databytes)[0]
+		## sanity check for the logical screen descriptor: first the
+		## logical screen width, then the logical screen height
+		screendescriptor = datafile.unpack(gifscreendescriptor, offset+6)
+		if screendescriptor == None:
+			continue
+		(logicalwidth, logicalheight, packedfields) = screendescriptor
 		if logicalwidth == 0:
 			continue
-		## then the logical screen height
-		databytes = datafile.read(2)
-		logicalheight = struct.unpack('<H', databytes)[0]
 		if logicalheight == 0:
 			continue
-		localoffset += 2
+		localoffset = offset + 11
 
 		## Then check to see if there is an image control block (for a valid
 		## GIF stream with actual image content there has to be at least one
@@ -6297,11 +6344,9 @@ def searchUnpackGIF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		## of information in between the logical screen descriptor and the first
 		## information control block, such as a global color table and XMP
 		## extensions or other application specific extensions.
-		packedfields = datafile.read(1)
-		localoffset += 1
 		globalcolortablesize = 0
-		if (ord(packedfields) >> 7 & 1) == 1:
-			globalcolortablesize = pow(2,(ord(packedfields)%8) + 1) * 3
+		if (packedfields >> 7 & 1) == 1:
+			globalcolortablesize = pow(2,(packedfields%8) + 1) * 3
 		localoffset += 2
 		localoffset += globalcolortablesize
 		databytes = datafile.seek(localoffset)
@@ -6484,18 +6529,13 @@ def searchUnpackGIF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 
 def searchUnpackKnownPNG(filename, tempdir=None, scanenv={}, debug=False):
 	## first check if the file actually could be a valid png file
-	pngfile = open(filename, 'rb')
-	pngfile.seek(0)
-	pngheader = pngfile.read(8)
-	pngfile.close()
+	pngview = fileview.getview(filename)
+	pngheader = pngview.readat(0, 8)
+	lendata = len(pngview)
+	pngtrailer = pngview.readat(lendata - 12, 12)
+	pngview.close()
 	if pngheader != fsmagic.fsmagic['png']:
 		return ([], [], [], {})
-
-	lendata = os.stat(filename).st_size
-	pngfile = open(filename, 'rb')
-	pngfile.seek(lendata - 12)
-	pngtrailer = pngfile.read(12)
-	pngfile.close()
 	if pngtrailer != fsmagic.fsmagic['pngtrailer']:
 		return ([], [], [], {})
 	## only check files smaller than or equal to 10 MiB for now
@@ -6530,6 +6570,9 @@ def searchUnpackKnownPNG(filename, tempdir=None, scanenv={}, debug=False):
 			return (diroffsets, blacklist, newtags, hints)
 	return ([], [], [], {})
 
+## layout of the header of a PNG chunk: size and type
+pngchunkheader = fileview.layout('>I4s')
+
 ## PNG extraction is similar to GIF extraction, except there is a way better
 ## defined trailer.
 def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}, debug=False):
@@ -6551,7 +6594,7 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	headeroffsets = offsets['png']
 	traileroffsets = deque(offsets['pngtrailer'])
 	counter = 1
-	datafile = open(filename, 'rb')
+	pngview = fileview.getview(filename)
 	orig_offset = headeroffsets[0]
 	lenheaderoffsets = len(headeroffsets)
 
@@ -6568,22 +6611,13 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		if blacklistoffset != None:
 			continue
 
-		datafile.seek(offset)
-
 		## some sanity checks. According to http://www.w3.org/TR/PNG/
 		## the first chunk in a PNG following the PNG signature is always IHDR.
 		## The PNG signature is 8 bytes
-		datafile.seek(offset+8)
-		chunkbytes = datafile.read(4)
 		## IHDR chunk size is always 13 bytes
-		#chunksize = struct.unpack('>I', chunkbytes)[0]
-		if chunkbytes != '\x00\x00\x00\x0d':
-			continue
-		chunkbytes = datafile.read(4)
-		if chunkbytes != 'IHDR':
+		if pngview.readat(offset+8, 8) != '\x00\x00\x00\x0dIHDR':
 			continue
 
-		datafile.seek(offset)
 		for r in xrange(0, trailerpopcounter):
 			traileroffsets.popleft()
 
@@ -6610,14 +6644,12 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 			localoffset = offset + 8
 			trailerseen = False
 			while localoffset <= trail and not trailerseen:
-				datafile.seek(localoffset)
-				pngbytes = datafile.read(8)
-				if len(pngbytes) != 8:
+				chunkheader = pngview.unpack(pngchunkheader, localoffset)
+				if chunkheader == None:
 					break
 				localoffset += 8
 
-				chunksize = struct.unpack('>I', pngbytes[:4])[0]
-				chunktype = pngbytes[4:]
+				(chunksize, chunktype) = chunkheader
 				## TODO: extract XMP data
 				if chunktype == 'IEND':
 					## trailer reached
@@ -6634,17 +6666,14 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 			localoffset = offset + 8
 			crccorrect = True
 			while localoffset <= trail:
-				datafile.seek(localoffset)
-
 				## grab the size
-				pngbytes = datafile.read(4)
+				chunksize = pngview.value('>I', localoffset)
 				localoffset += 4
 
-				chunksize = struct.unpack('>I', pngbytes)[0]
-				databytes = datafile.read(chunksize + 4)
-				pngcrc = datafile.read(4)
+				databytes = pngview.readat(localoffset, chunksize + 4)
+				pngcrc = pngview.value('>I', localoffset + chunksize + 4)
 				computedcrc = binascii.crc32(databytes) & 0xffffffff
-				if pngcrc != struct.pack('>I', computedcrc):
+				if pngcrc != computedcrc:
 					crccorrect = False
 					break
 				## now add the length to the localoffset, plus add four
@@ -6660,13 +6689,12 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 			if offset == 0 and trail == lendata - 12:
 				os.rmdir(tmpdir)
 				blacklist.append((0,lendata))
-				datafile.close()
+				pngview.close()
 				return (diroffsets, blacklist, ['graphics', 'png', 'binary'], hints)
 
 			## carve the image data from the file and write it to disk
-			datafile.seek(offset)
 			pngsize = trail+12-offset
-			data = datafile.read(pngsize)
+			data = pngview.readat(offset, pngsize)
 			pngfound = True
 			tmpfilename = os.path.join(tmpdir, 'unpack-%d.png' % counter)
 			tmpfile = open(tmpfilename, 'wb')
@@ -6683,7 +6711,7 @@ def searchUnpackPNG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 
 		if not pngfound:
 			os.rmdir(tmpdir)
-	datafile.close()
+	pngview.close()
 	return (diroffsets, blacklist, [], hints)
 
 ## JFIF is the most common JPEG format
@@ -6747,7 +6775,8 @@ def searchUnpackJPEG(filename, tempdir=None, blacklist=[], offsets={}, scanenv={
 		except:
 			pass
 
-	datafile = open(filename, 'rb')
+	## the view is read like a file, but without any system calls
+	datafile = fileview.getview(filename)
 	## Start verifying the JFIF image.
 	for offset in offsets['jpeg']:
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
@@ -7621,6 +7650,12 @@ def searchUnpackTTF(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	extension = 'ttf'
 	return searchUnpackFont(filename, tempdir, blacklist, offsets['ttf'], requiredtablenames, reporttag, extension)
 
+## layouts of the offset table of a font (after the 4 byte magic header: the
+## number of tables, searchrange, entryselector and rangeshift) and of the
+## records in the table directory (tag, checksum, offset and length)
+fontoffsettable = fileview.layout('>4xHHHH')
+fonttablerecord = fileview.layout('>4sLLL')
+
 def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames, reporttag, extension):
 	hints = {}
 	newtags = []
@@ -7628,54 +7663,32 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 	diroffsets = []
 
 	filesize = os.stat(filename).st_size
-	fontfile = open(filename, 'rb')
+	fontview = fileview.getview(filename)
 	for offset in offsets:
 		## first check if the offset is not blacklisted
 		blacklistoffset = extractor.inblacklist(offset, blacklist)
 		if blacklistoffset != None:
 			continue
 		## walk the file structure
-		fontfile.seek(offset)
 		fontsize = 0
 
-		## first the magic header, already checked
-		fontbytes = fontfile.read(4)
-
-		## then the number of tables
-		fontbytes = fontfile.read(2)
-		if len(fontbytes) != 2:
+		## first the magic header (already checked), then the number of
+		## tables, searchrange, entryselector and rangeshift
+		offsettable = fontview.unpack(fontoffsettable, offset)
+		if offsettable == None:
 			break
-		numberoftables = struct.unpack('>H', fontbytes)[0]
+		(numberoftables, searchrange, entryselector, rangeshift) = offsettable
 		if numberoftables == 0:
 			continue
 
-		## followed by searchrange
-		fontbytes = fontfile.read(2)
-		if len(fontbytes) != 2:
-			break
-		searchrange = struct.unpack('>H', fontbytes)[0]
-
 		## sanity check, see specification
 		if pow(2, int(math.log(numberoftables, 2)+4)) != searchrange:
 			continue
 
-		## followed by entryselector
-		fontbytes = fontfile.read(2)
-		if len(fontbytes) != 2:
-			break
-		entryselector = struct.unpack('>H', fontbytes)[0]
-
 		## sanity check, see specification
 		if int(math.log(numberoftables, 2)) != entryselector:
 			continue
 
-		## followed by rangeshift
-		fontbytes = fontfile.read(2)
-		if len(fontbytes) != 2:
-			break
-
-		rangeshift = struct.unpack('>H', fontbytes)[0]
-
 		## sanity check, see specification
 		if rangeshift != numberoftables*16 - searchrange:
 			continue
@@ -7687,12 +7700,12 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 		validfont = True
 		fontsizepadding = 0
 		for i in xrange(0,numberoftables):
-			## first the tag
-			fontbytes = fontfile.read(4)
-			if len(fontbytes) != 4:
+			## the tag, the checksum, the offset and the length
+			tablerecord = fontview.unpack(fonttablerecord, offset + 12 + i*16)
+			if tablerecord == None:
 				validfont = False
 				break
-			tabletag = fontbytes
+			(tabletag, checksum, tableoffset, tablelength) = tablerecord
 
 			## each table should only appear once
 			if tabletag in tablenames:
@@ -7700,31 +7713,12 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 				break
 			tablenames.add(tabletag)
 
-			## then the checksum
-			fontbytes = fontfile.read(4)
-			if len(fontbytes) != 4:
-				validfont = False
-				break
-			checksum = fontbytes
-
-			## then the offset
-			fontbytes = fontfile.read(4)
-			if len(fontbytes) != 4:
-				validfont = False
-				break
-			tableoffset = struct.unpack('>L', fontbytes)[0]
 			if tableoffset > filesize:
 				validfont = False
 				break
 			if tabletag == 'head':
 				headchecklocation = tableoffset
 
-			## finally the length
-			fontbytes = fontfile.read(4)
-			if len(fontbytes) != 4:
-				validfont = False
-				break
-			tablelength = struct.unpack('>L', fontbytes)[0]
 			if tablelength > filesize:
 				validfont = False
 				break
@@ -7737,39 +7731,30 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 				fontsize += (4 - fontsize%4)
 
 			## now calculate the checksum.
-			oldoffset = fontfile.tell()
-			fontfile.seek(offset+tableoffset)
-			fontbytes = fontfile.read(tablelength)
+			fontbytes = fontview.readat(offset+tableoffset, tablelength)
 			if len(fontbytes) != tablelength:
 				validfont = False
 				break
-			computedchecksum = 0
 			pad = 0
 			if tablelength % 4 != 0:
 				pad = 4 - tablelength % 4
 				fontbytes += '\x00'*pad
 
 			## the checksum has to fit in 4 bytes (long)
-			for r in xrange(0, len(fontbytes)/4):
-				computedchecksum += struct.unpack('>L', fontbytes[r*4:r*4+4])[0]
-			computedchecksum = computedchecksum%pow(2,32)
+			computedchecksum = sum(struct.unpack('>%dL' % (len(fontbytes)/4), fontbytes))%pow(2,32)
 
 			## the checksum for the 'head' section will be different
 			## according to the specification.
-			if not struct.pack('>L', computedchecksum) == checksum:
+			if not computedchecksum == checksum:
 				if tabletag != 'head':
 					validfont = False
 					break
 			## store the checksumadjustment
 			if tabletag == 'head':
-				fontfile.seek(offset+tableoffset+8)
-				fontbytes = fontfile.read(4)
-				if len(fontbytes) != 4:
+				checksumadjustment = fontview.value('>L', offset+tableoffset+8)
+				if checksumadjustment == None:
 					validfont = False
 					break
-				checksumadjustment = struct.unpack('>L', fontbytes)[0]
-
-			fontfile.seek(oldoffset)
 
 		if not validfont:
 			continue
@@ -7790,19 +7775,18 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 		## However, checksums in some fonts are then no longer
 		## properly computed.
 		## Example: Font4_Luminous_Sans.ttf in some phones
-		fontfile.seek(offset)
-		computedchecksum = 0
-		fontbytes = fontfile.read(fontsize - fontsizepadding)
+		fontbytes = fontview.readat(offset, fontsize - fontsizepadding)
 		if len(fontbytes) % 4 != 0:
 			pad = 4 - len(fontbytes) % 4
 			fontbytes += '\x00'*pad
-		for r in xrange(0, fontsize/4):
-			if r*4 == headchecklocation+8:
-				## skip the value for checksumadjustment in the 'head' table
-				computedchecksum += 0
-			else:
-				computedchecksum += struct.unpack('>L', fontbytes[r*4:r*4+4])[0]
-			computedchecksum = computedchecksum%pow(2,32)
+		if len(fontbytes) < fontsize:
+			continue
+		fontwords = struct.unpack('>%dL' % (fontsize/4), fontbytes[:fontsize])
+		computedchecksum = sum(fontwords)
+		if (headchecklocation+8)%4 == 0 and (headchecklocation+8)/4 < len(fontwords):
+			## skip the value for checksumadjustment in the 'head' table
+			computedchecksum -= fontwords[(headchecklocation+8)/4]
+		computedchecksum = computedchecksum%pow(2,32)
 
 		if (0xB1B0AFBA - computedchecksum)%pow(2,32) != checksumadjustment:
 			continue
@@ -7815,15 +7799,14 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 			hints[filename]['blacklistignorescans'] = set()
 			hints[filename]['blacklistignorescans'].add('png')
 			blacklist.append((0,fontsize))
-			fontfile.close()
+			fontview.close()
 			return (diroffsets, blacklist, [reporttag, 'font', 'resource', 'binary'], hints)
 
 		## not the whole file, so carve
 		tmpdir = dirsetup(tempdir, filename, extension, counter)
 		tmpfilename = os.path.join(tmpdir, 'unpack-%d.%s' % (counter, extension))
 		tmpfile = open(tmpfilename, 'wb')
-		fontfile.seek(offset)
-		tmpfile.write(fontfile.read(fontsize))
+		tmpfile.write(fontview.readat(offset, fontsize))
 		tmpfile.close()
 		hints[tmpfilename] = {}
 		hints[tmpfilename]['tags'] = [reporttag, 'font', 'resource', 'binary']
@@ -7834,9 +7817,14 @@ def searchUnpackFont(filename, tempdir, blacklist, offsets, requiredtablenames,
 		diroffsets.append((tmpdir, offset, fontsize))
 		counter = counter + 1
 
-	fontfile.close()
+	fontview.close()
 	return (diroffsets, blacklist, newtags, hints)
 
+## layout of an Ogg page header (after 'OggS'): version, header type, granule
+## position, serial number, page sequence number, checksum and the amount of
+## page segments
+oggpageheader = fileview.layout('<BBQLLLB')
+
 ## Search Ogg files in and unpack from a larger file. Since Ogg
 ## bitstreams can be multiplexed and chained it is difficult to
 ## separate Ogg files if they have been concatenated.
@@ -7856,7 +7844,10 @@ def searchUnpackOgg(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 	counter = 1
 	diroffsets = []
 
-	oggfile = open(filename, 'rb')
+	oggview = fileview.getview(filename)
+
+	## the offset right after the last page that was read
+	oggposition = 0
 
 	## Ogg files can be multiplexed and chained so some data
 	## needs to be juggled.
@@ -7889,7 +7880,7 @@ def searchUnpackOgg(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 			blacklisted = True
 			oggcontinue = False
 
-		if offset != oggfile.tell():
+		if offset != oggposition:
 			oggcontinue = False
 
 		## first check if this is a new stream or not
@@ -7930,32 +7921,16 @@ def searchUnpackOgg(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 			continue
 
 		## version field has to be zero
-		oggfile.seek(offset+4)
-		version = oggfile.read(1)
-		if version != '\x00':
+		if oggview.readat(offset+4, 1) != '\x00':
 			oggcontinue = False
 			continue
 
-		streamtype = oggfile.read(1)
-		## TODO: checks with streamtypes
-
-		oggbytes = oggfile.read(8)
-		if len(oggbytes) != 8:
-			writeoggdata = False
-			break
-		granuleposition = oggbytes
-
-		oggbytes = oggfile.read(4)
-		if len(oggbytes) != 4:
+		pageheader = oggview.unpack(oggpageheader, offset+4)
+		if pageheader == None:
 			writeoggdata = False
 			break
-		bitstreamserialnumber = struct.unpack('<L', oggbytes)[0]
-
-		oggbytes = oggfile.read(4)
-		if len(oggbytes) != 4:
-			writeoggdata = False
-			break
-		pagesequencenumber = struct.unpack('<L', oggbytes)[0]
+		(version, streamtype, granuleposition, bitstreamserialnumber, pagesequencenumber, oggchecksum, pagesegments) = pageheader
+		## TODO: checks with streamtypes
 
 		if bitstreamserialnumber in bitstreams:
 			## pages have to be ordered per bitstream
@@ -7965,22 +7940,12 @@ def searchUnpackOgg(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		else:
 			bitstreams[bitstreamserialnumber] = pagesequencenumber
 
-		oggbytes = oggfile.read(4)
-		if len(oggbytes) != 4:
+		## the segment table has the size of every segment
+		segmenttable = oggview.readat(offset+27, pagesegments)
+		if len(segmenttable) != pagesegments:
 			writeoggdata = False
 			break
-		oggchecksum = struct.unpack('<L', oggbytes)[0]
-
-		oggbytes = oggfile.read(1)
-		if len(oggbytes) != 1:
-			writeoggdata = False
-			break
-		pagesegments = struct.unpack('<B', oggbytes)[0]
-		segmenttotalsize = 0
-		for p in xrange(0, pagesegments):
-			oggbytes = oggfile.read(1)
-			segmentsize = struct.unpack('<B', oggbytes)[0]
-			segmenttotalsize += segmentsize
+		segmenttotalsize = sum(map(ord, segmenttable))
 
 		'''
 		## compute the checksum. The standard crc32 methods in
@@ -7999,14 +7964,14 @@ def searchUnpackOgg(filename, tempdir=None, blacklist=[], offsets={}, scanenv={}
 		'''
 
 		writeoggdata = True
-		oggdatatoread = oggfile.tell() - offset + segmenttotalsize
-		oggfile.seek(offset)
-		tmpfile.write(oggfile.read(oggdatatoread))
+		oggdatatoread = 27 + pagesegments + segmenttotalsize
+		tmpfile.write(oggview.readat(offset, oggdatatoread))
+		oggposition = offset + oggdatatoread
 		totalwritten += oggdatatoread
 		oldoffset = offset
 
 	tmpfile.close()
-	oggfile.close()
+	oggview.close()
 
 	if writeoggdata:
 		## now check if it is a valid file by running ogginfo
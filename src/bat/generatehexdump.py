@@ -18,6 +18,7 @@ This should be run as a postrun scan
 '''
 
 import os, os.path, sys, subprocess, gzip
+import extractor
 
 def generateHexdump(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor, conn, debug=False):
 	if not 'checksum' in unpackreport:
@@ -39,9 +40,20 @@ def generateHexdump(filename, unpackreport, scantempdir, topleveldir, scanenv, c
 	if filesize > maxsize:
 		return
 	if not os.path.exists("%s/%s-hexdump.gz" % (reportdir, unpackreport['checksum'])):
-		p = subprocess.Popen(['hexdump', '-Cv', filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-		(stanout, stanerr) = p.communicate()
-		if stanout != "":
-			gf = gzip.open("%s/%s-hexdump.gz" % (reportdir, unpackreport['checksum']), 'w')
+		## the output of hexdump is several times the size of the file,
+		## so it is compressed while it is read instead of keeping it
+		## in memory first.
+		devnull = open(os.devnull, 'w')
+		p = subprocess.Popen(['hexdump', '-Cv', filename], stdout=subprocess.PIPE, stderr=devnull, close_fds=True)
+		gf = None
+		while True:
+			stanout = p.stdout.read(1048576)
+			if stanout == "":
+				break
+			if gf == None:
+				gf = extractor.openreport("%s/%s-hexdump" % (reportdir, unpackreport['checksum']), True, scanenv.get('compresslevel', 9))
 			gf.write(stanout)
+		p.wait()
+		devnull.close()
+		if gf != None:
 			gf.close()
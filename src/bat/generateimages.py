@@ -7,6 +7,7 @@
 
 import os, os.path, sys, subprocess, copy, cPickle, tempfile, hashlib, shutil, multiprocessing, piecharts
 import math
+import reportstore
 import reportlab.rl_config as rl_config
 
 ## Ugly hack to register the right font with the system, because ReportLab really wants to find
@@ -111,9 +112,7 @@ def generateversionchart((versionpickle, picklehash, imagedir, pickledir)):
 	return picklehash
 
 def extractpickles((filehash, pickledir, topleveldir, unpacktempdir, minpercentagecutoff, maxpercentagecutoff)):
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
+	leafreports = reportstore.getstore(topleveldir).load(filehash)
 
 	if not leafreports.has_key('ranking'):
 		return
@@ -297,7 +296,7 @@ def generateimages(unpackreports, scantempdir, topleveldir, processors, scanenv,
 		if not 'ranking' in unpackreports[i]['tags']:
 			continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		filehashes.add(filehash)
 
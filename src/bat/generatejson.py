@@ -12,18 +12,22 @@ including the ranking algorithm.
 The documentation of the format can be found in the 'doc' directory (subject to change)
 '''
 
-import os, sys, re, json, cPickle, multiprocessing, copy, gzip, codecs, Queue, shutil
+import os, sys, re, json, multiprocessing, copy, gzip, codecs, Queue, shutil
+import reportstore, extractor, scanmetrics
 from multiprocessing import Process, Lock
 from multiprocessing.sharedctypes import Value, Array
 
-def writejson(scanqueue, topleveldir, outputhash, cursor, conn, scanenv, converthash, compressed):
+def writejson(scanqueue, topleveldir, outputhash, cursor, conn, scanenv, converthash, compressed, dbqueries):
 	hashcache = {}
+	if "compresslevel" in scanenv:
+		compresslevel = scanenv['compresslevel']
+	else:
+		compresslevel = 9
+	scanmetrics.resetcounters()
 	while True:
 		filehash = scanqueue.get(timeout=2592000)
 		## read the data from the pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).load(filehash)
 		## then mangle the data and dump it into a JSON file
 		jsonreport = {}
 
@@ -272,26 +276,15 @@ def writejson(scanqueue, topleveldir, outputhash, cursor, conn, scanenv, convert
 		## then security information
 		## TODO
 
-		## dump the JSON to a file
+		## dump the JSON to a file, optionally compressed while it is written.
+		## As the JSON is written in chunks this also avoids
+		## https://bugs.python.org/issue23306 for big reports.
 		jsonfilename = os.path.join(topleveldir, "reports", "%s.json" % filehash)
-		jsonfile = open(jsonfilename, 'w')
+		jsonfile = extractor.openreport(jsonfilename, compressed, compresslevel, 'w')
 		for chunk in json.JSONEncoder(indent=4).iterencode(jsonreport):
 			jsonfile.write(chunk)
 		jsonfile.close()
-		if compressed:
-			fin = open(jsonfilename, 'rb')
-			fout = gzip.open("%s.gz" % jsonfilename, 'wb')
-			## workaround for https://bugs.python.org/issue23306
-			## result: JSON will not be gzip compressed
-			try:
-				fout.write(fin.read())
-				fout.close()
-				fin.close()
-				os.unlink(fin.name)
-			except:
-				fout.close()
-				fin.close()
-				os.unlink(fout.name)
+		scanmetrics.sharecounter('dbqueries', dbqueries)
 		scanqueue.task_done()
 
 def printjson(unpackreports, scantempdir, topleveldir, processors, scanenv, batcursors, batcons, scandebug=False, unpacktempdir=None):
@@ -422,7 +415,7 @@ def printjson(unpackreports, scantempdir, topleveldir, processors, scanenv, batc
 		if 'duplicate' in unpackreports[unpackreport]['tags']:
 			continue
 		## then check if there is a pickle file. If not, continue
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		## then check if the data for this file has already been dumped (this should not
 		## happen). If so, continue.
@@ -444,6 +437,7 @@ def printjson(unpackreports, scantempdir, topleveldir, processors, scanenv, batc
 		processamount = min(processamount, jsontaskamount)
 		scanmanager = multiprocessing.Manager()
 		processpool = []
+		dbqueries = Value('L', 0)
 
 		for i in range(0,processamount):
 			if usedb:
@@ -452,11 +446,14 @@ def printjson(unpackreports, scantempdir, topleveldir, processors, scanenv, batc
 			else:
 				cursor = None
 				conn = None
-			p = multiprocessing.Process(target=writejson, args=(scanqueue,topleveldir,outputhash, cursor, conn, scanenv, converthash, compressed))
+			p = multiprocessing.Process(target=writejson, args=(scanqueue,topleveldir,outputhash, cursor, conn, scanenv, converthash, compressed, dbqueries))
 			processpool.append(p)
 			p.start()
 
 		scanqueue.join()
 
+		## wait for the workers, so their I/O is counted in the metrics
 		for p in processpool:
 			p.terminate()
+			p.join()
+		scanmetrics.count('dbqueries', dbqueries.value)
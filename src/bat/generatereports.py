@@ -25,6 +25,7 @@ originally belonged to.
 
 import os, os.path, sys, copy, cPickle, tempfile, hashlib, shutil, multiprocessing, cgi, gzip
 import codecs
+import reportstore, extractor
 
 ## compute a SHA256 hash. This is done in chunks to prevent a big file from
 ## being read in its entirety at once, slowing down a machine.
@@ -156,10 +157,8 @@ def generatehtmlsnippet((picklefile, pickledir, picklehash, reportdir)):
 
 ## generate several output files and extract pickles
 ## TODO: change name
-def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir, compressed)):
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
+def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir, compressed, compresslevel)):
+	leafreports = reportstore.getstore(topleveldir).load(filehash)
 
 	## return type: (filehash, reportresults, unmatchedresult)
 	reportresults = []
@@ -279,18 +278,11 @@ def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir,
 					html += "</p>\n"
 		if html != "":
 			htmlfilename = "%s/%s-functionnames.html" % (reportdir, filehash)
-			nameshtmlfile = open(htmlfilename, 'wb')
+			nameshtmlfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 			nameshtmlfile.write("<html><body>")
 			nameshtmlfile.write(html)
 			nameshtmlfile.write("</body></html>")
 			nameshtmlfile.close()
-			if compressed:
-				fin = open(htmlfilename, 'rb')
-				fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-				fout.write(fin.read())
-				fout.close()
-				fin.close()
-				os.unlink(fin.name)
 
 	footer = "</body></html>"
 	if variablepvs != {}:
@@ -454,18 +446,11 @@ def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir,
 
 		if html != "":
 			htmlfilename = "%s/%s-names.html" % (reportdir, filehash)
-			nameshtmlfile = open(htmlfilename, 'wb')
+			nameshtmlfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 			nameshtmlfile.write(header)
 			nameshtmlfile.write(html)
 			nameshtmlfile.write(footer)
 			nameshtmlfile.close()
-			if compressed:
-				fin = open(htmlfilename, 'rb')
-				fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-				fout.write(fin.read())
-				fout.close()
-				fin.close()
-				os.unlink(fin.name)
 
 	if res != None:
 		if res['unmatched'] != []:
@@ -498,7 +483,7 @@ def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir,
 			order = map(lambda x: (len(res['nonUniqueMatches'][x]), x), res['nonUniqueMatches'].keys())
 			order.sort(reverse=True)
 			htmlfilename = "%s/%s-assigned.html" % (reportdir, filehash)
-			assignedhtmlfile = open(htmlfilename, 'wb')
+			assignedhtmlfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 			## first write the header
 			assignedhtmlfile.write("<html><body><h1>Assigned strings per package</h1><p><ul>")
 			for r in order:
@@ -515,23 +500,16 @@ def extractpickles((filehash, pickledir, topleveldir, reportdir, unpacktempdir,
 				assignedhtmlfile.write("</p><hr>")
 			assignedhtmlfile.write(footer)
 			assignedhtmlfile.close()
-			if compressed:
-				fin = open(htmlfilename, 'rb')
-				fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-				fout.write(fin.read())
-				fout.close()
-				fin.close()
-				os.unlink(fin.name)
 	return (filehash, reportresults, functionresults, unmatchedresult)
 
-def generateunmatched((picklefile, pickledir, filehash, reportdir, compressed)):
+def generateunmatched((picklefile, pickledir, filehash, reportdir, compressed, compresslevel)):
 
 	unmatched_pickle = open(os.path.join(pickledir, picklefile), 'rb')
 	unmatches = cPickle.load(unmatched_pickle)
         unmatched_pickle.close()
 
 	htmlfilename = "%s/%s-unmatched.html" % (reportdir, filehash)
-	unmatchedhtmlfile = codecs.open(htmlfilename, encoding='utf-8', mode='wb')
+	unmatchedhtmlfile = codecs.getwriter('utf-8')(extractor.openreport(htmlfilename, compressed, compresslevel))
 	unmatchedhtmlfile.write(u"<html><body><h1>Unmatched strings (%d strings)</h1><p>" % (len(unmatches),))
 	for u in unmatches:
 		decoded = False
@@ -548,13 +526,6 @@ def generateunmatched((picklefile, pickledir, filehash, reportdir, compressed)):
 				pass
 	unmatchedhtmlfile.write(u"</p></body></html>")
 	unmatchedhtmlfile.close()
-	if compressed:
-		fin = open(htmlfilename, 'rb')
-		fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-		fout.write(fin.read())
-		fout.close()
-		fin.close()
-		os.unlink(fin.name)
 	os.unlink(os.path.join(pickledir, picklefile))
 
 def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv, batcursors, batcons, scandebug=False, unpacktempdir=None):
@@ -601,7 +572,7 @@ def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv
 		filehash = unpackreports[i]['checksum']
 		if filehash in filehashes:
 			continue
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		filehashes.add(filehash)
 
@@ -618,9 +589,13 @@ def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv
 		compressed = scanenv['compress']
 	else:
 		compressed = False
+	if "compresslevel" in scanenv:
+		compresslevel = scanenv['compresslevel']
+	else:
+		compresslevel = 9
 
 	## extract pickles and generate some files
-	extracttasks = map(lambda x: (x, pickledir, topleveldir, reportdir, unpacktempdir, compressed), filehashes)
+	extracttasks = map(lambda x: (x, pickledir, topleveldir, reportdir, unpacktempdir, compressed, compresslevel), filehashes)
 	pool = multiprocessing.Pool(processes=processors)
 	res = filter(lambda x: x != None, pool.map(extractpickles, extracttasks, 1))
 	pool.terminate()
@@ -661,7 +636,7 @@ def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv
 
 	## generate files for unmatched strings
 	if unmatchedpickles != set():
-		unmatchedtasks = set(map(lambda x: (picklehashes[x[0]], pickledir, x[0], reportdir, compressed), unmatchedpicklespackages))
+		unmatchedtasks = set(map(lambda x: (picklehashes[x[0]], pickledir, x[0], reportdir, compressed, compresslevel), unmatchedpicklespackages))
 		results = pool.map(generateunmatched, unmatchedtasks, 1)
 		for p in unmatchedpicklespackages:
 			if compressed:
@@ -691,7 +666,7 @@ def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv
 		pickleremoves = set()
 		for filehash in resultranks.keys():
 			htmlfilename = "%s/%s-unique.html" % (reportdir, filehash)
-			uniquehtmlfile = open(htmlfilename, 'wb')
+			uniquehtmlfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 			uniquehtmlfile.write("<html><body><h1>Unique matches per package</h1><p><ul>")
 			for r in resultranks[filehash]:
 				(picklehash, uniquematcheslen, packagename) = r
@@ -706,13 +681,6 @@ def generatereports(unpackreports, scantempdir, topleveldir, processors, scanenv
 				
 			uniquehtmlfile.write("</body></html>")
 			uniquehtmlfile.close()
-			if compressed:
-				fin = open(htmlfilename, 'rb')
-				fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-				fout.write(fin.read())
-				fout.close()
-				fin.close()
-				os.unlink(fin.name)
 		for i in pickleremoves:
 			try:
 				os.unlink(os.path.join(reportdir, "%s-unique.snippet" % i))
@@ -10,7 +10,8 @@ This is a plugin for the Binary Analysis Tool.
 This should be run as a postrun scan
 '''
 
-import os, os.path, sys, cPickle, gzip
+import os, os.path, sys, gzip
+import reportstore, extractor
 
 def guireport(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor, conn, debug=False):
 	if not 'checksum' in unpackreport:
@@ -48,17 +49,19 @@ def guireport(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor,
 			tmpimagedir = None
 
 	filehash = unpackreport['checksum']
-	if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+	if not reportstore.getstore(topleveldir).exists(filehash):
 		return
 
 	if "compress" in scanenv:
 		compressed = scanenv['compress']
 	else:
 		compressed = False
+	if "compresslevel" in scanenv:
+		compresslevel = scanenv['compresslevel']
+	else:
+		compresslevel = 9
 
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
+	leafreports = reportstore.getstore(topleveldir).load(filehash)
 
 
 	footer = '''
@@ -288,7 +291,7 @@ def guireport(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor,
 			hreflist += '<li><a href="#distro">distribution file name matches</a></li>'
 		hreflist += '</ul>'
 	htmlfilename = "%s/%s-guireport.html" % (reportdir, filehash)
-	guireportfile = open(htmlfilename, 'wb')
+	guireportfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 	guireportfile.write(overviewstring)
 	guireportfile.write(tablerows)
 	guireportfile.write("</table>")
@@ -299,13 +302,6 @@ def guireport(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor,
 	guireportfile.write(footer)
 
 	guireportfile.close()
-	if compressed:
-		fin = open(htmlfilename, 'rb')
-		fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-		fout.write(fin.read())
-		fout.close()
-		fin.close()
-		os.unlink(fin.name)
 
 	## ideally this should move to findlibs.py, where pictures are generated
 	elfheader = "<html><body><h1>Detailed ELF analysis</h1><table>"
@@ -345,17 +341,10 @@ def guireport(filename, unpackreport, scantempdir, topleveldir, scanenv, cursor,
 			imagehtml += "</ul></p>"
 	if tablerows != "":
 		htmlfilename = "%s/%s-elfreport.html" % (reportdir, filehash)
-		elfreportfile = open(htmlfilename, 'wb')
+		elfreportfile = extractor.openreport(htmlfilename, compressed, compresslevel)
 		elfreportfile.write(elfheader)
 		elfreportfile.write(tablerows)
 		elfreportfile.write(elftablefooter)
 		elfreportfile.write(imagehtml)
 		elfreportfile.write(elffooter)
 		elfreportfile.close()
-		if compressed:
-			fin = open(htmlfilename, 'rb')
-			fout = gzip.open("%s.gz" % htmlfilename, 'wb')
-			fout.write(fin.read())
-			fout.close()
-			fin.close()
-			os.unlink(fin.name)
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains a set of checksums in shared memory, which is used by the
+scan processes in bat/bruteforcescan.py to detect duplicate files. Before a
+file is scanned its checksum is claimed: only the first process that claims
+a checksum scans the file, other files with the same checksum are marked as
+duplicates.
+
+Previously a dictionary from a multiprocessing manager was used, protected
+by a single lock. Every check then was a round trip to the manager process
+while holding the lock, so with many processes and many small files the
+processes were mostly waiting for each other.
+
+The set is an open addressing hash table in shared memory, which is split
+into segments that each have their own lock. The segment is determined by
+the checksum, so processes only wait for each other if they claim checksums
+in the same segment at the same time, and no other process is involved.
+
+Entries are stored per binary (the id of the binary in the scan) so several
+binaries can be scanned at the same time and the entries of a binary can be
+removed when it has been unpacked.
+
+Removed entries are marked as removed (a 'tombstone') so checksums that were
+stored after them can still be found. Tombstones that are directly followed by
+an empty slot are cleared, as no search goes past them. If a segment contains
+too many tombstones it is rebuilt with only the entries that are left, so
+searches do not get slower with every binary that is scanned.
+'''
+
+import multiprocessing, ctypes, struct, binascii, hashlib
+from multiprocessing.sharedctypes import RawArray
+
+## amount of bytes of the checksum that are stored. Checksums are
+## only compared for files from the same binary, so this is plenty.
+keysize = 16
+
+## a slot is the binary id (plus one, so an empty slot is all zeroes)
+## followed by the first bytes of the checksum.
+slotsize = 4 + keysize
+emptyslot = '\x00' * slotsize
+
+## binary id for slots of entries that were removed
+removedid = struct.pack('<I', 0xffffffff)
+removedslot = removedid + '\x00' * keysize
+
+## a segment is rebuilt if more than this part of its slots are tombstones
+maxremoved = 4
+
+class SharedHashSet:
+	## 'slots' is the amount of entries that fit in the set. If a segment is
+	## full new checksums are not recorded and claiming them always succeeds,
+	## so files are not marked as duplicates, but are scanned again.
+	def __init__(self, slots=1048576, segments=64):
+		self.segments = segments
+		self.segmentslots = max(slots/segments, 1)
+		self.table = RawArray(ctypes.c_char, self.segments * self.segmentslots * slotsize)
+		self.locks = map(lambda x: multiprocessing.Lock(), range(self.segments))
+		## amount of tombstones per segment
+		self.removed = RawArray(ctypes.c_int, self.segments)
+
+	## return the slot contents for a checksum, the segment and the first
+	## slot in the segment to look at
+	def locate(self, binaryid, filehash):
+		try:
+			digest = binascii.unhexlify(filehash)
+		except TypeError:
+			digest = hashlib.md5(filehash).digest()
+		digest = digest[:keysize].ljust(keysize, '\x00')
+		key = struct.pack('<I', binaryid + 1) + digest
+		(segment, start) = self.position(key)
+		return (key, segment, start)
+
+	## return the segment and the first slot in the segment for the
+	## contents of a slot
+	def position(self, key):
+		position = struct.unpack('<Q', key[4:12])[0] + struct.unpack('<I', key[:4])[0] - 1
+		return (position % self.segments, (position / self.segments) % self.segmentslots)
+
+	## Walk the slots of a segment starting at 'start'. Returns the offset of
+	## 'key' in the table (or None) and the offset of the first free slot
+	## that was seen (or None).
+	def probe(self, key, segment, start):
+		base = segment * self.segmentslots
+		free = None
+		for i in xrange(0, self.segmentslots):
+			offset = (base + (start + i) % self.segmentslots) * slotsize
+			slot = self.table[offset:offset+slotsize]
+			if slot == key:
+				return (offset, free)
+			if slot == emptyslot:
+				if free == None:
+					free = offset
+				break
+			if free == None and slot[:4] == removedid:
+				free = offset
+		return (None, free)
+
+	## Add a checksum for a binary. Returns True if the checksum was not
+	## in the set yet (the caller should scan the file) and False if it
+	## was already claimed before (the file is a duplicate).
+	def claim(self, binaryid, filehash):
+		(key, segment, start) = self.locate(binaryid, filehash)
+		self.locks[segment].acquire()
+		(offset, free) = self.probe(key, segment, start)
+		if offset != None:
+			self.locks[segment].release()
+			return False
+		if free != None:
+			if self.table[free:free+4] == removedid:
+				self.removed[segment] -= 1
+			self.table[free:free+slotsize] = key
+		self.locks[segment].release()
+		return True
+
+	def __contains__(self, item):
+		(binaryid, filehash) = item
+		(key, segment, start) = self.locate(binaryid, filehash)
+		self.locks[segment].acquire()
+		(offset, free) = self.probe(key, segment, start)
+		self.locks[segment].release()
+		return offset != None
+
+	def remove(self, binaryid, filehash):
+		(key, segment, start) = self.locate(binaryid, filehash)
+		self.locks[segment].acquire()
+		(offset, free) = self.probe(key, segment, start)
+		if offset != None:
+			self.table[offset:offset+slotsize] = removedslot
+			self.removed[segment] += 1
+			self.clearremoved(segment, offset)
+			if self.removed[segment] * maxremoved > self.segmentslots:
+				self.rebuild(segment)
+		self.locks[segment].release()
+
+	## Clear the tombstone at 'offset' and the tombstones before it if the
+	## next slot is empty: searches stop at the empty slot anyway.
+	def clearremoved(self, segment, offset):
+		base = segment * self.segmentslots * slotsize
+		size = self.segmentslots * slotsize
+		nextoffset = base + (offset - base + slotsize) % size
+		if self.table[nextoffset:nextoffset+slotsize] != emptyslot:
+			return
+		for i in xrange(0, self.segmentslots):
+			if self.table[offset:offset+4] != removedid:
+				break
+			self.table[offset:offset+slotsize] = emptyslot
+			self.removed[segment] -= 1
+			offset = base + (offset - base - slotsize) % size
+
+	## Rebuild a segment with only the entries that are not removed. The
+	## lock of the segment should be held.
+	def rebuild(self, segment):
+		base = segment * self.segmentslots * slotsize
+		size = self.segmentslots * slotsize
+		data = self.table[base:base+size]
+		self.table[base:base+size] = '\x00' * size
+		self.removed[segment] = 0
+		for i in xrange(0, size, slotsize):
+			key = data[i:i+slotsize]
+			if key == emptyslot or key[:4] == removedid:
+				continue
+			(offset, free) = self.probe(key, segment, self.position(key)[1])
+			self.table[free:free+slotsize] = key
@@ -13,7 +13,7 @@ processing by various other scans.
 
 import string, os, os.path, sys, tempfile, shutil, copy, struct, zlib, cStringIO
 import subprocess
-import extractor, javacheck, elfcheck
+import extractor, javacheck, elfcheck, fileview
 
 splitcharacters = map(lambda x: chr(x), range(0,9) + range(14,32) + [127])
 
@@ -180,7 +180,8 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 	## contain compressed data, like .gnu_debugdata which should not trigger the
 	## black list.
 
-	createdtempfile = False
+	## byte ranges of the file that are not blacklisted, None for the whole file
+	scanranges = None
 	if "elf" in tags:
 		scanfile = filepath
 	else:
@@ -272,47 +273,18 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 		## bootloader, followed by a file system. The bootloader should be
 		## analyzed, the file system should have been unpacked and been
 		## blacklisted.
+		scanfile = filepath
 		if blacklist == []:
-			scanfile = filepath
+			scanranges = [(0, filesize)]
 		else:
 			## The blacklist is not empty. This could be a problem if
 			## the Linux kernel is an ELF file and contains for example
 			## an initrd.
-			## Parts of the file were already scanned, so
-			## carve the right parts from the file first
-			datafile = open(filepath, 'rb')
-			lastindex = 0
-			databytes = ""
-			datafile.seek(lastindex)
-			## make a copy and add a bogus value for the last
-			## byte to a temporary blacklist to make the loop work
-			## well.
-			blacklist_tmp = copy.deepcopy(blacklist)
-			## oh, this is an ugly hack. The blacklisting code really
-			## should be fixed.
-			blacklist_tmp.sort()
-
-			blacklist_tmp.append((filesize,filesize))
-			for i in blacklist_tmp:
-				if i[0] == lastindex:
-					lastindex = i[1] - 1
-					datafile.seek(lastindex)
-					continue
-				if i[0] > lastindex:
-					## just concatenate the bytes
-					data = datafile.read(i[0] - lastindex)
-					databytes = databytes + data
-					## set lastindex to the next
-					lastindex = i[1] - 1
-					datafile.seek(lastindex)
-			datafile.close()
-			if len(databytes) == 0:
+			## Parts of the file were already scanned, so only
+			## the other parts of the file are looked at.
+			scanranges = extractor.carveranges(filesize, blacklist)
+			if sum(map(lambda x: x[1] - x[0], scanranges)) == 0:
 				return None
-			tmpfile = tempfile.mkstemp(dir=unpacktempdir)
-			os.write(tmpfile[0], databytes)
-			os.fdopen(tmpfile[0]).close()
-			scanfile = tmpfile[1]
-			createdtempfile = True
 	## store the extracted string constants in the order
 	## in which they appear in the file
 	lines = []
@@ -338,9 +310,8 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 	## can be detected that strings were moved to different sections.
 	validsectionswithstrings = set(['.data', '.rodata', '.rodata.str1.1', '.rodata.str1.8'])
 	if "elf" in tags:
-		elfscanfiles = []
 		## first determine the size and offset of .data and .rodata sections,
-		## carve these sections from the ELF file, then run 'strings'
+		## then extract the strings from these sections
        		try:
 			(totalelf, elfres) = elfcheck.parseELF(scanfile)
 
@@ -353,17 +324,10 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 
 			## check if there actually are sections. On some systems the
 			## ELF header is corrupted and does not have section headers
+			elfdata = elfcheck.getELF(filepath).data
 			if not validelf:
-				p = subprocess.Popen(['strings', '-a', '-n', str(stringcutoff), scanfile], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-				(stanout, stanerr) = p.communicate()
-				if p.returncode != 0:
-					if createdtempfile:
-						## cleanup the tempfile
-						os.unlink(tmpfile[1])
-					return None
-				lines = stanout.split("\n")
+				lines = extractor.printablestrings(elfdata, stringcutoff)
 			else:
-				datafile = open(filepath, 'rb')
 				for s in elfres['sections']:
 					section = elfres['sections'][s]['name']
 					if not section in validsectionswithstrings:
@@ -380,26 +344,9 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 						if extractor.inblacklist(elfoffset+elfsize, blacklist) != None:
 							unpackelf = False
 					if unpackelf:
-						elftmp = tempfile.mkstemp(dir=unpacktempdir,suffix=section)
-						datafile.seek(elfoffset)
-						data = datafile.read(elfsize)
-						os.write(elftmp[0], data)
-						os.fdopen(elftmp[0]).close()
-						elfscanfiles.append(elftmp[1])
-				datafile.close()
-
-				for i in elfscanfiles:
-					## TODO: check if -Tbinary is needed or not
-       					p = subprocess.Popen(['strings', '-a', '-n', str(stringcutoff), i], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-       					(stanout, stanerr) = p.communicate()
-
-       					st = stanout.split("\n")
-
-       					for s in st:
-                       				printstring = s
-               					if len(printstring) >= stringcutoff:
-                       					lines.append(printstring)
-					os.unlink(i)
+						## sections are looked at separately, strings
+						## do not continue into the next section
+						lines += extractor.printablestrings(elfdata, stringcutoff, [(elfoffset, min(elfoffset+elfsize, len(elfdata)))])
 			if linuxkernel:
 				## no functions can be extracted from a Linux kernel ELF image
 				functionnames = set()
@@ -410,81 +357,46 @@ def extractC(filepath, tags, scanenv, filesize, stringcutoff, linuxkernel, black
 					(functionnames, variablenames, symbolfilenames) = dynres
 		except Exception, e:
 			print >>sys.stderr, "string scan failed for:", filepath, e, type(e)
-			if blacklist != [] and not linuxkernel:
-				## cleanup the tempfile
-				if createdtempfile:
-					os.unlink(tmpfile[1])
 			return None
 	elif 'bflt' in tags:
 		## first check the flags to see if the data section
 		## is gzip compressed
-		bfltfile = open(scanfile, 'rb')
-		bfltfile.seek(12)
-		bfltbytes = bfltfile.read(4)
-		data_start = struct.unpack('>I', bfltbytes)[0]
-		bfltbytes = bfltfile.read(4)
-		data_end = struct.unpack('>I', bfltbytes)[0]
-		bfltfile.seek(36)
-		bfltbytes = bfltfile.read(4)
-		bfltfile.seek(data_start)
-		databytes = bfltfile.read(data_end-data_start)
-		bfltfile.close()
-		
-		## write the bytes to a temporary file
-		bfltdata = tempfile.mkstemp()
+		scanview = fileview.getview(scanfile)
+		try:
+			scandata = scanview.data
+			bfltbytes = extractor.rangebytes(scandata, scanranges, 12, 4)
+			data_start = struct.unpack('>I', bfltbytes)[0]
+			bfltbytes = extractor.rangebytes(scandata, scanranges, 16, 4)
+			data_end = struct.unpack('>I', bfltbytes)[0]
+			bfltbytes = extractor.rangebytes(scandata, scanranges, 36, 4)
+			databytes = extractor.rangebytes(scandata, scanranges, data_start, data_end-data_start)
+		finally:
+			scanview.close()
+
 		flags = struct.unpack('>I', bfltbytes)[0]
 		if flags & 0x04 != 0:
 			deflateobj = zlib.decompressobj(-zlib.MAX_WBITS)
-			uncompresseddata = deflateobj.decompress(databytes)
-			os.write(bfltdata[0], uncompresseddata)
-		else:
-			os.write(bfltdata[0], databytes)
-		os.fdopen(bfltdata[0]).close()
-
-		## TODO: check if -Tbinary is needed or not
-       		p = subprocess.Popen(['strings', '-a', '-n', str(stringcutoff), bfltdata[1]], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-       		(stanout, stanerr) = p.communicate()
-
-      		st = stanout.split("\n")
+			databytes = deflateobj.decompress(databytes)
 
-       		for s in st:
-			printstring = s
-               		if len(printstring) >= stringcutoff:
-				lines.append(printstring)
-		os.unlink(bfltdata[1])
+		lines = extractor.printablestrings(databytes, stringcutoff)
 	else:
 		## extract all strings from the binary. Only look at strings
 		## that are a certain amount of characters or longer. This is
 		## configurable through "stringcutoff" although the gain will be relatively
 		## low by also scanning strings < stringcutoff
 		try:
-			p = subprocess.Popen(['strings', '-a', '-n', str(stringcutoff), scanfile], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-			(stanout, stanerr) = p.communicate()
-			if p.returncode != 0:
-				if createdtempfile:
-					## cleanup the tempfile
-					os.unlink(tmpfile[1])
-				return None
-			if stanout == '':
-				lines = []
-			else:
-				if stanout.endswith('\n'):
-					lines = stanout[:-1].split("\n")
-				else:
-					lines = stanout.split("\n")
+			scanview = fileview.getview(scanfile)
+			try:
+				lines = extractor.printablestrings(scanview.data, stringcutoff, scanranges)
+			finally:
+				scanview.close()
 			if linuxkernel:
 				for l in lines:
 					if l.endswith('.c') or l.endswith('.h') or l.endswith('.S'):
 						filenames.append(l)
 		except Exception, e:
 			print >>sys.stderr, "string scan failed for:", filepath, e, type(e)
-			if blacklist != [] and not linuxkernel:
-				## cleanup the tempfile
-				os.unlink(tmpfile[1])
 			return None
-	if createdtempfile:
-		## cleanup the tempfile
-		os.unlink(tmpfile[1])
 	cmeta['strings'] = lines
 	cmeta['filenames'] = filenames
 	cmeta['functionnames'] = functionnames
@@ -567,13 +479,9 @@ def extractJava(scanfile, tags, scanenv, filesize, stringcutoff, blacklist=[], s
 		## https://source.android.com/devices/tech/dalvik/dex-format.html
 		if javatype == 'oat':
 			## first try older oat
-			sectionres = elfcheck.getSection(scanfile, '.rodata')
-			if sectionres == None:
+			elfdata = elfcheck.getSectionData(scanfile, '.rodata')
+			if elfdata == None:
 				return
-			elffile = open(scanfile, 'rb')
-			elffile.seek(sectionres['sectionoffset'])
-			elfdata = elffile.read(sectionres['sectionsize'])
-			elffile.close()
 			dexfile = cStringIO.StringIO(elfdata)
 		else:
 			dexfile = open(scanfile, 'rb')
@@ -1268,15 +1176,10 @@ def extractJava(scanfile, tags, scanenv, filesize, stringcutoff, blacklist=[], s
 ## kernel source tree.
 def extractkernelsymbols(filename, scanenv, unpacktempdir):
 	variables = set()
-	sectionres = elfcheck.getSection(filename, '__ksymtab_strings')
-	if sectionres == None:
+	data = elfcheck.getSectionData(filename, '__ksymtab_strings')
+	if data == None:
 		return variables
 
-	datafile = open(filename, 'rb')
-	datafile.seek(sectionres['sectionoffset'])
-	data = datafile.read(sectionres['sectionsize'])
-	datafile.close()
-
 	if len(data) == 0:
 		return variables
 
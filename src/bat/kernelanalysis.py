@@ -9,8 +9,8 @@ This module implements a few checks for Linux kernel images and
 modules.
 '''
 
-import os, sys, string, re, subprocess, cPickle, tempfile, shutil
-import extractor, elfcheck
+import os, sys, string, re, subprocess, tempfile, shutil
+import extractor, elfcheck, reportstore
 
 ## perform various checks, such as extracting the Linux kernel
 ## version number, plus certain hardcoded identifiers from some
@@ -125,13 +125,9 @@ def analyseKernelModule(filename, tags, cursor, conn, filehashes, blacklist=[],
 	if not "elfrelocatable" in tags:
 		return None
 
-	sectionres = elfcheck.getSection(filename, '.modinfo')
-	if sectionres == None:
+	elfdata = elfcheck.getSectionData(filename, '.modinfo')
+	if elfdata == None:
 		return
-	elffile = open(filename, 'rb')
-	elffile.seek(sectionres['sectionoffset'])
-	elfdata = elffile.read(sectionres['sectionsize'])
-	elffile.close()
 
 	tagfields = filter(lambda x: x != '', elfdata.split('\x00'))
 	newtags = []
@@ -214,13 +210,11 @@ def kernelmodulecheck(unpackreports, scantempdir, topleveldir, processors, scane
 
 		filehash = unpackreports[i]['checksum']
 
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 
 		## read pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).load(filehash)
 
 		## record versions of Linux kernel images and modules
 		if leafreports.has_key('kernelmodule'):
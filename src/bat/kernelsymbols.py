@@ -4,14 +4,14 @@
 ## Copyright 2015 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import os, os.path, sys, subprocess, copy, cPickle, multiprocessing
+import os, os.path, sys, subprocess, copy, multiprocessing
 import pydot, csv, tempfile, shutil
 if sys.version_info[1] == 7:
 	import collections
 	have_counter = True
 else:
 	have_counter = False
-import elfcheck
+import elfcheck, reportstore
 
 '''
 This plugin for the Binary Analysis Tool can be used to check how the symbols
@@ -93,9 +93,7 @@ def writeGraph((symbolgraph, filehash, counter, imagedir, generatesvg)):
 ## * kernel symbols (both locally defined and needed from remote)
 ## * dependencies
 def extractfromkernelfile((filehash, filename, topleveldir, scantempdir)):
- 	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
+ 	leafreports = reportstore.getstore(topleveldir).load(filehash)
 	if leafreports.has_key('identifier'):
 		if leafreports['identifier'].has_key('kernelsymbols'):
 			kernelsymbols = leafreports['identifier']['kernelsymbols']
@@ -214,7 +212,7 @@ def findsymbols(unpackreports, scantempdir, topleveldir, processors, scanenv, ba
 		if not 'checksum' in unpackreports[i]:
 			continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		if not 'linuxkernel' in unpackreports[i]['tags']:
 			continue
@@ -4,8 +4,9 @@
 ## Copyright 2011-2016 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import os, os.path, sys, subprocess, copy, cPickle, Queue
+import os, os.path, sys, subprocess, copy, Queue
 import multiprocessing, re, datetime
+import reportstore, resultcache, scanmetrics
 from multiprocessing import Process, Lock
 from multiprocessing.sharedctypes import Value, Array
 if sys.version_info[1] == 7:
@@ -61,6 +62,16 @@ stringsdbperlanguagetable = { 'C':                'stringscache_c'
                             , 'ActionScript':     'stringscache_actionscript'
                             }
 
+scoresdbperlanguagetable = { 'C':                'scores_c'
+                           , 'C#':               'scores_csharp'
+                           , 'Java':             'scores_java'
+                           , 'JavaScript':       'scores_javascript'
+                           , 'PHP':              'scores_php'
+                           , 'Python':           'scores_python'
+                           , 'Ruby':             'scores_ruby'
+                           , 'ActionScript':     'scores_actionscript'
+                           }
+
 avgstringsdbperlanguagetable = { 'C':                'avgstringscache_c'
                                , 'C#':               'avgstringscache_csharp'
                                , 'Java':             'avgstringscache_java'
@@ -163,7 +174,7 @@ def aggregatejars(unpackreports, scantempdir, topleveldir, pool, scanenv, cleanc
 			continue
 		else:
 			filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		if cleanclasses:
 			if filehash in sha256stofiles:
@@ -180,9 +191,7 @@ def aggregatejars(unpackreports, scantempdir, topleveldir, pool, scanenv, cleanc
 			if filehash in sha256seen:
 				alljarfiles.append(i)
 				continue
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-			leafreports = cPickle.load(leaf_file)
-			leaf_file.close()
+			leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags'])
 			if 'tags' in leafreports:
 				## check if it was tagged as a ZIP file
 				if 'zip' in leafreports['tags']:
@@ -236,7 +245,7 @@ def aggregatejars(unpackreports, scantempdir, topleveldir, pool, scanenv, cleanc
 				filehash = unpackreports[c]['checksum']
 				if len(sha256stofiles[filehash]) == 1:
 					try:
-						os.unlink(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash))
+						reportstore.getstore(topleveldir).delete(filehash)
 					except Exception, e:
 						print >>sys.stderr, "error removing", c, e
 						sys.stderr.flush()
@@ -290,13 +299,11 @@ def aggregate((jarfile, jarreport, unpackreports, topleveldir)):
 		if not 'ranking' in c['tags']:
 			continue
 		filehash = c['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 
-		## read pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		## read the tags and ranking results
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags', 'ranking'])
 
 		## and more sanity checks
 		if not 'binary' in leafreports['tags']:
@@ -445,15 +452,8 @@ def aggregate((jarfile, jarreport, unpackreports, topleveldir)):
 	## now write the new result
 	## TODO: only do this if there actually is an aggregate result
 	filehash = jarreport['checksum']
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
-
-	leafreports['ranking'] = (rankres, dynamicresfinal, {'classes': classmatches, 'fields': fieldmatches, 'sources': sourcematches}, 'Java')
-
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-	leafreports = cPickle.dump(leafreports, leaf_file)
-	leaf_file.close()
+	ranking = (rankres, dynamicresfinal, {'classes': classmatches, 'fields': fieldmatches, 'sources': sourcematches}, 'Java')
+	reportstore.getstore(topleveldir).update(filehash, {'ranking': ranking})
 	return (jarfile, aggregated)
 
 def prune(uniques, package):
@@ -558,8 +558,17 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 	if not determinelicense and not determineversion and not determinecopyright:
 		return None
 
+	## Maximum amount of strings per ranking worker in the cache with
+	## results of string lookups. Setting it to 0 disables the cache.
+	try:
+		stringcachesize = int(scanenv.get('BAT_STRING_CACHE_SIZE', 0))
+	except:
+		stringcachesize = 0
+	stringfrequencies = {}
+
 	## ignore files which don't have ranking results
 	rankingfiles = set()
+	rankedfiles = set()
 	filehashseen = set()
 	hashtoname = {}
 
@@ -579,11 +588,9 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 		if filehash in filehashseen:
 			continue
 		filehashseen.add(filehash)
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['identifier', 'tags'])
 		if not 'identifier' in leafreports:
 			continue
 		language = leafreports['identifier']['language']
@@ -591,6 +598,25 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 			rankingfilesperlanguage[language].add(i)
 		else:
 			rankingfilesperlanguage[language] = set([i])
+		## files could already have been ranked while the firmware was
+		## still being unpacked (see rankingperfile())
+		if 'ranking' in leafreports['tags']:
+			rankedfiles.add(filehash)
+			continue
+		## record in how many files each string occurs, so strings that
+		## occur in many files can be looked up before ranking starts.
+		if stringcachesize > 0:
+			if leafreports['identifier'].get('strings') != None:
+				if not language in stringfrequencies:
+					if have_counter:
+						stringfrequencies[language] = collections.Counter()
+					else:
+						stringfrequencies[language] = {}
+				if have_counter:
+					stringfrequencies[language].update(set(leafreports['identifier']['strings']))
+				else:
+					for l in set(leafreports['identifier']['strings']):
+						stringfrequencies[language][l] = stringfrequencies[language].get(l, 0) + 1
 
 	if len(rankingfilesperlanguage) == 0:
 		return None
@@ -630,10 +656,47 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 		for r in filter(lambda x: x[1] != 0, res):
 			avgscores[language][r[0]] = r[1]
 
+	## Strings that are in more than one file (libc messages, BusyBox
+	## applet strings, OpenSSL errors, etc.) are looked up once here. The
+	## results are shared with all the ranking workers for the language
+	## as a read only "hot set" that is part of their string cache.
+	hotsets = {}
+	if stringcachesize > 0:
+		try:
+			stringcutoff = int(scanenv.get('BAT_STRING_CUTOFF', 5))
+		except:
+			stringcutoff = 5
+		try:
+			batchsize = int(scanenv.get('BAT_BATCH_SIZE', 1000))
+			if batchsize < 1:
+				batchsize = 1000
+		except:
+			batchsize = 1000
+		for language in stringfrequencies:
+			hotsets[language] = {}
+			if not language in scanenv['supported_languages']:
+				continue
+			hotlines = filter(lambda x: stringfrequencies[language][x] > 1 and len(x) >= stringcutoff, stringfrequencies[language])
+			hotlines = sorted(hotlines, key=lambda x: stringfrequencies[language][x], reverse=True)[:stringcachesize]
+			if hotlines == []:
+				continue
+			batchstringquery = "select stringidentifier, package, filename FROM %s WHERE stringidentifier = ANY(" % stringsdbperlanguagetable[language] + "%s)"
+			(hotres, hotseen) = batchlookup(hotlines, batchstringquery, batcursors[0], batcons[0], batchsize)
+			for line in hotseen:
+				hotsets[language][line] = hotres.get(line, [])
+			if scandebug:
+				print >>sys.stderr, "string cache: %d strings for %s preloaded" % (len(hotsets[language]), language)
+	stringfrequencies = {}
+
 	## create a queue for tasks, with a few threads reading from the queue
 	## and looking up results and putting them in a result queue
 	scanmanager = multiprocessing.Manager()
-	res = []
+	res = list(rankedfiles)
+
+	## counters for the string caches and database queries of all workers
+	cachehits = Value('L', 0)
+	cachemisses = Value('L', 0)
+	dbqueries = Value('L', 0)
 
 	if processors == None:
 		processamount = 1
@@ -648,10 +711,11 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 		## creating new queues (max: amount of tasks, or CPUs, whichever is the smallest)
 		scanqueue = multiprocessing.JoinableQueue(maxsize=0)
 		reportqueue = scanmanager.Queue(maxsize=0)
-		lock = Lock()
-		ignorecache = scanmanager.dict()
 
 		lookup_tasks = map(lambda x: (unpackreports[x]['checksum'], os.path.join(unpackreports[x]['realpath'], unpackreports[x]['name'])),rankingfilesperlanguage[language])
+		lookup_tasks = filter(lambda x: not x[0] in rankedfiles, lookup_tasks)
+		if lookup_tasks == []:
+			continue
 
 		map(lambda x: scanqueue.put(x), lookup_tasks)
 		minprocessamount = min(len(lookup_tasks), processamount)
@@ -659,7 +723,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 		processpool = []
 
 		for i in range(0,minprocessamount):
-			p = multiprocessing.Process(target=lookup_identifier, args=(scanqueue,reportqueue, batcursors[i], batcons[i],scanenv,topleveldir,avgscores,clones,scandebug,ignorecache, lock))
+			p = multiprocessing.Process(target=lookup_identifier, args=(scanqueue,reportqueue, batcursors[i], batcons[i],scanenv,topleveldir,avgscores,clones,scandebug,stringcachesize,hotsets.get(language, {}),cachehits,cachemisses,dbqueries))
 			processpool.append(p)
 			p.start()
 
@@ -675,17 +739,27 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 				break
 		reportqueue.join()
 
+		## wait for the workers, so their I/O is counted in the metrics
 		for p in processpool:
 			p.terminate()
+			p.join()
 
 	## finally shut down the scan manager
 	scanmanager.shutdown()
+	hotsets = {}
+
+	if scandebug and stringcachesize > 0:
+		print >>sys.stderr, "string cache: %d hits, %d misses" % (cachehits.value, cachemisses.value)
+		sys.stderr.flush()
+	scanmetrics.count('cachehits', cachehits.value)
+	scanmetrics.count('dbqueries', dbqueries.value)
 
 	for filehash in res:
 		if filehash != None:
 			if filehash in hashtoname:
 				for w in hashtoname[filehash]:
-					unpackreports[w]['tags'].append('ranking')
+					if not 'ranking' in unpackreports[w]['tags']:
+						unpackreports[w]['tags'].append('ranking')
 
 	## optionally aggregate the JAR files
 	if 'Java' in rankingfilesperlanguage:
@@ -741,11 +815,9 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 			if connectdb:
 				break
 			unpackreport = unpackreports[rankingfile]
-			## read the pickle
+			## read the ranking results
 			filehash = unpackreport['checksum']
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-			leafreports = cPickle.load(leaf_file)
-			leaf_file.close()
+			leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['ranking', 'tags'])
 
 			(res, functionRes, variablepvs, language) = leafreports['ranking']
 
@@ -781,22 +853,29 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 	if not connectdb:
 		return
 
+	## Start a single pool of workers that is used for all lookups of
+	## checksums, versions, licenses and copyright statements for all
+	## files and languages. The workers keep their database connection
+	## until all files have been processed.
 	scanmanager = multiprocessing.Manager()
+	scanqueue = multiprocessing.JoinableQueue(maxsize=0)
+	reportqueue = scanmanager.Queue(maxsize=0)
+	processpool = []
+	dbqueries = Value('L', 0)
 
-	sha256_filename_query = "select version, pathname from processed_file where checksum=%s"
-	sha256_license_query = "select distinct license, scanner from licenses where checksum=%s"
-	sha256_copyright_query = "select distinct copyright, type from extracted_copyright where checksum=%s"
+	for i in range(0,min(processamount, len(batcursors))):
+		p = multiprocessing.Process(target=grab_sha256_worker, args=(scanqueue,reportqueue,batcursors[i], batcons[i], dbqueries))
+		processpool.append(p)
+		p.start()
 
 	for language in rankingfilesperlanguage:
 		## keep a list of versions per sha256, since source files often are in more than one version
 		sha256_versions = {}
 		for rankingfile in rankingfilesperlanguage[language]:
 			unpackreport = unpackreports[rankingfile]
-			## read the pickle
+			## read the ranking results
 			filehash = unpackreport['checksum']
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-			leafreports = cPickle.load(leaf_file)
-			leaf_file.close()
+			leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['ranking', 'tags'])
 
 			(res, functionRes, variablepvs, language) = leafreports['ranking']
 
@@ -839,35 +918,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 					## first grab all possible checksums, plus associated line numbers
 					## for this string. Since these are unique strings they will only be
 					## present in the package (or clones of the package).
-					processpool = []
-					vsha256s = []
-
-					scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-					reportqueue = scanmanager.Queue(maxsize=0)
-
-					map(lambda x: scanqueue.put(x), uniques)
-
-					minprocessamount = min(len(uniques), processamount)
-
-					for i in range(0,minprocessamount):
-						p = multiprocessing.Process(target=grab_sha256_parallel, args=(scanqueue,reportqueue,batcursors[i], batcons[i], language, 'string'))
-						processpool.append(p)
-						p.start()
-
-					scanqueue.join()
-
-					while True:
-						try:
-							val = reportqueue.get_nowait()
-							vsha256s.append(val)
-							reportqueue.task_done()
-						except Queue.Empty, e:
-							## Queue is empty
-							break
-					reportqueue.join()
-
-					for p in processpool:
-						p.terminate()
+					vsha256s = runlookups(map(lambda x: ('string', x, language), uniques), scanqueue, reportqueue)
 
 					## for each combination (line,sha256,linenumber) store per checksum
 					## the line and linenumber(s). The checksums are used to look up version
@@ -892,35 +943,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 										tmplines[line] = []
 								tmplines[line].append((checksum, linenumber, sha256_versions[checksum]))
 
-					processpool = []
-					fileres = []
-
-					scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-					reportqueue = scanmanager.Queue(maxsize=0)
-
-					map(lambda x: scanqueue.put(x), sha256_scan_versions.keys())
-
-					minprocessamount = min(len(sha256_scan_versions.keys()), processamount)
-
-					for i in range(0,minprocessamount):
-						p = multiprocessing.Process(target=grab_sha256_filename, args=(scanqueue,reportqueue,batcursors[i], batcons[i], sha256_filename_query))
-						processpool.append(p)
-						p.start()
-
-					scanqueue.join()
-
-					while True:
-						try:
-							val = reportqueue.get_nowait()
-							fileres.append(val)
-							reportqueue.task_done()
-						except Queue.Empty, e:
-							## Queue is empty
-							break
-					reportqueue.join()
-
-					for p in processpool:
-						p.terminate()
+					fileres = runlookups(map(lambda x: ('filename', x), sha256_scan_versions.keys()), scanqueue, reportqueue)
 
 					resdict = {}
 					map(lambda x: resdict.update(x), fileres)
@@ -980,33 +1003,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 					if determinelicense:
 						if len(licensesha256s) != 0:
 							licensesha256s = set(licensesha256s)
-							processpool = []
-
-							scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-							reportqueue = scanmanager.Queue(maxsize=0)
-
-							map(lambda x: scanqueue.put(x), licensesha256s)
-							minprocessamount = min(len(licensesha256s), processamount)
-
-							for i in range(0,minprocessamount):
-								p = multiprocessing.Process(target=grab_sha256_license, args=(scanqueue,reportqueue,batcursors[i], batcons[i], sha256_license_query))
-								processpool.append(p)
-								p.start()
-
-							scanqueue.join()
-
-							while True:
-								try:
-									val = reportqueue.get_nowait()
-									packagelicenses.append(val)
-									reportqueue.task_done()
-								except Queue.Empty, e:
-									## Queue is empty
-									break
-							reportqueue.join()
-
-							for p in processpool:
-								p.terminate()
+							packagelicenses = runlookups(map(lambda x: ('license', x), licensesha256s), scanqueue, reportqueue)
 
 							packagelicenses_tmp = []
 							for p in packagelicenses:
@@ -1015,33 +1012,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 
 					if determinecopyright:
 						if len(copyrightsha256s) != 0:
-							processpool = []
-
-							scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-							reportqueue = scanmanager.Queue(maxsize=0)
-
-							map(lambda x: scanqueue.put(x), copyrightsha256s)
-							minprocessamount = min(len(copyrightsha256s), processamount)
-
-							for i in range(0,minprocessamount):
-								p = multiprocessing.Process(target=grab_sha256_copyright, args=(scanqueue,reportqueue,batcursors[i], batcons[i], sha256_copyright_query))
-								processpool.append(p)
-								p.start()
-
-							scanqueue.join()
-
-							while True:
-								try:
-									val = reportqueue.get_nowait()
-									packagecopyrights.append(val)
-									reportqueue.task_done()
-								except Queue.Empty, e:
-									## Queue is empty
-									break
-							reportqueue.join()
-
-							for p in processpool:
-								p.terminate()
+							packagecopyrights = runlookups(map(lambda x: ('copyright', x), copyrightsha256s), scanqueue, reportqueue)
 
 							## result is a list of {sha256sum: list of copyright statements}
 							packagecopyrights_tmp = []
@@ -1064,34 +1035,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 					functionnames = functionRes['uniquepackages'][package]
 
 					## right now only C is supported. TODO: fix this for other languages such as Java.
-					processpool = []
-					vsha256s = []
-
-					scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-					reportqueue = scanmanager.Queue(maxsize=0)
-
-					map(lambda x: scanqueue.put(x), functionnames)
-					minprocessamount = min(len(functionnames), processamount)
-
-					for i in range(0,minprocessamount):
-						p = multiprocessing.Process(target=grab_sha256_parallel, args=(scanqueue,reportqueue,batcursors[i], batcons[i], 'C', 'function'))
-						processpool.append(p)
-						p.start()
-
-					scanqueue.join()
-
-					while True:
-						try:
-							val = reportqueue.get_nowait()
-							vsha256s.append(val)
-							reportqueue.task_done()
-						except Queue.Empty, e:
-							## Queue is empty
-							break
-					reportqueue.join()
-
-					for p in processpool:
-						p.terminate()
+					vsha256s = runlookups(map(lambda x: ('function', x, 'C'), functionnames), scanqueue, reportqueue)
 
 					sha256_scan_versions = {}
 					tmplines = {}
@@ -1113,33 +1057,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 								tmplines[functionname].append((checksum, linenumber, sha256_versions[checksum]))
 					fileres = []
 					if len(sha256_scan_versions.keys()) != 0:
-						processpool = []
-
-						scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-						reportqueue = scanmanager.Queue(maxsize=0)
-
-						map(lambda x: scanqueue.put(x), sha256_scan_versions.keys())
-						minprocessamount = min(len(sha256_scan_versions.keys()), processamount)
-
-						for i in range(0,minprocessamount):
-							p = multiprocessing.Process(target=grab_sha256_filename, args=(scanqueue,reportqueue,batcursors[i], batcons[i], sha256_filename_query))
-							processpool.append(p)
-							p.start()
-
-						scanqueue.join()
-
-						while True:
-							try:
-								val = reportqueue.get_nowait()
-								fileres.append(val)
-								reportqueue.task_done()
-							except Queue.Empty, e:
-								## Queue is empty
-								break
-						reportqueue.join()
-
-						for p in processpool:
-							p.terminate()
+						fileres = runlookups(map(lambda x: ('filename', x), sha256_scan_versions.keys()), scanqueue, reportqueue)
 
 					resdict = {}
 					map(lambda x: resdict.update(x), fileres)
@@ -1207,37 +1125,10 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 									vartype = 'kernelvariable'
 							uniques = variablepvs['uniquepackages'][package]
 
-							processpool = []
-							vsha256s = []
-
-							scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-							reportqueue = scanmanager.Queue(maxsize=0)
+							vsha256s = runlookups(map(lambda x: (vartype, x, language), uniques), scanqueue, reportqueue)
 
-							map(lambda x: scanqueue.put(x), uniques)
-							minprocessamount = min(len(uniques), processamount)
-
-							for i in range(0,minprocessamount):
-								p = multiprocessing.Process(target=grab_sha256_parallel, args=(scanqueue,reportqueue,batcursors[i], batcons[i], language, vartype))
-								processpool.append(p)
-								p.start()
-
-							scanqueue.join()
-
-							while True:
-								try:
-									val = reportqueue.get_nowait()
-									vsha256s.append(val)
-									reportqueue.task_done()
-								except Queue.Empty, e:
-									## Queue is empty
-									break
-							reportqueue.join()
-
-							for p in processpool:
-								p.terminate()
-
-                        					sha256_scan_versions = {}
-                        					tmplines = {}
+							sha256_scan_versions = {}
+							tmplines = {}
 
 							for p in vsha256s:
 								(variablename, varres) = p
@@ -1257,34 +1148,7 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 
 							resdict = {}
 							if len(sha256_scan_versions.keys()) != 0:
-								processpool = []
-								fileres = []
-
-								scanqueue = multiprocessing.JoinableQueue(maxsize=0)
-								reportqueue = scanmanager.Queue(maxsize=0)
-
-								map(lambda x: scanqueue.put(x), sha256_scan_versions.keys())
-								minprocessamount = min(len(sha256_scan_versions.keys()), processamount)
-
-								for i in range(0,minprocessamount):
-									p = multiprocessing.Process(target=grab_sha256_filename, args=(scanqueue,reportqueue,batcursors[i], batcons[i], sha256_filename_query))
-									processpool.append(p)
-									p.start()
-
-								scanqueue.join()
-
-								while True:
-									try:
-										val = reportqueue.get_nowait()
-										fileres.append(val)
-										reportqueue.task_done()
-									except Queue.Empty, e:
-										## Queue is empty
-										break
-								reportqueue.join()
-
-								for p in processpool:
-									p.terminate()
+								fileres = runlookups(map(lambda x: ('filename', x), sha256_scan_versions.keys()), scanqueue, reportqueue)
 
 								map(lambda x: resdict.update(x), fileres)
 
@@ -1341,83 +1205,110 @@ def determinelicense_version_copyright(unpackreports, scantempdir, topleveldir,
 			if changed:
 				leafreports['ranking'] = (res, functionRes, variablepvs, language)
 				leafreports['tags'] = list(set(leafreports['tags'] + ['ranking']))
-				leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-				leafreports = cPickle.dump(leafreports, leaf_file)
-				leaf_file.close()
+				reportstore.getstore(topleveldir).update(filehash, leafreports)
 				unpackreport['tags'].append('ranking')
 
+	## wait for the workers, so their I/O is counted in the metrics
+	for p in processpool:
+		p.terminate()
+		p.join()
+	scanmetrics.count('dbqueries', dbqueries.value)
+
 	## finally shut down the scan manager
 	scanmanager.shutdown()
 
-## grab variable names.
-def grab_sha256_varname(scanqueue, reportqueue, cursor, conn, query):
-	while True:
-		sha256sum = scanqueue.get(timeout=2592000)
-		c.execute(query, (sha256sum,))
-		results = c.fetchall()
-		conn.commit()
-		reportqueue.put({sha256sum: results})
-		scanqueue.task_done()
-
-def grab_sha256_filename(scanqueue, reportqueue, cursor, conn, query):
-	while True:
-		sha256sum = scanqueue.get(timeout=2592000)
-		cursor.execute(query, (sha256sum,))
-		results = cursor.fetchall()
-		conn.commit()
-		reportqueue.put({sha256sum: results})
-		scanqueue.task_done()
-
-## grab copyright statements from the license database
-def grab_sha256_copyright(scanqueue, reportqueue, cursor, conn, query):
-	while True:
-		sha256sum = scanqueue.get(timeout=2592000)
-		cursor.execute(query, (sha256sum,))
-		results = cursor.fetchall()
-		conn.commit()
-		## 'statements' are not very accurate so ignore those
-		results = filter(lambda x: x[1] != 'statement', results)
-		reportqueue.put({sha256sum: results})
-		scanqueue.task_done()
+## Send a list of jobs to the lookup workers, wait for all of them to be
+## processed and return the results.
+def runlookups(jobs, scanqueue, reportqueue):
+	results = []
+	if jobs == []:
+		return results
+	map(lambda x: scanqueue.put(x), jobs)
+	scanqueue.join()
 
-## grab licenses from the license database
-def grab_sha256_license(scanqueue, reportqueue, cursor, conn, query):
 	while True:
-		sha256sum = scanqueue.get(timeout=2592000)
-		cursor.execute(query, (sha256sum,))
-		results = cursor.fetchall()
-		conn.commit()
-		reportqueue.put({sha256sum: results})
-		scanqueue.task_done()
-
-def grab_sha256_parallel(scanqueue, reportqueue, cursor, conn, language, querytype):
+		try:
+			val = reportqueue.get_nowait()
+			results.append(val)
+			reportqueue.task_done()
+		except Queue.Empty, e:
+			## Queue is empty
+			break
+	reportqueue.join()
+	return results
+
+## Long running worker for looking up information in the database. Jobs are
+## tuples where the first element indicates the type of job:
+##
+## * ('string', string, language), ('function', functionname, language),
+##   ('variable', variablename, language), ('kernelvariable', name, language):
+##   look up the checksums and line numbers of the source code files the
+##   identifier can be found in. Result: (identifier, [(checksum, linenumber)])
+## * ('filename', checksum): look up versions and path names of a checksum.
+##   Result: {checksum: [(version, pathname)]}
+## * ('license', checksum): look up licenses of a checksum.
+##   Result: {checksum: [(license, scanner)]}
+## * ('copyright', checksum): look up copyright statements of a checksum.
+##   Result: {checksum: [(copyright, type)]}
+##
+## The amount of database queries is added to 'dbqueries' for the metrics.
+def grab_sha256_worker(scanqueue, reportqueue, cursor, conn, dbqueries):
 	stringquery = "select distinct checksum, linenumber, language from extracted_string where stringidentifier=%s and language=%s"
 	functionquery = "select distinct checksum, linenumber, language from extracted_function where functionname=%s"
 	variablequery = "select distinct checksum, linenumber, language, type from extracted_name where name=%s"
 	kernelvarquery = "select distinct checksum, linenumber, language, type from extracted_name where name=%s"
+	filenamequery = "select version, pathname from processed_file where checksum=%s"
+	licensequery = "select distinct license, scanner from licenses where checksum=%s"
+	copyrightquery = "select distinct copyright, type from extracted_copyright where checksum=%s"
+
+	scanmetrics.resetcounters()
 	while True:
-		res = None
-		line = scanqueue.get(timeout=2592000)
-		if querytype == "string":
-			cursor.execute(stringquery, (line,language))
-			res = cursor.fetchall()
-		elif querytype == 'function':
-			cursor.execute(functionquery, (line,))
-			res = cursor.fetchall()
-		elif querytype == 'variable':
-			cursor.execute(variablequery, (line,))
-			res = cursor.fetchall()
-			res = filter(lambda x: x[3] == 'variable', res)
-		elif querytype == 'kernelvariable':
-			cursor.execute(kernelvarquery, (line,))
-			res = cursor.fetchall()
-			res = filter(lambda x: x[3] == 'kernelsymbol', res)
-		conn.commit()
-		if res != None:
-			res = filter(lambda x: x[2] == language, res)
-			## TODO: make a list of line numbers
-			res = map(lambda x: (x[0], x[1]), res)
-			reportqueue.put((line, res))
+		job = scanqueue.get(timeout=2592000)
+		jobtype = job[0]
+		if jobtype == 'filename':
+			sha256sum = job[1]
+			cursor.execute(filenamequery, (sha256sum,))
+			results = cursor.fetchall()
+			conn.commit()
+			reportqueue.put({sha256sum: results})
+		elif jobtype == 'license':
+			sha256sum = job[1]
+			cursor.execute(licensequery, (sha256sum,))
+			results = cursor.fetchall()
+			conn.commit()
+			reportqueue.put({sha256sum: results})
+		elif jobtype == 'copyright':
+			sha256sum = job[1]
+			cursor.execute(copyrightquery, (sha256sum,))
+			results = cursor.fetchall()
+			conn.commit()
+			## 'statements' are not very accurate so ignore those
+			results = filter(lambda x: x[1] != 'statement', results)
+			reportqueue.put({sha256sum: results})
+		else:
+			(querytype, line, language) = job
+			res = None
+			if querytype == "string":
+				cursor.execute(stringquery, (line,language))
+				res = cursor.fetchall()
+			elif querytype == 'function':
+				cursor.execute(functionquery, (line,))
+				res = cursor.fetchall()
+			elif querytype == 'variable':
+				cursor.execute(variablequery, (line,))
+				res = cursor.fetchall()
+				res = filter(lambda x: x[3] == 'variable', res)
+			elif querytype == 'kernelvariable':
+				cursor.execute(kernelvarquery, (line,))
+				res = cursor.fetchall()
+				res = filter(lambda x: x[3] == 'kernelsymbol', res)
+			conn.commit()
+			if res != None:
+				res = filter(lambda x: x[2] == language, res)
+				## TODO: make a list of line numbers
+				res = map(lambda x: (x[0], x[1]), res)
+				reportqueue.put((line, res))
+		scanmetrics.sharecounter('dbqueries', dbqueries)
 		scanqueue.task_done()
 
 def extractJava(javameta, scanenv, funccursor, funcconn, clones):
@@ -1737,9 +1628,126 @@ def scanDynamic(scanstr, variables, scanenv, funccursor, funcconn, clones):
 
 	return (dynamicRes, variablepvs)
 
+## Look up many identifiers at once using a query that takes an array as its
+## single parameter (for example "WHERE stringidentifier = ANY(%s)") and that
+## returns the identifier as the first column. This needs one round trip to the
+## database per chunk instead of one round trip per identifier.
+## Returns a dictionary {identifier: [remaining columns]} and the set of
+## identifiers that were actually looked up. If a chunk fails (for example
+## because of encoding issues) its identifiers are not added to this set, so
+## they can still be looked up one by one.
+def batchlookup(identifiers, query, cursor, conn, chunksize=1000):
+	results = {}
+	lookedup = set()
+	identifiers = list(identifiers)
+	for i in xrange(0, len(identifiers), chunksize):
+		chunk = identifiers[i:i+chunksize]
+		try:
+			cursor.execute(query, (chunk,))
+			res = cursor.fetchall()
+			conn.commit()
+		except Exception, e:
+			conn.rollback()
+			continue
+		lookedup.update(chunk)
+		for r in res:
+			if r[0] in results:
+				results[r[0]].append(r[1:])
+			else:
+				results[r[0]] = [r[1:]]
+	return (results, lookedup)
+
+## Cache for results of string lookups, with a maximum size. If the cache is
+## full the least recently used string is removed. A read only "hot set" of
+## strings that were already looked up before the workers started (shared
+## between all workers, as it is inherited when the worker is started) is
+## always used first and does not count towards the maximum size.
+## Strings without any results are cached as well (as an empty list).
+## The cache is only created if 'maxsize' is larger than 0 (OrderedDict is
+## not available on systems without Counter).
+class StringCache:
+	def __init__(self, maxsize, hotset={}):
+		self.maxsize = maxsize
+		self.hotset = hotset
+		if self.maxsize > 0:
+			self.cache = collections.OrderedDict()
+		else:
+			self.cache = {}
+		self.hits = 0
+		self.misses = 0
+
+	## return the cached results for a string, or None if not cached. If
+	## 'count' is False the lookup is not counted as a hit or a miss, for
+	## strings that were already counted in an earlier lookup.
+	def get(self, line, count=True):
+		if line in self.hotset:
+			if count:
+				self.hits += 1
+			return self.hotset[line]
+		if line in self.cache:
+			## move the string to the end, as it was most recently used
+			res = self.cache.pop(line)
+			self.cache[line] = res
+			if count:
+				self.hits += 1
+			return res
+		if count:
+			self.misses += 1
+		return None
+
+	def put(self, line, res):
+		if self.maxsize <= 0:
+			return
+		if line in self.hotset:
+			return
+		if line in self.cache:
+			self.cache.pop(line)
+		elif len(self.cache) >= self.maxsize:
+			self.cache.popitem(last=False)
+		self.cache[line] = res
+
 ## match identifiers with data in the database
 ## First match string literals, then function names and variable names for various languages
-def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir, avgscores, clones, scandebug, unmatchedignorecache, lock):
+def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir, avgscores, clones, scandebug, stringcachesize, hotset, cachehits, cachemisses, dbqueries):
+	## Results of string lookups are cached in the worker, so strings that
+	## occur in many files are not looked up over and over again. Strings
+	## that could not be found (also not in any of the variants for
+	## the Linux kernel) are remembered as well.
+	if not have_counter:
+		stringcachesize = 0
+		hotset = {}
+	stringcache = StringCache(stringcachesize, hotset)
+	unmatchedignorecache = set()
+
+	scanmetrics.resetcounters()
+	while True:
+		## get a new task from the queue
+		(filehash, filename) = scanqueue.get(timeout=2592000)
+		ranked = rankfile(filehash, filename, cursor, conn, scanenv, topleveldir, avgscores, clones, scandebug, stringcache, unmatchedignorecache)
+		scanmetrics.sharecounter('dbqueries', dbqueries)
+		if not ranked:
+			scanqueue.task_done()
+			continue
+
+		## update the shared cache statistics once per file
+		cachehits.get_lock().acquire()
+		cachehits.value += stringcache.hits
+		cachehits.get_lock().release()
+		cachemisses.get_lock().acquire()
+		cachemisses.value += stringcache.misses
+		cachemisses.get_lock().release()
+		stringcache.hits = 0
+		stringcache.misses = 0
+
+		reportqueue.put(filehash)
+		scanqueue.task_done()
+
+## Rank a single file: look up the strings, function names and variable names
+## that were extracted from the file in the database, compute the scores and
+## write the ranking to the report store. The string cache and the cache of
+## unmatched strings are kept by the caller, so they can be reused for other
+## files. Returns False if there was nothing to rank.
+def rankfile(filehash, filename, cursor, conn, scanenv, topleveldir, avgscores, clones, scandebug, stringcache, unmatchedignorecache):
 	## first some things that are shared between all scans
 	if 'BAT_STRING_CUTOFF' in scanenv:
 		try:
@@ -1749,7 +1757,7 @@ def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir
 	else:
 		stringcutoff = 5
 
-	## TODO: this should be done per language
+	## scores are precomputed per language by maintenance/scorecache.py
 	if 'BAT_SCORE_CACHE' in scanenv:
 		precomputescore = True
 	else:
@@ -1766,273 +1774,374 @@ def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir
 	scorecutoff = 1.0e-20
 	gaincutoff = 1
 
+	## Look up all distinct strings of a file in chunks, instead of
+	## doing a query per line. This saves a lot of round trips to the
+	## database for files with many strings (Linux kernel, BusyBox).
+	batchlookups = False
+	if scanenv.get('BAT_BATCH_LOOKUP', 0) == '1':
+		batchlookups = True
+	try:
+		batchsize = int(scanenv.get('BAT_BATCH_SIZE', 1000))
+		if batchsize < 1:
+			batchsize = 1000
+	except:
+		batchsize = 1000
+
 	kernelquery = "select package FROM linuxkernelfunctionnamecache WHERE functionname=%s LIMIT 1"
-	precomputequery = "select score from scores where stringidentifier=%s LIMIT 1"
+	batchkernelquery = "select distinct functionname FROM linuxkernelfunctionnamecache WHERE functionname = ANY(%s)"
 
-	while True:
-		## get a new task from the queue
-		(filehash, filename) = scanqueue.get(timeout=2592000)
+	## read the data that is needed for ranking
+	leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['identifier', 'tags'])
+	if not 'identifier' in leafreports:
+		## If there is no relevant data to scan continue to the next file
+		return False
 
-		## read the pickle with the data
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
-		if not 'identifier' in leafreports:
-			## If there is no relevant data to scan continue to the next file
-			scanqueue.task_done()
-			continue
+	if leafreports['identifier'] == {}:
+		## If there is no relevant data to scan continue to the next file
+		return False
 
-		if leafreports['identifier'] == {}:
-			## If there is no relevant data to scan continue to the next file
-			scanqueue.task_done()
-			continue
+	## grab the lines extracted earlier
+	lines = leafreports['identifier']['strings']
 
-		## grab the lines extracted earlier
-		lines = leafreports['identifier']['strings']
+	language = leafreports['identifier']['language']
 
-		language = leafreports['identifier']['language']
+	## this should of course not happen, but hey...
+	scanlines = True
+	if not language in scanenv['supported_languages']:
+		scanlines = False
 
-		## this should of course not happen, but hey...
-		scanlines = True
-		if not language in scanenv['supported_languages']:
-			scanlines = False
+	if not language in scoresdbperlanguagetable:
+		precomputescore = False
+	else:
+		precomputequery = "select score from %s where stringidentifier=" % scoresdbperlanguagetable[language] + "%s LIMIT 1"
+		batchprecomputequery = "select stringidentifier, score from %s where stringidentifier = ANY(" % scoresdbperlanguagetable[language] + "%s)"
 
-		if lines == None:
-			lenlines = 0
-			scanlines = False
-		else:
-			lenlines = len(lines)
-
-		linuxkernel = False
-		scankernelfunctions = False
-		if 'linuxkernel' in leafreports['tags']:
-			linuxkernel = True
-			if scanenv.get('BAT_KERNELFUNCTION_SCAN') == 1 and language == 'C':
-				scankernelfunctions = True
-
-		## first compute the score for the lines
-		if lenlines != 0 and scanlines:
-			## keep a dict of versions, license and copyright statements per package. TODO: remove these.
-			packageversions = {}
-			packagelicenses = {}
-			packagecopyrights = {}
-
-			if have_counter:
-				linecount = collections.Counter(lines)
-			else:
-				linecount = {}
-				for l in lines:
-					if l in linecount:
-						linecount[l] += 1
-					else:
-						linecount[l] = 1
-
-			## first look up and assign strings for as far as possible.
-			## strings that have not been assigned will be assigned later based
-			## on their score.
-			## Look up strings in the database and assign strings to packages.
-			uniqueMatches = {}
-			nonUniqueScore = {}
-			stringsLeft = {}
-			sameFileScore = {}
-			nonUniqueMatches = {}
-			nonUniqueMatchLines = []
-			nonUniqueAssignments = {}
-			directAssignedString = {}
-			unmatched = []
-			ignored = []
-			#unmatchedignorecache = set()
-
-			kernelfuncres = []
-			kernelparamres = []
+	if lines == None:
+		lenlines = 0
+		scanlines = False
+	else:
+		lenlines = len(lines)
+
+	linuxkernel = False
+	scankernelfunctions = False
+	if 'linuxkernel' in leafreports['tags']:
+		linuxkernel = True
+		if scanenv.get('BAT_KERNELFUNCTION_SCAN') == 1 and language == 'C':
+			scankernelfunctions = True
+
+	## Files that are identical to files that were ranked in earlier
+	## scans with the same configuration and knowledgebase do not need
+	## to be ranked again. Whether or not the file is a Linux kernel
+	## changes the ranking, so this is part of the context.
+	cachedranking = None
+	if 'BAT_RESULTCACHE' in scanenv:
+		cachedranking = resultcache.getcache(scanenv['BAT_RESULTCACHE']).get(filehash, scanenv['BAT_RESULTCACHE_FINGERPRINT'], linuxkernel)
+
+	## first compute the score for the lines
+	if cachedranking != None:
+		(res, functionRes, variablepvs, language) = cachedranking
+	elif lenlines != 0 and scanlines:
+		## keep a dict of versions, license and copyright statements per package. TODO: remove these.
+		packageversions = {}
+		packagelicenses = {}
+		packagecopyrights = {}
 
-			if scandebug:
-				print >>sys.stderr, "total extracted strings for %s: %d" % (filename, lenlines)
-
-			## some counters for keeping track of how many matches there are
-			matchedlines = 0
-			unmatchedlines = 0
-			matchednotclonelines = 0
-			matchednonassignedlines = 0
-			matcheddirectassignedlines = 0
-			nrUniqueMatches = 0
-
-			## start values for some state variables that are used
-			## most of these are only used if 'usesourceorder' == False
-			matched = False
-			matchednonassigned = False
-			matchednotclones = False
-			kernelfunctionmatched = False
-			uniquematch = False
-			oldline = None
-			notclones = []
-
-			if usesourceorder:
-				## keep track of which package was the most uniquely matched package
-				uniquepackage_tmp = None
-				uniquefilenames_tmp = []
-
-				## keep a backlog for strings that could possibly be assigned later
-				backlog = []
-				notclonesbacklog = []
-			else:
-				## sort the lines first, so it is easy to skip duplicates
-				lines.sort()
-
-			stringquery = "select package, filename FROM %s WHERE stringidentifier=" % stringsdbperlanguagetable[language] + "%s"
-			if stringsdbperlanguagetable[language] == 'stringscache_actionscript':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 141
-			elif stringsdbperlanguagetable[language] == 'stringscache_c':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 24824
-			elif stringsdbperlanguagetable[language] == 'stringscache_java':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 20255
-			elif stringsdbperlanguagetable[language] == 'stringscache_javascript':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 7506
-			elif stringsdbperlanguagetable[language] == 'stringscache_php':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 1950
-			elif stringsdbperlanguagetable[language] == 'stringscache_python':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 12352
-			elif stringsdbperlanguagetable[language] == 'stringscache_ruby':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 3048
-			elif stringsdbperlanguagetable[language] == 'varnamecache_c':
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 18390
-			else:
-				print(stringsdbperlanguagetable[language])
-				total_num_pkgs = 1
+		if have_counter:
+			linecount = collections.Counter(lines)
+		else:
+			linecount = {}
+			for l in lines:
+				if l in linecount:
+					linecount[l] += 1
+				else:
+					linecount[l] = 1
+
+		## first look up and assign strings for as far as possible.
+		## strings that have not been assigned will be assigned later based
+		## on their score.
+		## Look up strings in the database and assign strings to packages.
+		uniqueMatches = {}
+		nonUniqueScore = {}
+		stringsLeft = {}
+		sameFileScore = {}
+		nonUniqueMatches = {}
+		nonUniqueMatchLines = []
+		nonUniqueAssignments = {}
+		directAssignedString = {}
+		unmatched = []
+		ignored = []
+		#unmatchedignorecache = set()
+
+		kernelfuncres = []
+		kernelparamres = []
+
+		if scandebug:
+			print >>sys.stderr, "total extracted strings for %s: %d" % (filename, lenlines)
+
+		## some counters for keeping track of how many matches there are
+		matchedlines = 0
+		unmatchedlines = 0
+		matchednotclonelines = 0
+		matchednonassignedlines = 0
+		matcheddirectassignedlines = 0
+		nrUniqueMatches = 0
+
+		## start values for some state variables that are used
+		## most of these are only used if 'usesourceorder' == False
+		matched = False
+		matchednonassigned = False
+		matchednotclones = False
+		kernelfunctionmatched = False
+		uniquematch = False
+		oldline = None
+		notclones = []
+
+		if usesourceorder:
+			## keep track of which package was the most uniquely matched package
+			uniquepackage_tmp = None
+			uniquefilenames_tmp = []
+
+			## keep a backlog for strings that could possibly be assigned later
+			backlog = []
+			notclonesbacklog = []
+		else:
+			## sort the lines first, so it is easy to skip duplicates
+			lines.sort()
+
+		stringquery = "select package, filename FROM %s WHERE stringidentifier=" % stringsdbperlanguagetable[language] + "%s"
+		if stringsdbperlanguagetable[language] == 'stringscache_actionscript':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 141
+		elif stringsdbperlanguagetable[language] == 'stringscache_c':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 24824
+		elif stringsdbperlanguagetable[language] == 'stringscache_java':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 20255
+		elif stringsdbperlanguagetable[language] == 'stringscache_javascript':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 7506
+		elif stringsdbperlanguagetable[language] == 'stringscache_php':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 1950
+		elif stringsdbperlanguagetable[language] == 'stringscache_python':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 12352
+		elif stringsdbperlanguagetable[language] == 'stringscache_ruby':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 3048
+		elif stringsdbperlanguagetable[language] == 'varnamecache_c':
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 18390
+		else:
+			print(stringsdbperlanguagetable[language])
+			total_num_pkgs = 1
 			
-			# total_num_pkgs_query = "SELECT distinct(count(package)) FROM %s" % stringsdbperlanguagetable[language]
-			# cursor.execute(total_num_pkgs_query)
-			# total_num_pkgs = cursor.fetchone()[0]
-			# print(total_num_pkgs)
-
-			for line in lines:
-				#if scandebug:
-				#	print >>sys.stderr, u"processing <|%s|>" % line
-				kernelfunctionmatched = False
-
-				if not usesourceorder:
-					## speedup if the line happens to be the same as the old one
-					## This does *not* alter the score in any way, but perhaps
-					## it should: having a very significant string a few times
-					## is a strong indication.
-					if line == oldline:
-						if matched:
-							matchedlines += 1
-							if uniquematch:
-								nrUniqueMatches += 1
-								#uniqueMatches[package].append((line, []))
-						elif matchednonassigned:
-							linecount[line] = linecount[line] - 1
-							matchednonassignedlines += 1
-						elif matchednotclones:
-							linecount[line] = linecount[line] - 1
-							matchednotclonelines += 1
-						else:
-							unmatchedlines += 1
-							linecount[line] = linecount[line] - 1
-						continue
-					uniquematch = False
-					matched = False
-					matchednonassigned = False
-					matchednotclones = False
-					oldline = line
-
-				## skip empty lines (only triggered if stringcutoff == 0)
-				if line == "":
+		# total_num_pkgs_query = "SELECT distinct(count(package)) FROM %s" % stringsdbperlanguagetable[language]
+		# cursor.execute(total_num_pkgs_query)
+		# total_num_pkgs = cursor.fetchone()[0]
+		# print(total_num_pkgs)
+
+		## results of the batched lookups. Lines that are in 'batchseen' were
+		## looked up: if they are not in 'batchres' there was no match. Lines
+		## that are not in 'batchseen' are looked up one by one as before.
+		batchres = {}
+		batchseen = set()
+		batchscores = {}
+		batchscoreseen = set()
+		batchkernel = {}
+		batchkernelseen = set()
+		if batchlookups:
+			lookuplines = set()
+			for line in linecount:
+				if len(line) < stringcutoff or line == "":
 					continue
-
-				lock.acquire()
 				if line in unmatchedignorecache:
-					lock.release()
-					unmatched.append(line)
-					unmatchedlines += 1
-					linecount[line] = linecount[line] - 1
 					continue
-				lock.release()
+				cacheres = stringcache.get(line)
+				if cacheres != None:
+					batchseen.add(line)
+					if cacheres != []:
+						batchres[line] = cacheres
+					continue
+				lookuplines.add(line)
+			if precomputescore:
+				(batchscores, batchscoreseen) = batchlookup(lookuplines, batchprecomputequery, cursor, conn, batchsize)
+			if scankernelfunctions:
+				(batchkernel, batchkernelseen) = batchlookup(lookuplines, batchkernelquery, cursor, conn, batchsize)
+			batchstringquery = "select stringidentifier, package, filename FROM %s WHERE stringidentifier = ANY(" % stringsdbperlanguagetable[language] + "%s)"
+			(lookupres, lookupseen) = batchlookup(lookuplines, batchstringquery, cursor, conn, batchsize)
+			for line in lookupseen:
+				stringcache.put(line, lookupres.get(line, []))
+			batchres.update(lookupres)
+			batchseen.update(lookupseen)
+			if scandebug:
+				print >>sys.stderr, "batched lookup for %s: %d distinct strings, %d with matches" % (filename, len(lookuplines), len(batchres))
 
-				if len(line) < stringcutoff:
-					ignored.append(line)
-					linecount[line] = linecount[line] - 1
+		for line in lines:
+			#if scandebug:
+			#	print >>sys.stderr, u"processing <|%s|>" % line
+			kernelfunctionmatched = False
+
+			if not usesourceorder:
+				## speedup if the line happens to be the same as the old one
+				## This does *not* alter the score in any way, but perhaps
+				## it should: having a very significant string a few times
+				## is a strong indication.
+				if line == oldline:
+					if matched:
+						matchedlines += 1
+						if uniquematch:
+							nrUniqueMatches += 1
+							#uniqueMatches[package].append((line, []))
+					elif matchednonassigned:
+						linecount[line] = linecount[line] - 1
+						matchednonassignedlines += 1
+					elif matchednotclones:
+						linecount[line] = linecount[line] - 1
+						matchednotclonelines += 1
+					else:
+						unmatchedlines += 1
+						linecount[line] = linecount[line] - 1
 					continue
+				uniquematch = False
+				matched = False
+				matchednonassigned = False
+				matchednotclones = False
+				oldline = line
+
+			## skip empty lines (only triggered if stringcutoff == 0)
+			if line == "":
+				continue
+
+			if line in unmatchedignorecache:
+				unmatched.append(line)
+				unmatchedlines += 1
+				linecount[line] = linecount[line] - 1
+				continue
 
-				## An extra check for lines that score extremely low. This
-				## helps reduce load on databases stored on slower disks. Only used if
-				## precomputescore is set and "source order" is False.
-				if precomputescore:
+			if len(line) < stringcutoff:
+				ignored.append(line)
+				linecount[line] = linecount[line] - 1
+				continue
+
+			## An extra check for lines that score extremely low. This
+			## helps reduce load on databases stored on slower disks. Only used if
+			## precomputescore is set and "source order" is False.
+			if precomputescore:
+				if line in batchscoreseen:
+					if line in batchscores:
+						scoreres = batchscores[line][0]
+					else:
+						scoreres = None
+				else:
 					cursor.execute(precomputequery, (line,))
 					scoreres = cursor.fetchone()
 					conn.commit()
-					if scoreres != None:
-						## If the score is so low it will not have any influence on the final
-						## score, why even bother hitting the disk?
-						## Since there might be package rewrites this should be a bit less than the
-						## cut off value that was defined.
-						if scoreres[0] < scorecutoff/100:
-							nonUniqueMatchLines.append(line)
-							matchednonassignedlines += 1
-							matchednonassigned = True
-							linecount[line] = linecount[line] - 1
-							continue
+				if scoreres != None:
+					## If the score is so low it will not have any influence on the final
+					## score, why even bother hitting the disk?
+					## Since there might be package rewrites this should be a bit less than the
+					## cut off value that was defined.
+					if scoreres[0] < scorecutoff/100:
+						nonUniqueMatchLines.append(line)
+						matchednonassignedlines += 1
+						matchednonassigned = True
+						linecount[line] = linecount[line] - 1
+						continue
 
-				## if scoreres is None the line could still be something else like a kernel function, or a
-				## kernel string in a different format, so keep searching.
-				## If the image is a Linux kernel image first try Linux kernel specific matching
-				## like function names, then continue as normal.
+			## if scoreres is None the line could still be something else like a kernel function, or a
+			## kernel string in a different format, so keep searching.
+			## If the image is a Linux kernel image first try Linux kernel specific matching
+			## like function names, then continue as normal.
 
-				if linuxkernel:
-					## This is where things get a bit ugly. The strings in a Linux
-					## kernel image could also be function names, not string constants.
-					## There could be false positives here...
-					if scankernelfunctions:
+			if linuxkernel:
+				## This is where things get a bit ugly. The strings in a Linux
+				## kernel image could also be function names, not string constants.
+				## There could be false positives here...
+				if scankernelfunctions:
+					if line in batchkernelseen:
+						kernelres = batchkernel.get(line, [])
+					else:
 						cursor.execute(kernelquery, (line,))
 						kernelres = cursor.fetchall()
 						conn.commit()
-						if len(kernelres) != 0:
-							kernelfuncres.append(line)
-							kernelfunctionmatched = True
-							linecount[line] = linecount[line] - 1
-							continue
+					if len(kernelres) != 0:
+						kernelfuncres.append(line)
+						kernelfunctionmatched = True
+						linecount[line] = linecount[line] - 1
+						continue
 
-				## then see if there is anything in the cache at all
-				try:
+			## then see if there is anything in the cache at all. With
+			## batched lookups the string was already counted as a
+			## cache miss before the batched lookup.
+			if line in batchseen:
+				res = batchres.get(line, [])
+			else:
+				res = stringcache.get(line, not batchlookups)
+			try:
+				if res == None:
 					cursor.execute(stringquery, (line,))
-				except:
+					res = cursor.fetchall()
 					conn.commit()
-					## something weird is going on here, probably
-					## with encodings, so just ignore the line for
-					## now.
-					## One example is com.addi_40_src/src/com/addi/toolbox/crypto/aes.java
-					## from F-Droid. At line 221 there is a string SS.
-					## This string poses a problem.
-					unmatched.append(line)
-					unmatchedlines += 1
-					linecount[line] = linecount[line] - 1
-					lock.acquire()
-					unmatchedignorecache[line] = 1
-					lock.release()
-					continue
-				res = cursor.fetchall()
+					stringcache.put(line, res)
+			except:
 				conn.commit()
+				## something weird is going on here, probably
+				## with encodings, so just ignore the line for
+				## now.
+				## One example is com.addi_40_src/src/com/addi/toolbox/crypto/aes.java
+				## from F-Droid. At line 221 there is a string SS.
+				## This string poses a problem.
+				unmatched.append(line)
+				unmatchedlines += 1
+				linecount[line] = linecount[line] - 1
+				unmatchedignorecache.add(line)
+				continue
 
-				if len(res) == 0 and linuxkernel:
-					## make a copy of the original line
-					origline = line
-					## try a few variants that could occur in the Linux kernel
-					## The values of KERN_ERR and friends have changed in the years.
-					## In 2.6 it used to be for example <3> (defined in include/linux/kernel.h
-					## or include/linux/printk.h )
-					## In later kernels this was changed.
-					matchres = reerrorlevel.match(line)
+			if len(res) == 0 and linuxkernel:
+				## make a copy of the original line
+				origline = line
+				## try a few variants that could occur in the Linux kernel
+				## The values of KERN_ERR and friends have changed in the years.
+				## In 2.6 it used to be for example <3> (defined in include/linux/kernel.h
+				## or include/linux/printk.h )
+				## In later kernels this was changed.
+				matchres = reerrorlevel.match(line)
+				if matchres != None:
+					scanline = line.split('>', 1)[1]
+					if len(scanline) < stringcutoff:
+						ignored.append(line)
+						linecount[line] = linecount[line] - 1
+						continue
+					cursor.execute(stringquery, (scanline,))
+					res = cursor.fetchall()
+					conn.commit()
+					if len(res) != 0:
+						line = scanline
+					else:
+						scanline = scanline.split(':', 1)
+						if len(scanline) > 1:
+							scanline = scanline[1]
+							if scanline.startswith(" "):
+								scanline = scanline[1:]
+							if len(scanline) < stringcutoff:
+								ignored.append(line)
+								linecount[line] = linecount[line] - 1
+								continue
+							cursor.execute(stringquery, (scanline,))
+							res = cursor.fetchall()
+							conn.commit()
+							if len(res) != 0:
+								if len(scanline) != 0:
+									line = scanline
+				else:
+					## In include/linux/kern_levels.h since kernel 3.6 a different format is
+					## used. TODO: actually check in the binary whether or not a match (if any)
+					## is preceded by 0x01
+					matchres = rematch.match(line)
 					if matchres != None:
-						scanline = line.split('>', 1)[1]
+						scanline = line[1:]
 						if len(scanline) < stringcutoff:
 							ignored.append(line)
 							linecount[line] = linecount[line] - 1
@@ -2041,30 +2150,15 @@ def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir
 						res = cursor.fetchall()
 						conn.commit()
 						if len(res) != 0:
-							line = scanline
-						else:
-							scanline = scanline.split(':', 1)
-							if len(scanline) > 1:
-								scanline = scanline[1]
-								if scanline.startswith(" "):
-									scanline = scanline[1:]
-								if len(scanline) < stringcutoff:
-									ignored.append(line)
-									linecount[line] = linecount[line] - 1
-									continue
-								cursor.execute(stringquery, (scanline,))
-								res = cursor.fetchall()
-								conn.commit()
-								if len(res) != 0:
-									if len(scanline) != 0:
-										line = scanline
-					else:
-						## In include/linux/kern_levels.h since kernel 3.6 a different format is
-						## used. TODO: actually check in the binary whether or not a match (if any)
-						## is preceded by 0x01
-						matchres = rematch.match(line)
-						if matchres != None:
-							scanline = line[1:]
+							if len(scanline) != 0:
+								line = scanline
+
+					if len(res) == 0:
+						scanline = line.split(':', 1)
+						if len(scanline) > 1:
+							scanline = scanline[1]
+							if scanline.startswith(" "):
+								scanline = scanline[1:]
 							if len(scanline) < stringcutoff:
 								ignored.append(line)
 								linecount[line] = linecount[line] - 1
@@ -2076,520 +2170,559 @@ def lookup_identifier(scanqueue, reportqueue, cursor, conn, scanenv, topleveldir
 								if len(scanline) != 0:
 									line = scanline
 
-						if len(res) == 0:
-							scanline = line.split(':', 1)
-							if len(scanline) > 1:
-								scanline = scanline[1]
-								if scanline.startswith(" "):
-									scanline = scanline[1:]
-								if len(scanline) < stringcutoff:
-									ignored.append(line)
-									linecount[line] = linecount[line] - 1
-									continue
-								cursor.execute(stringquery, (scanline,))
-								res = cursor.fetchall()
-								conn.commit()
-								if len(res) != 0:
-									if len(scanline) != 0:
-										line = scanline
-
-					## result is still empty, perhaps it is a module parameter. TODO
-					if len(res) == 0:
-						if '.' in line:
-							if line.count('.') == 1:
-								paramres = reparam.match(line)
-								if paramres != None:
-									pass
-
-					## if 'line' has been changed, then linecount should be changed accordingly
-					if line != origline:
-						linecount[origline] = linecount[origline] - 1
-						if line in linecount:
-							linecount[line] = linecount[line] + 1
-						else:
-							linecount[line] = 1
-
-				## nothing in the cache
+				## result is still empty, perhaps it is a module parameter. TODO
 				if len(res) == 0:
-					unmatched.append(line)
-					unmatchedlines += 1
-					linecount[line] = linecount[line] - 1
-					lock.acquire()
-					unmatchedignorecache[line] = 1
-					lock.release()
-					continue
-				if len(res) != 0:
-					## Assume:
-					## * database has no duplicates
-					## * filenames in the database have been processed using os.path.basename()
+					if '.' in line:
+						if line.count('.') == 1:
+							paramres = reparam.match(line)
+							if paramres != None:
+								pass
+
+				## if 'line' has been changed, then linecount should be changed accordingly
+				if line != origline:
+					linecount[origline] = linecount[origline] - 1
+					if line in linecount:
+						linecount[line] = linecount[line] + 1
+					else:
+						linecount[line] = 1
+
+			## nothing in the cache
+			if len(res) == 0:
+				unmatched.append(line)
+				unmatchedlines += 1
+				linecount[line] = linecount[line] - 1
+				unmatchedignorecache.add(line)
+				continue
+			if len(res) != 0:
+				## Assume:
+				## * database has no duplicates
+				## * filenames in the database have been processed using os.path.basename()
 
-					if scandebug:
-						print >>sys.stderr, "\n%d matches found for <(|%s|)> in %s" % (len(res), line, filename)
+				if scandebug:
+					print >>sys.stderr, "\n%d matches found for <(|%s|)> in %s" % (len(res), line, filename)
 
-					pkgs = {}    ## {package name: set([filenames without path])}
+				pkgs = {}    ## {package name: set([filenames without path])}
 	
-					filenames = {}
-
-					## For each string determine in how many packages (without version) the string
-					## is found.
-					## If the string is only found in one package the string is unique to the package
-					## so record it as such and add its length to a score.
-					for result in res:
-						(package, sourcefilename) = result
-						if package in clones:
-							package = clones[package]
-						if not package in pkgs:
-							pkgs[package] = set([sourcefilename])
-						else:
-							pkgs[package].add(sourcefilename)
-						if not sourcefilename in filenames:
-							filenames[sourcefilename] = [package]
-						else:
-							filenames[sourcefilename] = list(set(filenames[sourcefilename] + [package]))
-					scalar = 1
-
-					if len(pkgs) != 1:
-						nonUniqueMatchLines.append(line)
-						## The string found is not unique to a package, but is it 
-						## unique to a filename?
-						## This method assumes that files that are named the same
-						## also contain the same or similar content. This could lead
-						## to incorrect results.
-
-						## now determine the score for the string
-						try:
-							score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
-						except Exception, e:
-							## pow(alpha, (len(filenames) - 1)) is overflowing here
-							## so the score would be very close to 0. The largest value
-							## is sys.maxint, so use that one. The score will be
-							## smaller than almost any value of scorecutoff...
-							if usesourceorder:
-								score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
-							else:
-								matchednonassigned = True
-								matchednonassignedlines += 1
-								linecount[line] = linecount[line] - 1
-								continue
-						## if it is assumed that the compiler puts string constants in the
-						## same order in the generated code then strings can be assigned
-						## to the package directly
+				filenames = {}
+
+				## For each string determine in how many packages (without version) the string
+				## is found.
+				## If the string is only found in one package the string is unique to the package
+				## so record it as such and add its length to a score.
+				for result in res:
+					(package, sourcefilename) = result
+					if package in clones:
+						package = clones[package]
+					if not package in pkgs:
+						pkgs[package] = set([sourcefilename])
+					else:
+						pkgs[package].add(sourcefilename)
+					if not sourcefilename in filenames:
+						filenames[sourcefilename] = [package]
+					else:
+						filenames[sourcefilename] = list(set(filenames[sourcefilename] + [package]))
+				scalar = 1
+
+				if len(pkgs) != 1:
+					nonUniqueMatchLines.append(line)
+					## The string found is not unique to a package, but is it 
+					## unique to a filename?
+					## This method assumes that files that are named the same
+					## also contain the same or similar content. This could lead
+					## to incorrect results.
+
+					## now determine the score for the string
+					try:
+						score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
+					except Exception, e:
+						## pow(alpha, (len(filenames) - 1)) is overflowing here
+						## so the score would be very close to 0. The largest value
+						## is sys.maxint, so use that one. The score will be
+						## smaller than almost any value of scorecutoff...
 						if usesourceorder:
-							if uniquepackage_tmp in pkgs:
-								assign_string = False
-								assign_filename = None
-								for pf in uniquefilenames_tmp:
-									if pf in pkgs[uniquepackage_tmp]:
-										assign_string = True
-										assign_filename = pf
-										break
-								if assign_string:
-									if not nonUniqueMatches.has_key(uniquepackage_tmp):
-										nonUniqueMatches[uniquepackage_tmp] = [line]
-									else:
-										nonUniqueMatches[uniquepackage_tmp].append(line)
-									if directAssignedString.has_key(uniquepackage_tmp):
-										directAssignedString[uniquepackage_tmp].append((line, assign_filename, score))
-									else:
-										directAssignedString[uniquepackage_tmp] = [(line, assign_filename, score)]
-									matcheddirectassignedlines += 1
-									nonUniqueAssignments[uniquepackage_tmp] = nonUniqueAssignments.get(uniquepackage_tmp,0) + 1
-
-									matchedlines += 1
-									linecount[line] = linecount[line] - 1
-									continue
-								else:
-									## store pkgs and line for backward lookups
-									backlog.append((line, pkgs[uniquepackage_tmp], score))
-
-						if not score > scorecutoff:
+							score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
+						else:
 							matchednonassigned = True
 							matchednonassignedlines += 1
-							if not usesourceorder:
-								linecount[line] = linecount[line] - 1
+							linecount[line] = linecount[line] - 1
 							continue
+					## if it is assumed that the compiler puts string constants in the
+					## same order in the generated code then strings can be assigned
+					## to the package directly
+					if usesourceorder:
+						if uniquepackage_tmp in pkgs:
+							assign_string = False
+							assign_filename = None
+							for pf in uniquefilenames_tmp:
+								if pf in pkgs[uniquepackage_tmp]:
+									assign_string = True
+									assign_filename = pf
+									break
+							if assign_string:
+								if not nonUniqueMatches.has_key(uniquepackage_tmp):
+									nonUniqueMatches[uniquepackage_tmp] = [line]
+								else:
+									nonUniqueMatches[uniquepackage_tmp].append(line)
+								if directAssignedString.has_key(uniquepackage_tmp):
+									directAssignedString[uniquepackage_tmp].append((line, assign_filename, score))
+								else:
+									directAssignedString[uniquepackage_tmp] = [(line, assign_filename, score)]
+								matcheddirectassignedlines += 1
+								nonUniqueAssignments[uniquepackage_tmp] = nonUniqueAssignments.get(uniquepackage_tmp,0) + 1
 
-						## After having computed a score determine if the files
-						## the string was found in in are all called the same.
-						## filenames {name of file: { name of package: 1} }
-						if filter(lambda x: len(filenames[x]) != 1, filenames.keys()) == []:
-							matchednotclonelines += 1
-							for fn in filenames:
-								## The filename fn containing the matched string can only
-								## be found in one package.
-								## For example: string 'foobar' is present in 'foo.c' in package 'foo'
-								## and 'bar.c' in package 'bar', but not in 'foo.c' in package 'bar'
-								## or 'bar.c' in foo (if any).
-								fnkey = filenames[fn][0]
-								nonUniqueScore[fnkey] = nonUniqueScore.get(fnkey,0) + score
-							matchednotclones = True
-							if not usesourceorder:
+								matchedlines += 1
 								linecount[line] = linecount[line] - 1
-								notclones.append((line, filenames))
+								continue
 							else:
-								notclonesbacklog.append((line, filenames))
-							continue
+								## store pkgs and line for backward lookups
+								backlog.append((line, pkgs[uniquepackage_tmp], score))
+
+					if not score > scorecutoff:
+						matchednonassigned = True
+						matchednonassignedlines += 1
+						if not usesourceorder:
+							linecount[line] = linecount[line] - 1
+						continue
+
+					## After having computed a score determine if the files
+					## the string was found in in are all called the same.
+					## filenames {name of file: { name of package: 1} }
+					if filter(lambda x: len(filenames[x]) != 1, filenames.keys()) == []:
+						matchednotclonelines += 1
+						for fn in filenames:
+							## The filename fn containing the matched string can only
+							## be found in one package.
+							## For example: string 'foobar' is present in 'foo.c' in package 'foo'
+							## and 'bar.c' in package 'bar', but not in 'foo.c' in package 'bar'
+							## or 'bar.c' in foo (if any).
+							fnkey = filenames[fn][0]
+							nonUniqueScore[fnkey] = nonUniqueScore.get(fnkey,0) + score
+						matchednotclones = True
+						if not usesourceorder:
+							linecount[line] = linecount[line] - 1
+							notclones.append((line, filenames))
 						else:
-							for fn in filenames:
-								## There are multiple packages in which the same
-								## filename contains this string, for example 'foo.c'
-								## in packages 'foo' and 'bar. This is likely to be
-								## internal cloning in the repo.  This string is
-								## assigned to a single package in the loop below.
-								## Some strings will not signficantly contribute to the score, so they
-								## could be ignored and not added to the list.
-								## For now exclude them, but in the future they could be included for
-								## completeness.
-								stringsLeft['%s\t%s' % (line, fn)] = {'string': line, 'score': score, 'filename': fn, 'pkgs' : filenames[fn]}
-								## lookup
+							notclonesbacklog.append((line, filenames))
+						continue
+					else:
+						for fn in filenames:
+							## There are multiple packages in which the same
+							## filename contains this string, for example 'foo.c'
+							## in packages 'foo' and 'bar. This is likely to be
+							## internal cloning in the repo.  This string is
+							## assigned to a single package in the loop below.
+							## Some strings will not signficantly contribute to the score, so they
+							## could be ignored and not added to the list.
+							## For now exclude them, but in the future they could be included for
+							## completeness.
+							stringsLeft['%s\t%s' % (line, fn)] = {'string': line, 'score': score, 'filename': fn, 'pkgs' : filenames[fn]}
+							## lookup
 
+				else:
+					## the string is unique to this package and this package only
+					uniquematch = True
+					## store the uniqueMatches without any information about checksums
+					if not package in uniqueMatches:
+						uniqueMatches[package] = [(line, [])]
 					else:
-						## the string is unique to this package and this package only
-						uniquematch = True
-						## store the uniqueMatches without any information about checksums
-						if not package in uniqueMatches:
-							uniqueMatches[package] = [(line, [])]
-						else:
-							uniqueMatches[package].append((line, []))
-						linecount[line] = linecount[line] - 1
-						if usesourceorder:
-							uniquepackage_tmp = package
-							uniquefilenames_tmp = pkgs[package]
-							## process backlog
-							for b in xrange(len(backlog), 0, -1):
-								assign_string = False
-								assign_filename = None
-								(backlogline, backlogfilenames, backlogscore) = backlog[b-1]
-								for pf in uniquefilenames_tmp:
-									if pf in backlogfilenames:
-										assign_string = True
-										assign_filename = pf
-										break
-								if assign_string:
-									## keep track of the old score in case it is changed/recomputed here
-									oldbacklogscore = backlogscore
-									if not nonUniqueMatches.has_key(uniquepackage_tmp):
-										nonUniqueMatches[uniquepackage_tmp] = [backlogline]
-									else:
-										nonUniqueMatches[uniquepackage_tmp].append(backlogline)
-									if directAssignedString.has_key(uniquepackage_tmp):
-										directAssignedString[uniquepackage_tmp].append((backlogline, assign_filename, backlogscore))
-									else:
-										directAssignedString[uniquepackage_tmp] = [(backlogline, assign_filename, backlogscore)]
-									matcheddirectassignedlines += 1
-									nonUniqueAssignments[uniquepackage_tmp] = nonUniqueAssignments.get(uniquepackage_tmp,0) + 1
-									## remove the directly assigned string from stringsLeft,
-									## at least for *this* package
-									try:
-										for pf in backlogfilenames:
-											del stringsLeft['%s\t%s' % (backlogline, pf)]
-									except KeyError, e:
-										pass
-									## decrease matchednonassigned if the originally computed score
-									## is too low
-									if not oldbacklogscore > scorecutoff:
-										matchednonassigned = matchednonassigned - 1
-									linecount[backlogline] = linecount[backlogline] - 1
-									for cl in notclonesbacklog:
-										(notclone, filenames) = cl
-										if notclone == backlogline:
-											matchednotclonelines -= 1
-											for fn in filenames:
-												fnkey = filenames[fn][0]
-												nonUniqueScore[fnkey] = nonUniqueScore.get(fnkey) - backlogscore
-											notclonesbacklog.remove(cl)
-											break
-								else:
+						uniqueMatches[package].append((line, []))
+					linecount[line] = linecount[line] - 1
+					if usesourceorder:
+						uniquepackage_tmp = package
+						uniquefilenames_tmp = pkgs[package]
+						## process backlog
+						for b in xrange(len(backlog), 0, -1):
+							assign_string = False
+							assign_filename = None
+							(backlogline, backlogfilenames, backlogscore) = backlog[b-1]
+							for pf in uniquefilenames_tmp:
+								if pf in backlogfilenames:
+									assign_string = True
+									assign_filename = pf
 									break
-							## store notclones for later use
-							notclones += notclonesbacklog
-							backlog = []
-							notclonesbacklog = []
-					matched = True
-
-					## for statistics it's nice to see how many lines were matched
-					matchedlines += 1
-
-			## clean up stringsLeft first
-			for l in stringsLeft.keys():
-				if linecount[stringsLeft[l]['string']] == 0:
-					del stringsLeft[l]
-			## done looking up and assigning all the strings
-
-			uniqueScore = {}
-			for package in uniqueMatches:
-				if not package in uniqueScore:
-					uniqueScore[package] = 0
-				for line in uniqueMatches[package]:
-					score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
-
-			directAssignedScore = {}
-			for package in directAssignedString:
-				if not package in directAssignedScore:
-					directAssignedScore[package] = 0
-				for line in directAssignedString[package]:
-					directAssignedScore[package] += line[2]
-
-			## If the string is not unique, do a little bit more work to determine which
-			## file is the most likely, so also record the filename.
-			##
-			## 1. determine whether the string is unique to a package
-			## 2. if not, determine which filenames the string is in
-			## 3. for each filename, determine whether or not this file (containing the string)
-			##    is unique to a package
-			## 4. if not, try to determine the most likely package the string was found in
-
-			## For each string that occurs in the same filename in multiple
-			## packages (e.g., "debugXML.c", a cloned file of libxml2 in several
-			## packages), assign it to one package.  We do this by picking the
-			## package that would gain the highest score increment across all
-			## strings that are left.  This is repeated until no strings are left.
-			pkgsScorePerString = {}
-			for stri in stringsLeft:
-				pkgsSortedTmp = map(lambda x: {'package': x, 'uniquescore': uniqueScore.get(x, 0)}, stringsLeft[stri]['pkgs'])
+							if assign_string:
+								## keep track of the old score in case it is changed/recomputed here
+								oldbacklogscore = backlogscore
+								if not nonUniqueMatches.has_key(uniquepackage_tmp):
+									nonUniqueMatches[uniquepackage_tmp] = [backlogline]
+								else:
+									nonUniqueMatches[uniquepackage_tmp].append(backlogline)
+								if directAssignedString.has_key(uniquepackage_tmp):
+									directAssignedString[uniquepackage_tmp].append((backlogline, assign_filename, backlogscore))
+								else:
+									directAssignedString[uniquepackage_tmp] = [(backlogline, assign_filename, backlogscore)]
+								matcheddirectassignedlines += 1
+								nonUniqueAssignments[uniquepackage_tmp] = nonUniqueAssignments.get(uniquepackage_tmp,0) + 1
+								## remove the directly assigned string from stringsLeft,
+								## at least for *this* package
+								try:
+									for pf in backlogfilenames:
+										del stringsLeft['%s\t%s' % (backlogline, pf)]
+								except KeyError, e:
+									pass
+								## decrease matchednonassigned if the originally computed score
+								## is too low
+								if not oldbacklogscore > scorecutoff:
+									matchednonassigned = matchednonassigned - 1
+								linecount[backlogline] = linecount[backlogline] - 1
+								for cl in notclonesbacklog:
+									(notclone, filenames) = cl
+									if notclone == backlogline:
+										matchednotclonelines -= 1
+										for fn in filenames:
+											fnkey = filenames[fn][0]
+											nonUniqueScore[fnkey] = nonUniqueScore.get(fnkey) - backlogscore
+										notclonesbacklog.remove(cl)
+										break
+							else:
+								break
+						## store notclones for later use
+						notclones += notclonesbacklog
+						backlog = []
+						notclonesbacklog = []
+				matched = True
+
+				## for statistics it's nice to see how many lines were matched
+				matchedlines += 1
+
+		## clean up stringsLeft first
+		for l in stringsLeft.keys():
+			if linecount[stringsLeft[l]['string']] == 0:
+				del stringsLeft[l]
+		## done looking up and assigning all the strings
+
+		uniqueScore = {}
+		for package in uniqueMatches:
+			if not package in uniqueScore:
+				uniqueScore[package] = 0
+			for line in uniqueMatches[package]:
+				score = (1 * scalar) / pow(total_num_pkgs, len(filenames))
+
+		directAssignedScore = {}
+		for package in directAssignedString:
+			if not package in directAssignedScore:
+				directAssignedScore[package] = 0
+			for line in directAssignedString[package]:
+				directAssignedScore[package] += line[2]
+
+		## If the string is not unique, do a little bit more work to determine which
+		## file is the most likely, so also record the filename.
+		##
+		## 1. determine whether the string is unique to a package
+		## 2. if not, determine which filenames the string is in
+		## 3. for each filename, determine whether or not this file (containing the string)
+		##    is unique to a package
+		## 4. if not, try to determine the most likely package the string was found in
+
+		## For each string that occurs in the same filename in multiple
+		## packages (e.g., "debugXML.c", a cloned file of libxml2 in several
+		## packages), assign it to one package.  We do this by picking the
+		## package that would gain the highest score increment across all
+		## strings that are left.  This is repeated until no strings are left.
+		pkgsScorePerString = {}
+		for stri in stringsLeft:
+			pkgsSortedTmp = map(lambda x: {'package': x, 'uniquescore': uniqueScore.get(x, 0)}, stringsLeft[stri]['pkgs'])
+
+			## get the unique score per package and sort in reverse order
+			pkgsSorted = sorted(pkgsSortedTmp, key=lambda x: x['uniquescore'], reverse=True)
+			## and get rid of the unique scores again. Now it's sorted.
+			pkgsSorted = map(lambda x: x['package'], pkgsSorted)
+			pkgs2 = []
+
+			for pkgSort in pkgsSorted:
+				if uniqueScore.get(pkgSort, 0) == uniqueScore.get(pkgsSorted[0], 0):
+					pkgs2.append(pkgSort)
+			pkgsScorePerString[stri] = pkgs2
+
+		newgain = {}
+		for stri in stringsLeft:
+			for p2 in pkgsScorePerString[stri]:
+				newgain[p2] = newgain.get(p2, 0) + stringsLeft[stri]['score']
+
+		useless_packages = set()
+		for p in newgain.keys():
+			## check if packages could ever contribute usefully.
+			if newgain[p] < gaincutoff:
+				useless_packages.add(p)
+
+		## walk through the data again, filter out useless stuff
+		new_stringsleft = {}
+
+		string_split = {}
+
+		for stri in stringsLeft:
+			## filter out the strings that only occur in packages that will contribute
+			## to the score. Ignore the rest.
+			if filter(lambda x: x not in useless_packages, pkgsScorePerString[stri]) != []:
+				new_stringsleft[stri] = stringsLeft[stri]
+				strsplit = stri.rsplit('\t', 1)[0]
+				if strsplit in string_split:
+					string_split[strsplit].add(stri)
+				else:
+					string_split[strsplit] = set([stri])
+
+		## the difference between stringsLeft and new_stringsleft is matched
+		## but unassigned if the strings *only* occur in stringsLeft
+		oldstrleft = set()
+		for i in stringsLeft:
+			oldstrleft.add(stringsLeft[i]['string'])
+		for i in oldstrleft.difference(set(string_split.keys())):
+			matchednonassignedlines += linecount[i]
+			matchedlines -= linecount[i]
+
+		stringsLeft = new_stringsleft
+
+		roundNr = 0
+		strleft = len(stringsLeft)
+
+		## keep track of which strings were already found. This is because each string
+		## is only considered once anyway.
+		while strleft > 0:
+			roundNr = roundNr + 1
+			#if scandebug:
+			#	print >>sys.stderr, "\nround %d: %d strings left" % (roundNr, strleft)
+			gain = {}
+			stringsPerPkg = {}
+
+			## cleanup
+			if roundNr != 0:
+				todelete = set()
+				for stri in stringsLeft:
+					if linecount[stringsLeft[stri]['string']] == 0:
+						todelete.add(stri)
 
-				## get the unique score per package and sort in reverse order
-				pkgsSorted = sorted(pkgsSortedTmp, key=lambda x: x['uniquescore'], reverse=True)
-				## and get rid of the unique scores again. Now it's sorted.
-				pkgsSorted = map(lambda x: x['package'], pkgsSorted)
-				pkgs2 = []
+				for a in todelete:
+					del stringsLeft[a]
 
-				for pkgSort in pkgsSorted:
-					if uniqueScore.get(pkgSort, 0) == uniqueScore.get(pkgsSorted[0], 0):
-						pkgs2.append(pkgSort)
-				pkgsScorePerString[stri] = pkgs2
+			oldstrleft = set()
+			for i in stringsLeft:
+				oldstrleft.add(stringsLeft[i]['string'])
 
-			newgain = {}
+			## Determine to which packages the remaining strings belong.
+			newstrleft = set()
 			for stri in stringsLeft:
 				for p2 in pkgsScorePerString[stri]:
-					newgain[p2] = newgain.get(p2, 0) + stringsLeft[stri]['score']
+					if p2 in useless_packages:
+						continue
+					gain[p2] = gain.get(p2, 0) + stringsLeft[stri]['score']
+					if not p2 in stringsPerPkg:
+						stringsPerPkg[p2] = []
+					stringsPerPkg[p2].append(stri)
+					newstrleft.add(stringsLeft[stri]['string'])
+
+			for i in oldstrleft.difference(newstrleft):
+				if linecount[i] == 0:
+					continue
+				matchednonassignedlines += 1
+				matchedlines -= 1
+				linecount[i] -= 1
 
-			useless_packages = set()
-			for p in newgain.keys():
+			for p2 in gain.keys():
 				## check if packages could ever contribute usefully.
-				if newgain[p] < gaincutoff:
-					useless_packages.add(p)
-
-			## walk through the data again, filter out useless stuff
-			new_stringsleft = {}
-
-			string_split = {}
+				if gain[p2] < gaincutoff:
+					useless_packages.add(p2)
 
-			for stri in stringsLeft:
-				## filter out the strings that only occur in packages that will contribute
-				## to the score. Ignore the rest.
-				if filter(lambda x: x not in useless_packages, pkgsScorePerString[stri]) != []:
-					new_stringsleft[stri] = stringsLeft[stri]
-					strsplit = stri.rsplit('\t', 1)[0]
-					if strsplit in string_split:
-						string_split[strsplit].add(stri)
-					else:
-						string_split[strsplit] = set([stri])
+			## gain_sorted contains the sort order, gain contains the actual data
+			gain_sorted = sorted(gain, key = lambda x: gain.__getitem__(x), reverse=True)
+			if gain_sorted == []:
+				break
 
-			## the difference between stringsLeft and new_stringsleft is matched
-			## but unassigned if the strings *only* occur in stringsLeft
-			oldstrleft = set()
-			for i in stringsLeft:
-				oldstrleft.add(stringsLeft[i]['string'])
-			for i in oldstrleft.difference(set(string_split.keys())):
-				matchednonassignedlines += linecount[i]
-				matchedlines -= linecount[i]
+			## so far value is the best, but that might change
+			best = gain_sorted[0]
 
-			stringsLeft = new_stringsleft
+			## Possible optimisation: skip the last step if the gain is not high enough
+			if filter(lambda x: x[1] > gaincutoff, gain.items()) == []:
+				break
 
-			roundNr = 0
-			strleft = len(stringsLeft)
+			## if multiple packages have a big enough gain, add them to 'close'
+			## and 'fight' to see which package is the most likely hit.
+			close = filter(lambda x: gain[x] > (gain[best] * 0.9), gain_sorted)
 
-			## keep track of which strings were already found. This is because each string
-			## is only considered once anyway.
-			while strleft > 0:
-				roundNr = roundNr + 1
+			## Let's hope "sort" terminates on a comparison function that
+			## may not actually be a proper ordering.	
+			if len(close) > 1:
 				#if scandebug:
-				#	print >>sys.stderr, "\nround %d: %d strings left" % (roundNr, strleft)
-				gain = {}
-				stringsPerPkg = {}
-
-				## cleanup
-				if roundNr != 0:
-					todelete = set()
-					for stri in stringsLeft:
-						if linecount[stringsLeft[stri]['string']] == 0:
-							todelete.add(stri)
-
-					for a in todelete:
-						del stringsLeft[a]
-
-				oldstrleft = set()
-				for i in stringsLeft:
-					oldstrleft.add(stringsLeft[i]['string'])
-
-				## Determine to which packages the remaining strings belong.
-				newstrleft = set()
-				for stri in stringsLeft:
-					for p2 in pkgsScorePerString[stri]:
-						if p2 in useless_packages:
-							continue
-						gain[p2] = gain.get(p2, 0) + stringsLeft[stri]['score']
-						if not p2 in stringsPerPkg:
-							stringsPerPkg[p2] = []
-						stringsPerPkg[p2].append(stri)
-						newstrleft.add(stringsLeft[stri]['string'])
-
-				for i in oldstrleft.difference(newstrleft):
-					if linecount[i] == 0:
-						continue
-					matchednonassignedlines += 1
-					matchedlines -= 1
-					linecount[i] -= 1
-
-				for p2 in gain.keys():
-					## check if packages could ever contribute usefully.
-					if gain[p2] < gaincutoff:
-						useless_packages.add(p2)
-
-				## gain_sorted contains the sort order, gain contains the actual data
-				gain_sorted = sorted(gain, key = lambda x: gain.__getitem__(x), reverse=True)
-				if gain_sorted == []:
-					break
-
-				## so far value is the best, but that might change
-				best = gain_sorted[0]
-
-				## Possible optimisation: skip the last step if the gain is not high enough
-				if filter(lambda x: x[1] > gaincutoff, gain.items()) == []:
-					break
-
-				## if multiple packages have a big enough gain, add them to 'close'
-				## and 'fight' to see which package is the most likely hit.
-				close = filter(lambda x: gain[x] > (gain[best] * 0.9), gain_sorted)
-
-       				## Let's hope "sort" terminates on a comparison function that
-       				## may not actually be a proper ordering.	
-				if len(close) > 1:
-					#if scandebug:
-					#	print >>sys.stderr, "  doing battle royale between", close
-					## reverse sort close, then best = close_sorted[0][0]
-					for c in close:
-						if avgscores[language].get(c) is None:
-							avgscores[language][c] = 0
-					close_sorted = map(lambda x: (x, avgscores[language][x]), close)
-					close_sorted = sorted(close_sorted, key = lambda x: x[1], reverse=True)
-					## If we don't have a unique score *at all* it is likely that everything
-					## is cloned. There could be a few reasons:
-					## 1. there are duplicates in the database due to renaming
-					## 2. package A is completely contained in package B (bundling).
-					## If there are no hits for package B, it is more likely we are
-					## actually seeing package A.
-					if uniqueScore == {}:
-						best = close_sorted[-1][0]
-					else:
-						best = close_sorted[0][0]
-					#if scandebug:
-					#	print >>sys.stderr, "  %s won" % best
-				best_score = 0
-				## for each string in the package with the best gain add the score
-				## to the package and move on to the next package.
-				todelete = set()
-				for xy in stringsPerPkg[best]:
-					x = stringsLeft[xy]
-					strsplit = xy.rsplit('\t', 1)[0]
-					if linecount[strsplit] == 0:
-						## is this correct here? There are situations where one
-						## string appears multiple times in a single source file
-						## and also the binary (eapol_sm.c in hostapd 0.3.9 contains
-						## the string "%s    state=%s" several times and binaries
-						## do too.
-						todelete.add(strsplit)
-						continue
-					sameFileScore[best] = sameFileScore.get(best, 0) + x['score']
-					best_score += 1
-					linecount[strsplit] = linecount[strsplit] - 1
-					if best in nonUniqueMatches:
-						nonUniqueMatches[best].append(strsplit)
-					else:
-						nonUniqueMatches[best]  = [strsplit]
-
-				for a in todelete:
-					for st in string_split[a]:
-						del stringsLeft[st]
-				## store how many non unique strings were assigned per package
-				nonUniqueAssignments[best] = nonUniqueAssignments.get(best,0) + best_score
-				if gain[best] < gaincutoff:
-					break
-				strleft = len(stringsLeft)
-
-			for i in stringsLeft:
-				strsplit = i.rsplit('\t', 1)[0]
+				#	print >>sys.stderr, "  doing battle royale between", close
+				## reverse sort close, then best = close_sorted[0][0]
+				for c in close:
+					if avgscores[language].get(c) is None:
+						avgscores[language][c] = 0
+				close_sorted = map(lambda x: (x, avgscores[language][x]), close)
+				close_sorted = sorted(close_sorted, key = lambda x: x[1], reverse=True)
+				## If we don't have a unique score *at all* it is likely that everything
+				## is cloned. There could be a few reasons:
+				## 1. there are duplicates in the database due to renaming
+				## 2. package A is completely contained in package B (bundling).
+				## If there are no hits for package B, it is more likely we are
+				## actually seeing package A.
+				if uniqueScore == {}:
+					best = close_sorted[-1][0]
+				else:
+					best = close_sorted[0][0]
+				#if scandebug:
+				#	print >>sys.stderr, "  %s won" % best
+			best_score = 0
+			## for each string in the package with the best gain add the score
+			## to the package and move on to the next package.
+			todelete = set()
+			for xy in stringsPerPkg[best]:
+				x = stringsLeft[xy]
+				strsplit = xy.rsplit('\t', 1)[0]
 				if linecount[strsplit] == 0:
+					## is this correct here? There are situations where one
+					## string appears multiple times in a single source file
+					## and also the binary (eapol_sm.c in hostapd 0.3.9 contains
+					## the string "%s    state=%s" several times and binaries
+					## do too.
+					todelete.add(strsplit)
 					continue
-				matchednonassignedlines += 1
-				matchedlines -= 1
-				linecount[strsplit] -= 1
-
-			scores = {}
-			for k in set(uniqueScore.keys() + sameFileScore.keys()):
-				scores[k] = uniqueScore.get(k, 0) + sameFileScore.get(k, 0) + nonUniqueScore.get(k,0) + directAssignedScore.get(k,0)
-			scores_sorted = sorted(scores, key = lambda x: scores.__getitem__(x), reverse=True)
+				sameFileScore[best] = sameFileScore.get(best, 0) + x['score']
+				best_score += 1
+				linecount[strsplit] = linecount[strsplit] - 1
+				if best in nonUniqueMatches:
+					nonUniqueMatches[best].append(strsplit)
+				else:
+					nonUniqueMatches[best]  = [strsplit]
+
+			for a in todelete:
+				for st in string_split[a]:
+					del stringsLeft[st]
+			## store how many non unique strings were assigned per package
+			nonUniqueAssignments[best] = nonUniqueAssignments.get(best,0) + best_score
+			if gain[best] < gaincutoff:
+				break
+			strleft = len(stringsLeft)
 
-			rank = 1
-			reports = []
-			if scores == {}:
-				totalscore = 0.0
-			else:
-				totalscore = float(reduce(lambda x, y: x + y, scores.values()))
-
-			for s in scores_sorted:
-				try:
-					percentage = (scores[s]/totalscore)*100.0
-				except:
-					percentage = 0.0
-				reports.append({'rank': rank, 'package': s, 'unique': uniqueMatches.get(s,[]), 'uniquematcheslen': len(uniqueMatches.get(s,[])), 'percentage': percentage, 'packageversions': packageversions.get(s, {}), 'packagelicenses': packagelicenses.get(s, []), 'packagecopyrights': packagecopyrights.get(s,[])})
-				rank = rank+1
-
-			if matchedlines == 0 and unmatched == []:
-				res = None
-			else:
-				if scankernelfunctions:
-					matchedlines = matchedlines - len(kernelfuncres)
-					lenlines = lenlines - len(kernelfuncres)
-				ignored = list(set(ignored))
-				ignored.sort()
-				res = {'matchedlines': matchedlines, 'extractedlines': lenlines, 'reports': reports, 'nonUniqueMatches': nonUniqueMatches, 'nonUniqueAssignments': nonUniqueAssignments, 'unmatched': unmatched, 'scores': scores, 'unmatchedlines': unmatchedlines, 'matchednonassignedlines': matchednonassignedlines, 'matchednotclonelines': matchednotclonelines, 'matcheddirectassignedlines': matcheddirectassignedlines, 'ignored': list(set(ignored))}
+		for i in stringsLeft:
+			strsplit = i.rsplit('\t', 1)[0]
+			if linecount[strsplit] == 0:
+				continue
+			matchednonassignedlines += 1
+			matchedlines -= 1
+			linecount[strsplit] -= 1
+
+		scores = {}
+		for k in set(uniqueScore.keys() + sameFileScore.keys()):
+			scores[k] = uniqueScore.get(k, 0) + sameFileScore.get(k, 0) + nonUniqueScore.get(k,0) + directAssignedScore.get(k,0)
+		scores_sorted = sorted(scores, key = lambda x: scores.__getitem__(x), reverse=True)
+
+		rank = 1
+		reports = []
+		if scores == {}:
+			totalscore = 0.0
 		else:
+			totalscore = float(reduce(lambda x, y: x + y, scores.values()))
+
+		for s in scores_sorted:
+			try:
+				percentage = (scores[s]/totalscore)*100.0
+			except:
+				percentage = 0.0
+			reports.append({'rank': rank, 'package': s, 'unique': uniqueMatches.get(s,[]), 'uniquematcheslen': len(uniqueMatches.get(s,[])), 'percentage': percentage, 'packageversions': packageversions.get(s, {}), 'packagelicenses': packagelicenses.get(s, []), 'packagecopyrights': packagecopyrights.get(s,[])})
+			rank = rank+1
+
+		if matchedlines == 0 and unmatched == []:
 			res = None
+		else:
+			if scankernelfunctions:
+				matchedlines = matchedlines - len(kernelfuncres)
+				lenlines = lenlines - len(kernelfuncres)
+			ignored = list(set(ignored))
+			ignored.sort()
+			res = {'matchedlines': matchedlines, 'extractedlines': lenlines, 'reports': reports, 'nonUniqueMatches': nonUniqueMatches, 'nonUniqueAssignments': nonUniqueAssignments, 'unmatched': unmatched, 'scores': scores, 'unmatchedlines': unmatchedlines, 'matchednonassignedlines': matchednonassignedlines, 'matchednotclonelines': matchednotclonelines, 'matcheddirectassignedlines': matcheddirectassignedlines, 'ignored': list(set(ignored))}
+	else:
+		res = None
 
-		## then look up results for function names, variable names, and so on.
-		if language == 'C':
-			if linuxkernel:
-				functionRes = {}
-				if 'BAT_KERNELSYMBOL_SCAN' in scanenv:
-					namekernelquery = "select distinct package from linuxkernelnamecache where varname=%s"
-					variablepvs = scankernelsymbols(leafreports['identifier']['kernelsymbols'], scanenv, namekernelquery, cursor, conn, clones)
-				## TODO: clean up
-				if leafreports['identifier'].has_key('kernelfunctions'):
-					if leafreports['identifier']['kernelfunctions'] != []:
-						functionRes['kernelfunctions'] = copy.deepcopy(leafreports['identifier']['kernelfunctions'])
-			else:
-				(functionRes, variablepvs) = scanDynamic(leafreports['identifier']['functionnames'], leafreports['identifier']['variablenames'], scanenv, cursor, conn, clones)
-		elif language == 'Java':
-			if not ('BAT_CLASSNAME_SCAN' in scanenv or 'BAT_FIELDNAME_SCAN' in scanenv or 'BAT_METHOD_SCAN' in scanenv):
-				variablepvs = {}
-				functionRes = {}
-			else:
-				(functionRes, variablepvs) = extractJava(leafreports['identifier'], scanenv, cursor, conn, clones)
+	## then look up results for function names, variable names, and so on.
+	if cachedranking != None:
+		## already taken from the result cache
+		pass
+	elif language == 'C':
+		if linuxkernel:
+			functionRes = {}
+			if 'BAT_KERNELSYMBOL_SCAN' in scanenv:
+				namekernelquery = "select distinct package from linuxkernelnamecache where varname=%s"
+				variablepvs = scankernelsymbols(leafreports['identifier']['kernelsymbols'], scanenv, namekernelquery, cursor, conn, clones)
+			## TODO: clean up
+			if leafreports['identifier'].has_key('kernelfunctions'):
+				if leafreports['identifier']['kernelfunctions'] != []:
+					functionRes['kernelfunctions'] = copy.deepcopy(leafreports['identifier']['kernelfunctions'])
 		else:
+			(functionRes, variablepvs) = scanDynamic(leafreports['identifier']['functionnames'], leafreports['identifier']['variablenames'], scanenv, cursor, conn, clones)
+	elif language == 'Java':
+		if not ('BAT_CLASSNAME_SCAN' in scanenv or 'BAT_FIELDNAME_SCAN' in scanenv or 'BAT_METHOD_SCAN' in scanenv):
 			variablepvs = {}
 			functionRes = {}
+		else:
+			(functionRes, variablepvs) = extractJava(leafreports['identifier'], scanenv, cursor, conn, clones)
+	else:
+		variablepvs = {}
+		functionRes = {}
+
+	## then write results back to disk. This needs to be done because results for
+	## Java might need to be aggregated first.
+	leafreports['ranking'] = (res, functionRes, variablepvs, language)
+	leafreports['tags'].append('ranking')
+	reportstore.getstore(topleveldir).update(filehash, {'ranking': leafreports['ranking'], 'tags': leafreports['tags']})
+	if 'BAT_RESULTCACHE' in scanenv and cachedranking == None:
+		resultcache.getcache(scanenv['BAT_RESULTCACHE']).put(filehash, scanenv['BAT_RESULTCACHE_FINGERPRINT'], linuxkernel, leafreports['ranking'])
+	return True
+
+## State of the per file ranking, kept per process: the average string scores,
+## the renamed packages and the caches of the ranking.
+perfilestate = {}
+
+## Rank a single file as soon as the leaf scans for the file have finished,
+## instead of waiting until all files in the firmware have been unpacked. This
+## is run by bruteforcescan for every unique file. Files that were ranked
+## here are not ranked again in determinelicense_version_copyright(), but
+## because it is not known in advance in how many files a string occurs there
+## is no preloaded "hot set" of strings, only the string cache of the process.
+def rankingperfile(filehash, filename, tags, topleveldir, scanenv, cursor, conn, scandebug=False):
+	if not 'identifier' in tags:
+		return None
+	## already ranked, for example in the baseline of an incremental scan
+	if 'ranking' in tags:
+		return None
+	if cursor == None:
+		return None
+	if not (scanenv.get('BAT_RANKING_VERSION', 0) == '1' or scanenv.get('BAT_RANKING_LICENSE', 0) == '1' or scanenv.get('BAT_RANKING_COPYRIGHT', 0) == '1'):
+		return None
 
-		## then write results back to disk. This needs to be done because results for
-		## Java might need to be aggregated first.
-		leafreports['ranking'] = (res, functionRes, variablepvs, language)
-		leafreports['tags'].append('ranking')
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-		leafreports = cPickle.dump(leafreports, leaf_file)
-		leaf_file.close()
-		reportqueue.put(filehash)
-		scanqueue.task_done()
+	pid = os.getpid()
+	if not pid in perfilestate:
+		clones = {}
+		if scanenv.get('HAVE_CLONE_DB') == 1:
+			cursor.execute("SELECT originalname,newname from renames")
+			clonestmp = cursor.fetchall()
+			conn.commit()
+			for cl in clonestmp:
+				(originalname,newname) = cl
+				if not originalname in clones:
+					clones[originalname] = newname
+		avgscores = {}
+		for language in avgstringsdbperlanguagetable:
+			if not language in scanenv['supported_languages']:
+				continue
+			avgscores[language] = {}
+			cursor.execute("select package, avgstrings from %s" % avgstringsdbperlanguagetable[language])
+			res = cursor.fetchall()
+			conn.commit()
+			for r in filter(lambda x: x[1] != 0, res):
+				avgscores[language][r[0]] = r[1]
+		try:
+			stringcachesize = int(scanenv.get('BAT_STRING_CACHE_SIZE', 0))
+		except:
+			stringcachesize = 0
+		if not have_counter:
+			stringcachesize = 0
+		perfilestate.clear()
+		perfilestate[pid] = (avgscores, clones, StringCache(stringcachesize, {}), set())
+
+	(avgscores, clones, stringcache, unmatchedignorecache) = perfilestate[pid]
+	if rankfile(filehash, filename, cursor, conn, scanenv, topleveldir, avgscores, clones, scandebug, stringcache, unmatchedignorecache):
+		return ['ranking']
+	return None
 
 def licensesetup(scanenv, cursor, conn, debug=False):
 	if cursor == None:
@@ -24,8 +24,35 @@ spent, plus there might be false positives (mostly LZMA).
 '''
 
 import sys, os, subprocess, os.path, shutil, stat, struct, zlib, binascii
-import tempfile, re, magic, hashlib, HTMLParser, math
-import fsmagic, extractor, javacheck, elfcheck
+import tempfile, re, magic, hashlib, HTMLParser, math, mmap, string
+import fsmagic, extractor, javacheck, elfcheck, fileview
+
+## Try to load the pyahocorasick module if available, to search for
+## all markers in a single pass. It is not standard on every Linux
+## distribution, so fall back to searching for markers one by one.
+try:
+	import ahocorasick
+	have_ahocorasick = True
+except Exception, e:
+	have_ahocorasick = False
+
+## Build (and cache) a multi-pattern search automaton for a set of markers.
+## This needs the (optional) pyahocorasick module. If it is not available None
+## is returned and the markers are searched for one by one.
+markerautomata = {}
+def getMarkerAutomaton(bufkeys):
+	if not have_ahocorasick:
+		return None
+	automatonkey = tuple(sorted(map(lambda x: x[0], bufkeys)))
+	if automatonkey in markerautomata:
+		return markerautomata[automatonkey]
+	automaton = ahocorasick.Automaton()
+	for bkey in bufkeys:
+		(key, bufkey) = bkey
+		automaton.add_word(bufkey, (key, len(bufkey)))
+	automaton.make_automaton()
+	markerautomata[automatonkey] = automaton
+	return automaton
 
 ## method to search for all the markers in magicscans
 ## Although it is in this method it is actually not a pre-run scan, so perhaps
@@ -35,10 +62,13 @@ import fsmagic, extractor, javacheck, elfcheck
 ## * offsettokeys :: a dictionary that maps an offset to a marker
 ## * isascii :: a flag to indicate that the data found was ASCII
 ## data only or not
+##
+## The file is memory mapped and searched in windows of 2000000 bytes (with
+## a 50 bytes overlap, so patterns < 50 bytes are never missed). If the
+## pyahocorasick module is available all markers are searched for in a single
+## pass over each window. Candidates that need extra checks (jpeg, compress, ttf)
+## are verified using the same memory map.
 def genericMarkerSearch(filename, magicscans, optmagicscans, offset=0, length=0, debug=False):
-	datafile = open(filename, 'rb')
-	databuffer = []
-
 	## dictionary with offsets per marker
 	offsets = {}
 
@@ -48,11 +78,6 @@ def genericMarkerSearch(filename, magicscans, optmagicscans, offset=0, length=0,
 	## flag that indicates if the data is ASCII
 	isascii = True
 
-	datafile.seek(offset)
-	if length == 0:
-		databuffer = datafile.read(2000000)
-	else:
-		databuffer = datafile.read(length)
 	marker_keys = magicscans + optmagicscans
 	bufkeys = []
 	for key in marker_keys:
@@ -65,65 +90,77 @@ def genericMarkerSearch(filename, magicscans, optmagicscans, offset=0, length=0,
 
 	## don't read the file if there are no keys to process
 	if bufkeys == []:
-		datafile.close()
 		return (offsets, offsettokeys, isascii)
 
-	datafile2 = open(filename, 'rb')
-	while databuffer != '':
-		if isascii:
-			if not extractor.isPrintables(databuffer):
-				isascii = False
-		for bkey in bufkeys:
-			(key, bufkey) = bkey
-			if not bufkey in databuffer:
-				continue
-			res = databuffer.find(bufkey)
-			while res != -1:
+	filesize = os.stat(filename).st_size
+	if length == 0:
+		endoffset = filesize
+	else:
+		endoffset = min(filesize, offset + length)
+
+	if offset < endoffset:
+		datafile = open(filename, 'rb')
+		datamap = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+		automaton = getMarkerAutomaton(bufkeys)
+
+		windowoffset = offset
+		while windowoffset < endoffset:
+			databuffer = datamap[windowoffset:min(windowoffset + 2000000, endoffset)]
+			if isascii:
+				if databuffer.translate(None, string.printable) != '':
+					isascii = False
+			if automaton != None:
+				candidates = []
+				for endindex, (key, keylength) in automaton.iter(databuffer):
+					candidates.append((key, endindex - keylength + 1))
+			else:
+				candidates = []
+				for bkey in bufkeys:
+					(key, bufkey) = bkey
+					if not bufkey in databuffer:
+						continue
+					res = databuffer.find(bufkey)
+					while res != -1:
+						candidates.append((key, res))
+						res = databuffer.find(bufkey, res+1)
+			for candidate in candidates:
+				(key, res) = candidate
+				markeroffset = windowoffset + res
 				## hardcode a few checks to avoid possibly passing
 				## around many offsets to many methods
 				if key == 'jpeg':
-					datafile2.seek(offset+res+2)
-					checkkey = datafile2.read(1)
+					checkkey = datamap[markeroffset+2:markeroffset+3]
 					if len(checkkey) == 1:
 						if checkkey == '\xff':
-							offsets[key].add(offset + res)
+							offsets[key].add(markeroffset)
 				elif key == 'compress':
-					datafile2.seek(offset+res+2)
-					compressdata = datafile2.read(1)
+					compressdata = datamap[markeroffset+2:markeroffset+3]
 					if len(compressdata) == 1:
 						compressbits = ord(compressdata) & 0x1f
 						if compressbits >= 9 and compressbits <= 16:
-							offsets[key].add(offset + res)
+							offsets[key].add(markeroffset)
 				elif key == 'ttf':
-					datafile2.seek(offset+res+4)
-					fontbytes = datafile2.read(2)
+					fontbytes = datamap[markeroffset+4:markeroffset+6]
 					if len(fontbytes) == 2:
 						numberoftables = struct.unpack('>H', fontbytes)[0]
 						if numberoftables != 0:
 							## followed by searchrange
-							fontbytes = datafile2.read(2)
+							fontbytes = datamap[markeroffset+6:markeroffset+8]
 							if len(fontbytes) == 2:
 								searchrange = struct.unpack('>H', fontbytes)[0]
 								## sanity check, see specification
 								if pow(2, int(math.log(numberoftables, 2)+4)) == searchrange:
-									offsets[key].add(offset + res)
+									offsets[key].add(markeroffset)
 				else:
-					offsets[key].add(offset + res)
-				res = databuffer.find(bufkey, res+1)
-		if length != 0:
-			break
-		## move the offset 1999950
-		datafile.seek(offset + 1999950)
-		## read 2000000 bytes with a 50 bytes overlap with the previous
-		## read so we don't miss any pattern. This needs to be updated
-		## as soon as patterns >= 50 are used.
-		databuffer = datafile.read(2000000)
-		if len(databuffer) >= 50:
-			offset = offset + 1999950
-		else:
-			offset = offset + len(databuffer)
-	datafile2.close()
-	datafile.close()
+					offsets[key].add(markeroffset)
+			if windowoffset + 2000000 >= endoffset:
+				break
+			## move the window 1999950 bytes, so there is a 50 bytes overlap
+			## with the previous window and no pattern is missed. This needs
+			## to be updated as soon as patterns >= 50 are used.
+			windowoffset = windowoffset + 1999950
+		datamap.close()
+		datafile.close()
 
 	for key in marker_keys:
 		offsets[key] = list(offsets[key])
@@ -774,6 +811,10 @@ def verifyMP4(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv
 
 ## very simplistic verifier for some Windows icon files
 ## https://en.wikipedia.org/wiki/ICO_%28file_format%29
+## layout of an entry in the ICO directory: width, height, colours, reserved,
+## colour planes, bits per pixel, size and offset of the image
+icoentry = fileview.layout('<BBBBHHII')
+
 def verifyIco(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv={}, debug=False, unpacktempdir=None, filehashes=None):
 	newtags = []
 	knownicoextensions = ['cur', 'ico', 'hdb']
@@ -789,78 +830,66 @@ def verifyIco(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv
 	if 'compressed' in tags or 'graphics' in tags or 'xml' in tags:
 		return newtags
 	## check the first four bytes
-	icofile = open(filename, 'rb')
-	icobytes = icofile.read(4)
-	icofile.close()
+	icoview = fileview.getview(filename)
+	icobytes = icoview.readat(0, 4)
 	## only allow icon files and cursor files
 	if icobytes == '\x00\x00\x01\x00':
 		filetype = 'ico'
 	elif icobytes == '\x00\x00\x02\x00':
 		filetype = 'cur'
 	else:
+		icoview.close()
 		return newtags
 	## now check how many images there are in the file
-	icofile = open(filename, 'rb')
-	icofile.seek(4)
-	icobytes = icofile.read(2)
-	icofile.close()
-	if len(icobytes) != 2:
-		return newtags
-	icocount = struct.unpack('<H', icobytes)[0]
-
-	if icocount == 0:
+	icocount = icoview.value('<H', 4)
+	if icocount == None or icocount == 0:
+		icoview.close()
 		return newtags
 
-	icofilesize = os.stat(filename).st_size
-	icofile = open(filename, 'rb')
-	icofile.seek(6)
+	icofilesize = len(icoview)
 
 	oldoffset = 0
 	## the ICO format first has all the headers, then the image data
 	for i in xrange(0,icocount):
-		icoheader = icofile.read(16)
-		if len(icoheader) != 16:
-			icofile.close()
+		icoheader = icoview.unpack(icoentry, 6 + i*16)
+		if icoheader == None:
+			icoview.close()
 			return newtags
 		## now parse the header
 		## fourth byte should be 0 according to specification
 		## although according to wikipedia a value of '\xff' is
 		## written by .NET
-		if not (icoheader[3] == '\x00' or icoheader[3] == '\xff'):
-			icofile.close()
+		if not (icoheader[3] == 0 or icoheader[3] == 0xff):
+			icoview.close()
 			return newtags
 
 		## grab the size of the icon, plus the offset where it can
 		## be found in the file
-		icosize = struct.unpack('<I', icoheader[8:12])[0]
-		icooffset = struct.unpack('<I', icoheader[12:16])[0]
+		(icosize, icooffset) = icoheader[-2:]
 
 		## the declared size of the icon cannot be larger than
 		## the icon file
 		if icosize > icofilesize:
-			icofile.close()
+			icoview.close()
 			return newtags
 		## the declared offset of the icon cannot be beyond the
 		## end of the icon file
 		if icooffset > icofilesize:
-			icofile.close()
+			icoview.close()
 			return newtags
 		## the data of the icon cannot be outside of the file
 		if icooffset + icosize > icofilesize:
-			icofile.close()
+			icoview.close()
 			return newtags
 		## the icon cannot start before the end of the
 		## previous icon (if any)
 		if not icooffset >= oldoffset:
+			icoview.close()
 			return newtags
 		oldoffset = icooffset + icosize
 		## TODO: extra sanity check to see if each image
 		## is actually a valid image.
-		#oldoffset = icofile.tell()
-		#icofile.seek(icooffset)
-		#icobytes = icofile.read(icosize)
-		#icofile.seek(oldoffset)
-	icofile.close()
+	icoview.close()
 
 	## the size of all icons together has to be the file size
 	if not oldoffset == icofilesize:
@@ -999,6 +1028,12 @@ def verifyVimSwap(filename, cursor, conn, tempdir=None, tags=[], offsets={}, sca
 
 ## Check for timezone files.
 ## documentation: man 5 tzfile
+## layout of the header of a time zone file: magic, version, 15 reserved bytes
+## and the number of UTC/local indicators, standard/wall indicators, leap
+## seconds, transition times, local time types and characters in the time zone
+## abbreviation strings
+tzheader = fileview.layout('>4sc15s6I')
+
 def verifyTZ(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv={}, debug=False, unpacktempdir=None, filehashes=None):
 	newtags = []
 	filesize = os.stat(filename).st_size
@@ -1007,255 +1042,118 @@ def verifyTZ(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv=
 	if filesize < 44:
 		return newtags
 
-	datafile = open(filename, 'rb')
-	databuffer = datafile.read(4)
-	if databuffer != 'TZif':
-		datafile.close()
+	tzview = fileview.getview(filename)
+	(magic, versionbyte, reserved, utcindicators, standardindicators, leapseconds, transitiontimes, localtimetypes, timezoneabbreviationchars) = tzview.unpack(tzheader, 0)
+	if magic != 'TZif':
+		tzview.close()
 		return newtags
 	## the version of the file
-	databytes = datafile.read(1)
-	if not databytes in ['\x00', '\x32', '\x33']:
-		datafile.close()
+	if not versionbyte in ['\x00', '\x32', '\x33']:
+		tzview.close()
 		return newtags
-	if databytes == '\x00':
+	if versionbyte == '\x00':
 		version = 0
-	elif databytes == '\x32':
+	elif versionbyte == '\x32':
 		version = 2
-	elif databytes == '\x33':
+	elif versionbyte == '\x33':
 		version = 3
 	## then 15 null bytes
-	databytes = datafile.read(15)
-	if len(databytes) != 15:
-		datafile.close()
-		return newtags
-	if set(databytes) != set(['\x00']):
-		datafile.close()
+	if set(reserved) != set(['\x00']):
+		tzview.close()
 		return newtags
 
-	## number of utc/local indicators
-	databytes = datafile.read(4)
-	utcindicators = struct.unpack('>I', databytes)[0]
-
-	## number of standard indicators
-	databytes = datafile.read(4)
-	standardindicators = struct.unpack('>I', databytes)[0]
-
-	## number of leap seconds
-	databytes = datafile.read(4)
-	leapseconds = struct.unpack('>I', databytes)[0]
-
-	## number of transition times
-	databytes = datafile.read(4)
-	transitiontimes = struct.unpack('>I', databytes)[0]
-	
-	## number of local time types
-	databytes = datafile.read(4)
-	localtimetypes = struct.unpack('>I', databytes)[0]
-
 	if localtimetypes == 0:
-		datafile.close()
+		tzview.close()
 		return newtags
 
-	## number of characters in the timezone abbrevation strings
-	databytes = datafile.read(4)
-	timezoneabbreviationchars = struct.unpack('>I', databytes)[0]
-
-	for i in xrange(0,transitiontimes):
-		databytes = datafile.read(4)
-		if len(databytes) != 4:
-			datafile.close()
-			return newtags
-	for i in xrange(0,transitiontimes):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, localtimetypes):
-		databytes = datafile.read(6)
-		if len(databytes) != 6:
-			datafile.close()
-			return newtags
-
-	databytes = datafile.read(timezoneabbreviationchars)
-	if len(databytes) != timezoneabbreviationchars:
-		datafile.close()
+	## The header is followed by the transition times (4 bytes each),
+	## the local time type for each transition time (1 byte each), the
+	## local time types (6 bytes each), the time zone abbreviations,
+	## the leap seconds (8 bytes each), the standard indicators and the
+	## UTC indicators (1 byte each), which all have to fit in the file.
+	tzoffset = 44 + transitiontimes*5 + localtimetypes*6 + timezoneabbreviationchars + leapseconds*8 + standardindicators + utcindicators
+	if tzoffset > filesize:
+		tzview.close()
 		return newtags
 
-	for i in xrange(0, leapseconds):
-		databytes = datafile.read(8)
-		if len(databytes) != 8:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, standardindicators):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, utcindicators):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
 	## if the end of the file is reached, then this
 	## is a valid time zone file
-	if datafile.tell() == filesize:
+	if tzoffset == filesize:
 		newtags.append('timezone')
 		newtags.append('resource')
-		datafile.close()
+		tzview.close()
 		return newtags
 	if version == 0:
 		## version 0 does not have an extra header
-		datafile.close()
+		tzview.close()
 		return newtags
 
 	## for version 2 and version 3 there can be extra data
 	## header is 44 bytes
-	if filesize - datafile.tell() < 44:
-		datafile.close()
+	if filesize - tzoffset < 44:
+		tzview.close()
 		return newtags
 
-	databytes = datafile.read(4)
-	if databytes != 'TZif':
-		datafile.close()
+	(magic, secondversionbyte, reserved, utcindicators, standardindicators, leapseconds, transitiontimes, localtimetypes, timezoneabbreviationchars) = tzview.unpack(tzheader, tzoffset)
+	if magic != 'TZif':
+		tzview.close()
 		return newtags
 
 	## the version of the file, has to be the same as
 	## in the first header
-	databytes = datafile.read(1)
-	if not databytes in ['\x32', '\x33']:
-		datafile.close()
+	if secondversionbyte != versionbyte:
+		tzview.close()
 		return newtags
 
-	if databytes == '\x32':
-		if version != 2:
-			datafile.close()
-			return newtags
-	elif databytes == '\x33':
-		if version != 3:
-			datafile.close()
-			return newtags
-
 	## then again 15 null bytes
-	databytes = datafile.read(15)
-	if set(databytes) != set(['\x00']):
-		datafile.close()
+	if set(reserved) != set(['\x00']):
+		tzview.close()
 		return newtags
 
-	## and then all the same data again
-	## number of utc/local indicators
-	databytes = datafile.read(4)
-	utcindicators = struct.unpack('>I', databytes)[0]
-
-	## number of standard indicators
-	databytes = datafile.read(4)
-	standardindicators = struct.unpack('>I', databytes)[0]
-
-	## number of leap seconds
-	databytes = datafile.read(4)
-	leapseconds = struct.unpack('>I', databytes)[0]
-
-	## number of transition times
-	databytes = datafile.read(4)
-	transitiontimes = struct.unpack('>I', databytes)[0]
-	
-	## number of local time types
-	databytes = datafile.read(4)
-	localtimetypes = struct.unpack('>I', databytes)[0]
-
 	if localtimetypes == 0:
-		datafile.close()
+		tzview.close()
 		return newtags
 
-	## number of characters in the timezone abbrevation strings
-	databytes = datafile.read(4)
-	timezoneabbreviationchars = struct.unpack('>I', databytes)[0]
-
-	for i in xrange(0,transitiontimes):
-		databytes = datafile.read(8)
-		if len(databytes) != 8:
-			datafile.close()
-			return newtags
-	for i in xrange(0,transitiontimes):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, localtimetypes):
-		databytes = datafile.read(6)
-		if len(databytes) != 6:
-			datafile.close()
-			return newtags
-
-	databytes = datafile.read(timezoneabbreviationchars)
-	if len(databytes) != timezoneabbreviationchars:
-		datafile.close()
+	## and then all the same data again, but with 8 byte transition
+	## times and 12 byte leap seconds
+	tzoffset += 44 + transitiontimes*9 + localtimetypes*6 + timezoneabbreviationchars + leapseconds*12 + standardindicators + utcindicators
+	if tzoffset > filesize:
+		tzview.close()
 		return newtags
 
-	for i in xrange(0, leapseconds):
-		databytes = datafile.read(12)
-		if len(databytes) != 12:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, standardindicators):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
-	for i in xrange(0, utcindicators):
-		databytes = datafile.read(1)
-		if len(databytes) != 1:
-			datafile.close()
-			return newtags
-
 	## if the end of the file is reached, then this
 	## is a valid time zone file
-	if datafile.tell() == filesize:
+	if tzoffset == filesize:
 		newtags.append('timezone')
 		newtags.append('resource')
-		datafile.close()
+		tzview.close()
 		return newtags
 
 	## on to the third header, which is a (possibly empty)
 	## tzset string (man 3 tzset) in between two newlines
-	databytes = datafile.read(1)
-	if databytes != '\n':
-		datafile.close()
+	if tzview.readat(tzoffset, 1) != '\n':
+		tzview.close()
 		return newtags
+	tzoffset += 1
 
 	## there have to be at two newlines, so this cannot be
 	## the last byte of the file
-	if datafile.tell() == filesize:
-		datafile.close()
+	if tzoffset == filesize:
+		tzview.close()
 		return newtags
 
 	## check if the file ends with a newline
-	curoffset = datafile.tell()
-	datafile.seek(filesize-1)
-	databytes = datafile.read(1)
-	if databytes != '\n':
-		datafile.close()
+	if tzview.readat(filesize-1, 1) != '\n':
+		tzview.close()
 		return newtags
-	datafile.seek(curoffset)
 
 	## TODO: better check if the tzset string is valid
 	validtzchars = set("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ<>:+-.,/")
-	while True:
-		databytes = datafile.read(1)
-		if datafile.tell() == filesize:
-			datafile.close()
-			break
-		if not databytes in validtzchars:
-			datafile.close()
-			return newtags
+	tzstring = tzview.readat(tzoffset, filesize - 1 - tzoffset)
+	tzview.close()
+	if not set(tzstring).issubset(validtzchars):
+		return newtags
 
-	datafile.close()
 	newtags.append('timezone')
 	newtags.append('resource')
 	return newtags
@@ -1387,124 +1285,67 @@ def verifyCertificate(filename, cursor, conn, tempdir=None, tags=[], offsets={},
 ## check compiled terminfo files
 ## man 5 term
 ## does not check the ncurses extensions
+## layout of the header of a compiled terminfo file: magic and the sizes of the
+## names section, the boolean section, the numbers section (in short integers),
+## the number of offsets in the string table and the size of the string table
+terminfoheader = fileview.layout('<2s5H')
+
 def verifyTerminfo(filename, cursor, conn, tempdir=None, tags=[], offsets={}, scanenv={}, debug=False, unpacktempdir=None, filehashes=None):
 	newtags = []
 	if not 'binary' in tags:
 		return newtags
 	if 'compressed' in tags or 'graphics' in tags or 'xml' in tags:
 		return newtags
-	terminfofile = open(filename, 'rb')
-	databytes = terminfofile.read(2)
-	if databytes != '\x1a\x01':
-		terminfofile.close()
+	terminfoview = fileview.getview(filename)
+	header = terminfoview.unpack(terminfoheader, 0)
+	if header == None:
+		terminfoview.close()
 		return newtags
-	filesize = os.stat(filename).st_size
+	(magic, namesectionbytes, booleansectionbytes, numbersectionbytes, numberoffsets, stringtablesize) = header
+	if magic != '\x1a\x01':
+		terminfoview.close()
+		return newtags
+	filesize = len(terminfoview)
 	## keep a fictional offset, starting directly after the header
 	offset = 12
-	## next two bytes is the size in bytes in the names section
-	databytes = terminfofile.read(2)
-	if len(databytes) != 2:
-		terminfofile.close()
-		return newtags
-	namesectionbytes = struct.unpack('<H', databytes)[0]
 	if offset + namesectionbytes > filesize:
-		terminfofile.close()
+		terminfoview.close()
 		return newtags
 	offset += namesectionbytes
-	## then next two bytes is the size in bytes in the boolean section
-	databytes = terminfofile.read(2)
-	if len(databytes) != 2:
-		terminfofile.close()
-		return newtags
-	booleansectionbytes = struct.unpack('<H', databytes)[0]
 	if offset + booleansectionbytes > filesize:
-		terminfofile.close()
+		terminfoview.close()
 		return newtags
 	if booleansectionbytes%2 != 0:
 		## align bytes
 		booleansectionbytes += 1
 	offset += booleansectionbytes
-	## then next two bytes is the size in short integers in the numbers section
-	databytes = terminfofile.read(2)
-	if len(databytes) != 2:
-		terminfofile.close()
-		return newtags
-	numbersectionbytes = struct.unpack('<H', databytes)[0]
 	if offset + numbersectionbytes*2 > filesize:
-		terminfofile.close()
+		terminfoview.close()
 		return newtags
 	offset += numbersectionbytes * 2
-	## then next two bytes is the number of offsets in the string table
-	databytes = terminfofile.read(2)
-	if len(databytes) != 2:
-		terminfofile.close()
-		return newtags
-	numberoffsets = struct.unpack('<H', databytes)[0]
 	stringnumberoffset = offset
 	if offset + numberoffsets*2 > filesize:
-		terminfofile.close()
+		terminfoview.close()
 		return newtags
 	offset += numberoffsets * 2
-	## then next two bytes is the size of the string table
-	databytes = terminfofile.read(2)
-	if len(databytes) != 2:
-		terminfofile.close()
-		return newtags
-	stringtablesize = struct.unpack('<H', databytes)[0]
 	stringtableoffset = offset
 	if offset + stringtablesize > filesize:
-		terminfofile.close()
+		terminfoview.close()
 		return newtags
 	offset += stringtablesize
 	## extra sanity check, the string number offsets should be
 	## valid offsets into the string table
-	terminfofile.seek(stringnumberoffset)
-	termbytes = terminfofile.read(numberoffsets*2)
-	for t in xrange(0, len(termbytes), 2):
-		if termbytes[t:t+2] == '\xff\xff':
+	stringnumberoffsets = struct.unpack('<%dH' % numberoffsets, terminfoview.readat(stringnumberoffset, numberoffsets*2))
+	terminfoview.close()
+	for tableoffset in stringnumberoffsets:
+		if tableoffset == 0xffff:
 			continue
-		tableoffset = struct.unpack('<H', termbytes[t:t+2])[0]
 		if stringtableoffset + tableoffset > filesize:
-			terminfofile.close()
 			return newtags
 	if offset != filesize:
 		## perhaps it uses ncurses extensions
-		terminfofile.seek(offset)
-		## the number of extended boolean capabilities
-		databytes = terminfofile.read(2)
-		if len(databytes) != 2:
-			terminfofile.close()
-			return newtags
-		extendedboolean = struct.unpack('<H', databytes)[0]
-		## the number of extended numeric capabilities
-		databytes = terminfofile.read(2)
-		if len(databytes) != 2:
-			terminfofile.close()
-			return newtags
-		extendednumeric = struct.unpack('<H', databytes)[0]
-		## the number of extended string capabilities
-		databytes = terminfofile.read(2)
-		if len(databytes) != 2:
-			terminfofile.close()
-			return newtags
-		extendedstring = struct.unpack('<H', databytes)[0]
-		## the size of extended string table
-		databytes = terminfofile.read(2)
-		if len(databytes) != 2:
-			terminfofile.close()
-			return newtags
-		extendedstringtablesize = struct.unpack('<H', databytes)[0]
-		## the last offset of extended string table in bytes
-		databytes = terminfofile.read(2)
-		if len(databytes) != 2:
-			terminfofile.close()
-			return newtags
-
-		## TODO: more sanity checks
-		extendedstringtablelastoffset = struct.unpack('<H', databytes)[0]
-		terminfofile.close()
+		## TODO: sanity checks for the extended capabilities
 		return newtags
-	terminfofile.close()
 	newtags.append('terminfo')
 	newtags.append('resource')
 	return newtags
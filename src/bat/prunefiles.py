@@ -5,6 +5,7 @@
 ## Licensed under Apache 2.0, see LICENSE file for details
 
 import os, os.path, sys
+import reportstore
 
 '''
 This method can be used to prune scans, by for example ignoring all graphics files
@@ -30,7 +31,7 @@ def prunefiles(unpackreports, scantempdir, topleveldir, processors, scanenv, bat
 
 	for filehash in cleanfiles:
 		try:
-			os.unlink(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash))
+			reportstore.getstore(topleveldir).delete(filehash)
 		except Exception, e:
 			print >>sys.stderr, "error removing", filehash, e
 			sys.stderr.flush()
@@ -4,7 +4,8 @@
 ## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import os, os.path, sys, subprocess, copy, cPickle, multiprocessing
+import os, os.path, sys, subprocess, copy, multiprocessing
+import reportstore
 
 '''
 This plugin for BAT looks at the extracted identifiers and looks at if there
@@ -17,15 +18,13 @@ def reportcopyright(unpackreports, scantempdir, topleveldir, processors, scanenv
 		if not 'checksum' in unpackreports[i]:
 			continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
 		if not 'identifier' in unpackreports[i]['tags']:
 			continue
 
-		## read pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		## read the strings and tags
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['identifier', 'tags'])
 
 		writeback = False
 		strs = leafreports['identifier']['strings']
@@ -41,8 +40,5 @@ def reportcopyright(unpackreports, scantempdir, topleveldir, processors, scanenv
 		if writeback:
 			unpackreports[i]['tags'].append('copyright')
 			leafreports['tags'].append('copyright')
-			leafreports['copyrights'] = copyrights
 
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-			leafreports = cPickle.dump(leafreports, leaf_file)
-			leaf_file.close()
+			reportstore.getstore(topleveldir).update(filehash, {'copyrights': copyrights, 'tags': leafreports['tags']})
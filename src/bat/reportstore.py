@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains the report store, which holds the results of the scans for
+every unique file (the "leaf reports"). These used to be written to a separate
+pickle file per file (filereports/<hash>-filereport.pickle) which had to be
+read completely and written back every time a scan needed or changed even a
+single value.
+
+The report store is a single SQLite database in the top level directory of a
+scan. Every top level key of a report (for example 'tags', 'identifier' or
+'ranking') is stored separately, so scans can read and write just the fields
+they need.
+
+For the scan archive the reports can be exported to the old layout, with one
+pickle per file in the 'filereports' directory.
+'''
+
+import os, os.path, sqlite3, cPickle
+import extractor
+
+## name of the database in the top level directory of a scan
+reportstorename = 'filereports.sqlite3'
+
+class ReportStore:
+	def __init__(self, topleveldir):
+		self.dbpath = os.path.join(topleveldir, reportstorename)
+		self.conn = None
+		self.pid = None
+
+	## open the database. Connections cannot be shared between processes,
+	## so a new connection is made after a fork.
+	def connect(self):
+		if self.conn != None:
+			if self.pid == os.getpid():
+				return self.conn
+			## A connection inherited from the parent process should
+			## not be used, but it should not be closed either, as
+			## SQLite could then remove the journal that the parent
+			## process is still using.
+			inheritedconnections.append(self.conn)
+		self.conn = sqlite3.connect(self.dbpath, timeout=600)
+		self.conn.text_factory = str
+		self.pid = os.getpid()
+		## the store is written by many scan processes at the same time
+		self.conn.execute("pragma journal_mode=wal")
+		self.conn.execute("pragma synchronous=off")
+		self.conn.execute("create table if not exists reports (checksum text, field text, data blob, primary key (checksum, field))")
+		self.conn.commit()
+		return self.conn
+
+	def exists(self, filehash):
+		conn = self.connect()
+		res = conn.execute("select 1 from reports where checksum=? limit 1", (filehash,)).fetchone()
+		return res != None
+
+	## return all reports in the store as a list of checksums
+	def checksums(self):
+		conn = self.connect()
+		return map(lambda x: x[0], conn.execute("select distinct checksum from reports").fetchall())
+
+	## read the complete report for a file
+	def load(self, filehash):
+		conn = self.connect()
+		leafreports = {}
+		for (field, data) in conn.execute("select field, data from reports where checksum=?", (filehash,)):
+			leafreports[field] = cPickle.loads(str(data))
+		return leafreports
+
+	## read only a few fields of a report. Fields that are not in the
+	## report are not in the result.
+	def loadfields(self, filehash, fields):
+		conn = self.connect()
+		leafreports = {}
+		for field in fields:
+			res = conn.execute("select data from reports where checksum=? and field=?", (filehash, field)).fetchone()
+			if res != None:
+				leafreports[field] = cPickle.loads(str(res[0]))
+		return leafreports
+
+	## read a single field of a report
+	def get(self, filehash, field, default=None):
+		res = self.loadfields(filehash, [field])
+		if field in res:
+			return res[field]
+		return default
+
+	## write (or overwrite) some fields of a report, leaving the
+	## other fields alone
+	def update(self, filehash, fields):
+		conn = self.connect()
+		rows = map(lambda x: (filehash, x, sqlite3.Binary(cPickle.dumps(fields[x], cPickle.HIGHEST_PROTOCOL))), fields)
+		conn.executemany("insert or replace into reports (checksum, field, data) values (?,?,?)", rows)
+		conn.commit()
+
+	## replace the complete report for a file
+	def store(self, filehash, leafreports):
+		conn = self.connect()
+		conn.execute("delete from reports where checksum=?", (filehash,))
+		self.update(filehash, leafreports)
+
+	def delete(self, filehash):
+		conn = self.connect()
+		conn.execute("delete from reports where checksum=?", (filehash,))
+		conn.commit()
+
+	## write every report (or the reports for 'filehashes') as a pickle file
+	## to the 'filereports' directory in 'targetdir', which is the layout that
+	## is used in the scan archive. If 'compressed' is set the pickles are
+	## gzip compressed while they are written.
+	def export(self, targetdir, filehashes=None, compressed=False, compresslevel=9):
+		filereportsdir = os.path.join(targetdir, 'filereports')
+		if not os.path.exists(filereportsdir):
+			try:
+				os.mkdir(filereportsdir)
+			except OSError:
+				## created by another process exporting at the same time
+				pass
+		if filehashes == None:
+			filehashes = self.checksums()
+		for filehash in filehashes:
+			picklefile = extractor.openreport(os.path.join(filereportsdir, "%s-filereport.pickle" % filehash), compressed, compresslevel)
+			cPickle.dump(self.load(filehash), picklefile)
+			picklefile.close()
+
+	def close(self):
+		if self.conn != None and self.pid == os.getpid():
+			self.conn.close()
+		self.conn = None
+
+## Most scans only get the top level directory, so keep one store per top
+## level directory per process, instead of opening the database for every
+## report that is read or written.
+reportstores = {}
+inheritedconnections = []
+
+def getstore(topleveldir):
+	if not topleveldir in reportstores:
+		reportstores[topleveldir] = ReportStore(topleveldir)
+	return reportstores[topleveldir]
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains the result cache, which keeps results of scans across
+scans of different firmwares. Related firmwares (for example different
+versions of the same product) often contain many identical files (same
+BusyBox, same C library) and for these files the results of the leaf scans
+and the ranking will be the same every time.
+
+Results are stored per checksum and per "fingerprint". The fingerprint is a
+checksum of everything that could change the result for identical files: the
+version of BAT, the configuration of the scans and the version of the
+knowledgebase. If any of these change the fingerprint changes as well and
+old results are no longer used.
+
+Some results also depend on the context the file was found in, for example
+tags passed by the unpacker. This context is stored with the result and has
+to match as well.
+
+The cache is a single SQLite database in a directory that is set in the
+configuration file. It can be removed at any time.
+'''
+
+import os, os.path, sqlite3, cPickle, hashlib
+import scanmetrics
+
+## name of the database in the cache directory
+resultcachename = 'resultcache.sqlite3'
+
+## Make a canonical representation of (part of) a scan configuration, so
+## the same configuration always results in the same fingerprint. Order
+## of dictionaries and sets is not guaranteed, so these are sorted.
+def canonical(data):
+	if isinstance(data, dict):
+		return "{%s}" % ", ".join(map(lambda x: "%s: %s" % (canonical(x), canonical(data[x])), sorted(data.keys())))
+	if isinstance(data, (set, frozenset)):
+		return "set(%s)" % canonical(sorted(data))
+	if isinstance(data, (list, tuple)):
+		return "[%s]" % ", ".join(map(lambda x: canonical(x), data))
+	return repr(data)
+
+## compute a fingerprint from the BAT version, the knowledgebase version
+## and a list of scan configurations (or other data)
+def fingerprint(batversion, knowledgebase, scanconfigs):
+	h = hashlib.new('sha256')
+	h.update(canonical([batversion, knowledgebase, scanconfigs]))
+	return h.hexdigest()
+
+## Determine the version of the knowledgebase. If an explicit version was
+## set in the configuration file it is used, otherwise the amount of packages
+## that were processed into the database is used, which changes every time
+## packages are added.
+def knowledgebaseversion(configuredversion, cursor, conn):
+	if configuredversion != None:
+		return configuredversion
+	if cursor == None:
+		return None
+	try:
+		cursor.execute("select count(*) from processed")
+		res = cursor.fetchone()
+		conn.commit()
+		return res[0]
+	except:
+		conn.rollback()
+		return None
+
+class ResultCache:
+	def __init__(self, cachedir):
+		self.dbpath = os.path.join(cachedir, resultcachename)
+		self.conn = None
+		self.pid = None
+
+	## open the database. Like with the report store a new connection is
+	## made after a fork.
+	def connect(self):
+		if self.conn != None:
+			if self.pid == os.getpid():
+				return self.conn
+			inheritedconnections.append(self.conn)
+		self.conn = sqlite3.connect(self.dbpath, timeout=600)
+		self.conn.text_factory = str
+		self.pid = os.getpid()
+		self.conn.execute("pragma journal_mode=wal")
+		self.conn.execute("create table if not exists results (checksum text, fingerprint text, context text, data blob, primary key (checksum, fingerprint, context))")
+		self.conn.commit()
+		return self.conn
+
+	## return the cached result, or None if there is no result
+	def get(self, filehash, fingerprint, context):
+		conn = self.connect()
+		res = conn.execute("select data from results where checksum=? and fingerprint=? and context=?", (filehash, fingerprint, canonical(context))).fetchone()
+		if res == None:
+			return None
+		scanmetrics.count('cachehits')
+		return cPickle.loads(str(res[0]))
+
+	def put(self, filehash, fingerprint, context, result):
+		conn = self.connect()
+		conn.execute("insert or replace into results (checksum, fingerprint, context, data) values (?,?,?,?)", (filehash, fingerprint, canonical(context), sqlite3.Binary(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))))
+		conn.commit()
+
+	def close(self):
+		if self.conn != None and self.pid == os.getpid():
+			self.conn.close()
+		self.conn = None
+
+## keep one cache per cache directory per process
+resultcaches = {}
+inheritedconnections = []
+
+def getcache(cachedir):
+	if not cachedir in resultcaches:
+		resultcaches[cachedir] = ResultCache(cachedir)
+	return resultcaches[cachedir]
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains code to record metrics about the scans (prerun, unpack,
+leaf, aggregate and postrun) that are run by BAT. For every scan the amount
+of calls, the wall clock time, the CPU time, the amount of bytes read and
+written, the amount of subprocesses that were started, the amount of database
+queries and the amount of cache hits are recorded.
+
+CPU time, bytes read and bytes written are the differences in the counters of
+the process (from os.times() and /proc/self/io) before and after a scan, so
+they include subprocesses and processes (multiprocessing) that were started by
+the scan, as long as these were waited for: the counters of a process are
+added to those of its parent when it is waited for. Bytes written are mostly
+temporary files (unpacked data). The other counters are kept in this module
+and increased by the code that starts subprocesses, queries the database or
+uses a cache.
+
+Processes that are started by a scan (for example the workers of the ranking
+scan, which do most of the database queries) have their own copy of these
+counters. They add their counts to a shared value with sharecounter(), which
+the scan adds to its own counters when the processes are done.
+
+Subprocesses are counted by replacing subprocess.Popen, so subprocesses that
+are started with a reference to Popen that was taken before metrics were
+enabled (for example 'from subprocess import Popen' at import time) or
+without the subprocess module (os.system()) are not counted. BAT itself
+only uses subprocess.Popen.
+
+Every process records metrics in its own ScanMetrics object and sends the
+results back with the results of the file that was scanned, so the metrics
+can be combined per binary and written to METRICS.json in the output archive.
+
+Optionally scans can be profiled with cProfile. The profiles of every scan are
+combined and written in the format of pstats.
+'''
+
+import os, os.path, time, json, marshal, pstats, cProfile, subprocess
+
+try:
+	import psycopg2.extensions
+	havepsycopg2 = True
+except Exception, e:
+	havepsycopg2 = False
+
+## metrics are only recorded if enabled, see enable()
+enabled = False
+
+## counters that are increased by other code
+counters = {'subprocesses': 0, 'dbqueries': 0, 'cachehits': 0}
+
+## names of the metrics, in the order they are stored in
+fields = ['calls', 'walltime', 'cputime', 'bytesread', 'byteswritten', 'subprocesses', 'dbqueries', 'cachehits']
+
+def count(counter, amount=1):
+	counters[counter] += amount
+
+## Set all counters to 0. This should be done by a process that is started by
+## a scan, as it starts with a copy of the counters of the scan.
+def resetcounters():
+	for counter in counters:
+		counters[counter] = 0
+
+## Add the value of 'counter' to 'value' (a multiprocessing.Value that is
+## shared with the scan) and set the counter to 0. This is done by processes
+## that are started by a scan, before they report that a task is done.
+def sharecounter(counter, value):
+	if counters[counter] == 0:
+		return
+	value.get_lock().acquire()
+	value.value += counters[counter]
+	value.get_lock().release()
+	counters[counter] = 0
+
+## subprocess.Popen is replaced by this class when metrics are enabled, so
+## subprocesses started by any scan are counted.
+origpopen = subprocess.Popen
+
+class CountingPopen(origpopen):
+	def __init__(self, *args, **kwargs):
+		counters['subprocesses'] += 1
+		origpopen.__init__(self, *args, **kwargs)
+
+## cursor for the database that counts the queries
+if havepsycopg2:
+	class CountingCursor(psycopg2.extensions.cursor):
+		def execute(self, query, args=None):
+			counters['dbqueries'] += 1
+			return psycopg2.extensions.cursor.execute(self, query, args)
+
+		def executemany(self, query, args):
+			counters['dbqueries'] += 1
+			return psycopg2.extensions.cursor.executemany(self, query, args)
+
+## Enable the metrics. This should be done before the processes for
+## scanning are started, so they inherit the setting.
+def enable():
+	global enabled
+	enabled = True
+	subprocess.Popen = CountingPopen
+
+## amount of bytes that were read from /proc/self/io by iocounters()
+ioreadbytes = 0
+
+## Return the amount of bytes read and written by the process (including
+## subprocesses that were waited for). These are not available on every
+## system. Reading /proc/self/io is itself counted as reading (after the
+## contents were generated), so the bytes read by earlier calls are not
+## included, otherwise every scan would read about 100 bytes extra.
+def iocounters():
+	global ioreadbytes
+	bytesread = 0
+	byteswritten = 0
+	try:
+		iofile = open('/proc/self/io', 'r')
+		iodata = iofile.read()
+		iofile.close()
+		for l in iodata.splitlines():
+			if l.startswith('rchar:'):
+				bytesread = int(l.split(':', 1)[1]) - ioreadbytes
+			elif l.startswith('wchar:'):
+				byteswritten = int(l.split(':', 1)[1])
+		ioreadbytes += len(iodata)
+	except Exception, e:
+		pass
+	return (bytesread, byteswritten)
+
+## the values of all metrics (except 'calls') at this moment
+def snapshot():
+	times = os.times()
+	(bytesread, byteswritten) = iocounters()
+	return [time.time(), times[0] + times[1] + times[2] + times[3], bytesread, byteswritten, counters['subprocesses'], counters['dbqueries'], counters['cachehits']]
+
+## add the profile statistics in 'source' to 'target', like pstats does
+def addprofile(target, source):
+	for func in source:
+		target[func] = pstats.add_func_stats(target.get(func, (0, 0, 0, 0, {})), source[func])
+
+class ScanMetrics:
+	def __init__(self):
+		## (phase, name) -> list of values, in the order of 'fields'
+		self.scans = {}
+		## (phase, name) -> profile statistics
+		self.profiles = {}
+
+	## Run 'function' with the arguments and record the metrics for
+	## the scan 'name' in phase 'phase'. If 'profile' is set the
+	## function is run with cProfile. Returns the result of 'function'.
+	def measure(self, phase, name, profile, function, *args, **kwargs):
+		if not enabled:
+			return function(*args, **kwargs)
+		profiler = None
+		start = snapshot()
+		if profile:
+			profiler = cProfile.Profile()
+			profiler.enable()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			if profiler != None:
+				profiler.disable()
+			end = snapshot()
+			self.add((phase, name), [1] + map(lambda x: end[x] - start[x], range(0, len(start))))
+			if profiler != None:
+				profiler.create_stats()
+				self.addprofile((phase, name), profiler.stats)
+
+	def add(self, scankey, values):
+		if scankey in self.scans:
+			self.scans[scankey] = map(lambda x: x[0] + x[1], zip(self.scans[scankey], values))
+		else:
+			self.scans[scankey] = values
+
+	def addprofile(self, scankey, stats):
+		if not scankey in self.profiles:
+			self.profiles[scankey] = {}
+		addprofile(self.profiles[scankey], stats)
+
+	## The metrics that were recorded, to send to another process, or
+	## None if nothing was recorded.
+	def result(self):
+		if self.scans == {} and self.profiles == {}:
+			return None
+		return (self.scans, self.profiles)
+
+	## merge a result from another process
+	def merge(self, result):
+		if result == None:
+			return
+		(scans, profiles) = result
+		for scankey in scans:
+			self.add(scankey, scans[scankey])
+		for scankey in profiles:
+			self.addprofile(scankey, profiles[scankey])
+
+	## Write the metrics to METRICS.json in 'topleveldir', together with
+	## the durations of the phases from 'statistics'. The profiles are
+	## written to the directory 'profiles', one file per scan.
+	def write(self, topleveldir, statistics):
+		metrics = {'statistics': {}, 'scans': {}}
+		for i in statistics:
+			if hasattr(statistics[i], 'total_seconds'):
+				metrics['statistics'][i] = statistics[i].total_seconds()
+			else:
+				metrics['statistics'][i] = statistics[i]
+		for (phase, name) in self.scans:
+			if not phase in metrics['scans']:
+				metrics['scans'][phase] = {}
+			metrics['scans'][phase][name] = dict(zip(fields, self.scans[(phase, name)]))
+		metricsfile = open(os.path.join(topleveldir, 'METRICS.json'), 'w')
+		json.dump(metrics, metricsfile, indent=4, sort_keys=True)
+		metricsfile.close()
+
+		if self.profiles == {}:
+			return
+		profiledir = os.path.join(topleveldir, 'profiles')
+		if not os.path.exists(profiledir):
+			os.mkdir(profiledir)
+		for (phase, name) in self.profiles:
+			profilefile = open(os.path.join(profiledir, "%s-%s.pstats" % (phase, name)), 'wb')
+			marshal.dump(self.profiles[(phase, name)], profilefile)
+			profilefile.close()
@@ -8,7 +8,8 @@
 This file contains a few methods that can be useful for security scanning.
 '''
 
-import os, sys, zipfile, subprocess, re, cPickle, copy, tempfile
+import os, sys, zipfile, subprocess, re, copy, tempfile
+import reportstore
 
 ## This method extracts the CRC32 checksums from the entries of the encrypted zip file and checks
 ## whether or not there are any files in the database with the same CRC32. If so, a known plaintext
@@ -30,11 +31,9 @@ def scanEncryptedZip(unpackreports, scantempdir, topleveldir, processors, scanen
 		if not 'zip' in unpackreports[i]['tags']:
                         continue
 		filehash = unpackreports[i]['checksum']
-		if not os.path.exists(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash)):
+		if not reportstore.getstore(topleveldir).exists(filehash):
 			continue
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags'])
 		if not 'encrypted' in leafreports['tags']:
 			continue
 		if not 'zip' in leafreports['tags']:
@@ -62,12 +61,12 @@ def scanEncryptedZip(unpackreports, scantempdir, topleveldir, processors, scanen
 				plaintexts.add(res[0])
 		## now write back the results
 		if len(plaintexts) != 0:
+			filehash = unpackreports[i]['checksum']
+			leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['tags'])
 			leafreports['encryptedzip-plaintexts'] = plaintexts
 			leafreports['tags'].append('encryptedzip-attack')
 			unpackreports[i]['tags'].append('encryptedzip-attack')
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-			cPickle.dump(leafreports, leaf_file)
-			leaf_file.close()
+			reportstore.getstore(topleveldir).update(filehash, leafreports)
 	return
 
 def encryptedZipSetup(scanenv, cursor, conn, debug=False):
@@ -116,10 +115,8 @@ def scanShellInvocations(unpackreports, scantempdir, topleveldir, processors, sc
 
 		filehash = unpackreports[i]['checksum']
 
-		## read pickle file
-		leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-		leafreports = cPickle.load(leaf_file)
-		leaf_file.close()
+		## read the strings and tags
+		leafreports = reportstore.getstore(topleveldir).loadfields(filehash, ['identifier', 'tags'])
 
 		strs = leafreports['identifier']['strings']
 		buggylines = []
@@ -132,12 +129,9 @@ def scanShellInvocations(unpackreports, scantempdir, topleveldir, processors, sc
 						break
 		## now write back the results
 		if buggylines != []:
-			leafreports['shellinvocations'] = buggylines
 			leafreports['tags'].append('shellinvocations')
 			unpackreports[i]['tags'].append('shellinvocations')
-			leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'wb')
-			cPickle.dump(leafreports, leaf_file)
-			leaf_file.close()
+			reportstore.getstore(topleveldir).update(filehash, {'shellinvocations': buggylines, 'tags': leafreports['tags']})
 
 ## method to check if a file is an OpenSSH public or private key
 ## uses openssl to check
@@ -331,9 +325,7 @@ def searchLogins(unpackreports, scantempdir, topleveldir, processors, scanenv, b
 		return
 
 	filehash = unpackreports[u]['checksum']
-	leaf_file = open(os.path.join(topleveldir, "filereports", "%s-filereport.pickle" % filehash), 'rb')
-	leafreports = cPickle.load(leaf_file)
-	leaf_file.close()
+	leafreports = reportstore.getstore(topleveldir).load(filehash)
 
 	logins = map(lambda x: x[0], leafreports['passwords'])
 
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This file contains an index to quickly find files in the 'batresult' table
+of the database that are close (according to TLSH) to a file that is
+scanned.
+
+Without the index the TLSH of a file is compared to the TLSH of every file
+in 'batresult' with the same name, so files that were renamed are never found
+and files with common names (libc.so.0, busybox) are compared to very many
+files.
+
+The TLSH distance between two files is at least 12 times the difference of
+the length values in the TLSH headers (if that is more than 1), so files with
+a length value that is too different can never be within the threshold. The
+index therefore has a separate part for every length value and only the parts
+with a length value close enough are searched.
+
+Every part is a vantage point tree: every node has a file (the vantage point)
+and the distance 'mu' to the median of the files below it. Files closer to the
+vantage point than 'mu' are in the left subtree, the others in the right
+subtree. While searching for files within a certain distance of a TLSH, whole
+subtrees can be skipped using the triangle inequality. The TLSH distance is
+not a strict metric, so in rare cases a file that is just within the threshold
+might not be found.
+
+New files can be added without rebuilding the index: the new files get their
+own tree and trees are merged when a new tree is at least as big as the tree
+before it, so there are only a few trees per length value. The index is stored
+as a pickle and built by maintenance/createtlshindex.py.
+'''
+
+import os, cPickle
+
+try:
+	import tlsh
+	tlshscan = True
+except Exception, e:
+	tlshscan = False
+
+## check if a TLSH hash can be used for comparisons
+def validhash(tlshhash):
+	if tlshhash == None or tlshhash == '':
+		return False
+	try:
+		tlsh.diff(tlshhash, tlshhash)
+		return True
+	except Exception, e:
+		return False
+
+## Build a vantage point tree from a list of (TLSH, entry) tuples. The
+## tree is stored as lists in the order of the nodes, so it can be pickled
+## without recursion: for every node the TLSH and entry of the vantage point,
+## 'mu' and the index of the left and right child (-1 if there is none).
+def buildtree(items):
+	tree = {'hashes': [], 'entries': [], 'mu': [], 'left': [], 'right': []}
+	## stack with the items for a subtree and the node and side
+	## of the parent the subtree should be attached to
+	stack = [(items, None, None)]
+	while stack != []:
+		(subitems, parent, side) = stack.pop()
+		node = len(tree['hashes'])
+		if parent != None:
+			tree[side][parent] = node
+		(vantagehash, vantageentry) = subitems[0]
+		tree['hashes'].append(vantagehash)
+		tree['entries'].append(vantageentry)
+		tree['left'].append(-1)
+		tree['right'].append(-1)
+		rest = subitems[1:]
+		if rest == []:
+			tree['mu'].append(0)
+			continue
+		distances = sorted(map(lambda x: (tlsh.diff(vantagehash, x[0]), x), rest), key=lambda x: x[0])
+		## split on the position of the median, not on the value, so
+		## the tree stays balanced with many identical distances
+		median = len(distances) / 2
+		tree['mu'].append(distances[median][0])
+		if median > 0:
+			stack.append((map(lambda x: x[1], distances[:median]), node, 'left'))
+		stack.append((map(lambda x: x[1], distances[median:]), node, 'right'))
+	return tree
+
+## Return the length value from the header of a TLSH. The nibbles of the
+## bytes in the header are swapped. Newer versions of TLSH prefix the hash
+## with a version ('T1').
+def lengthvalue(tlshhash):
+	if tlshhash.startswith('T'):
+		tlshhash = tlshhash[2:]
+	return int(tlshhash[3] + tlshhash[2], 16)
+
+class TLSHIndex:
+	def __init__(self, trees=None):
+		## length value -> list of trees
+		if trees == None:
+			trees = {}
+		self.trees = trees
+
+	def __len__(self):
+		return sum(map(lambda x: sum(map(lambda y: len(y['hashes']), x)), self.trees.values()))
+
+	## all entries in the index
+	def entries(self):
+		res = []
+		for lvalue in self.trees:
+			for tree in self.trees[lvalue]:
+				res += tree['entries']
+		return res
+
+	## Add a list of (TLSH, entry) tuples. Entries with a TLSH that cannot
+	## be compared are ignored. Returns the amount of entries that were
+	## added.
+	def add(self, items):
+		perlvalue = {}
+		added = 0
+		for item in items:
+			if not validhash(item[0]):
+				continue
+			lvalue = lengthvalue(item[0])
+			if lvalue in perlvalue:
+				perlvalue[lvalue].append(item)
+			else:
+				perlvalue[lvalue] = [item]
+			added += 1
+		for lvalue in perlvalue:
+			newitems = perlvalue[lvalue]
+			trees = self.trees.setdefault(lvalue, [])
+			while trees != [] and len(trees[-1]['hashes']) <= len(newitems):
+				tree = trees.pop()
+				newitems = zip(tree['hashes'], tree['entries']) + newitems
+			trees.append(buildtree(newitems))
+		return added
+
+	## Return up to 'k' entries with a distance to 'tlshhash' smaller than
+	## 'threshold' as a list of (distance, entry) tuples, closest first.
+	def query(self, tlshhash, threshold, k=1):
+		if not validhash(tlshhash):
+			return []
+		res = []
+		## the distance an entry has to be below to be a result,
+		## which gets smaller when k results have been found
+		maxdistance = threshold
+		## length values that differ 1 add 1 to the distance, a bigger
+		## difference adds 12 for each step (length values wrap around)
+		lvalue = lengthvalue(tlshhash)
+		maxldiff = max(1, (threshold - 1) / 12)
+		lvalues = set(map(lambda x: (lvalue + x) % 256, range(-maxldiff, maxldiff + 1)))
+		for l in lvalues:
+			for tree in self.trees.get(l, []):
+				stack = [0]
+				while stack != []:
+					node = stack.pop()
+					distance = tlsh.diff(tlshhash, tree['hashes'][node])
+					if distance < maxdistance:
+						res.append((distance, tree['entries'][node]))
+						res.sort(key=lambda x: x[0])
+						if len(res) >= k:
+							res = res[:k]
+							maxdistance = res[-1][0]
+					mu = tree['mu'][node]
+					if tree['left'][node] != -1 and distance - maxdistance < mu:
+						stack.append(tree['left'][node])
+					if tree['right'][node] != -1 and distance + maxdistance >= mu:
+						stack.append(tree['right'][node])
+		return res
+
+	def write(self, indexfile):
+		## write to a temporary file first, so scans that are running
+		## never see a partially written index
+		tmpfile = "%s.tmp" % indexfile
+		outfile = open(tmpfile, 'wb')
+		cPickle.dump({'trees': self.trees}, outfile, cPickle.HIGHEST_PROTOCOL)
+		outfile.close()
+		os.rename(tmpfile, indexfile)
+
+def readindex(indexfile):
+	infile = open(indexfile, 'rb')
+	index = cPickle.load(infile)
+	infile.close()
+	return TLSHIndex(index['trees'])
+
+## The index is read only once per process, instead of for every file.
+tlshindexes = {}
+
+def getindex(indexfile):
+	if not indexfile in tlshindexes:
+		tlshindexes[indexfile] = readindex(indexfile)
+	return tlshindexes[indexfile]
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+Build or refresh the index of TLSH hashes of the files in the 'batresult'
+table (see bat/tlshindex.py), which is used by bat-scan to find the closest
+known file for files that were not seen before.
+
+If the index already exists only files that were added to 'batresult' since
+the index was built or last refreshed are added to it, unless -r is given,
+in which case the index is built from scratch.
+
+The configuration file is the same as the configuration file for scanning. The
+path of the index is taken from 'tlshindex' in the configuration file, unless
+it is given with -i.
+'''
+
+import sys, os, os.path, datetime
+from optparse import OptionParser
+import ConfigParser
+
+## import the PostgreSQL connection module
+import psycopg2
+
+import bat.tlshindex
+
+## amount of rows that are fetched from the database at once
+chunksize = 100000
+
+def main(argv):
+	config = ConfigParser.ConfigParser()
+
+	parser = OptionParser()
+	parser.add_option("-c", "--config", action="store", dest="cfg", help="path to configuration file", metavar="FILE")
+	parser.add_option("-i", "--index", action="store", dest="indexfile", help="path to TLSH index (default: tlshindex from configuration file)", metavar="FILE")
+	parser.add_option("-r", "--rebuild", action="store_true", dest="rebuild", help="rebuild the index from scratch (default: false)")
+
+	(options, args) = parser.parse_args()
+
+	if options.cfg == None:
+		parser.error("Specify configuration file")
+
+	if not os.path.exists(options.cfg):
+		parser.error("Configuration file does not exist")
+	try:
+		configfile = open(options.cfg, 'r')
+	except:
+		parser.error("Configuration file not readable")
+	config.readfp(configfile)
+	configfile.close()
+
+	if not bat.tlshindex.tlshscan:
+		print >>sys.stderr, "TLSH module not available, exiting"
+		sys.exit(1)
+
+	indexfile = options.indexfile
+
+	## the configuration file is actually the same as the configuration for BAT scanning
+	for section in config.sections():
+		if section != "batconfig":
+			continue
+		try:
+			postgresql_user = config.get(section, 'postgresql_user')
+			postgresql_password = config.get(section, 'postgresql_password')
+			postgresql_db = config.get(section, 'postgresql_db')
+
+			## check to see if a host (IP-address) was supplied
+			try:
+				postgresql_host = config.get(section, 'postgresql_host')
+			except:
+				postgresql_host = None
+
+			## check to see if a port was specified. If not, default to 'None'
+			try:
+				postgresql_port = config.get(section, 'postgresql_port')
+			except Exception, e:
+				postgresql_port = None
+
+		except Exception, e:
+			print >>sys.stderr, "PostgreSQL information incomplete, exiting"
+			sys.stderr.flush()
+			sys.exit(1)
+		if indexfile == None:
+			try:
+				indexfile = config.get(section, 'tlshindex')
+			except:
+				pass
+
+	if indexfile == None:
+		parser.error("Specify path to TLSH index")
+
+	if os.path.exists(indexfile) and not options.rebuild:
+		tlshindex = bat.tlshindex.readindex(indexfile)
+	else:
+		tlshindex = bat.tlshindex.TLSHIndex()
+
+	## files are identified by checksum, path and the checksum of the
+	## top level file they were found in
+	knownfiles = set(map(lambda x: (x[0], x[2], x[4]), tlshindex.entries()))
+	print "files in index: %d" % len(knownfiles), datetime.datetime.utcnow().isoformat()
+	sys.stdout.flush()
+
+	conn = psycopg2.connect(database=postgresql_db, user=postgresql_user, password=postgresql_password, host=postgresql_host, port=postgresql_port)
+
+	## a named (server side) cursor, so not all of 'batresult' is sent
+	## to the client at once
+	cursor = conn.cursor('tlshindex')
+	cursor.execute("select checksum, filename, tlsh, pathname, parentname, parentchecksum from batresult where tlsh is not null")
+	newitems = []
+	res = cursor.fetchmany(chunksize)
+	while res != []:
+		for (checksum, filename, tlshchecksum, pathname, parentname, parentchecksum) in res:
+			if (checksum, pathname, parentchecksum) in knownfiles:
+				continue
+			knownfiles.add((checksum, pathname, parentchecksum))
+			newitems.append((tlshchecksum, (checksum, filename, pathname, parentname, parentchecksum)))
+		res = cursor.fetchmany(chunksize)
+	cursor.close()
+	conn.close()
+
+	added = tlshindex.add(newitems)
+	tlshindex.write(indexfile)
+	print "files added to index: %d, files in index: %d" % (added, len(tlshindex)), datetime.datetime.utcnow().isoformat()
+
+if __name__ == "__main__":
+	main(sys.argv)
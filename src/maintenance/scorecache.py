@@ -1,68 +1,297 @@
 #!/usr/bin/python
 
 ## Binary Analysis Tool
-## Copyright 2014-2015 Armijn Hemel for Tjaldur Software Governance Solutions
+## Copyright 2014-2016 Armijn Hemel for Tjaldur Software Governance Solutions
 ## Licensed under Apache 2.0, see LICENSE file for details
 
-import sys, os, os.path
+'''
+Compute the precomputed scores of strings (the 'scores_*' tables) from the
+string caches (the 'stringscache_*' tables) for every language, either in
+PostgreSQL (the database used by createdb.py, configured in the same
+configuration file) or in a SQLite database with the caching tables.
+
+The score of a string only depends on the amount of packages and the amount
+of distinct file names the string was found in, so for each language the
+strings are grouped in a single query and the scores are written in bulk
+(COPY for PostgreSQL, executemany() for SQLite) to a new table, which then
+replaces the old table.
+
+When packages are added to the database with createdb.py the list of new
+files that createdb.py writes (the -n option) can be supplied to only
+recompute the scores of strings that were found in these files.
+'''
+
+import sys, os, os.path, datetime, ConfigParser
 import sqlite3
 from optparse import OptionParser
 
+## default parameter for scoring, the same as in bat/licenseversion.py
+alpha = 5.0
+
+## amount of rows that are fetched and written at once
+chunksize = 100000
+
+stringsdbperlanguagetable = { 'C':                'stringscache_c'
+                            , 'C#':               'stringscache_csharp'
+                            , 'Java':             'stringscache_java'
+                            , 'JavaScript':       'stringscache_javascript'
+                            , 'PHP':              'stringscache_php'
+                            , 'Python':           'stringscache_python'
+                            , 'Ruby':             'stringscache_ruby'
+                            , 'ActionScript':     'stringscache_actionscript'
+                            }
+
+scoresdbperlanguagetable = { 'C':                'scores_c'
+                           , 'C#':               'scores_csharp'
+                           , 'Java':             'scores_java'
+                           , 'JavaScript':       'scores_javascript'
+                           , 'PHP':              'scores_php'
+                           , 'Python':           'scores_python'
+                           , 'Ruby':             'scores_ruby'
+                           , 'ActionScript':     'scores_actionscript'
+                           }
+
+## A string found in a single package gets its length as a score. Otherwise
+## the score is divided by alpha for every extra file name the string was
+## found in.
+def computescore(stringidentifier, packages, filenames):
+	if packages == 1:
+		return float(len(stringidentifier))
+	try:
+		score = float(len(stringidentifier)) / pow(alpha, (filenames - 1))
+	except Exception, e:
+		score = len(stringidentifier) / sys.maxint
+	## cut off for for example postgresql
+	if score < 1e-37:
+		score = 0.0
+	return score
+
+## escape a value for the text format of COPY
+def copyescape(value):
+	return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+## An iterator over the rows of 'cursor', which behaves like a file, so it
+## can be used with copy_from() of psycopg2 without keeping all scores in
+## memory.
+class ScoreReader:
+	def __init__(self, cursor):
+		self.cursor = cursor
+		self.buf = ''
+		self.rows = 0
+
+	def read(self, size=-1):
+		while size < 0 or len(self.buf) < size:
+			res = self.cursor.fetchmany(chunksize)
+			if res == []:
+				break
+			lines = []
+			for (stringidentifier, packages, filenames) in res:
+				lines.append("%s\t%d\t%r\n" % (copyescape(stringidentifier), packages, computescore(stringidentifier, packages, filenames)))
+			self.rows += len(res)
+			self.buf += ''.join(lines)
+		if size < 0:
+			size = len(self.buf)
+		data = self.buf[:size]
+		self.buf = self.buf[size:]
+		return data
+
+	def readline(self, size=-1):
+		return self.read(size)
+
+## the query that groups the strings, optionally only for strings in
+## 'stringsquery'
+def groupquery(stringstable, stringsquery=None):
+	if stringsquery != None:
+		return "select stringidentifier, count(distinct package), count(distinct filename) from %s where stringidentifier in (%s) group by stringidentifier" % (stringstable, stringsquery)
+	return "select stringidentifier, count(distinct package), count(distinct filename) from %s group by stringidentifier" % stringstable
+
+## The strings are read with 'readconn' and the scores are written with
+## 'conn': a connection cannot be used to fetch rows while a COPY is running.
+def buildpostgresql(conn, readconn, language, newfiles):
+	stringstable = stringsdbperlanguagetable[language]
+	scorestable = scoresdbperlanguagetable[language]
+	cursor = conn.cursor()
+	cursor.execute("select 1 from information_schema.tables where table_name=%s", (stringstable,))
+	if cursor.fetchone() == None:
+		cursor.close()
+		conn.commit()
+		return None
+	cursor.execute("set synchronous_commit=off")
+	if newfiles != None:
+		stringsquery = "select stringidentifier from extracted_string where checksum = ANY(%s) and language=%s"
+		queryargs = (list(newfiles), language)
+		targettable = scorestable
+		cursor.execute("create table if not exists %s (stringidentifier text, packages int, score real)" % scorestable)
+		cursor.execute("delete from %s where stringidentifier in (%s)" % (scorestable, stringsquery), queryargs)
+	else:
+		stringsquery = None
+		queryargs = ()
+		targettable = "%s_new" % scorestable
+		cursor.execute("drop table if exists %s" % targettable)
+		cursor.execute("create table %s (stringidentifier text, packages int, score real)" % targettable)
+
+	## a named (server side) cursor, so the results of the query are
+	## not all sent to the client at once
+	groupcursor = readconn.cursor("%s_group" % scorestable)
+	groupcursor.execute(groupquery(stringstable, stringsquery), queryargs)
+	scorereader = ScoreReader(groupcursor)
+	cursor.copy_from(scorereader, targettable, columns=('stringidentifier', 'packages', 'score'))
+	groupcursor.close()
+	readconn.commit()
+
+	if newfiles == None:
+		cursor.execute("drop table if exists %s" % scorestable)
+		cursor.execute("alter table %s rename to %s" % (targettable, scorestable))
+	cursor.execute("create index if not exists %s_index on %s(stringidentifier)" % (scorestable, scorestable))
+	conn.commit()
+	cursor.close()
+	return scorereader.rows
+
+def buildsqlite(conn, language, newfiles):
+	stringstable = stringsdbperlanguagetable[language]
+	scorestable = scoresdbperlanguagetable[language]
+	cursor = conn.cursor()
+	cursor.execute("select name from sqlite_master where type='table' and name=?", (stringstable,))
+	if cursor.fetchone() == None:
+		cursor.close()
+		return None
+	if newfiles != None:
+		cursor.execute("create temporary table scorestrings (stringidentifier text)")
+		checksums = list(newfiles)
+		for i in xrange(0, len(checksums), 500):
+			chunk = checksums[i:i+500]
+			cursor.execute("insert into scorestrings select distinct stringidentifier from extracted_string where language=? and checksum in (%s)" % ",".join("?" * len(chunk)), [language] + chunk)
+		cursor.execute("create index scorestrings_index on scorestrings(stringidentifier)")
+		targettable = scorestable
+		cursor.execute("create table if not exists %s (stringidentifier text, packages int, score real)" % scorestable)
+		cursor.execute("delete from %s where stringidentifier in (select stringidentifier from scorestrings)" % scorestable)
+	else:
+		targettable = "%s_new" % scorestable
+		cursor.execute("drop table if exists %s" % targettable)
+		cursor.execute("create table %s (stringidentifier text, packages int, score real)" % targettable)
+
+	insertcursor = conn.cursor()
+	if newfiles != None:
+		cursor.execute(groupquery(stringstable, "select stringidentifier from scorestrings"))
+	else:
+		cursor.execute(groupquery(stringstable))
+	rows = 0
+	res = cursor.fetchmany(chunksize)
+	while res != []:
+		insertcursor.executemany("insert into %s (stringidentifier, packages, score) values (?,?,?)" % targettable, map(lambda x: (x[0], x[1], computescore(x[0], x[1], x[2])), res))
+		rows += len(res)
+		res = cursor.fetchmany(chunksize)
+	insertcursor.close()
+
+	if newfiles != None:
+		cursor.execute("drop table scorestrings")
+	else:
+		cursor.execute("drop table if exists %s" % scorestable)
+		cursor.execute("alter table %s rename to %s" % (targettable, scorestable))
+	cursor.execute("create index if not exists %s_index on %s(stringidentifier)" % (scorestable, scorestable))
+	conn.commit()
+	cursor.close()
+	return rows
+
+## read the checksums of new files, per language, from the list that
+## createdb.py writes with the -n option
+def readnewlist(newlist):
+	newfiles = {}
+	for l in open(newlist):
+		fields = l.strip().split('\t')
+		if len(fields) != 2:
+			continue
+		(filehash, language) = fields
+		if language in newfiles:
+			newfiles[language].add(filehash)
+		else:
+			newfiles[language] = set([filehash])
+	return newfiles
+
 def main(argv):
-	alpha = 5.0
+	config = ConfigParser.ConfigParser()
 
 	parser = OptionParser()
-	parser.add_option("-d", "--database", action="store", dest="db", help="path to caching database", metavar="FILE")
+	parser.add_option("-c", "--config", action="store", dest="cfg", help="path to configuration file (PostgreSQL)", metavar="FILE")
+	parser.add_option("-d", "--database", action="store", dest="db", help="path to caching database (SQLite)", metavar="FILE")
+	parser.add_option("-l", "--languages", action="store", dest="languages", help="colon separated list of languages (default: all)", metavar="LANGUAGES")
+	parser.add_option("-n", "--newlist", action="store", dest="newlist", help="path to file with new hashes written by createdb.py, only update scores for strings in these files", metavar="FILE")
 	(options, args) = parser.parse_args()
-	if options.db == None:
-		parser.error("Path to caching database")
-	if not os.path.exists(options.db):
-		print >>sys.stderr, "Caching database %s does not exist" % options.db
-		sys.exit(1)
+	if options.cfg == None and options.db == None:
+		parser.error("Specify configuration file or path to caching database")
+	if options.cfg != None and options.db != None:
+		parser.error("Specify either configuration file or path to caching database")
 
-	conn = sqlite3.connect(options.db)
-	c = conn.cursor()
+	languages = sorted(stringsdbperlanguagetable.keys())
+	if options.languages != None:
+		languages = options.languages.split(':')
+		for language in languages:
+			if not language in stringsdbperlanguagetable:
+				parser.error("Unsupported language %s" % language)
 
-	c.execute("create table if not exists scores (stringidentifier text, packages int, score real)")
-	c.execute("create index if not exists scoresindex on scores(stringidentifier)")
-	conn.commit()
-	c2 = conn.cursor()
-
-	c.execute("select distinct stringidentifier from stringscache")
-	programstrings = c.fetchmany(10000)
-	while programstrings != []:
-		for p in programstrings:
-			pkgs = {}
-			filenames = {}
-
-			pfs = c2.execute("select package, filename from stringscache where stringidentifier=?", p).fetchall()
-			packages = set(map(lambda x: x[0], pfs))
-
-			if len(packages) == 1:
-				score = float(len(p[0]))
-			else:
-				for pf in pfs:
-					(package, filename) = pf
-					if not filenames.has_key(filename):
-						filenames[filename] = [package]
-					else:   
-						filenames[filename] = list(set(filenames[filename] + [package]))
-				try:
-					score = float(len(p[0])) / pow(alpha, (len(filenames) - 1))
-				except Exception, e:
-					score = len(p[0]) / sys.maxint
-				## cut off for for example postgresql
-				if score < 1e-37:
-					score = 0.0
-			c2.execute("insert into scores(stringidentifier, packages, score) values (?,?,?)", (p[0], len(packages), float(score)))
-		programstrings = c.fetchmany(10000)
-	conn.commit()
-	c2.close()
-	print "vacuuming"
-	c.execute("vacuum")
-	conn.commit()
-	c.close()
+	newfiles = None
+	if options.newlist != None:
+		if not os.path.exists(options.newlist):
+			parser.error("List with new files does not exist")
+		newfiles = readnewlist(options.newlist)
+
+	if options.db != None:
+		if not os.path.exists(options.db):
+			print >>sys.stderr, "Caching database %s does not exist" % options.db
+			sys.exit(1)
+		conn = sqlite3.connect(options.db)
+		conn.execute("PRAGMA synchronous=off")
+		if newfiles != None:
+			if conn.execute("select name from sqlite_master where type='table' and name='extracted_string'").fetchone() == None:
+				print >>sys.stderr, "Caching database %s has no table extracted_string, cannot update scores for new files" % options.db
+				sys.exit(1)
+	else:
+		if not os.path.exists(options.cfg):
+			parser.error("Configuration file does not exist")
+		import psycopg2
+		config.read(options.cfg)
+		try:
+			postgresql_user = config.get('extractconfig', 'postgresql_user')
+			postgresql_password = config.get('extractconfig', 'postgresql_password')
+			postgresql_db = config.get('extractconfig', 'postgresql_db')
+		except:
+			print >>sys.stderr, "Database connection not defined in configuration file. Exiting..."
+			sys.exit(1)
+		try:
+			postgresql_host = config.get('extractconfig', 'postgresql_host')
+		except:
+			postgresql_host = None
+		try:
+			postgresql_port = config.get('extractconfig', 'postgresql_port')
+		except:
+			postgresql_port = None
+		conn = psycopg2.connect(database=postgresql_db, user=postgresql_user, password=postgresql_password, host=postgresql_host, port=postgresql_port)
+		readconn = psycopg2.connect(database=postgresql_db, user=postgresql_user, password=postgresql_password, host=postgresql_host, port=postgresql_port)
+
+	for language in languages:
+		languagefiles = None
+		if newfiles != None:
+			if not language in newfiles:
+				continue
+			languagefiles = newfiles[language]
+		print "computing scores for %s" % language, datetime.datetime.utcnow().isoformat()
+		sys.stdout.flush()
+		if options.db != None:
+			rows = buildsqlite(conn, language, languagefiles)
+		else:
+			rows = buildpostgresql(conn, readconn, language, languagefiles)
+		if rows == None:
+			print "no string cache for %s" % language
+		else:
+			print "%d scores for %s" % (rows, language), datetime.datetime.utcnow().isoformat()
+		sys.stdout.flush()
+
+	if options.db != None and newfiles == None:
+		print "vacuuming"
+		conn.execute("vacuum")
+	if options.db == None:
+		readconn.close()
 	conn.close()
-	
+
 if __name__ == "__main__":
 	main(sys.argv)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program compares the two ways of detecting duplicate files in the scan
+processes of bat/bruteforcescan.py when many processes check checksums at the
+same time: the old method (a dictionary from a multiprocessing manager that
+is protected by a single lock) and the set of checksums in shared memory from
+bat/hashset.py.
+
+Checksums of a number of (fake) files are divided over the processes, which
+all start at the same time. A part of the files are duplicates. For every
+amount of processes the files per second are reported for both methods, as
+well as the amount of duplicates that were found, which should be the same.
+'''
+
+import sys, datetime, hashlib, random, multiprocessing
+from multiprocessing import Process, Lock
+from optparse import OptionParser
+
+import bat.hashset
+
+def managerworker(checksums, hashdict, llock, startevent, resultqueue):
+	startevent.wait()
+	duplicates = 0
+	for filehash in checksums:
+		llock.acquire()
+		if (0, filehash) in hashdict:
+			llock.release()
+			duplicates += 1
+		else:
+			hashdict[(0, filehash)] = filehash
+			llock.release()
+	resultqueue.put(duplicates)
+
+def hashsetworker(checksums, hashes, startevent, resultqueue):
+	startevent.wait()
+	duplicates = 0
+	for filehash in checksums:
+		if not hashes.claim(0, filehash):
+			duplicates += 1
+	resultqueue.put(duplicates)
+
+## run the workers and return the amount of duplicates and the time it took
+def runworkers(target, args, checksums, processamount):
+	startevent = multiprocessing.Event()
+	resultqueue = multiprocessing.Queue()
+	processpool = []
+	for i in range(0, processamount):
+		p = Process(target=target, args=(checksums[i::processamount],) + args + (startevent, resultqueue))
+		processpool.append(p)
+		p.start()
+	starttime = datetime.datetime.utcnow()
+	startevent.set()
+	duplicates = 0
+	for p in processpool:
+		duplicates += resultqueue.get()
+	totaltime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	for p in processpool:
+		p.join()
+	return (duplicates, totaltime)
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-f", "--files", action="store", dest="files", help="amount of files (default: 50000)", metavar="FILES")
+	parser.add_option("-p", "--processes", action="store", dest="processes", help="comma separated amounts of processes (default: 4,16,64)", metavar="PROCESSES")
+	(options, args) = parser.parse_args()
+
+	files = 50000
+	processamounts = [4, 16, 64]
+	try:
+		if options.files != None:
+			files = int(options.files)
+		if options.processes != None:
+			processamounts = map(lambda x: int(x), options.processes.split(','))
+	except:
+		parser.error("Invalid amount")
+
+	## checksums are picked at random from a smaller range, so several
+	## files have the same checksum, like in firmwares with several
+	## copies of the same files.
+	random.seed(files)
+	checksums = map(lambda x: hashlib.sha256(str(random.randint(0, files * 4 / 5))).hexdigest(), range(0, files))
+	print "files: %d, unique: %d" % (files, len(set(checksums)))
+
+	for processamount in processamounts:
+		scanmanager = multiprocessing.Manager()
+		(managerduplicates, managertime) = runworkers(managerworker, (scanmanager.dict(), Lock()), checksums, processamount)
+		scanmanager.shutdown()
+		(hashsetduplicates, hashsettime) = runworkers(hashsetworker, (bat.hashset.SharedHashSet(),), checksums, processamount)
+		print "%d processes: manager: %.0f files/second (%d duplicates), shared hash set: %.0f files/second (%d duplicates)" % (processamount, files/managertime, managerduplicates, files/hashsettime, hashsetduplicates)
+		if managerduplicates != hashsetduplicates:
+			print >>sys.stderr, "amount of duplicates differs"
+
+if __name__ == "__main__":
+	main(sys.argv)
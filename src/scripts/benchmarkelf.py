@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program measures how often ELF files are parsed during a scan and how
+much time is spent in the ELF code (bat/elfcheck.py), with and without the
+cache of parsed ELF files.
+
+For every ELF file in the corpus the same calls are made that are made
+during a scan: the ELF check in the prerun phase, string and symbol
+extraction in the identifier scan, the library scan (findlibs) and the
+architecture lookup. The results with and without the cache are compared
+to make sure that both return the same results.
+'''
+
+import sys, os, os.path, datetime
+from optparse import OptionParser
+
+import bat.elfcheck
+
+## the calls that are made for a single ELF file during a scan
+def scanelf(filename):
+	results = []
+	## prerun
+	tags = bat.elfcheck.verifyELF(filename, tags=['binary'])
+	results.append(tags)
+	## identifier
+	results.append(bat.elfcheck.parseELF(filename))
+	results.append(bat.elfcheck.getSection(filename, '__ksymtab_strings'))
+	results.append(bat.elfcheck.getAllSymbols(filename))
+	## findlibs
+	results.append(bat.elfcheck.getAllSymbols(filename))
+	results.append(bat.elfcheck.getDynamicLibs(filename))
+	results.append(bat.elfcheck.parseELF(filename))
+	## architecture
+	results.append(bat.elfcheck.getArchitecture(filename, tags))
+	return results
+
+def runscans(corpus, cachesize):
+	bat.elfcheck.elfcachesize = cachesize
+	bat.elfcheck.elfcache.clear()
+	del bat.elfcheck.elfcacheorder[:]
+	bat.elfcheck.parsecount = 0
+	results = {}
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		results[c] = scanelf(c)
+	totaltime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	return (results, bat.elfcheck.parsecount, totaltime)
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-d", "--directory", action="store", dest="corpusdir", help="path to directory with files (corpus)", metavar="DIR")
+	(options, args) = parser.parse_args()
+	if options.corpusdir == None:
+		parser.error("Path to corpus directory needed")
+	if not os.path.isdir(options.corpusdir):
+		parser.error("Corpus directory does not exist")
+
+	corpus = []
+	osgen = os.walk(options.corpusdir)
+	try:
+		while True:
+			i = osgen.next()
+			for p in i[2]:
+				filepath = os.path.join(i[0], p)
+				if os.path.islink(filepath) or not os.path.isfile(filepath):
+					continue
+				elffile = open(filepath, 'rb')
+				elfbytes = elffile.read(4)
+				elffile.close()
+				if elfbytes != '\x7f\x45\x4c\x46':
+					continue
+				corpus.append(filepath)
+	except StopIteration:
+		pass
+
+	if corpus == []:
+		print >>sys.stderr, "No ELF files found in corpus"
+		sys.exit(1)
+
+	totalsize = sum(map(lambda x: os.stat(x).st_size, corpus))
+	print "ELF files: %d, total size: %d bytes" % (len(corpus), totalsize)
+
+	(uncachedresults, uncachedparses, uncachedtime) = runscans(corpus, 0)
+	print "without cache: %d parses, %.2f parses per file, %.3f seconds" % (uncachedparses, float(uncachedparses)/len(corpus), uncachedtime)
+
+	(cachedresults, cachedparses, cachedtime) = runscans(corpus, 8)
+	print "with cache: %d parses, %.2f parses per file, %.3f seconds" % (cachedparses, float(cachedparses)/len(corpus), cachedtime)
+
+	differences = 0
+	for c in corpus:
+		if uncachedresults[c] != cachedresults[c]:
+			print >>sys.stderr, "results differ for %s" % c
+			differences += 1
+	print "files with different results: %d" % differences
+
+if __name__ == "__main__":
+	main(sys.argv)
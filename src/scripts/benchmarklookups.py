@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program compares the per-line string lookups that are done in the
+ranking code (bat/licenseversion.py) with the batched lookups, which look
+up all distinct strings of a file in chunks.
+
+Input is either a BAT file report pickle (from the 'filereports' directory
+of a scan archive, uncompressed) or a text file with one string per line.
+Database credentials are read from the [batconfig] section of a BAT
+configuration file.
+
+For both methods the amount of round trips to the database and the wall
+clock time are reported, and the results are compared to make sure that
+both methods return the same matches.
+'''
+
+import sys, os, os.path, cPickle, datetime
+import ConfigParser
+from optparse import OptionParser
+import psycopg2
+
+import bat.licenseversion
+
+## wrapper around a cursor to count the amount of queries that are sent
+class CountingCursor:
+	def __init__(self, cursor):
+		self.cursor = cursor
+		self.queries = 0
+
+	def execute(self, query, args=None):
+		self.queries += 1
+		return self.cursor.execute(query, args)
+
+	def fetchall(self):
+		return self.cursor.fetchall()
+
+	def fetchone(self):
+		return self.cursor.fetchone()
+
+def perline(lines, table, cursor, conn):
+	stringquery = "select package, filename FROM %s WHERE stringidentifier=" % table + "%s"
+	results = {}
+	for line in lines:
+		try:
+			cursor.execute(stringquery, (line,))
+			res = cursor.fetchall()
+			conn.commit()
+		except:
+			conn.rollback()
+			continue
+		if res != []:
+			results[line] = res
+	return results
+
+def batched(lines, table, cursor, conn, chunksize):
+	batchquery = "select stringidentifier, package, filename FROM %s WHERE stringidentifier = ANY(" % table + "%s)"
+	(results, lookedup) = bat.licenseversion.batchlookup(lines, batchquery, cursor, conn, chunksize)
+	return results
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-c", "--config", action="store", dest="cfg", help="path to BAT configuration file", metavar="FILE")
+	parser.add_option("-i", "--input", action="store", dest="inputfile", help="path to file report pickle or text file with strings", metavar="FILE")
+	parser.add_option("-l", "--language", action="store", dest="language", help="language of the strings (default: C)", metavar="LANGUAGE")
+	parser.add_option("-s", "--chunksize", action="store", dest="chunksize", help="amount of strings per batched query (default: 1000)", metavar="SIZE")
+	parser.add_option("-m", "--minimum", action="store", dest="minimum", help="minimum length of strings (default: 5)", metavar="LENGTH")
+	(options, args) = parser.parse_args()
+
+	if options.cfg == None:
+		parser.error("Need configuration file")
+	if options.inputfile == None:
+		parser.error("Need input file")
+	if not os.path.exists(options.inputfile):
+		parser.error("Input file does not exist")
+
+	language = 'C'
+	if options.language != None:
+		language = options.language
+	if not language in bat.licenseversion.stringsdbperlanguagetable:
+		parser.error("Unsupported language %s" % language)
+	table = bat.licenseversion.stringsdbperlanguagetable[language]
+
+	chunksize = 1000
+	if options.chunksize != None:
+		try:
+			chunksize = int(options.chunksize)
+		except:
+			parser.error("Invalid chunk size")
+	stringcutoff = 5
+	if options.minimum != None:
+		try:
+			stringcutoff = int(options.minimum)
+		except:
+			parser.error("Invalid minimum length")
+
+	config = ConfigParser.ConfigParser()
+	configfile = open(options.cfg, 'r')
+	config.readfp(configfile)
+	configfile.close()
+	try:
+		postgresql_user = config.get('batconfig', 'postgresql_user')
+		postgresql_password = config.get('batconfig', 'postgresql_password')
+		postgresql_db = config.get('batconfig', 'postgresql_db')
+	except:
+		print >>sys.stderr, "Database credentials not found in configuration file"
+		sys.exit(1)
+	try:
+		postgresql_host = config.get('batconfig', 'postgresql_host')
+	except:
+		postgresql_host = None
+	try:
+		postgresql_port = config.get('batconfig', 'postgresql_port')
+	except:
+		postgresql_port = None
+
+	## read the strings, either from a pickle or from a text file
+	lines = []
+	try:
+		leaf_file = open(options.inputfile, 'rb')
+		leafreports = cPickle.load(leaf_file)
+		leaf_file.close()
+		lines = leafreports['identifier']['strings']
+	except:
+		lines = map(lambda x: x[:-1], open(options.inputfile, 'rb').readlines())
+
+	lookuplines = set(filter(lambda x: len(x) >= stringcutoff, lines))
+	print "strings: %d, distinct strings to look up: %d" % (len(lines), len(lookuplines))
+
+	conn = psycopg2.connect(database=postgresql_db, user=postgresql_user, password=postgresql_password, host=postgresql_host, port=postgresql_port)
+
+	cursor = CountingCursor(conn.cursor())
+	starttime = datetime.datetime.utcnow()
+	perlineres = perline(lookuplines, table, cursor, conn)
+	perlinetime = datetime.datetime.utcnow() - starttime
+	print "per line: %d round trips, %s" % (cursor.queries, perlinetime)
+
+	cursor = CountingCursor(conn.cursor())
+	starttime = datetime.datetime.utcnow()
+	batchres = batched(lookuplines, table, cursor, conn, chunksize)
+	batchtime = datetime.datetime.utcnow() - starttime
+	print "batched: %d round trips, %s" % (cursor.queries, batchtime)
+
+	## sanity check: both methods should return the same matches
+	mismatches = 0
+	for line in set(perlineres.keys() + batchres.keys()):
+		if sorted(perlineres.get(line, [])) != sorted(map(tuple, batchres.get(line, []))):
+			mismatches += 1
+	print "matched strings: %d, mismatches: %d" % (len(perlineres), mismatches)
+	if batchtime.total_seconds() != 0:
+		print "speedup: %.2f" % (perlinetime.total_seconds() / batchtime.total_seconds())
+	conn.close()
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program measures the throughput (in MB/s) of the marker search that is
+run for every file that BAT scans (prerun.genericMarkerSearch) on a corpus of
+files, for example a directory with firmware images.
+
+For comparison the old marker search (one search per marker per 2 MB
+window, with a second file handle for extra checks) is run as well and the
+results of both are compared to make sure they are identical.
+
+The results are not identical for files where the last window of the old
+marker search is smaller than 50 bytes (files of 1999950 up to 2000000 bytes,
+or windows later in the file): markers in that window were reported a second
+time at a wrong offset. This case is checked with a generated file first.
+'''
+
+import sys, os, os.path, struct, math, datetime, tempfile
+from optparse import OptionParser
+
+import bat.prerun, bat.fsmagic, bat.extractor
+
+## the marker search as it was before the single pass search was introduced
+def legacyMarkerSearch(filename, magicscans, optmagicscans, offset=0, length=0):
+	datafile = open(filename, 'rb')
+	offsets = {}
+	offsettokeys = {}
+	isascii = True
+
+	datafile.seek(offset)
+	if length == 0:
+		databuffer = datafile.read(2000000)
+	else:
+		databuffer = datafile.read(length)
+	marker_keys = magicscans + optmagicscans
+	bufkeys = []
+	for key in marker_keys:
+		offsets[key] = set()
+		if not key in bat.fsmagic.fsmagic:
+			continue
+		bufkeys.append((key,bat.fsmagic.fsmagic[key]))
+
+	if bufkeys == []:
+		datafile.close()
+		return (offsets, offsettokeys, isascii)
+
+	datafile2 = open(filename, 'rb')
+	while databuffer != '':
+		if isascii:
+			if not bat.extractor.isPrintables(databuffer):
+				isascii = False
+		for bkey in bufkeys:
+			(key, bufkey) = bkey
+			if not bufkey in databuffer:
+				continue
+			res = databuffer.find(bufkey)
+			while res != -1:
+				if key == 'jpeg':
+					datafile2.seek(offset+res+2)
+					checkkey = datafile2.read(1)
+					if len(checkkey) == 1:
+						if checkkey == '\xff':
+							offsets[key].add(offset + res)
+				elif key == 'compress':
+					datafile2.seek(offset+res+2)
+					compressdata = datafile2.read(1)
+					if len(compressdata) == 1:
+						compressbits = ord(compressdata) & 0x1f
+						if compressbits >= 9 and compressbits <= 16:
+							offsets[key].add(offset + res)
+				elif key == 'ttf':
+					datafile2.seek(offset+res+4)
+					fontbytes = datafile2.read(2)
+					if len(fontbytes) == 2:
+						numberoftables = struct.unpack('>H', fontbytes)[0]
+						if numberoftables != 0:
+							fontbytes = datafile2.read(2)
+							if len(fontbytes) == 2:
+								searchrange = struct.unpack('>H', fontbytes)[0]
+								if pow(2, int(math.log(numberoftables, 2)+4)) == searchrange:
+									offsets[key].add(offset + res)
+				else:
+					offsets[key].add(offset + res)
+				res = databuffer.find(bufkey, res+1)
+		if length != 0:
+			break
+		datafile.seek(offset + 1999950)
+		databuffer = datafile.read(2000000)
+		if len(databuffer) >= 50:
+			offset = offset + 1999950
+		else:
+			offset = offset + len(databuffer)
+	datafile2.close()
+	datafile.close()
+
+	for key in marker_keys:
+		offsets[key] = list(offsets[key])
+		offsets[key].sort()
+		for offset in offsets[key]:
+			if offset in offsettokeys:
+				offsettokeys[offset].append(key)
+			else:
+				offsettokeys[offset] = [key]
+	return (offsets, offsettokeys, isascii)
+
+## Check the marker search for a file where the last window of the old
+## marker search is smaller than 50 bytes. The old marker search computed
+## the offset of that window as the offset of the previous window plus the
+## length of the last window, instead of 1999950 bytes further. Returns
+## False if the marker search does not find the right offset.
+def checkshortwindow(legacy):
+	markerkey = 'gzip'
+	markeroffset = 1999960
+	(tmpfd, tmpfile) = tempfile.mkstemp()
+	os.write(tmpfd, '\x00' * markeroffset + bat.fsmagic.fsmagic[markerkey] + '\x00' * 17)
+	os.close(tmpfd)
+	newoffsets = bat.prerun.genericMarkerSearch(tmpfile, [markerkey], [])[0][markerkey]
+	if legacy:
+		legacyoffsets = legacyMarkerSearch(tmpfile, [markerkey], [])[0][markerkey]
+	os.unlink(tmpfile)
+	print "short last window: marker at %d, marker search: %s" % (markeroffset, newoffsets)
+	if legacy:
+		print "short last window: old marker search: %s" % legacyoffsets
+	return newoffsets == [markeroffset]
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-d", "--directory", action="store", dest="corpusdir", help="path to directory with files (corpus)", metavar="DIR")
+	parser.add_option("-n", "--nolegacy", action="store_true", dest="nolegacy", help="don't run the old marker search")
+	(options, args) = parser.parse_args()
+	if options.corpusdir == None:
+		parser.error("Path to corpus directory needed")
+	if not os.path.isdir(options.corpusdir):
+		parser.error("Corpus directory does not exist")
+
+	corpus = []
+	osgen = os.walk(options.corpusdir)
+	try:
+		while True:
+			i = osgen.next()
+			for p in i[2]:
+				filepath = os.path.join(i[0], p)
+				if os.path.islink(filepath) or not os.path.isfile(filepath):
+					continue
+				corpus.append(filepath)
+	except StopIteration:
+		pass
+
+	if corpus == []:
+		print >>sys.stderr, "No files found in corpus"
+		sys.exit(1)
+
+	if not checkshortwindow(not options.nolegacy):
+		print >>sys.stderr, "marker search reports wrong offsets for a short last window"
+		sys.exit(1)
+
+	magicscans = bat.fsmagic.fsmagic.keys()
+	totalsize = sum(map(lambda x: os.stat(x).st_size, corpus))
+	print "files: %d, total size: %d bytes, markers: %d, single pass automaton: %s" % (len(corpus), totalsize, len(magicscans), bat.prerun.have_ahocorasick)
+
+	newresults = {}
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		newresults[c] = bat.prerun.genericMarkerSearch(c, magicscans, [])
+	newtime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	if newtime != 0:
+		print "marker search: %.3f seconds, %.2f MB/s" % (newtime, totalsize/1000000.0/newtime)
+
+	if options.nolegacy:
+		return
+
+	differences = 0
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		legacyresult = legacyMarkerSearch(c, magicscans, [])
+		if legacyresult != newresults[c]:
+			print >>sys.stderr, "results differ for %s" % c
+			differences += 1
+	legacytime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	if legacytime != 0:
+		print "old marker search: %.3f seconds, %.2f MB/s" % (legacytime, totalsize/1000000.0/legacytime)
+	print "files with different results: %d" % differences
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program compares the I/O done for writing compressed result files (HTML,
+JSON, pickles) in the postrun phase with the old method (write the file,
+read it back, write a gzip compressed copy and remove the original) and with
+writing the compressed data directly (bat.extractor.openreport).
+
+The files in a directory (for example the 'reports' directory of an unpacked
+scan archive with compress set to 'no') are used as the contents of the result
+files. Data is written in chunks, like the report writers do. The amount of
+bytes that were read and written (from /proc/self/io) and the wall clock time
+are reported for both methods, and the results are compared to make sure
+that both methods result in the same data.
+'''
+
+import sys, os, os.path, datetime, gzip, tempfile, shutil
+from optparse import OptionParser
+
+import bat.extractor
+
+## size of the chunks the data is written in
+chunksize = 4096
+
+## return the amount of bytes read and written by this process
+def iocounters():
+	counters = {}
+	for l in open('/proc/self/io').readlines():
+		(name, value) = l.split(':', 1)
+		counters[name] = int(value)
+	return (counters['rchar'], counters['wchar'])
+
+def writechunks(outfile, data):
+	for i in xrange(0, len(data), chunksize):
+		outfile.write(data[i:i+chunksize])
+
+def writeoldstyle(filename, data, compresslevel):
+	outfile = open(filename, 'wb')
+	writechunks(outfile, data)
+	outfile.close()
+	fin = open(filename, 'rb')
+	fout = gzip.open("%s.gz" % filename, 'wb', compresslevel)
+	fout.write(fin.read())
+	fout.close()
+	fin.close()
+	os.unlink(fin.name)
+
+def writestreaming(filename, data, compresslevel):
+	outfile = bat.extractor.openreport(filename, True, compresslevel)
+	writechunks(outfile, data)
+	outfile.close()
+
+def runwriter(writer, corpus, outputdir, compresslevel):
+	(startread, startwritten) = iocounters()
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		writer(os.path.join(outputdir, c), corpus[c], compresslevel)
+	totaltime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	(endread, endwritten) = iocounters()
+	return (endread - startread, endwritten - startwritten, totaltime)
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-d", "--directory", action="store", dest="corpusdir", help="path to directory with files (corpus)", metavar="DIR")
+	parser.add_option("-l", "--level", action="store", dest="compresslevel", help="gzip compression level (default: 9)", metavar="LEVEL")
+	(options, args) = parser.parse_args()
+	if options.corpusdir == None:
+		parser.error("Path to corpus directory needed")
+	if not os.path.isdir(options.corpusdir):
+		parser.error("Corpus directory does not exist")
+
+	compresslevel = 9
+	if options.compresslevel != None:
+		try:
+			compresslevel = int(options.compresslevel)
+		except:
+			parser.error("Invalid compression level")
+
+	## read all files first, so reading the corpus is not counted
+	corpus = {}
+	for p in os.listdir(options.corpusdir):
+		filepath = os.path.join(options.corpusdir, p)
+		if os.path.islink(filepath) or not os.path.isfile(filepath):
+			continue
+		corpus[p] = open(filepath, 'rb').read()
+
+	if corpus == {}:
+		print >>sys.stderr, "No files found in corpus"
+		sys.exit(1)
+
+	print "files: %d, total size: %d bytes" % (len(corpus), sum(map(lambda x: len(x), corpus.values())))
+
+	olddir = tempfile.mkdtemp()
+	newdir = tempfile.mkdtemp()
+
+	(oldread, oldwritten, oldtime) = runwriter(writeoldstyle, corpus, olddir, compresslevel)
+	print "write, then compress: %d bytes read, %d bytes written, %.3f seconds" % (oldread, oldwritten, oldtime)
+	(newread, newwritten, newtime) = runwriter(writestreaming, corpus, newdir, compresslevel)
+	print "compress while writing: %d bytes read, %d bytes written, %.3f seconds" % (newread, newwritten, newtime)
+
+	differences = 0
+	for c in corpus:
+		if gzip.open(os.path.join(olddir, "%s.gz" % c)).read() != gzip.open(os.path.join(newdir, "%s.gz" % c)).read():
+			print >>sys.stderr, "results differ for %s" % c
+			differences += 1
+	print "files with different results: %d" % differences
+
+	shutil.rmtree(olddir)
+	shutil.rmtree(newdir)
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program compares extracting strings with the external 'strings' program
+(the old method used in bat/identifier.py) with the string extraction in
+bat/extractor.py, on a directory with files (for example BusyBox and C
+library binaries).
+
+Like in bat/identifier.py for ELF files only the .data and .rodata sections
+are looked at (with 'strings' each section is first written to a temporary
+file), for other files the whole file is looked at.
+
+For both methods the wall clock time is reported and the results are
+compared to make sure that both methods return the same strings.
+'''
+
+import sys, os, os.path, datetime, tempfile, subprocess
+from optparse import OptionParser
+
+import bat.elfcheck, bat.extractor, bat.fileview
+
+validsectionswithstrings = set(['.data', '.rodata', '.rodata.str1.1', '.rodata.str1.8'])
+
+## return the ranges of the file to extract strings from (each range is
+## extracted separately), or None for the whole file
+def getranges(filename):
+	(totalelf, elfres) = bat.elfcheck.parseELF(filename)
+	if elfres == None or elfres['sections'] == {}:
+		return None
+	ranges = []
+	for s in elfres['sections']:
+		if not elfres['sections'][s]['name'] in validsectionswithstrings:
+			continue
+		if elfres['sections'][s]['sectiontype'] == 8:
+			continue
+		ranges.append((elfres['sections'][s]['sectionoffset'], elfres['sections'][s]['sectionoffset'] + elfres['sections'][s]['sectionsize']))
+	return ranges
+
+def runstrings(filename, stringcutoff):
+	p = subprocess.Popen(['strings', '-a', '-n', str(stringcutoff), filename], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	(stanout, stanerr) = p.communicate()
+	if stanout == '':
+		return []
+	if stanout.endswith('\n'):
+		return stanout[:-1].split("\n")
+	return stanout.split("\n")
+
+def externalstrings(filename, ranges, stringcutoff):
+	if ranges == None:
+		return runstrings(filename, stringcutoff)
+	lines = []
+	datafile = open(filename, 'rb')
+	for (start, end) in ranges:
+		datafile.seek(start)
+		data = datafile.read(end - start)
+		tmpfile = tempfile.mkstemp()
+		os.write(tmpfile[0], data)
+		os.fdopen(tmpfile[0]).close()
+		lines += runstrings(tmpfile[1], stringcutoff)
+		os.unlink(tmpfile[1])
+	datafile.close()
+	return lines
+
+def internalstrings(filename, ranges, stringcutoff):
+	scanview = bat.fileview.FileView(filename)
+	scandata = scanview.data
+	if ranges == None:
+		lines = bat.extractor.printablestrings(scandata, stringcutoff)
+	else:
+		lines = []
+		for (start, end) in ranges:
+			lines += bat.extractor.printablestrings(scandata, stringcutoff, [(start, min(end, len(scandata)))])
+	scanview.close()
+	return lines
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-d", "--directory", action="store", dest="corpusdir", help="path to directory with files (corpus)", metavar="DIR")
+	parser.add_option("-m", "--minimum", action="store", dest="minimum", help="minimum length of strings (default: 5)", metavar="LENGTH")
+	(options, args) = parser.parse_args()
+	if options.corpusdir == None:
+		parser.error("Path to corpus directory needed")
+	if not os.path.isdir(options.corpusdir):
+		parser.error("Corpus directory does not exist")
+
+	stringcutoff = 5
+	if options.minimum != None:
+		try:
+			stringcutoff = int(options.minimum)
+		except:
+			parser.error("Invalid minimum length")
+
+	corpus = []
+	osgen = os.walk(options.corpusdir)
+	try:
+		while True:
+			i = osgen.next()
+			for p in i[2]:
+				filepath = os.path.join(i[0], p)
+				if os.path.islink(filepath) or not os.path.isfile(filepath):
+					continue
+				corpus.append(filepath)
+	except StopIteration:
+		pass
+
+	if corpus == []:
+		print >>sys.stderr, "No files found in corpus"
+		sys.exit(1)
+
+	ranges = {}
+	for c in corpus:
+		ranges[c] = getranges(c)
+	totalsize = sum(map(lambda x: os.stat(x).st_size, corpus))
+	elffiles = len(filter(lambda x: ranges[x] != None, corpus))
+	print "files: %d (ELF: %d), total size: %d bytes" % (len(corpus), elffiles, totalsize)
+
+	internalresults = {}
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		internalresults[c] = internalstrings(c, ranges[c], stringcutoff)
+	internaltime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	print "string extraction: %.3f seconds" % internaltime
+
+	differences = 0
+	processes = 0
+	starttime = datetime.datetime.utcnow()
+	for c in corpus:
+		if ranges[c] == None:
+			processes += 1
+		else:
+			processes += len(ranges[c])
+		if externalstrings(c, ranges[c], stringcutoff) != internalresults[c]:
+			print >>sys.stderr, "results differ for %s" % c
+			differences += 1
+	externaltime = (datetime.datetime.utcnow() - starttime).total_seconds()
+	print "strings: %.3f seconds, %d processes" % (externaltime, processes)
+	print "files with different results: %d" % differences
+
+if __name__ == "__main__":
+	main(sys.argv)
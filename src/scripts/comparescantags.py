@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+## Binary Analysis Tool
+## Copyright 2016 Armijn Hemel for Tjaldur Software Governance Solutions
+## Licensed under Apache 2.0, see LICENSE file for details
+
+'''
+This program compares the tags in two scan archives of the same binary, for
+example a full scan and an incremental scan (bat-scan --baseline), which
+should result in identical tags. Both the tags in scandata.pickle and the tags
+in the file reports (filereports/) are compared. The archives have to be made
+with 'packpickles' enabled.
+
+The program exits with status 1 if there are differences.
+'''
+
+import sys, os, os.path, tarfile, gzip, cPickle
+from optparse import OptionParser
+
+## read the tags per file (scandata.pickle) and per checksum (file reports)
+def readtags(archive):
+	filetags = {}
+	reporttags = {}
+	tar = tarfile.open(archive, 'r:*')
+	for member in tar:
+		if not member.isfile():
+			continue
+		if member.name == 'scandata.pickle':
+			unpackreports = cPickle.load(tar.extractfile(member))
+			for u in unpackreports:
+				if 'tags' in unpackreports[u]:
+					filetags[u] = unpackreports[u]['tags']
+			continue
+		if not member.name.startswith('filereports/'):
+			continue
+		picklename = os.path.basename(member.name)
+		if picklename.endswith('-filereport.pickle.gz'):
+			picklefile = gzip.GzipFile(fileobj=tar.extractfile(member))
+		elif picklename.endswith('-filereport.pickle'):
+			picklefile = tar.extractfile(member)
+		else:
+			continue
+		reporttags[picklename.split('-', 1)[0]] = cPickle.load(picklefile).get('tags', [])
+	tar.close()
+	return (filetags, reporttags)
+
+## Compare the tags of two dictionaries. The order of tags does not matter,
+## but tags that occur more than once do.
+def comparetags(kind, tags1, tags2):
+	differences = 0
+	for k in sorted(set(tags1.keys() + tags2.keys())):
+		if not k in tags1 or not k in tags2:
+			print "%s %s: only in one archive" % (kind, k)
+			differences += 1
+			continue
+		if sorted(tags1[k]) != sorted(tags2[k]):
+			print "%s %s: %s != %s" % (kind, k, sorted(tags1[k]), sorted(tags2[k]))
+			differences += 1
+	return differences
+
+def main(argv):
+	parser = OptionParser()
+	parser.add_option("-a", "--first", action="store", dest="first", help="path to first scan archive", metavar="FILE")
+	parser.add_option("-b", "--second", action="store", dest="second", help="path to second scan archive", metavar="FILE")
+	(options, args) = parser.parse_args()
+
+	if options.first == None or options.second == None:
+		parser.error("Specify two scan archives")
+	for archive in [options.first, options.second]:
+		if not os.path.exists(archive):
+			parser.error("Scan archive %s does not exist" % archive)
+
+	(filetags1, reporttags1) = readtags(options.first)
+	(filetags2, reporttags2) = readtags(options.second)
+	if filetags1 == {} or filetags2 == {}:
+		print >>sys.stderr, "scandata.pickle missing, archives should be made with packpickles"
+		sys.exit(1)
+
+	differences = comparetags('file', filetags1, filetags2)
+	differences += comparetags('report', reporttags1, reporttags2)
+	print "%d files, %d reports, %d differences" % (len(filetags1), len(reporttags1), differences)
+	if differences != 0:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main(sys.argv)